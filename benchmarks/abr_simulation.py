@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Adaptive quality simulation
+#
+# Drives the adaptive quality controller against a simulated
+# bandwidth-limited link whose capacity changes over time, with a simulated
+# receiver that plays from a buffer and stalls when it runs dry. The same
+# link is replayed with adaptation disabled for comparison. Runs in
+# simulated time, so it finishes instantly.
+#
+#   python3 benchmarks/abr_simulation.py --schedule 0:12000,30:2500,60:5000,90:1200,120:12000
+
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.adaptive_bitrate import AdaptiveBitrateController, build_tiers
+
+STEP = 0.1  # Simulation step in seconds
+STARTUP_BUFFER = 1.0  # Seconds of media a receiver buffers before (re)starting playback
+
+
+class SimulatedLink:
+    """A link of varying capacity between the stream server and one receiver"""
+
+    def __init__(self, schedule):
+        self.schedule = sorted(schedule)
+
+    def capacity(self, now: float) -> float:
+        """Capacity in kbit/s at a point in time"""
+        current = self.schedule[0][1]
+        for start, kbps in self.schedule:
+            if now >= start:
+                current = kbps
+        return current
+
+
+def simulate(link: SimulatedLink, duration: float, adaptive: bool, tiers) -> dict:
+    now = 0.0
+    controller = AdaptiveBitrateController(tiers, lambda tier: None, clock=lambda: now)
+    backlog = []  # [kbit remaining, kbit/s it was encoded at] per queued chunk
+    buffered = 0.0
+    playing = False
+    stalls = 0
+    stall_time = 0.0
+    bitrate_time = 0.0
+    tier_log = []
+
+    steps = int(duration / STEP)
+    for step in range(steps):
+        now = step * STEP
+        tier = controller.tier
+        backlog.append([tier.bitrate * STEP, tier.bitrate])
+
+        # Send as much of the backlog as the link allows this step
+        budget = link.capacity(now) * STEP
+        sent = 0.0
+        while backlog and budget > 0:
+            chunk = backlog[0]
+            amount = min(chunk[0], budget)
+            chunk[0] -= amount
+            budget -= amount
+            sent += amount
+            buffered += amount / chunk[1]
+            if chunk[0] <= 0:
+                backlog.pop(0)
+        if sent:
+            controller.report_delivery('receiver', int(sent * 1000 / 8), sent / link.capacity(now))
+
+        # Play from the buffer
+        if playing:
+            buffered -= STEP
+            if buffered <= 0:
+                buffered = 0.0
+                playing = False
+                stalls += 1
+                controller.report_stall('receiver')
+        elif buffered >= STARTUP_BUFFER:
+            playing = True
+        if not playing and step * STEP > STARTUP_BUFFER * 2:
+            stall_time += STEP
+        bitrate_time += tier.bitrate * STEP
+
+        if adaptive and step % int(1.0 / STEP) == 0:
+            controller.report_encoder(0, 3, 0)
+            controller.update()
+        if step % int(10.0 / STEP) == 0:
+            tier_log.append((now, link.capacity(now), str(controller.tier)))
+
+    return {
+        'stalls': stalls,
+        'stall_time': stall_time,
+        'average_bitrate': bitrate_time / duration,
+        'switches': controller.switches,
+        'tier_log': tier_log,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate adaptive quality over a bandwidth-limited link")
+    parser.add_argument('--schedule', default='0:12000,30:2500,60:5000,90:1200,120:12000',
+                        help="comma separated start_second:kbit/s link capacity changes")
+    parser.add_argument('--duration', type=float, default=180.0)
+    parser.add_argument('--resolution', default='1080p')
+    parser.add_argument('--framerate', type=int, default=30)
+    parser.add_argument('--bitrate', type=int, default=6000)
+    args = parser.parse_args()
+
+    schedule = [tuple(float(value) for value in item.split(':')) for item in args.schedule.split(',')]
+    link = SimulatedLink(schedule)
+    tiers = build_tiers(args.resolution, args.framerate, args.bitrate)
+    print("tiers: " + "; ".join(str(tier) for tier in tiers))
+
+    for adaptive in (False, True):
+        result = simulate(link, args.duration, adaptive, tiers)
+        print(f"\n{'adaptive' if adaptive else 'fixed'}: {result['stalls']} stalls, "
+              f"{result['stall_time']:.1f} s stalled, average {result['average_bitrate']:.0f} kbit/s, "
+              f"{result['switches']} switches")
+        if adaptive:
+            for when, capacity, tier in result['tier_log']:
+                print(f"  t={when:5.0f} s  link {capacity:6.0f} kbit/s  {tier}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Audio sync benchmark
+#
+# Runs the audio capture stage on a synthetic PCM source whose clock
+# drifts against the pipeline clock, with a simulated video path delay and
+# an optional source stall half way through. Reports how well the output
+# timeline tracks the pipeline clock, the A/V offset, the drift correction
+# that was settled on, and underruns.
+#
+#   python3 benchmarks/audio_sync_benchmark.py --duration 60 --drift=-500,0,500
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.audio_capture import BYTES_PER_SAMPLE, AudioCapture, SyntheticPcmSource
+from src.pipeline_clock import PipelineClock
+
+
+def run(drift_ppm: float, duration: float, video_delay: float, stall: float) -> dict:
+    clock = PipelineClock()
+    source = SyntheticPcmSource(drift_ppm=drift_ppm, clock=clock.now)
+    emitted = [0]
+
+    def output(data):
+        emitted[0] += len(data) // (source.channels * BYTES_PER_SAMPLE)
+
+    capture = AudioCapture(source, clock, output, video_delay=lambda: video_delay)
+    clock.start()
+    capture.start()
+    if stall:
+        threading.Timer(duration / 2, source.stall, args=(stall,)).start()
+
+    # Measure over the second half, after the fill level has settled
+    time.sleep(duration / 2 + stall + 1.0)
+    start_time, start_frames = clock.now(), emitted[0]
+    time.sleep(duration / 2)
+    elapsed = clock.now() - start_time
+    frames = emitted[0] - start_frames
+    stats = capture.stats()
+    capture.stop()
+    return {
+        'timeline_error': frames / capture.rate - elapsed,
+        **stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark audio capture drift correction and A/V sync")
+    parser.add_argument('--duration', type=float, default=60.0)
+    parser.add_argument('--drift', default='-500,0,500', help="sound card clock error in ppm")
+    parser.add_argument('--video-delay', type=float, default=0.08)
+    parser.add_argument('--stall', type=float, default=0.3, help="source stall in seconds, 0 for none")
+    args = parser.parse_args()
+
+    for drift in (float(value) for value in args.drift.split(',')):
+        result = run(drift, args.duration, args.video_delay, args.stall)
+        print(f"drift {drift:+5.0f} ppm: timeline error {1000 * result['timeline_error']:+6.1f} ms, "
+              f"A/V offset {1000 * result['av_offset']:+6.1f} ms, "
+              f"correction {result['drift_ppm']:+5.0f} ppm, "
+              f"buffered {1000 * result['buffered']:5.1f} ms, "
+              f"{result['underruns']} underruns, {result['overruns']} overrun frames")
+
+
+if __name__ == "__main__":
+    main()
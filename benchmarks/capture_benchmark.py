@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Screen capture benchmark
+#
+# Reports capture fps, CPU per frame and allocations per frame. Run it
+# against a virtual display so results do not depend on the desktop:
+#
+#   xvfb-run -s "-screen 0 1920x1080x24" python3 benchmarks/capture_benchmark.py
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.screen_capture import ScreenCapture
+
+
+def run(frames: int, framerate: float, ring_size: int) -> dict:
+    capture = ScreenCapture(ring_size=ring_size, framerate=framerate)
+    with capture:
+        # Warm up so the ring and any lazy X state are allocated
+        for _ in range(ring_size * 2):
+            capture.grab()
+
+        tracemalloc.start()
+        blocks_before = sys.getallocatedblocks()
+        snapshot_before = tracemalloc.take_snapshot()
+        cpu_start = time.process_time()
+        wall_start = time.monotonic()
+
+        for _ in capture.frames(frames):
+            pass
+
+        wall = time.monotonic() - wall_start
+        cpu = time.process_time() - cpu_start
+        snapshot_after = tracemalloc.take_snapshot()
+        blocks_after = sys.getallocatedblocks()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        new_blocks = sum(max(stat.count_diff, 0)
+                         for stat in snapshot_after.compare_to(snapshot_before, 'lineno'))
+        return {
+            'backend': 'MIT-SHM' if capture.use_shm else 'GetImage',
+            'resolution': f"{capture.width}x{capture.height}",
+            'frames': frames,
+            'fps': frames / wall,
+            'cpu_percent': 100.0 * cpu / wall,
+            'cpu_ms_per_frame': 1000.0 * cpu / frames,
+            'net_blocks_per_frame': (blocks_after - blocks_before) / frames,
+            'traced_new_blocks_per_frame': new_blocks / frames,
+            'peak_traced_bytes': peak,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark X11 screen capture")
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--framerate', type=float, default=30, help="0 captures as fast as possible")
+    parser.add_argument('--ring-size', type=int, default=3)
+    args = parser.parse_args()
+
+    result = run(args.frames, args.framerate, args.ring_size)
+    for key, value in result.items():
+        print(f"{key:28} {value:.3f}" if isinstance(value, float) else f"{key:28} {value}")
+
+
+if __name__ == "__main__":
+    main()
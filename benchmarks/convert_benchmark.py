@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Colour conversion benchmark
+#
+# Checks the converter against a straightforward float64 reference and
+# reports throughput in source megapixels per second for each pixel format
+# and resolution preset pair.
+#
+#   python3 benchmarks/convert_benchmark.py --source 1080p
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.color_convert import COLOR_MATRICES, ColorConverter, resolution_size
+
+
+def reference_yuv(bgra: np.ndarray, matrix: str = 'bt709'):
+    """Per-pixel limited-range conversion followed by 2x2 chroma averaging"""
+    kr, kb = COLOR_MATRICES[matrix]
+    b, g, r = (bgra[..., channel].astype(np.float64) for channel in range(3))
+    luma = kr * r + (1.0 - kr - kb) * g + kb * b
+    y = 16 + 219 / 255 * luma
+    cb = 128 + 224 / 255 * (b - luma) / (2 * (1 - kb))
+    cr = 128 + 224 / 255 * (r - luma) / (2 * (1 - kr))
+
+    def subsample(plane):
+        return (plane[0::2, 0::2] + plane[1::2, 0::2] + plane[0::2, 1::2] + plane[1::2, 1::2]) / 4
+
+    return np.rint(y), np.rint(subsample(cb)), np.rint(subsample(cr))
+
+
+def verify(bgra: np.ndarray) -> dict:
+    """Return the maximum absolute error per plane for both pixel formats"""
+    errors = {}
+    y_ref, u_ref, v_ref = reference_yuv(bgra)
+    size = (bgra.shape[1], bgra.shape[0])
+    for pixel_format in ('i420', 'nv12'):
+        converter = ColorConverter(size, pixel_format)
+        converter.convert(bgra)
+        if pixel_format == 'nv12':
+            u, v = converter.uv_plane[..., 0], converter.uv_plane[..., 1]
+        else:
+            u, v = converter.u_plane, converter.v_plane
+        errors[pixel_format] = max(float(np.abs(converter.y_plane - y_ref).max()),
+                                   float(np.abs(u - u_ref).max()),
+                                   float(np.abs(v - v_ref).max()))
+    return errors
+
+
+def throughput(bgra: np.ndarray, target: str, pixel_format: str, iterations: int) -> float:
+    converter = ColorConverter(resolution_size(target), pixel_format)
+    converter.convert(bgra)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        converter.convert(bgra)
+    elapsed = time.perf_counter() - start
+    return iterations * bgra.shape[0] * bgra.shape[1] / elapsed / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark BGRA to YUV conversion")
+    parser.add_argument('--source', default='1080p')
+    parser.add_argument('--targets', default='1080p,720p,480p')
+    parser.add_argument('--iterations', type=int, default=30)
+    args = parser.parse_args()
+
+    width, height = resolution_size(args.source)
+    bgra = np.random.default_rng(0).integers(0, 256, (height, width, 4), dtype=np.uint8)
+
+    for pixel_format, error in verify(bgra).items():
+        print(f"{pixel_format} max error vs reference: {error:.0f}")
+
+    for target in args.targets.split(','):
+        for pixel_format in ('i420', 'nv12'):
+            rate = throughput(bgra, target, pixel_format, args.iterations)
+            print(f"{args.source} -> {target} {pixel_format}: {rate:.1f} MP/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Device model benchmark
+#
+# Measures the GUI thread time the tray's device menu costs as discovery
+# events arrive. A simulated receiver network (benchmarks/fake_mdns.py)
+# is listed, then a feeder thread delivers bursts of churn events
+# (receivers appearing, leaving and changing address) one delta at a
+# time, as discovery does. For each network size it reports how many
+# model updates the bursts were coalesced into, the shortest gap between
+# two updates, and the GUI thread time per update. For comparison it also
+# times rebuilding the whole menu, as the tray used to on every opening.
+#
+# Runs on Qt's offscreen platform. Exits non-zero when the p99 GUI thread
+# time per update exceeds --budget-ms.
+#
+#   python3 benchmarks/device_model_benchmark.py --sizes 50,500 --bursts 100 --burst-size 20
+
+import argparse
+import os
+import sys
+import threading
+import time
+from typing import Dict, List
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtWidgets import QAction, QApplication, QMenu
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.device_discovery import DeviceDelta
+from ui.device_model import DeviceModel
+from ui.system_tray import DeviceMenu
+from discovery_scaling import DELTA_KINDS, device_info, percentiles
+from fake_mdns import ReceiverFleet
+
+
+class TimedDeviceModel(DeviceModel):
+    """A device model that records how long each update keeps the GUI thread busy"""
+
+    def __init__(self):
+        super().__init__()
+        self.update_seconds: List[float] = []
+        self.update_times: List[float] = []
+
+    def flush(self):
+        start = time.perf_counter()
+        super().flush()
+        self.update_seconds.append(time.perf_counter() - start)
+        self.update_times.append(start)
+
+
+def rebuild_menu(menu: QMenu, devices: Dict[str, Dict[str, object]]):
+    """What the tray did on every opening before the device model"""
+    menu.clear()
+    for uuid, device in devices.items():
+        action = QAction(f"{device['name']} ({device['model_name']})", menu)
+        action.setData(uuid)
+        menu.addAction(action)
+
+
+def wait_for(app: QApplication, done, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while not done() and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.001)
+
+
+def run(app: QApplication, size: int, bursts: int, burst_size: int, burst_interval: float) -> Dict[str, object]:
+    fleet = ReceiverFleet(size)
+    model = TimedDeviceModel()
+    menu = DeviceMenu(model)
+    menu.set_searching(False)
+
+    # List the whole network, one delta per receiver
+    for device in fleet.devices.values():
+        model.submit([DeviceDelta('added', device.uuid, device_info(device))])
+    wait_for(app, lambda: len(model.devices) == size)
+    model.update_seconds.clear()
+    model.update_times.clear()
+
+    def feed():
+        for _ in range(bursts):
+            for _ in range(burst_size):
+                kind, device = fleet.churn_event()
+                model.submit([DeviceDelta(DELTA_KINDS[kind], device.uuid, device_info(device))])
+            time.sleep(burst_interval)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    wait_for(app, lambda: not feeder.is_alive(), timeout=bursts * burst_interval + 60)
+    # Let the last update land
+    wait_for(app, lambda: False, timeout=0.1)
+    if len(menu.device_actions) != len(model.devices) or len(model.devices) != len(fleet.devices):
+        raise RuntimeError(f"menu lists {len(menu.device_actions)} devices, network has {len(fleet.devices)}")
+
+    baseline = QMenu()
+    rebuild_seconds = []
+    for _ in range(20):
+        start = time.perf_counter()
+        rebuild_menu(baseline, model.devices)
+        rebuild_seconds.append(time.perf_counter() - start)
+
+    gaps = [later - earlier for earlier, later in zip(model.update_times, model.update_times[1:])]
+    return {
+        'updates': len(model.update_seconds),
+        'min_gap': min(gaps) if gaps else 0.0,
+        'update': percentiles(model.update_seconds),
+        'rebuild': percentiles(rebuild_seconds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GUI thread time of device list updates")
+    parser.add_argument('--sizes', default='50,500', help="comma separated network sizes")
+    parser.add_argument('--bursts', type=int, default=100)
+    parser.add_argument('--burst-size', type=int, default=20, help="discovery events per burst")
+    parser.add_argument('--burst-interval', type=float, default=0.05, help="seconds between bursts")
+    parser.add_argument('--budget-ms', type=float, help="maximum p99 GUI thread time per update")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    failures = []
+    print(f"{'devices':>8} {'events':>7} {'updates':>7} {'min gap':>8} {'update p50':>10} {'update p99':>10} "
+          f"{'rebuild p50':>11}")
+    for size in (int(size) for size in args.sizes.split(',')):
+        result = run(app, size, args.bursts, args.burst_size, args.burst_interval)
+        update, rebuild = result['update'], result['rebuild']
+        print(f"{size:8d} {args.bursts * args.burst_size:7d} {result['updates']:7d} "
+              f"{result['min_gap'] * 1000:6.1f}ms {update['p50'] * 1000:8.3f}ms {update['p99'] * 1000:8.3f}ms "
+              f"{rebuild['p50'] * 1000:9.3f}ms")
+        if args.budget_ms is not None and update['p99'] * 1000 > args.budget_ms:
+            failures.append(f"{size} devices: p99 update {update['p99'] * 1000:.3f} ms")
+
+    if failures:
+        print("Over budget:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Frame differ benchmark
+#
+# Compares a static workload (an unchanging slide) with a video workload
+# (every pixel changes every frame) and reports the CPU spent diffing and
+# how many frames would be passed on to the encoder.
+#
+#   python3 benchmarks/diff_benchmark.py --resolution 1920x1080
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.frame_diff import FrameDiffer
+from src.screen_capture import Frame
+
+
+def run(workload: str, width: int, height: int, frames: int, framerate: float) -> dict:
+    rng = np.random.default_rng(0)
+    # Pre-generate content so the benchmark measures the differ, not the generator
+    sources = [rng.integers(0, 256, (height, width, 4), dtype=np.uint8) for _ in range(2)]
+    frame = Frame(sources[0].copy())
+    differ = FrameDiffer()
+    emitted = 0
+
+    cpu_start = time.process_time()
+    for index in range(frames):
+        if workload == 'video':
+            np.copyto(frame.data, sources[index % 2])
+        frame.timestamp = index / framerate
+        frame.sequence = index
+        if differ.process(frame) is not None:
+            emitted += 1
+    cpu = time.process_time() - cpu_start
+
+    return {
+        'workload': workload,
+        'frames': frames,
+        'frames_emitted': emitted,
+        'cpu_ms_per_frame': 1000.0 * cpu / frames,
+        'cpu_percent_at_framerate': 100.0 * cpu / (frames / framerate),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the frame differ")
+    parser.add_argument('--resolution', default='1920x1080')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--framerate', type=float, default=30)
+    args = parser.parse_args()
+    width, height = (int(value) for value in args.resolution.split('x'))
+
+    for workload in ('static', 'video'):
+        result = run(workload, width, height, args.frames, args.framerate)
+        print(", ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                        for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Discovery scaling benchmark
+#
+# Measures how device discovery copes as the number of receivers grows.
+#
+# The "table" mode needs no network or optional packages: it feeds a
+# simulated fleet's churn (receivers appearing, leaving and changing
+# address) straight into the DeviceDiscovery table and reports, for each
+# fleet size, the CPU time per event, how long registered callbacks take
+# to hear about it, and the peak memory allocated. Delta callbacks and
+# full-list callbacks are measured separately, since a full-list callback
+# copies the whole table on every event.
+#
+# The "mdns" mode runs real discovery (zeroconf and pychromecast) against
+# benchmarks/fake_mdns.py on the loopback interface, and reports the time
+# until every receiver is listed, CPU and memory used, and how long each
+# churn event takes to reach the delta callbacks. The responder runs in
+# this process, so its CPU time is included.
+#
+# Exits non-zero when a --budget-* limit is exceeded, for use in CI.
+#
+#   python3 benchmarks/discovery_scaling.py --sizes 10,100,1000,5000
+#   python3 benchmarks/discovery_scaling.py --mode mdns --sizes 100,500 --churn 5
+
+import argparse
+import configparser
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.device_cache import DeviceCache
+from src.device_discovery import (DEVICE_ADDED, DEVICE_REMOVED, DEVICE_UPDATED, PYCHROMECAST_AVAILABLE,
+                                  ZEROCONF_AVAILABLE, DeviceDiscovery)
+from fake_mdns import APPEAR, DISAPPEAR, MOVE, FakeDevice, FakeMdnsResponder, ReceiverFleet
+
+DELTA_KINDS = {APPEAR: DEVICE_ADDED, DISAPPEAR: DEVICE_REMOVED, MOVE: DEVICE_UPDATED}
+
+
+class _Manager:
+    """The part of CastManager that DeviceDiscovery looks at"""
+
+    def __init__(self, config=None):
+        self.config = config
+
+
+def device_info(device: FakeDevice) -> Dict[str, object]:
+    """The table entry discovery would create for a fake receiver"""
+    return {
+        'name': device.name,
+        'model_name': device.model_name,
+        'uuid': device.uuid,
+        'cast_type': 'cast',
+        'address': device.address,
+        'port': device.port,
+        'status': 'available',
+    }
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+    values = np.array(samples)
+    return {'p50': float(np.percentile(values, 50)), 'p99': float(np.percentile(values, 99)),
+            'max': float(values.max())}
+
+
+def run_table(size: int, events: int, callback_kind: str, seed: int = 1) -> Dict[str, object]:
+    """Fill the table with a fleet, then apply churn events one at a time"""
+    fleet = ReceiverFleet(size, seed)
+    cache_dir = tempfile.TemporaryDirectory(prefix='ubuntucast-discovery-')
+    discovery = DeviceDiscovery(_Manager(), cache=DeviceCache(path=os.path.join(cache_dir.name, 'devices.json')))
+    event_start = [0.0]
+    callback_latency = []
+
+    def on_change(_):
+        callback_latency.append(time.perf_counter() - event_start[0])
+
+    if callback_kind == 'delta':
+        discovery.register_delta_callback(on_change)
+    else:
+        discovery.register_callback(on_change)
+
+    tracemalloc.start()
+    fill_start = time.process_time()
+    for device in fleet.devices.values():
+        discovery._apply_device(device_info(device))
+    fill_cpu = time.process_time() - fill_start
+    callback_latency.clear()
+
+    event_cpu = []
+    for _ in range(events):
+        kind, device = fleet.churn_event()
+        cpu_start = time.process_time()
+        event_start[0] = time.perf_counter()
+        if kind == DISAPPEAR:
+            discovery._remove_device(device.uuid)
+        else:
+            discovery._apply_device(device_info(device))
+        event_cpu.append(time.process_time() - cpu_start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    cache_dir.cleanup()
+
+    return {
+        'fill_cpu_per_device': fill_cpu / size,
+        'event_cpu': percentiles(event_cpu),
+        'callback_latency': percentiles(callback_latency),
+        'peak_memory_kib': peak // 1024,
+    }
+
+
+def run_mdns(size: int, churn_rate: float, duration: float, timeout: float) -> Dict[str, object]:
+    """Discover a fake fleet over mDNS on loopback, then measure churn latency"""
+    config = configparser.ConfigParser()
+    config['ADVANCED'] = {'discovery_interfaces': '127.0.0.1'}
+    fleet = ReceiverFleet(size)
+    pending = {}  # (delta kind, uuid) -> time the responder announced it
+    churn_latency = []
+    listed = threading.Event()
+    lock = threading.Lock()
+
+    def on_event(kind, device, announced):
+        with lock:
+            pending[(DELTA_KINDS[kind], device.uuid)] = announced
+
+    def on_deltas(deltas):
+        now = time.monotonic()
+        with lock:
+            for delta in deltas:
+                announced = pending.pop((delta.kind, delta.uuid), None)
+                if announced is not None:
+                    churn_latency.append(now - announced)
+        if len(discovery.devices) >= size:
+            listed.set()
+
+    cache_dir = tempfile.TemporaryDirectory(prefix='ubuntucast-discovery-')
+    discovery = DeviceDiscovery(_Manager(config), cache=DeviceCache(path=os.path.join(cache_dir.name, 'devices.json')))
+    discovery.register_delta_callback(on_deltas)
+    responder = FakeMdnsResponder(fleet, on_event=on_event)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_start = usage.ru_utime + usage.ru_stime
+    responder.start()
+    start = time.monotonic()
+    try:
+        discovery.start_discovery()
+        time_to_all = time.monotonic() - start if listed.wait(timeout) else None
+        discovered = len(discovery.devices)
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        discovery_cpu = usage.ru_utime + usage.ru_stime - cpu_start
+
+        if churn_rate > 0 and time_to_all is not None:
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                responder.apply_churn()
+                time.sleep(1.0 / churn_rate)
+            # Let the last events arrive before counting what was missed
+            time.sleep(2.0)
+    finally:
+        discovery.stop_discovery()
+        responder.stop(goodbye=False)
+        cache_dir.cleanup()
+
+    with lock:
+        missed = len(pending)
+    return {
+        'time_to_all_devices': time_to_all,
+        'devices_listed': discovered,
+        'discovery_cpu': discovery_cpu,
+        'queries': responder.queries,
+        'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'churn_latency': percentiles(churn_latency),
+        'churn_missed': missed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark device discovery against large receiver fleets")
+    parser.add_argument('--mode', default='table', choices=('table', 'mdns'))
+    parser.add_argument('--sizes', default='10,100,1000,5000', help="comma separated fleet sizes")
+    parser.add_argument('--events', type=int, default=500, help="churn events per size in table mode")
+    parser.add_argument('--churn', type=float, default=5.0, help="churn events per second in mdns mode")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds of churn in mdns mode")
+    parser.add_argument('--timeout', type=float, default=60.0, help="seconds to wait for every receiver")
+    parser.add_argument('--budget-event-ms', type=float,
+                        help="maximum p99 CPU per event with delta callbacks (table mode)")
+    parser.add_argument('--budget-callback-ms', type=float,
+                        help="maximum p99 callback latency (delta callbacks in table mode, churn in mdns mode)")
+    parser.add_argument('--budget-memory-kib', type=int, help="maximum peak memory of the largest fleet")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    failures = []
+
+    if args.mode == 'table':
+        print(f"{'devices':>8} {'callbacks':>9} {'fill/dev':>10} {'event p50':>10} {'event p99':>10} "
+              f"{'cb p50':>10} {'cb p99':>10} {'peak KiB':>9}")
+        for size in sizes:
+            for callback_kind in ('delta', 'full'):
+                result = run_table(size, args.events, callback_kind)
+                event, callback = result['event_cpu'], result['callback_latency']
+                print(f"{size:8d} {callback_kind:>9} {result['fill_cpu_per_device'] * 1e6:8.1f}us "
+                      f"{event['p50'] * 1e6:8.1f}us {event['p99'] * 1e6:8.1f}us "
+                      f"{callback['p50'] * 1e6:8.1f}us {callback['p99'] * 1e6:8.1f}us "
+                      f"{result['peak_memory_kib']:9d}")
+                if callback_kind != 'delta':
+                    continue
+                if args.budget_event_ms is not None and event['p99'] * 1000 > args.budget_event_ms:
+                    failures.append(f"{size} devices: p99 event CPU {event['p99'] * 1000:.3f} ms")
+                if args.budget_callback_ms is not None and callback['p99'] * 1000 > args.budget_callback_ms:
+                    failures.append(f"{size} devices: p99 callback latency {callback['p99'] * 1000:.3f} ms")
+                if (args.budget_memory_kib is not None and size == max(sizes)
+                        and result['peak_memory_kib'] > args.budget_memory_kib):
+                    failures.append(f"{size} devices: peak memory {result['peak_memory_kib']} KiB")
+    else:
+        if not (PYCHROMECAST_AVAILABLE and ZEROCONF_AVAILABLE):
+            sys.exit("pychromecast and zeroconf are required for the mdns mode")
+        for size in sizes:
+            result = run_mdns(size, args.churn, args.duration, args.timeout)
+            latency = result['churn_latency']
+            time_to_all = result['time_to_all_devices']
+            print(f"{size:6d} receivers: "
+                  + (f"all listed in {time_to_all:.2f} s" if time_to_all is not None
+                     else f"only {result['devices_listed']} listed")
+                  + f", {result['discovery_cpu']:.2f} s CPU, {result['queries']} queries, "
+                  f"peak RSS {result['peak_rss_kib'] // 1024} MiB, churn latency p50 {latency['p50'] * 1000:.0f} ms "
+                  f"p99 {latency['p99'] * 1000:.0f} ms, {result['churn_missed']} missed")
+            if time_to_all is None:
+                failures.append(f"{size} receivers: only {result['devices_listed']} listed")
+            if args.budget_callback_ms is not None and latency['p99'] * 1000 > args.budget_callback_ms:
+                failures.append(f"{size} receivers: p99 churn latency {latency['p99'] * 1000:.0f} ms")
+            if (args.budget_memory_kib is not None and size == max(sizes)
+                    and result['peak_rss_kib'] > args.budget_memory_kib):
+                failures.append(f"{size} receivers: peak RSS {result['peak_rss_kib']} KiB")
+
+    if failures:
+        print("Over budget:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
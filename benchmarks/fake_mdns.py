@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Fake mDNS receiver fleet
+#
+# Advertises a fleet of simulated Cast receivers as _googlecast._tcp
+# services over multicast DNS on one interface, normally loopback, so
+# device discovery can be run against hundreds or thousands of receivers
+# without any on the network. Answers PTR queries for the service type
+# (honouring known-answer suppression) and SRV/TXT/A queries for single
+# receivers, and announces churn as it happens: receivers appearing,
+# leaving with a goodbye, and moving to a new address.
+#
+# Receiver addresses are taken from 127.1.0.0/16, which is all local, so
+# discovery on loopback can reach them.
+#
+#   python3 benchmarks/fake_mdns.py --devices 500 --churn 2
+
+import argparse
+import random
+import socket
+import struct
+import threading
+import time
+import uuid as uuid_module
+from typing import Callable, Dict, List, Optional, Tuple
+
+MDNS_GROUP = '224.0.0.251'
+MDNS_PORT = 5353
+SERVICE_TYPE = '_googlecast._tcp.local.'
+
+TYPE_A, TYPE_PTR, TYPE_TXT, TYPE_SRV, TYPE_ANY = 1, 12, 16, 33, 255
+CLASS_IN = 1
+CACHE_FLUSH = 0x8000
+TTL = 120
+HOST_TTL = 120
+
+# Stay well inside a typical 1500 byte MTU
+MAX_PACKET = 1400
+
+# Kinds of churn event
+APPEAR = 'appear'
+DISAPPEAR = 'disappear'
+MOVE = 'move'
+
+
+class FakeDevice:
+    """One advertised receiver"""
+
+    def __init__(self, index: int, rng: random.Random):
+        self.uuid = str(uuid_module.UUID(int=rng.getrandbits(128), version=4))
+        self.name = f"Fake Receiver {index}"
+        self.model_name = rng.choice(("Chromecast", "Chromecast Ultra", "Google Nest Hub", "Google TV"))
+        self.port = 8009
+        self.address = ''
+
+    @property
+    def instance(self) -> str:
+        return f"{self.model_name.replace(' ', '-')}-{self.uuid.replace('-', '')}.{SERVICE_TYPE}"
+
+    @property
+    def host(self) -> str:
+        return f"{self.uuid}.local."
+
+    def txt(self) -> List[str]:
+        return [f"id={self.uuid.replace('-', '')}", "cd=0", "rm=", "ve=05", f"md={self.model_name}",
+                "ic=/setup/icon.png", f"fn={self.name}", "ca=4101", "st=0", "bs=FA8FCA000000", "nf=1", "rs="]
+
+
+class ReceiverFleet:
+    """A set of fake receivers that can churn"""
+
+    def __init__(self, count: int, seed: int = 1):
+        self.rng = random.Random(seed)
+        self.devices: Dict[str, FakeDevice] = {}
+        self._next_index = 0
+        self._next_address = 1
+        for _ in range(count):
+            self.add()
+
+    def add(self) -> FakeDevice:
+        device = FakeDevice(self._next_index, self.rng)
+        self._next_index += 1
+        device.address = self._allocate_address()
+        self.devices[device.uuid] = device
+        return device
+
+    def _allocate_address(self) -> str:
+        number = self._next_address
+        self._next_address += 1
+        return f"127.1.{number // 254 % 256}.{number % 254 + 1}"
+
+    def churn_event(self) -> Tuple[str, FakeDevice]:
+        """Apply a random appear, disappear or move and return it"""
+        kind = self.rng.choice((APPEAR, DISAPPEAR, MOVE)) if self.devices else APPEAR
+        if kind == APPEAR:
+            return kind, self.add()
+        device = self.devices[self.rng.choice(list(self.devices))]
+        if kind == DISAPPEAR:
+            del self.devices[device.uuid]
+        else:
+            device.address = self._allocate_address()
+        return kind, device
+
+
+def _encode_name(name: str) -> bytes:
+    out = bytearray()
+    for label in name.rstrip('.').split('.'):
+        data = label.encode()
+        out += bytes([len(data)]) + data
+    return bytes(out) + b'\x00'
+
+
+def _read_name(packet: bytes, offset: int) -> Tuple[str, int]:
+    """Read a possibly compressed name, returning it and the offset after it"""
+    labels = []
+    end = None
+    for _ in range(128):
+        length = packet[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | packet[offset + 1]
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(packet[offset:offset + length].decode(errors='replace'))
+        offset += length
+    return '.'.join(labels) + '.', end if end is not None else offset
+
+
+def _record(name: str, rtype: int, rclass: int, ttl: int, rdata: bytes) -> bytes:
+    return _encode_name(name) + struct.pack('>HHIH', rtype, rclass, ttl, len(rdata)) + rdata
+
+
+def device_records(device: FakeDevice, ttl: int = TTL) -> Tuple[bytes, List[bytes]]:
+    """The PTR answer and the SRV, TXT and A records describing a device"""
+    ptr = _record(SERVICE_TYPE, TYPE_PTR, CLASS_IN, ttl, _encode_name(device.instance))
+    txt = b''.join(bytes([len(entry.encode())]) + entry.encode() for entry in device.txt())
+    extra = [
+        _record(device.instance, TYPE_SRV, CLASS_IN | CACHE_FLUSH, ttl,
+                struct.pack('>HHH', 0, 0, device.port) + _encode_name(device.host)),
+        _record(device.instance, TYPE_TXT, CLASS_IN | CACHE_FLUSH, ttl, txt),
+        _record(device.host, TYPE_A, CLASS_IN | CACHE_FLUSH, min(ttl, HOST_TTL),
+                socket.inet_aton(device.address)),
+    ]
+    return ptr, extra
+
+
+def parse_query(packet: bytes) -> Tuple[List[Tuple[str, int]], set]:
+    """Questions of an mDNS query and the PTR targets listed as known answers"""
+    if len(packet) < 12:
+        return [], set()
+    _, flags, questions, answers = struct.unpack_from('>HHHH', packet, 0)
+    if flags & 0x8000:
+        return [], set()  # A response, not a query
+    offset = 12
+    asked = []
+    for _ in range(questions):
+        name, offset = _read_name(packet, offset)
+        rtype, _ = struct.unpack_from('>HH', packet, offset)
+        offset += 4
+        asked.append((name.lower(), rtype))
+    known = set()
+    for _ in range(answers):
+        name, offset = _read_name(packet, offset)
+        rtype, _, ttl, length = struct.unpack_from('>HHIH', packet, offset)
+        offset += 10
+        if rtype == TYPE_PTR and ttl > TTL // 2:
+            target, _ = _read_name(packet, offset)
+            known.add(target.lower())
+        offset += length
+    return asked, known
+
+
+def _packets(groups: List[Tuple[List[bytes], List[bytes]]]) -> List[bytes]:
+    """Pack (answers, additionals) groups into as few response packets as fit"""
+    packets = []
+    answers: List[bytes] = []
+    additionals: List[bytes] = []
+    size = 12
+    for group_answers, group_additionals in groups:
+        group_size = sum(map(len, group_answers)) + sum(map(len, group_additionals))
+        if answers and size + group_size > MAX_PACKET:
+            packets.append(_packet(answers, additionals))
+            answers, additionals, size = [], [], 12
+        answers += group_answers
+        additionals += group_additionals
+        size += group_size
+    if answers:
+        packets.append(_packet(answers, additionals))
+    return packets
+
+
+def _packet(answers: List[bytes], additionals: List[bytes]) -> bytes:
+    header = struct.pack('>HHHHHH', 0, 0x8400, 0, len(answers), 0, len(additionals))
+    return header + b''.join(answers) + b''.join(additionals)
+
+
+class FakeMdnsResponder:
+    """Answers mDNS queries for a ReceiverFleet and announces its churn
+
+    ``on_event`` is called with (kind, device, time) right after a churn
+    event has been announced, for measuring how long discovery takes to
+    report it.
+    """
+
+    def __init__(self, fleet: ReceiverFleet, interface: str = '127.0.0.1',
+                 on_event: Optional[Callable[[str, FakeDevice, float], None]] = None,
+                 packet_interval: float = 0.0005):
+        self.fleet = fleet
+        self.interface = interface
+        self.on_event = on_event
+        # Pace multi-packet responses like real responders, so receive buffers do not overflow
+        self.packet_interval = packet_interval
+        self.queries = 0
+        self.packets_sent = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._sock: Optional[socket.socket] = None
+        self._threads: List[threading.Thread] = []
+
+    def start(self, churn_rate: float = 0.0):
+        """Start answering queries, with ``churn_rate`` churn events per second"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            # Share the port with a system responder such as avahi
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', MDNS_PORT))
+        interface = socket.inet_aton(self.interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(MDNS_GROUP) + interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 255)
+        sock.settimeout(0.5)
+        self._sock = sock
+        self._stop_event.clear()
+        self._threads = [threading.Thread(target=self._serve, name="FakeMdnsServe")]
+        if churn_rate > 0:
+            self._threads.append(threading.Thread(target=self._churn, args=(churn_rate,), name="FakeMdnsChurn"))
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        self.announce(list(self.fleet.devices.values()))
+
+    def stop(self, goodbye: bool = True):
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        if goodbye and self._sock is not None:
+            with self._lock:
+                devices = list(self.fleet.devices.values())
+            self.announce(devices, ttl=0)
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def announce(self, devices: List[FakeDevice], ttl: int = TTL):
+        """Send unsolicited responses for devices; a zero TTL says goodbye"""
+        groups = []
+        for device in devices:
+            ptr, extra = device_records(device, ttl)
+            groups.append(([ptr], extra))
+        self._send(_packets(groups))
+
+    def apply_churn(self) -> Tuple[str, FakeDevice]:
+        """Apply and announce one churn event"""
+        with self._lock:
+            kind, device = self.fleet.churn_event()
+        if kind == DISAPPEAR:
+            self.announce([device], ttl=0)
+        else:
+            self.announce([device])
+        if self.on_event is not None:
+            self.on_event(kind, device, time.monotonic())
+        return kind, device
+
+    def _send(self, packets: List[bytes]):
+        sock = self._sock
+        if sock is None:
+            return
+        for index, packet in enumerate(packets):
+            if index:
+                time.sleep(self.packet_interval)
+            try:
+                sock.sendto(packet, (MDNS_GROUP, MDNS_PORT))
+                self.packets_sent += 1
+            except OSError:
+                return
+
+    def _serve(self):
+        while not self._stop_event.is_set():
+            try:
+                packet, _ = self._sock.recvfrom(9000)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            try:
+                asked, known = parse_query(packet)
+            except (IndexError, struct.error, UnicodeDecodeError):
+                continue
+            if asked:
+                self.queries += 1
+                self._answer(asked, known)
+
+    def _answer(self, asked: List[Tuple[str, int]], known: set):
+        with self._lock:
+            devices = list(self.fleet.devices.values())
+        groups = []
+        for name, rtype in asked:
+            if name == SERVICE_TYPE and rtype in (TYPE_PTR, TYPE_ANY):
+                for device in devices:
+                    if device.instance.lower() not in known:
+                        ptr, extra = device_records(device)
+                        groups.append(([ptr], extra))
+                continue
+            for device in devices:
+                if name in (device.instance.lower(), device.host.lower()):
+                    _, extra = device_records(device)
+                    groups.append((extra, []))
+                    break
+        self._send(_packets(groups))
+
+    def _churn(self, rate: float):
+        rng = random.Random(self.fleet.rng.random())
+        while not self._stop_event.wait(rng.expovariate(rate)):
+            self.apply_churn()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Advertise a fleet of fake Cast receivers over mDNS")
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--churn', type=float, default=0.0, help="churn events per second")
+    parser.add_argument('--interface', default='127.0.0.1')
+    args = parser.parse_args()
+
+    responder = FakeMdnsResponder(ReceiverFleet(args.devices), args.interface,
+                                  on_event=lambda kind, device, _: print(f"{kind}: {device.name} {device.address}"))
+    responder.start(args.churn)
+    print(f"Advertising {args.devices} receivers on {args.interface}")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"{len(responder.fleet.devices)} receivers, {responder.queries} queries, "
+                  f"{responder.packets_sent} packets sent")
+    except KeyboardInterrupt:
+        responder.stop()
+
+
+if __name__ == "__main__":
+    main()
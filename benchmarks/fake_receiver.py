@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Fake Cast receiver
+#
+# A local stand-in for a Chromecast that speaks enough of the CASTV2
+# control protocol for pychromecast to connect, launch the Default Media
+# Receiver and load a stream: length-prefixed CastMessage protobufs over
+# TLS on the connection, heartbeat, receiver and media namespaces. Once a
+# stream is loaded it plays it like the real media player would, pulling
+# the HLS playlist and segments from the live edge, and records when the
+# first video arrived and how many frames came through.
+#
+# The certificate is a throwaway self-signed one made with the openssl
+# command line tool, which pychromecast accepts as it does not verify
+# receiver certificates.
+#
+#   python3 benchmarks/fake_receiver.py --port 8009
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid as uuid_module
+from typing import Dict, List, Optional, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.stream_server import _child_boxes, _video_sample_count
+
+NS_CONNECTION = 'urn:x-cast:com.google.cast.tp.connection'
+NS_HEARTBEAT = 'urn:x-cast:com.google.cast.tp.heartbeat'
+NS_RECEIVER = 'urn:x-cast:com.google.cast.receiver'
+NS_MEDIA = 'urn:x-cast:com.google.cast.media'
+
+DEFAULT_MEDIA_RECEIVER = 'CC1AD845'
+
+_certificate_lock = threading.Lock()
+_certificate: Optional[Tuple[str, str]] = None
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def encode_message(source: str, destination: str, namespace: str, payload: dict) -> bytes:
+    """Encode a string-payload CastMessage protobuf"""
+    out = bytearray(b'\x08\x00')  # protocol_version = CASTV2_1_0
+    for tag, text in ((0x12, source), (0x1a, destination), (0x22, namespace)):
+        data = text.encode()
+        out += bytes([tag]) + _varint(len(data)) + data
+    out += b'\x28\x00'  # payload_type = STRING
+    data = json.dumps(payload).encode()
+    out += b'\x32' + _varint(len(data)) + data
+    return bytes(out)
+
+
+def decode_message(data: bytes) -> Dict[str, object]:
+    """Decode a CastMessage protobuf into its fields, with the JSON payload parsed"""
+    names = {2: 'source', 3: 'destination', 4: 'namespace', 6: 'payload', 7: 'binary'}
+    fields: Dict[str, object] = {}
+    offset = 0
+    while offset < len(data):
+        key, offset = _read_varint(data, offset)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            _, offset = _read_varint(data, offset)
+        elif wire_type == 2:
+            length, offset = _read_varint(data, offset)
+            value = data[offset:offset + length]
+            offset += length
+            if number in names:
+                fields[names[number]] = value if number == 7 else value.decode()
+        else:
+            raise ValueError(f"Unexpected protobuf wire type {wire_type}")
+    if 'payload' in fields:
+        fields['payload'] = json.loads(fields['payload'])
+    return fields
+
+
+def _read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, offset
+
+
+def _self_signed_certificate() -> Tuple[str, str]:
+    """Create (once per process) a throwaway certificate and key"""
+    global _certificate
+    with _certificate_lock:
+        if _certificate is None:
+            directory = tempfile.mkdtemp(prefix='ubuntucast-fake-receiver-')
+            cert, key = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+            subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '2',
+                            '-subj', '/CN=UbuntuCast fake receiver', '-keyout', key, '-out', cert],
+                           check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            _certificate = (cert, key)
+        return _certificate
+
+
+class HlsPlayer:
+    """Plays an HLS stream at the live edge and counts what arrives"""
+
+    def __init__(self, url: str, on_first_segment=None):
+        self.url = url
+        self.on_first_segment = on_first_segment
+        self.first_segment_time: Optional[float] = None
+        self.segments = 0
+        self.bytes = 0
+        self.video_frames = 0
+        self.errors = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="FakeReceiverPlayer")
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _get(self, connection: http.client.HTTPConnection, path: str) -> Optional[bytes]:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        data = response.read()
+        return data if response.status == 200 else None
+
+    def _live_edge(self, connection, path: str) -> Optional[int]:
+        playlist = self._get(connection, path)
+        if playlist is None:
+            return None
+        segments = [line for line in playlist.decode().splitlines() if line.startswith('segment_')]
+        return int(segments[-1][8:-4]) if segments else None
+
+    def _run(self):
+        parts = urllib.parse.urlsplit(self.url)
+        base = parts.path.rsplit('/', 1)[0]
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+        sequence = None
+        while not self._stop_event.is_set():
+            try:
+                if sequence is None:
+                    # (Re)join at the live edge, fetching the init segment like a decoder reset
+                    sequence = self._live_edge(connection, parts.path)
+                    if sequence is None or self._get(connection, f'{base}/init.mp4') is None:
+                        sequence = None
+                        self._stop_event.wait(0.2)
+                        continue
+                data = self._get(connection, f'{base}/segment_{sequence}.m4s')
+                if data is None:
+                    sequence = None
+                    continue
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                connection.close()
+                self._stop_event.wait(0.2)
+                continue
+            self.segments += 1
+            self.bytes += len(data)
+            view = memoryview(data)
+            self.video_frames += sum(_video_sample_count(payload)
+                                     for box_type, payload in _child_boxes(view) if box_type == b'moof')
+            if self.first_segment_time is None:
+                self.first_segment_time = time.monotonic()
+                if self.on_first_segment is not None:
+                    self.on_first_segment()
+            sequence += 1
+        connection.close()
+
+
+class _Connection:
+    """One sender's TLS connection"""
+
+    def __init__(self, receiver: 'FakeCastReceiver', sock: ssl.SSLSocket):
+        self.receiver = receiver
+        self.sock = sock
+        self.write_lock = threading.Lock()
+
+    def send(self, source: str, destination: str, namespace: str, payload: dict):
+        message = encode_message(source, destination, namespace, payload)
+        with self.write_lock:
+            self.sock.sendall(struct.pack('>I', len(message)) + message)
+
+    def serve(self):
+        try:
+            while True:
+                header = self._read(4)
+                if header is None:
+                    return
+                body = self._read(struct.unpack('>I', header)[0])
+                if body is None:
+                    return
+                self.receiver.handle(self, decode_message(body))
+        except (OSError, ValueError):
+            return
+        finally:
+            self.receiver.disconnected(self)
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+
+    def _read(self, size: int) -> Optional[bytes]:
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return bytes(data)
+
+
+class FakeCastReceiver:
+    """A local CASTV2 receiver running the Default Media Receiver"""
+
+    def __init__(self, name: str = "Fake Receiver", uuid: Optional[str] = None,
+                 host: str = '127.0.0.1', port: int = 0, model_name: str = "Chromecast"):
+        self.name = name
+        self.uuid = uuid or str(uuid_module.uuid4())
+        self.model_name = model_name
+        self.host = host
+        self._requested_port = port
+        self.player: Optional[HlsPlayer] = None
+        self.load_time: Optional[float] = None
+        self.first_segment_time: Optional[float] = None
+        self.first_segment_event = threading.Event()
+        self._session: Optional[Tuple[str, str]] = None  # (sessionId, transportId) of the running app
+        self._player_state = 'IDLE'
+        self._media: Optional[dict] = None
+        self._connections: List[_Connection] = []
+        self._lock = threading.Lock()
+        self._listener: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self._listener.getsockname()[1]
+
+    def device_info(self) -> dict:
+        """The receiver as a DeviceDiscovery table entry"""
+        return {'name': self.name, 'model_name': self.model_name, 'uuid': self.uuid,
+                'cast_type': 'cast', 'address': self.host, 'port': self.port, 'status': 'available'}
+
+    def start(self):
+        cert, key = _self_signed_certificate()
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self._requested_port))
+        listener.listen(8)
+        self._listener = listener
+        self._context = context
+        self._thread = threading.Thread(target=self._accept, name="FakeReceiverAccept")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self.player is not None:
+            self.player.stop()
+        if self._listener is not None:
+            self._listener.close()
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.sock.close()
+            except OSError:
+                pass
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+            except OSError:
+                return
+            try:
+                sock = self._context.wrap_socket(sock, server_side=True)
+            except (OSError, ssl.SSLError):
+                sock.close()
+                continue
+            connection = _Connection(self, sock)
+            with self._lock:
+                self._connections.append(connection)
+            thread = threading.Thread(target=connection.serve, name="FakeReceiverConnection")
+            thread.daemon = True
+            thread.start()
+
+    def disconnected(self, connection: _Connection):
+        with self._lock:
+            if connection in self._connections:
+                self._connections.remove(connection)
+
+    def handle(self, connection: _Connection, message: dict):
+        namespace = message.get('namespace')
+        payload = message.get('payload') or {}
+        source, destination = message.get('source', ''), message.get('destination', '')
+        kind = payload.get('type')
+
+        if namespace == NS_HEARTBEAT and kind == 'PING':
+            connection.send(destination, source, NS_HEARTBEAT, {'type': 'PONG'})
+        elif namespace == NS_CONNECTION:
+            pass  # Virtual connections open and close without a reply
+        elif namespace == NS_RECEIVER:
+            self._handle_receiver(connection, source, destination, kind, payload)
+        elif namespace == NS_MEDIA:
+            self._handle_media(connection, source, destination, kind, payload)
+
+    def _handle_receiver(self, connection, source, destination, kind, payload):
+        if kind == 'LAUNCH':
+            if self._session is None or payload.get('appId') != DEFAULT_MEDIA_RECEIVER:
+                self._stop_player()
+                self._session = (str(uuid_module.uuid4()), f"web-{uuid_module.uuid4().hex[:8]}")
+        elif kind == 'STOP':
+            self._stop_player()
+            self._session = None
+        elif kind != 'GET_STATUS':
+            return
+        status = self._receiver_status(payload.get('requestId', 0))
+        connection.send(destination, source, NS_RECEIVER, status)
+        if kind != 'GET_STATUS':
+            self._broadcast(NS_RECEIVER, self._receiver_status(0), 'receiver-0')
+
+    def _receiver_status(self, request_id: int) -> dict:
+        applications = []
+        if self._session is not None:
+            session_id, transport_id = self._session
+            applications.append({
+                'appId': DEFAULT_MEDIA_RECEIVER, 'displayName': 'Default Media Receiver',
+                'isIdleScreen': False, 'launchedFromCloud': False,
+                'namespaces': [{'name': NS_MEDIA}],
+                'sessionId': session_id, 'statusText': 'Ready To Cast', 'transportId': transport_id,
+            })
+        return {
+            'type': 'RECEIVER_STATUS', 'requestId': request_id,
+            'status': {
+                'applications': applications, 'isActiveInput': True, 'isStandBy': False,
+                'volume': {'controlType': 'attenuation', 'level': 1.0, 'muted': False, 'stepInterval': 0.05},
+            },
+        }
+
+    def _handle_media(self, connection, source, destination, kind, payload):
+        request_id = payload.get('requestId', 0)
+        if kind == 'LOAD':
+            self._stop_player()
+            self._media = payload.get('media', {})
+            self._player_state = 'BUFFERING'
+            self.load_time = time.monotonic()
+            self.player = HlsPlayer(self._media.get('contentId', ''), self._on_first_segment)
+            self.player.start()
+        elif kind == 'STOP':
+            self._stop_player()
+        elif kind not in ('GET_STATUS', 'PLAY', 'PAUSE'):
+            return
+        connection.send(destination, source, NS_MEDIA, self._media_status(request_id))
+
+    def _media_status(self, request_id: int) -> dict:
+        status = []
+        if self._media is not None:
+            status.append({
+                'mediaSessionId': 1, 'playbackRate': 1, 'playerState': self._player_state,
+                'currentTime': time.monotonic() - self.load_time if self.load_time else 0,
+                'supportedMediaCommands': 15, 'volume': {'level': 1.0, 'muted': False},
+                'media': self._media, 'activeTrackIds': [],
+            })
+        return {'type': 'MEDIA_STATUS', 'requestId': request_id, 'status': status}
+
+    def _on_first_segment(self):
+        self.first_segment_time = self.player.first_segment_time
+        self._player_state = 'PLAYING'
+        self.first_segment_event.set()
+        self._broadcast_media()
+
+    def _stop_player(self):
+        if self.player is not None:
+            self.player.stop()
+            self.player = None
+        if self._media is not None:
+            self._player_state = 'IDLE'
+            self._broadcast_media()
+            self._media = None
+
+    def _broadcast_media(self):
+        if self._session is not None:
+            self._broadcast(NS_MEDIA, self._media_status(0), self._session[1])
+
+    def _broadcast(self, namespace: str, payload: dict, source: str):
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.send(source, '*', namespace, payload)
+            except OSError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Cast receiver for manual testing")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8009)
+    parser.add_argument('--name', default="Fake Receiver")
+    args = parser.parse_args()
+
+    receiver = FakeCastReceiver(args.name, host=args.host, port=args.port)
+    receiver.start()
+    print(f"{receiver.name} ({receiver.uuid}) listening on {args.host}:{receiver.port}")
+    try:
+        while True:
+            time.sleep(5)
+            player = receiver.player
+            if player is not None:
+                print(f"{player.segments} segments, {player.video_frames} frames, {player.bytes} bytes")
+    except KeyboardInterrupt:
+        receiver.stop()
+
+
+if __name__ == "__main__":
+    main()
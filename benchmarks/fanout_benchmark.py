@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Fan-out benchmark
+#
+# Runs a real CastManager session against N simulated receivers. Each
+# receiver is a fake Chromecast whose play_media() starts an HLS client
+# pulling the live stream from the shared segment server, and the pipeline
+# is replaced by a synthetic encoder publishing fMP4 fragments at a fixed
+# bitrate. Reports process CPU usage and delivered segments for each
+# receiver count, which should stay close to flat as receivers are added
+# because capture and encoding happen once per session.
+#
+#   python3 benchmarks/fanout_benchmark.py --receivers 1,2,4,8,16 --duration 5
+
+import argparse
+import configparser
+import http.client
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import Future
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.cast_manager import CastManager
+from stream_server_benchmark import fragment, init_segment
+
+
+class SyntheticPipeline:
+    """Stands in for the capture and encode pipeline, publishing fragments in real time"""
+
+    def __init__(self, output_callback, bitrate: int, fragments_per_second: int = 5):
+        self.output_callback = output_callback
+        self.fragment_size = bitrate * 1000 // 8 // fragments_per_second
+        self.fragments_per_second = fragments_per_second
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self):
+        self.output_callback(init_segment())
+        count = 0
+        interval = 1.0 / self.fragments_per_second
+        next_time = time.monotonic()
+        while not self._stop_event.is_set():
+            # One keyframe per second closes a segment
+            self.output_callback(fragment(count % self.fragments_per_second == 0, self.fragment_size))
+            count += 1
+            next_time += interval
+            self._stop_event.wait(max(0.0, next_time - time.monotonic()))
+
+
+class SimulatedReceiver:
+    """Plays the HLS stream at the live edge like a Chromecast's media player"""
+
+    def __init__(self):
+        self.segments = 0
+        self.bytes = 0
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread = None
+
+    def play_media(self, url, content_type, **kwargs):
+        self._thread = threading.Thread(target=self._run, args=(url,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def register_status_listener(self, listener):
+        pass
+
+    def _get(self, connection, path: str) -> bytes:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        data = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"{path}: HTTP {response.status}")
+        return data
+
+    def _run(self, url: str):
+        parts = urllib.parse.urlsplit(url)
+        base = parts.path.rsplit('/', 1)[0]
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+        playlist = self._get(connection, parts.path).decode()
+        self._get(connection, f'{base}/init.mp4')
+        segments = [line for line in playlist.splitlines() if line.startswith('segment_')]
+        sequence = int(segments[-1][8:-4])
+        while not self._stop_event.is_set():
+            data = self._get(connection, f'{base}/segment_{sequence}.m4s')
+            self.segments += 1
+            self.bytes += len(data)
+            sequence += 1
+        connection.close()
+
+
+class FakeCast:
+    def __init__(self, uuid: str):
+        self.name = f"Receiver {uuid}"
+        self.cast_info = type('CastInfo', (), {'host': '127.0.0.1'})()
+        self.media_controller = SimulatedReceiver()
+
+
+class FakePool:
+    """Connection pool handing out fake receivers immediately"""
+
+    def connect(self, uuid, callback=None) -> Future:
+        future = Future()
+        future.set_result(FakeCast(uuid))
+        if callback is not None:
+            callback(future.result())
+        return future
+
+    def acquire(self, uuid):
+        pass
+
+    def release(self, uuid):
+        pass
+
+
+class BenchmarkCastManager(CastManager):
+    def __init__(self, config, bitrate: int):
+        super().__init__(config)
+        self.bitrate = bitrate
+        self.connection_pool = FakePool()
+
+    def _probe_profile(self, device_uuid, cast):
+        pass  # Simulated receivers have no capabilities to probe
+
+    def _create_pipeline(self, tier, profiles):
+        return SyntheticPipeline(self.stream_server.publish, self.bitrate)
+
+
+def run(receivers: int, duration: float, bitrate: int) -> dict:
+    config = configparser.ConfigParser()
+    config['ADVANCED'] = {'adaptive_quality': 'false'}
+    manager = BenchmarkCastManager(config, bitrate)
+    uuids = [str(number) for number in range(receivers)]
+    manager.select_devices(uuids)
+    started = threading.Event()
+    manager.register_status_callback(lambda status: status == "started" and started.set())
+    manager.start_casting()
+    started.wait(10)
+    while manager.get_target_states() != {uuid: "playing" for uuid in uuids}:
+        time.sleep(0.05)
+    time.sleep(1.0)  # Let every receiver reach the live edge
+
+    cpu_start, wall_start = time.process_time(), time.monotonic()
+    counts = [target.cast.media_controller.segments for target in manager.active_targets]
+    time.sleep(duration)
+    cpu = time.process_time() - cpu_start
+    wall = time.monotonic() - wall_start
+    delivered = [target.cast.media_controller.segments - count
+                 for target, count in zip(manager.active_targets, counts)]
+    manager.stop_casting()
+    return {
+        'cpu_percent': 100 * cpu / wall,
+        'min_segments': min(delivered),
+        'max_segments': max(delivered),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark one encode fanned out to many receivers")
+    parser.add_argument('--receivers', default='1,2,4,8,16')
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--bitrate', type=int, default=6000, help="kbit/s")
+    args = parser.parse_args()
+
+    for receivers in (int(value) for value in args.receivers.split(',')):
+        result = run(receivers, args.duration, args.bitrate)
+        print(f"{receivers:3d} receivers: {result['cpu_percent']:5.1f}% CPU, "
+              f"segments per receiver {result['min_segments']}-{result['max_segments']} "
+              f"in {args.duration:.0f} s")
+
+
+if __name__ == "__main__":
+    main()
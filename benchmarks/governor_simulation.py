@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Resource governor simulation
+#
+# Drives the resource governor with readings from a simulated laptop: the
+# cast's CPU cost follows the frame rate and size the governor allows,
+# other programs add load on a schedule, and the CPU heats towards a
+# temperature set by total load. Above --throttle-temp the CPU loses a
+# share of its capacity, and the cast gets fewer frames through than it
+# asked for, which is the uneven stalling seen on real laptops. The same
+# schedule is replayed without the governor for comparison. Runs in
+# simulated time, so it finishes instantly.
+#
+# Exits non-zero when the governed run throttles after its first minute,
+# switches levels more often than --max-switches, or does not return to
+# full quality once the last load leaves room for it, so it doubles as a test of the
+# governor's decisions:
+#
+#   python3 benchmarks/governor_simulation.py --schedule 0:10,60:60,180:10 --duration 300
+
+import argparse
+import os
+import sys
+from typing import Dict, List, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.resource_governor import LEVELS, ResourceGovernor, ResourceReading
+
+STEP = 1.0  # Simulation step in seconds, also how often the governor is updated
+THERMAL_TIME_CONSTANT = 40.0  # Seconds for the CPU to get two thirds of the way to its steady temperature
+THROTTLED_CAPACITY = 0.6  # Share of the CPU left while thermal throttling
+
+
+class SimulatedLaptop:
+    """CPU load and temperature of a laptop casting while other programs run"""
+
+    def __init__(self, schedule: List[Tuple[float, float]], cast_cost: float, ambient: float,
+                 heating: float, throttle_temp: float):
+        self.schedule = sorted(schedule)
+        self.cast_cost = cast_cost  # Percent of all cores a full quality cast needs
+        self.ambient = ambient
+        self.heating = heating  # Degrees above ambient at 100% load
+        self.throttle_temp = throttle_temp
+        self.temperature = ambient + heating * (cast_cost + schedule[0][1]) / 100
+
+    def background(self, now: float) -> float:
+        """Percent of all cores other programs use at a point in time"""
+        current = self.schedule[0][1]
+        for start, percent in self.schedule:
+            if now >= start:
+                current = percent
+        return current
+
+    def step(self, now: float, level) -> Dict[str, float]:
+        """Advance one step with the cast at ``level``; returns what happened"""
+        # Conversion and encoding scale with pixels per second; fewer workers cost a little efficiency
+        demand = self.cast_cost * level.framerate_scale * level.size_scale ** 2 * (1.0 + 0.05 * (1 - level.worker_scale))
+        background = self.background(now)
+        throttled = self.temperature > self.throttle_temp
+        capacity = 100.0 * (THROTTLED_CAPACITY if throttled else 1.0)
+        total = demand + background
+        # Under contention everyone gets the same share of what they asked for
+        share = min(1.0, capacity / total) if total else 1.0
+        used = total * share
+        target = self.ambient + self.heating * used / 100
+        self.temperature += (target - self.temperature) * STEP / THERMAL_TIME_CONSTANT
+        return {
+            'process_cpu': demand * share,
+            'system_cpu': used,
+            'delivered': share,
+            'throttled': throttled,
+        }
+
+
+def simulate(laptop: SimulatedLaptop, duration: float, governed: bool, framerate: int) -> Dict[str, object]:
+    now = 0.0
+    reading = ResourceReading(0.0)
+    governor = ResourceGovernor(lambda level: None, sampler=lambda: reading, clock=lambda: now)
+    throttled_seconds = 0.0
+    late_throttle = 0.0
+    frames = 0.0
+    level_log = []
+
+    steps = int(duration / STEP)
+    for step in range(steps):
+        now = step * STEP
+        level = governor.level if governed else LEVELS[0]
+        state = laptop.step(now, level)
+        if state['throttled']:
+            throttled_seconds += STEP
+            if now >= 60:
+                late_throttle += STEP
+        frames += framerate * level.framerate_scale * state['delivered'] * STEP
+        reading = ResourceReading(state['process_cpu'], state['system_cpu'], None, laptop.temperature)
+        if governed:
+            governor.update()
+        if step % int(15.0 / STEP) == 0:
+            level_log.append((now, laptop.background(now), laptop.temperature, governor.level_index,
+                              governor.level.describe()))
+
+    return {
+        'throttled': throttled_seconds,
+        'late_throttle': late_throttle,
+        'fps': frames / duration,
+        'switches': governor.switches,
+        'final_level': governor.level_index,
+        'level_log': level_log,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the resource governor on a laptop that heats up")
+    parser.add_argument('--schedule', default='0:10,60:60,180:10',
+                        help="comma separated start_second:percent CPU used by other programs")
+    parser.add_argument('--duration', type=float, default=300.0)
+    parser.add_argument('--cast-cost', type=float, default=35.0, help="percent of all cores a full cast uses")
+    parser.add_argument('--ambient', type=float, default=40.0)
+    parser.add_argument('--heating', type=float, default=70.0, help="degrees above ambient at full load")
+    parser.add_argument('--throttle-temp', type=float, default=95.0)
+    parser.add_argument('--framerate', type=int, default=30)
+    parser.add_argument('--max-switches', type=int, default=12)
+    args = parser.parse_args()
+
+    schedule = [tuple(float(value) for value in item.split(':')) for item in args.schedule.split(',')]
+    results = {}
+    for governed in (False, True):
+        laptop = SimulatedLaptop(schedule, args.cast_cost, args.ambient, args.heating, args.throttle_temp)
+        result = results[governed] = simulate(laptop, args.duration, governed, args.framerate)
+        print(f"\n{'governed' if governed else 'ungoverned'}: {result['throttled']:.0f} s throttled, "
+              f"{result['fps']:.1f} fps delivered, {result['switches']} switches")
+        if governed:
+            for when, background, temperature, index, description in result['level_log']:
+                print(f"  t={when:5.0f} s  others {background:3.0f}% CPU  {temperature:5.1f} °C  "
+                      f"level {index}  {description}")
+
+    governed = results[True]
+    failures = []
+    if governed['late_throttle']:
+        failures.append(f"throttled for {governed['late_throttle']:.0f} s after the first minute")
+    if governed['switches'] > args.max_switches:
+        failures.append(f"{governed['switches']} switches, more than {args.max_switches}")
+    # Full quality under the last load, once the temperature has settled
+    used = min(100.0, args.cast_cost + schedule[-1][1])
+    settled = ResourceReading(args.cast_cost, used, None, args.ambient + args.heating * used / 100)
+    if ResourceGovernor(lambda level: None, sampler=lambda: settled)._has_headroom(settled) and governed['final_level']:
+        failures.append(f"still at level {governed['final_level']} after the load went away")
+    if failures:
+        print("Failed:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
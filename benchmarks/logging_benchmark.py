@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Logging overhead benchmark
+#
+# Measures what a log call costs the thread that makes it, which for
+# discovery, capture and encoder threads is time taken from casting.
+#
+#   sync      the old setup: FileHandler and StreamHandler on the root logger
+#   queue     src/logging_setup.py, with the rate limiter off
+#   flapping  src/logging_setup.py logging one failure per device in a loop,
+#             as a flapping network does; most calls are rate limited
+#   events    per-frame JSON events with an events file configured
+#   no-events the per-frame check the pipeline makes when events are off
+#
+# --slow-disk-ms adds a delay to every file write, to show how a busy
+# disk stalls the logging thread with synchronous handlers. stderr goes to
+# /dev/null. Exits non-zero when the p99 cost of a queued call exceeds
+# --budget-us.
+#
+#   python3 benchmarks/logging_benchmark.py --calls 20000 --slow-disk-ms 1
+
+import argparse
+import configparser
+import logging
+import logging.handlers
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.logging_setup import LOG_FORMAT, LogPipeline, events
+from discovery_scaling import percentiles
+
+logger = logging.getLogger("UbuntuCast.Benchmark")
+
+
+def slow_down(handler: logging.Handler, delay: float):
+    """Make every write by a file handler take at least ``delay`` seconds"""
+    if delay <= 0:
+        return
+    emit = handler.emit
+
+    def slow_emit(record):
+        time.sleep(delay)
+        emit(record)
+    handler.emit = slow_emit
+
+
+def measure(calls: int, log: Callable[[int], None]) -> Dict[str, float]:
+    samples = []
+    for index in range(calls):
+        start = time.perf_counter()
+        log(index)
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def run_sync(log_dir: str, calls: int, delay: float) -> Dict[str, float]:
+    root = logging.getLogger()
+    file_handler = logging.FileHandler(os.path.join(log_dir, "sync.log"))
+    slow_down(file_handler, delay)
+    handlers = [file_handler, logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    try:
+        return measure(calls, lambda index: logger.info(f"Frame {index} sent to Living Room TV"))
+    finally:
+        for handler in handlers:
+            root.removeHandler(handler)
+            handler.close()
+
+
+def run_pipeline(log_dir: str, calls: int, delay: float, scenario: str) -> Dict[str, float]:
+    pipeline = LogPipeline()
+    pipeline.start(os.path.join(log_dir, scenario))
+    slow_down(pipeline.file_handler, delay)
+    config = configparser.ConfigParser()
+    config['ADVANCED'] = {
+        'log_rate_limit_interval': '10' if scenario == 'flapping' else '0',
+        'log_events_file': os.path.join(log_dir, scenario, 'events.jsonl') if scenario == 'events' else '',
+    }
+    pipeline.configure(config)
+    if scenario == 'events':
+        slow_down(pipeline.events_handler, delay)
+
+    def log_flapping(index):
+        logger.error(f"Failed to connect to device {index % 200}: timed out")
+
+    def log_event(index):
+        if events.isEnabledFor(logging.DEBUG):
+            events.debug("frame", extra={'event': {'pts': index / 30, 'result': 'changed',
+                                                   'width': 1920, 'height': 1080, 'encoder_queue': 1}})
+
+    log = {
+        'queue': lambda index: logger.info(f"Frame {index} sent to Living Room TV"),
+        'flapping': log_flapping,
+        'events': log_event,
+        'no-events': log_event,
+    }[scenario]
+    try:
+        result = measure(calls, log)
+    finally:
+        drain_start = time.perf_counter()
+        pipeline.shutdown()
+        result['drain'] = time.perf_counter() - drain_start
+        result['suppressed'] = pipeline.rate_limit.suppressed_total
+        result['dropped'] = pipeline.dropped
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cost of log calls to the calling thread")
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--slow-disk-ms', type=float, default=0.0, help="delay added to every file write")
+    parser.add_argument('--budget-us', type=float, help="maximum p99 cost of a queued log call")
+    args = parser.parse_args()
+
+    delay = args.slow_disk_ms / 1000
+    stderr = sys.stderr
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='ubuntucast-logging-') as log_dir, open(os.devnull, 'w') as devnull:
+        sys.stderr = devnull
+        try:
+            results['sync'] = run_sync(log_dir, args.calls, delay)
+            for scenario in ('queue', 'flapping', 'events', 'no-events'):
+                results[scenario] = run_pipeline(log_dir, args.calls, delay, scenario)
+        finally:
+            sys.stderr = stderr
+
+    print(f"{'scenario':>10} {'p50':>9} {'p99':>9} {'max':>9} {'drain':>8} {'suppressed':>10} {'dropped':>8}")
+    for scenario, result in results.items():
+        drain = f"{result['drain'] * 1000:6.0f}ms" if 'drain' in result else ''
+        print(f"{scenario:>10} {result['p50'] * 1e6:7.2f}us {result['p99'] * 1e6:7.2f}us "
+              f"{result['max'] * 1e6:7.0f}us {drain:>8} {result.get('suppressed', ''):>10} "
+              f"{result.get('dropped', ''):>8}")
+
+    queued = results['queue']['p99'] * 1e6
+    if args.budget_us is not None and queued > args.budget_us:
+        print(f"Over budget: queued log call p99 {queued:.2f} us > {args.budget_us:.2f} us")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Pipeline mode benchmark
+#
+# Feeds a synthetic full-motion source through the threaded pipeline and
+# through the multi-process pipeline with different converter counts, with
+# ffmpeg replaced by a sink that discards the raw frames. Reports the frame
+# rate that reaches the encoder against the source rate, frames lost on the
+# way and process CPU, so the point where one core stops keeping up shows.
+#
+#   python3 benchmarks/pipeline_benchmark.py --modes thread,process:1,process:2,process:4 --cases 1080p30,1440p60
+
+import argparse
+import functools
+import os
+import resource
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.color_convert import resolution_size
+from src.encoder import EncoderSupervisor
+from src.pipeline import CastPipeline
+from src.pipeline_runner import ProcessPipeline
+from synthetic_sources import SyntheticSource
+
+NULL_ENCODER = ['sh', '-c', 'cat > /dev/null']
+
+
+class NullEncoderMixin:
+    """Runs the encoder supervisor against a sink instead of ffmpeg"""
+
+    def _ensure_encoder(self, output_size):
+        width, height = output_size
+        settings = self.encoder_settings.replace(width=width, height=height)
+        if self.encoder is None:
+            self.encoder_settings = settings
+            self.encoder = EncoderSupervisor(settings, self.output_callback,
+                                             queue_size=self.queue_size, command=NULL_ENCODER)
+            self.encoder.start()
+        elif settings != self.encoder.settings:
+            self.encoder_settings = settings
+            self.encoder.reconfigure(settings)
+
+
+class NullThreadPipeline(NullEncoderMixin, CastPipeline):
+    pass
+
+
+class NullProcessPipeline(NullEncoderMixin, ProcessPipeline):
+    pass
+
+
+def cpu_seconds() -> float:
+    """CPU time of this process and its finished children"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def run(mode: str, size, framerate: float, duration: float, warmup: float = 2.0) -> dict:
+    if mode == 'thread':
+        pipeline = NullThreadPipeline(SyntheticSource('full_motion', size, framerate), size, framerate,
+                                      lambda data: None)
+    else:
+        workers = int(mode.split(':')[1]) if ':' in mode else 0
+        pipeline = NullProcessPipeline(functools.partial(SyntheticSource, 'full_motion', size, framerate),
+                                       size, framerate, lambda data: None, workers=workers)
+    pipeline.start()
+    try:
+        time.sleep(warmup)
+        encoder = pipeline.encoder
+        if encoder is None:
+            raise RuntimeError("no frame reached the encoder during warm-up")
+        start_time, start_cpu = time.monotonic(), cpu_seconds()
+        start_frames, start_dropped = encoder.frames_submitted, encoder.frames_dropped
+        stats_before = pipeline.stats()
+        time.sleep(duration)
+        elapsed = time.monotonic() - start_time
+        frames = encoder.frames_submitted - start_frames
+        dropped = encoder.frames_dropped - start_dropped
+        stats = pipeline.stats()
+    finally:
+        pipeline.stop()
+
+    lost = 0
+    if stats['mode'] == 'process':
+        lost = stats['stages']['capture']['dropped'] - stats_before['stages']['capture']['dropped']
+        lost += stats['skipped'] - stats_before['skipped']
+    # Stage processes are accounted once joined, warm-up included, so this errs high
+    cpu = cpu_seconds() - start_cpu
+    return {
+        'fps': frames / elapsed,
+        'lost': lost + dropped,
+        'cpu': cpu / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the threaded and multi-process pipelines")
+    parser.add_argument('--modes', default='thread,process:1,process:2,process:4',
+                        help="thread, or process:<converter count>")
+    parser.add_argument('--cases', default='1080p30,1440p60', help="<resolution><framerate> pairs")
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs")
+    for case in args.cases.split(','):
+        resolution, framerate = case.split('p')
+        size = resolution_size(resolution + 'p')
+        for mode in args.modes.split(','):
+            result = run(mode, size, float(framerate), args.duration)
+            print(f"{case:>9} {mode:>10}: {result['fps']:5.1f} of {framerate} fps, "
+                  f"{result['lost']} frames lost, CPU {100 * result['cpu']:4.0f}%")
+
+
+if __name__ == "__main__":
+    main()
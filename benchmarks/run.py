@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# End-to-end benchmark suite
+#
+# Casts each synthetic workload (static desktop, scrolling text, full-motion
+# video) to a fake Cast receiver on the loopback interface, through the
+# real discovery table, connection pool, CastManager, pipeline, ffmpeg and
+# segment server, and records for each:
+#
+#   time_to_first_frame  device discovered until the receiver got video (s)
+#   fps                  video frames per second arriving at the receiver
+#   cpu_per_frame        CPU seconds per encoded frame, including ffmpeg and
+#                        stage processes
+#   peak_rss             memory high-water mark of this process and of its
+#                        children (KiB)
+#   stages               p50/p90/p99 latency of each pipeline stage (s)
+#
+# --trace casts a recorded frame trace (src/frame_trace.py) instead, looped
+# at its recorded pace, so real desktop content can be compared too.
+#
+# Results are written as JSON named after the current commit, so runs on
+# two commits can be compared with --compare. Needs pychromecast, ffmpeg
+# and openssl; everything runs offline. CPU and memory of child processes
+# are read from /proc, so Linux only.
+#
+#   python3 benchmarks/run.py --duration 20
+#   python3 benchmarks/run.py --trace ~/desktop.trace
+#   python3 benchmarks/run.py --compare benchmarks/results/abc1234.json benchmarks/results/def5678.json
+
+import argparse
+import configparser
+import functools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.cast_manager import CastManager
+from src.color_convert import resolution_size
+from src.device_cache import DeviceCache
+from src.device_discovery import PYCHROMECAST_AVAILABLE, DeviceDiscovery
+from src.device_profiles import DeviceProfiles
+from src.frame_trace import TraceReplay
+from src.metrics import QUANTILES, STAGES, metrics
+from fake_receiver import FakeCastReceiver
+from synthetic_sources import KINDS, SyntheticSource
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def child_pids() -> List[int]:
+    """Processes started by this one: ffmpeg and pipeline stage processes"""
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == os.getpid():
+            pids.append(int(entry))
+    return pids
+
+
+def process_cpu(pid: int) -> float:
+    """User and system CPU seconds of a running process"""
+    try:
+        with open(f'/proc/{pid}/stat') as stat:
+            fields = stat.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def process_peak_rss(pid: int) -> int:
+    """Memory high-water mark of a running process in KiB"""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def total_cpu() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    return own.ru_utime + own.ru_stime + sum(process_cpu(pid) for pid in child_pids())
+
+
+def make_config(resolution: str, framerate: int, pipeline_mode: str) -> configparser.ConfigParser:
+    config = configparser.ConfigParser()
+    config['CASTING'] = {'resolution': resolution, 'framerate': str(framerate), 'audio_enabled': 'false'}
+    # Fixed quality, so runs measure the pipeline rather than the controller's choices
+    config['ADVANCED'] = {'adaptive_quality': 'false', 'pipeline_mode': pipeline_mode}
+    return config
+
+
+def run_scenario(kind: str, resolution: str, framerate: int, duration: float,
+                 pipeline_mode: str, warmup: float = 3.0, trace: Optional[str] = None) -> dict:
+    receiver = FakeCastReceiver(f"Benchmark {kind}")
+    receiver.start()
+    cache_dir = tempfile.TemporaryDirectory(prefix='ubuntucast-benchmark-')
+    manager = CastManager(make_config(resolution, framerate, pipeline_mode))
+    if trace:
+        manager.source_factory = functools.partial(TraceReplay, trace, loop=True)
+    else:
+        manager.source_factory = functools.partial(SyntheticSource, kind, resolution_size(resolution))
+    # A throwaway device cache and profiles, so runs do not see each other's receivers
+    cache = DeviceCache(path=os.path.join(cache_dir.name, 'devices.json'))
+    manager.device_profiles = DeviceProfiles(path=os.path.join(cache_dir.name, 'profiles.json'))
+    discovery = DeviceDiscovery(manager, cache=cache)
+    manager.set_device_discovery(discovery)
+    metrics.reset()
+    metrics.enabled = True
+    try:
+        discovered = time.monotonic()
+        discovery._apply_device(receiver.device_info())
+        if not manager.select_devices([receiver.uuid]):
+            raise RuntimeError("could not connect to the fake receiver")
+        if not manager.start_casting():
+            raise RuntimeError("casting did not start")
+        if not receiver.first_segment_event.wait(timeout=60):
+            raise RuntimeError("the receiver got no video")
+        time_to_first_frame = receiver.first_segment_time - discovered
+
+        time.sleep(warmup)
+        metrics.reset()
+        encoder = manager.pipeline.encoder
+        start_time, start_cpu = time.monotonic(), total_cpu()
+        start_received, start_encoded = receiver.player.video_frames, encoder.frames_written
+        time.sleep(duration)
+        elapsed = time.monotonic() - start_time
+        cpu = total_cpu() - start_cpu
+        received = receiver.player.video_frames - start_received
+        encoded = encoder.frames_written - start_encoded
+        children_rss = sum(process_peak_rss(pid) for pid in child_pids())
+    finally:
+        metrics.enabled = False
+        manager.shutdown()
+        receiver.stop()
+        cache_dir.cleanup()
+
+    stages = {}
+    for stage in STAGES:
+        histogram = metrics.histogram('ubuntucast_stage_seconds', stage=stage)
+        if histogram is not None:
+            stages[stage] = {f"p{int(q * 100)}": histogram.quantile(q) for q in QUANTILES}
+    latency = metrics.histogram('ubuntucast_frame_latency_seconds')
+    return {
+        'time_to_first_frame': time_to_first_frame,
+        'fps': received / elapsed,
+        'encoded_fps': encoded / elapsed,
+        'cpu_per_frame': cpu / encoded if encoded else None,
+        'cpu_percent': 100 * cpu / elapsed,
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'children_peak_rss': children_rss,
+        'frame_latency': {f"p{int(q * 100)}": latency.quantile(q) for q in QUANTILES} if latency else {},
+        'stages': stages,
+    }
+
+
+def current_commit() -> str:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                           text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    return commit + ('-dirty' if dirty else '')
+
+
+def flatten(results: dict, prefix: str = '') -> Dict[str, float]:
+    """Flatten nested results into dotted metric names"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(base_path: str, new_path: str):
+    with open(base_path) as base_file, open(new_path) as new_file:
+        base, new = json.load(base_file), json.load(new_file)
+    print(f"{base['commit']} -> {new['commit']}")
+    base_flat, new_flat = flatten(base['results']), flatten(new['results'])
+    for name in sorted(set(base_flat) | set(new_flat)):
+        old, value = base_flat.get(name), new_flat.get(name)
+        if old is None or value is None:
+            print(f"{name:55} {old!s:>12} -> {value!s:>12}")
+            continue
+        change = f"{100 * (value - old) / old:+7.1f}%" if old else ''
+        print(f"{name:55} {old:12.5g} -> {value:12.5g} {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the end-to-end casting benchmarks")
+    parser.add_argument('--kinds', default=','.join(KINDS))
+    parser.add_argument('--resolution', default='1080p')
+    parser.add_argument('--framerate', type=int, default=30)
+    parser.add_argument('--pipeline-mode', default='thread', choices=('thread', 'process'))
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--trace', action='append', default=[], help="cast this frame trace instead of --kinds")
+    parser.add_argument('--output', help="results file, by default results/<commit>.json")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help="compare two results files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if not PYCHROMECAST_AVAILABLE:
+        sys.exit("pychromecast is required to talk to the fake receiver")
+
+    commit = current_commit()
+    report = {
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'host': {'python': platform.python_version(), 'machine': platform.machine(),
+                 'cpus': os.cpu_count()},
+        'settings': {'resolution': args.resolution, 'framerate': args.framerate,
+                     'pipeline_mode': args.pipeline_mode, 'duration': args.duration, 'traces': args.trace},
+        'results': {},
+    }
+    scenarios = [(os.path.splitext(os.path.basename(trace))[0], os.path.expanduser(trace)) for trace in args.trace]
+    for kind, trace in scenarios or [(kind, None) for kind in args.kinds.split(',')]:
+        result = run_scenario(kind, args.resolution, args.framerate, args.duration, args.pipeline_mode,
+                              trace=trace)
+        report['results'][kind] = result
+        print(f"{kind:>12}: first frame {result['time_to_first_frame']:.2f} s, {result['fps']:5.1f} fps, "
+              f"{1000 * (result['cpu_per_frame'] or 0):.1f} ms CPU/frame, "
+              f"peak RSS {result['peak_rss'] // 1024} MiB + {result['children_peak_rss'] // 1024} MiB")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as results_file:
+        json.dump(report, results_file, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
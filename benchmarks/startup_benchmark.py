@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Startup time benchmark
+#
+# Starts the application in a fresh interpreter on Qt's offscreen platform,
+# with a throwaway home directory, and reports how long it takes until the
+# tray icon is shown (counted from launching the interpreter) and until
+# it is connected to the casting daemon, which it starts. It also prints the per-phase startup
+# profile and the heavy modules already imported when the tray icon
+# appeared.
+#
+# Exits non-zero when the median time to the tray icon exceeds
+# --budget-ms, so it can guard against startup regressions in CI.
+#
+#   python3 benchmarks/startup_benchmark.py --runs 5 --budget-ms 800
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should only be imported behind the tray icon
+HEAVY_MODULES = ('numpy', 'pychromecast', 'zeroconf', 'src.cast_manager', 'src.device_discovery', 'src.daemon')
+
+CHILD = f"""
+import json, os, sys, time
+sys.path.insert(0, {ROOT!r})
+from src import ubuntucast
+from src.startup_profiler import StartupProfiler
+profiler = StartupProfiler(origin=ubuntucast._STARTED)
+app = ubuntucast.UbuntuCast(profiler)
+tray_at = time.monotonic()
+heavy = [name for name in {HEAVY_MODULES!r} if name in profiler.imported['tray_visible']]
+deadline = time.monotonic() + 60
+while 'daemon_connected' not in profiler.marks and time.monotonic() < deadline:
+    app.app.processEvents()
+    time.sleep(0.01)
+print(json.dumps({{'tray_at': tray_at, 'heavy_at_tray': heavy, 'profile': profiler.report()}}))
+sys.stdout.flush()
+if app.stack_ready.is_set():
+    app.cast_manager.shutdown()
+os._exit(0)
+"""
+
+
+def run_once(home: str) -> dict:
+    env = dict(os.environ, HOME=home, XDG_RUNTIME_DIR=home, QT_QPA_PLATFORM='offscreen')
+    os.makedirs(os.path.join(home, '.local/share/ubuntucast/logs'), exist_ok=True)
+    launched = time.monotonic()
+    result = subprocess.run([sys.executable, '-c', CHILD], env=env, capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(f"startup failed:\n{result.stderr}")
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report['time_to_tray'] = report['tray_at'] - launched
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark time from launch to the tray icon")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, help="maximum median time to the tray icon")
+    args = parser.parse_args()
+
+    reports = []
+    with tempfile.TemporaryDirectory(prefix='ubuntucast-startup-') as home:
+        for _ in range(args.runs):
+            reports.append(run_once(home))
+
+    to_tray = statistics.median(report['time_to_tray'] for report in reports)
+    in_process = statistics.median(report['profile']['marks']['tray_visible'] for report in reports)
+    connected = [report['profile']['marks'].get('daemon_connected') for report in reports]
+    print(f"tray icon after {to_tray * 1000:.0f} ms from launch, {in_process * 1000:.0f} ms after the "
+          f"entry point was imported (median of {args.runs})")
+    if all(connected):
+        print(f"connected to the daemon after {statistics.median(connected) * 1000:.0f} ms")
+    heavy = reports[-1]['heavy_at_tray']
+    print(f"heavy modules imported before the tray icon: {', '.join(heavy) if heavy else 'none'}")
+    print()
+    print(f"{'phase':32} {'thread':18} {'start':>8} {'time':>8} {'modules':>7}")
+    for phase in sorted(reports[-1]['profile']['phases'], key=lambda phase: phase['start']):
+        print(f"{phase['name']:32} {phase['thread'][:18]:18} {phase['start'] * 1000:6.1f}ms "
+              f"{phase['seconds'] * 1000:6.1f}ms {phase['modules']:7d}")
+
+    if args.budget_ms is not None and to_tray * 1000 > args.budget_ms:
+        print(f"Over budget: {to_tray * 1000:.0f} ms > {args.budget_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Stream server benchmark
+#
+# Publishes synthetic fMP4 fragments into the segment server and has a
+# local HTTP client request each segment before it exists, the way a
+# player at the live edge does. Reports the time from a segment being
+# published to its first byte reaching the client.
+#
+#   python3 benchmarks/stream_server_benchmark.py --segments 50
+
+import argparse
+import http.client
+import os
+import struct
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.stream_server import SAMPLE_IS_NON_SYNC, StreamServer
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def fragment(keyframe: bool, payload_size: int) -> bytes:
+    """A minimal moof+mdat pair whose first sample is or is not a keyframe"""
+    tfhd = box(b'tfhd', struct.pack('>II', 0x020000, 1))
+    flags = 0 if keyframe else SAMPLE_IS_NON_SYNC
+    trun = box(b'trun', struct.pack('>III', 0x000004, 1, flags))
+    moof = box(b'moof', box(b'traf', tfhd + trun))
+    return moof + box(b'mdat', bytes(payload_size))
+
+
+def init_segment() -> bytes:
+    return box(b'ftyp', b'iso6' + bytes(4)) + box(b'moov', bytes(32))
+
+
+def fetch(server: StreamServer, sequence: int, results: dict):
+    connection = http.client.HTTPConnection('127.0.0.1', server.port, timeout=10)
+    connection.request('GET', f'{server.base_path}/segment_{sequence}.m4s')
+    response = connection.getresponse()
+    response.read(1)
+    results[sequence] = time.monotonic()
+    response.read()
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark segment publish to first byte latency")
+    parser.add_argument('--segments', type=int, default=50)
+    parser.add_argument('--chunks', type=int, default=5, help="fragments per segment")
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    server = StreamServer(host='127.0.0.1')
+    server.start()
+    server.publish(init_segment())
+
+    clients = []
+    received = {}
+    published = {}
+    for sequence in range(args.segments):
+        client = threading.Thread(target=fetch, args=(server, sequence, received))
+        client.start()
+        clients.append(client)
+        time.sleep(0.01)  # Let the request arrive and block at the live edge
+
+        # The first fragment, a keyframe, also closes the previous segment
+        published[sequence] = time.monotonic()
+        for chunk in range(args.chunks):
+            server.publish(fragment(chunk == 0, args.chunk_size))
+        if sequence > 0:
+            clients[sequence - 1].join()
+    server.publish(fragment(True, args.chunk_size))  # Close the last segment
+    clients[-1].join()
+    latencies = [received[sequence] - published[sequence] for sequence in range(args.segments)]
+
+    server.stop()
+    latencies.sort()
+    print(f"segments: {len(latencies)}")
+    print(f"publish to first byte median: {1000 * latencies[len(latencies) // 2]:.2f} ms")
+    print(f"publish to first byte p95:    {1000 * latencies[int(len(latencies) * 0.95)]:.2f} ms")
+    print(f"publish to first byte max:    {1000 * latencies[-1]:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
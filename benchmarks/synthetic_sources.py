@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Synthetic frame sources
+#
+# Deterministic stand-ins for ScreenCapture that need no X server. Each
+# kind models a typical cast workload:
+#
+#   static       a desktop where only a blinking text cursor changes
+#   scrolling    a page of text lines scrolling at a steady speed
+#   full_motion  noise that changes every pixel of every frame, like video
+#
+# Frames are copied into a small ring of reusable buffers, as the real
+# capture does, so memory use and copy costs are comparable.
+
+import os
+import sys
+import time
+from typing import Callable, Iterator, Optional, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.screen_capture import Frame
+
+KINDS = ('static', 'scrolling', 'full_motion')
+
+
+class SyntheticSource:
+    """A frame source with the same interface as ScreenCapture"""
+
+    def __init__(self, kind: str = 'static', size: Tuple[int, int] = (1920, 1080),
+                 framerate: float = 30, clock: Callable[[], float] = time.monotonic,
+                 ring_size: int = 3, scroll_speed: float = 600.0, seed: int = 1):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown synthetic source kind: {kind}")
+        self.kind = kind
+        self.size = size
+        self.framerate = framerate
+        self.clock = clock
+        self.ring_size = ring_size
+        self.scroll_speed = scroll_speed  # Pixels per second
+        self.seed = seed
+        self._frames = []
+        self._content = []
+        self._sequence = 0
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    def open(self):
+        width, height = self.size
+        rng = np.random.default_rng(self.seed)
+        self._frames = [Frame(np.zeros((height, width, 4), dtype=np.uint8)) for _ in range(self.ring_size)]
+        if self.kind == 'static':
+            self._content = [_desktop(width, height, rng)]
+        elif self.kind == 'scrolling':
+            self._content = [_text_page(width, height * 4, rng)]
+        else:
+            self._content = [rng.integers(0, 256, (height, width, 4), dtype=np.uint8) for _ in range(8)]
+        self._sequence = 0
+
+    def close(self):
+        self._frames = []
+        self._content = []
+
+    def grab(self) -> Frame:
+        """Render the next frame into the ring and return it"""
+        if not self._frames:
+            self.open()
+        frame = self._frames[self._sequence % self.ring_size]
+        now = self.clock()
+        if self.kind == 'static':
+            np.copyto(frame.data, self._content[0])
+            # A 2x20 cursor blinking twice a second
+            if int(now * 2) % 2:
+                frame.data[100:120, 200:202] = 0
+        elif self.kind == 'scrolling':
+            page = self._content[0]
+            offset = int(now * self.scroll_speed) % (page.shape[0] - self.height)
+            np.copyto(frame.data, page[offset:offset + self.height])
+        else:
+            np.copyto(frame.data, self._content[self._sequence % len(self._content)])
+        frame.timestamp = self.clock()
+        frame.sequence = self._sequence
+        self._sequence += 1
+        return frame
+
+    def frames(self, max_frames: Optional[int] = None) -> Iterator[Frame]:
+        """Yield frames paced at the frame rate, which may change while running"""
+        deadline = time.monotonic()
+        count = 0
+        while max_frames is None or count < max_frames:
+            yield self.grab()
+            count += 1
+            deadline += 1.0 / self.framerate if self.framerate > 0 else 0.0
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.monotonic()
+
+    def __iter__(self) -> Iterator[Frame]:
+        return self.frames()
+
+
+def _desktop(width: int, height: int, rng) -> np.ndarray:
+    """A gradient wallpaper with a few flat windows on it"""
+    image = np.empty((height, width, 4), dtype=np.uint8)
+    image[..., 0] = np.linspace(80, 160, width, dtype=np.uint8)[np.newaxis, :]
+    image[..., 1] = np.linspace(40, 90, height, dtype=np.uint8)[:, np.newaxis]
+    image[..., 2] = 60
+    image[..., 3] = 255
+    for _ in range(4):
+        x, y = int(rng.integers(0, width // 2)), int(rng.integers(0, height // 2))
+        image[y:y + height // 3, x:x + width // 3, :3] = rng.integers(180, 250, 3, dtype=np.uint8)
+    return image
+
+
+def _text_page(width: int, height: int, rng) -> np.ndarray:
+    """White page with rows of dark word-like bars"""
+    page = np.full((height, width, 4), 255, dtype=np.uint8)
+    for y in range(8, height - 16, 24):
+        x = 16
+        while x < width - 120:
+            word = int(rng.integers(20, 110))
+            page[y:y + 12, x:x + word, :3] = 40
+            x += word + 12
+    return page
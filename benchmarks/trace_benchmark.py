@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Frame trace benchmark
+#
+# Records each synthetic workload (benchmarks/synthetic_sources.py) to a
+# frame trace on a simulated clock, so the same frames and timestamps are
+# recorded on every run, with and without delta compression. Reports the
+# trace size and the recording cost per frame.
+#
+# Each trace is then replayed as fast as possible through the pipeline's
+# diff and colour conversion stages, and with --encode through ffmpeg, and
+# the time per frame of every stage is reported. Replayed frames must match
+# the recorded ones bit for bit and a second replay must make the same
+# diff decisions; the benchmark exits non-zero if not, or when the p99 cost
+# of replaying a frame exceeds --budget-ms.
+#
+# --trace replays existing traces instead, such as ones recorded from a
+# real desktop with frame_trace_record in config.ini, so throughput can be
+# compared between commits on the same input. --output writes results in
+# the format benchmarks/run.py --compare reads.
+#
+#   python3 benchmarks/trace_benchmark.py --frames 300 --resolution 1080p
+#   python3 benchmarks/trace_benchmark.py --trace ~/desktop.trace --encode --output before.json
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import zlib
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.color_convert import ColorConverter, resolution_size
+from src.encoder import EncoderSettings, EncoderSupervisor
+from src.frame_diff import FrameDiffer
+from src.frame_trace import FrameTrace, TraceRecorder, TraceReplay
+from discovery_scaling import percentiles
+from run import current_commit
+from synthetic_sources import KINDS, SyntheticSource
+
+
+def checksum(data) -> int:
+    return zlib.crc32(memoryview(data).cast('B')) if data.flags.c_contiguous else zlib.crc32(data.tobytes())
+
+
+def record(kind: str, path: str, size, frames: int, framerate: float, delta: bool) -> Dict[str, object]:
+    now = [0.0]
+    source = SyntheticSource(kind, size, framerate=framerate, clock=lambda: now[0])
+    source.open()
+    recorder = TraceRecorder(path, delta=delta)
+    samples = []
+    checksums = []
+    with recorder:
+        for index in range(frames):
+            now[0] = index / framerate
+            frame = source.grab()
+            start = time.perf_counter()
+            recorder.write(frame)
+            samples.append(time.perf_counter() - start)
+            checksums.append(checksum(frame.data))
+    source.close()
+    return {'write': percentiles(samples), 'bytes': os.path.getsize(path), 'keyframes': recorder.keyframes,
+            'checksums': checksums}
+
+
+def replay(path: str, output_size, encode: bool, verify: bool) -> Dict[str, object]:
+    source = TraceReplay(path, speed=0)
+    differ = FrameDiffer()
+    converter: Optional[ColorConverter] = None
+    encoder: Optional[EncoderSupervisor] = None
+    stages: Dict[str, List[float]] = {'replay': [], 'diff': [], 'convert': []}
+    decisions = []
+    checksums = []
+    encode_start = 0.0
+
+    with source:
+        frames = source.frames()
+        while True:
+            start = time.perf_counter()
+            frame = next(frames, None)
+            stages['replay'].append(time.perf_counter() - start)
+            if frame is None:
+                stages['replay'].pop()
+                break
+            if verify:
+                checksums.append(checksum(frame.data))
+
+            start = time.perf_counter()
+            result = differ.process(frame)
+            stages['diff'].append(time.perf_counter() - start)
+            if result is None:
+                decisions.append(None)
+                continue
+            decisions.append((result.keepalive, len(result.dirty_rects)))
+
+            if converter is None:
+                converter = ColorConverter(output_size or (frame.width, frame.height))
+            start = time.perf_counter()
+            planes = converter.convert(frame.data)
+            stages['convert'].append(time.perf_counter() - start)
+
+            if encode:
+                if encoder is None or encoder.settings.frame_size != planes.nbytes:
+                    if encoder is not None:
+                        encoder.stop()
+                    width, height = converter.output_size
+                    encoder = EncoderSupervisor(EncoderSettings(width, height, 30, converter.pixel_format),
+                                                lambda data: None)
+                    encoder.start()
+                    encode_start = encode_start or time.perf_counter()
+                # Wait for a free slot, so no frame is dropped and every one is encoded
+                while encoder.queue_depth >= encoder.queue_size - 1:
+                    time.sleep(0.0005)
+                encoder.submit(planes, frame.timestamp)
+
+    result = {name: percentiles(samples) for name, samples in stages.items()}
+    result['frames'] = len(stages['diff'])
+    result['changed'] = len(stages['convert'])
+    result['decisions'] = decisions
+    result['checksums'] = checksums
+    if encoder is not None:
+        while encoder.queue_depth:
+            time.sleep(0.001)
+        encoder.stop()
+        result['encode_fps'] = result['changed'] / (time.perf_counter() - encode_start)
+    return result
+
+
+def report_row(result: Dict[str, object]) -> Dict[str, object]:
+    """Results without the per-frame lists, in seconds, for the results file"""
+    return {key: value for key, value in result.items() if key not in ('decisions', 'checksums')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark frame trace recording and replay")
+    parser.add_argument('--kinds', default=','.join(KINDS))
+    parser.add_argument('--resolution', default='1080p', help="size of the recorded synthetic frames")
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--framerate', type=float, default=30.0)
+    parser.add_argument('--trace', action='append', default=[], help="replay this trace instead of recording")
+    parser.add_argument('--output-size', help="conversion output size, by default the frame size")
+    parser.add_argument('--encode', action='store_true', help="also encode the replayed frames with ffmpeg")
+    parser.add_argument('--keep', help="directory to keep the recorded traces in")
+    parser.add_argument('--output', help="results file for benchmarks/run.py --compare")
+    parser.add_argument('--budget-ms', type=float, help="maximum p99 cost of replaying a frame")
+    args = parser.parse_args()
+
+    output_size = resolution_size(args.output_size) if args.output_size else None
+    failures = []
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='ubuntucast-trace-') as scratch:
+        directory = args.keep or scratch
+        os.makedirs(directory, exist_ok=True)
+        cases = [(os.path.splitext(os.path.basename(path))[0], os.path.expanduser(path), None)
+                 for path in args.trace]
+        if not cases:
+            print(f"{'trace':>18} {'frames':>6} {'keyframes':>9} {'size':>9} {'write p50':>9} {'write p99':>9}")
+            for kind in args.kinds.split(','):
+                for delta in (True, False):
+                    name = f"{kind}-{'delta' if delta else 'raw'}"
+                    path = os.path.join(directory, f"{name}.trace")
+                    recorded = record(kind, path, resolution_size(args.resolution), args.frames,
+                                      args.framerate, delta)
+                    print(f"{name:>18} {args.frames:6d} {recorded['keyframes']:9d} "
+                          f"{recorded['bytes'] / 1e6:7.1f}MB {recorded['write']['p50'] * 1000:7.2f}ms "
+                          f"{recorded['write']['p99'] * 1000:7.2f}ms")
+                    cases.append((name, path, recorded))
+            print()
+
+        print(f"{'trace':>18} {'frames':>6} {'changed':>7} {'replay p50':>10} {'replay p99':>10} "
+              f"{'diff p50':>9} {'convert p50':>11} {'encode':>9}")
+        for name, path, recorded in cases:
+            FrameTrace(path).close()  # Fail early on a file that is not a trace
+            result = replay(path, output_size, args.encode, verify=recorded is not None)
+            again = replay(path, output_size, False, verify=False)
+            encode = f"{result['encode_fps']:6.1f}fps" if 'encode_fps' in result else ''
+            print(f"{name:>18} {result['frames']:6d} {result['changed']:7d} "
+                  f"{result['replay']['p50'] * 1000:8.3f}ms {result['replay']['p99'] * 1000:8.3f}ms "
+                  f"{result['diff']['p50'] * 1000:7.3f}ms {result['convert']['p50'] * 1000:9.3f}ms {encode:>9}")
+
+            if recorded is not None and result['checksums'] != recorded['checksums']:
+                failures.append(f"{name}: replayed frames differ from the recorded ones")
+            if result['decisions'] != again['decisions']:
+                failures.append(f"{name}: a second replay made different diff decisions")
+            if args.budget_ms is not None and result['replay']['p99'] * 1000 > args.budget_ms:
+                failures.append(f"{name}: replay p99 {result['replay']['p99'] * 1000:.3f} ms")
+            results[name] = report_row(result)
+            if recorded is not None:
+                results[name]['record'] = {'write': recorded['write'], 'bytes': recorded['bytes']}
+
+    if args.output:
+        report = {
+            'commit': current_commit(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'settings': {'traces': args.trace, 'kinds': args.kinds, 'resolution': args.resolution,
+                         'frames': args.frames, 'output_size': args.output_size, 'encode': args.encode},
+            'results': results,
+        }
+        with open(args.output, 'w') as results_file:
+            json.dump(report, results_file, indent=2)
+        print(f"Results written to {args.output}")
+
+    if failures:
+        print("Failed:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
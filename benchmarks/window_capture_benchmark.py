@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Window capture benchmark
+#
+# Opens a synthetic window, repaints it with a new solid colour at a fixed
+# rate from a second X connection and captures it with WindowCapture. A
+# third of the way through the window is moved, and two thirds of the way
+# it is resized; the capture must follow both without being reopened.
+#
+# Reports frames captured against repaints, damage events, CPU per second
+# and per frame, and for comparison the CPU per second of the full-screen
+# grab and crop at the same frame rate. Checks that every frame shows a
+# colour that was painted and that frames after the resize have the new
+# size, and exits non-zero if not, so it doubles as a test under Xvfb:
+#
+#   python3 benchmarks/window_capture_benchmark.py --xvfb --seconds 6 --paint-rate 10
+
+import argparse
+import ctypes
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.screen_capture import ScreenCapture, _load_library
+from src.window_capture import WindowCapture
+
+WINDOW_SIZE = (640, 360)
+RESIZED = (800, 450)
+
+
+def start_xvfb(size: Tuple[int, int] = (1280, 720)) -> Tuple[subprocess.Popen, str]:
+    """Start a private Xvfb on the first free display number"""
+    number = 90
+    while os.path.exists(f"/tmp/.X11-unix/X{number}") or os.path.exists(f"/tmp/.X{number}-lock"):
+        number += 1
+    display = f":{number}"
+    server = subprocess.Popen(['Xvfb', display, '-screen', '0', f"{size[0]}x{size[1]}x24", '-nolisten', 'tcp'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while not os.path.exists(f"/tmp/.X11-unix/X{number}"):
+        if server.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError("Xvfb did not start")
+        time.sleep(0.05)
+    return server, display
+
+
+class SyntheticWindow:
+    """A plain X window painted with solid colours through its own connection"""
+
+    def __init__(self, display_name: str, size: Tuple[int, int]):
+        libx11 = self.libx11 = _load_library('X11')
+        libx11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        libx11.XOpenDisplay.restype = ctypes.c_void_p
+        libx11.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        libx11.XDefaultRootWindow.restype = ctypes.c_ulong
+        libx11.XCreateSimpleWindow.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_int,
+                                               ctypes.c_uint, ctypes.c_uint, ctypes.c_uint, ctypes.c_ulong,
+                                               ctypes.c_ulong]
+        libx11.XCreateSimpleWindow.restype = ctypes.c_ulong
+        libx11.XCreateGC.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_void_p]
+        libx11.XCreateGC.restype = ctypes.c_void_p
+        libx11.XSetForeground.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_ulong]
+        libx11.XFillRectangle.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_void_p, ctypes.c_int,
+                                          ctypes.c_int, ctypes.c_uint, ctypes.c_uint]
+        libx11.XMoveWindow.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_int]
+        libx11.XResizeWindow.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_uint, ctypes.c_uint]
+        libx11.XMapWindow.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+        libx11.XDestroyWindow.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+        libx11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        libx11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+
+        self.display = libx11.XOpenDisplay(display_name.encode())
+        if not self.display:
+            raise RuntimeError(f"Cannot open display {display_name}")
+        self.size = size
+        self.position = (40, 40)
+        self.window = libx11.XCreateSimpleWindow(self.display, libx11.XDefaultRootWindow(self.display),
+                                                 *self.position, *size, 0, 0, 0)
+        self.gc = libx11.XCreateGC(self.display, self.window, 0, None)
+        libx11.XMapWindow(self.display, self.window)
+        libx11.XSync(self.display, 0)
+
+    def paint(self, colour: int):
+        self.libx11.XSetForeground(self.display, self.gc, colour)
+        self.libx11.XFillRectangle(self.display, self.window, self.gc, 0, 0, *self.size)
+        self.libx11.XSync(self.display, 0)
+
+    def move(self, x: int, y: int):
+        self.position = (x, y)
+        self.libx11.XMoveWindow(self.display, self.window, x, y)
+        self.libx11.XSync(self.display, 0)
+
+    def resize(self, size: Tuple[int, int]):
+        self.size = size
+        self.libx11.XResizeWindow(self.display, self.window, *size)
+        self.libx11.XSync(self.display, 0)
+
+    def close(self):
+        self.libx11.XDestroyWindow(self.display, self.window)
+        self.libx11.XCloseDisplay(self.display)
+
+
+def colour_at(frame_data: np.ndarray) -> int:
+    """The 0xRRGGBB colour at the centre of a BGRA frame"""
+    height, width = frame_data.shape[:2]
+    blue, green, red = (int(value) for value in frame_data[height // 2, width // 2, :3])
+    return red << 16 | green << 8 | blue
+
+
+def run_window(display: str, seconds: float, paint_rate: float, framerate: float) -> Dict[str, object]:
+    window = SyntheticWindow(display, WINDOW_SIZE)
+    painted: List[int] = []
+    done = threading.Event()
+
+    def paint():
+        start = time.monotonic()
+        count = 0
+        while time.monotonic() - start < seconds:
+            elapsed = time.monotonic() - start
+            if window.position == (40, 40) and elapsed > seconds / 3:
+                window.move(200, 120)
+            if window.size == WINDOW_SIZE and elapsed > seconds * 2 / 3:
+                window.resize(RESIZED)
+            colour = (count * 0x3D5A17 + 0x102030) & 0xFFFFFF
+            painted.append(colour)
+            window.paint(colour)
+            count += 1
+            time.sleep(max(0.0, start + count / paint_rate - time.monotonic()))
+        done.set()
+
+    capture = WindowCapture(window.window, display_name=display, framerate=framerate, idle_interval=1.0)
+    frames = []
+    wrong_colour = 0
+    with capture:
+        painter = threading.Thread(target=paint, daemon=True)
+        cpu_start = time.process_time()
+        wall_start = time.monotonic()
+        painter.start()
+        stop_at: Optional[float] = None
+        for frame in capture.frames():
+            colour = colour_at(frame.data)
+            # Black is the background, seen before the first paint and after the resize
+            if colour != 0 and colour not in painted:
+                wrong_colour += 1
+            frames.append((frame.width, frame.height, colour))
+            if done.is_set() and stop_at is None:
+                stop_at = time.monotonic() + 1.5  # Long enough for one idle frame
+            if stop_at is not None and time.monotonic() > stop_at:
+                break
+        wall = time.monotonic() - wall_start
+        cpu = time.process_time() - cpu_start
+        damage_events, resizes = capture.damage_events, capture.resizes
+    window.close()
+
+    after_resize = [size for size in ((width, height) for width, height, _ in frames) if size == RESIZED]
+    return {
+        'repaints': len(painted),
+        'frames': len(frames),
+        'damage_events': damage_events,
+        'resizes': resizes,
+        'frames_after_resize': len(after_resize),
+        'wrong_colour': wrong_colour,
+        'last_colour_ok': bool(frames) and frames[-1][2] == painted[-1],
+        'cpu_percent': 100.0 * cpu / wall,
+        'cpu_ms_per_frame': 1000.0 * cpu / max(len(frames), 1),
+    }
+
+
+def run_root_crop(display: str, seconds: float, framerate: float) -> Dict[str, float]:
+    """The full-screen grab and crop that window casting used to need"""
+    capture = ScreenCapture(display, framerate=framerate)
+    x, y = 200, 120
+    width, height = RESIZED
+    crop = np.empty((height, width, 4), dtype=np.uint8)
+    count = 0
+    with capture:
+        cpu_start = time.process_time()
+        wall_start = time.monotonic()
+        for frame in capture.frames():
+            np.copyto(crop, frame.data[y:y + height, x:x + width])
+            count += 1
+            if time.monotonic() - wall_start > seconds:
+                break
+        wall = time.monotonic() - wall_start
+        cpu = time.process_time() - cpu_start
+    return {'frames': count, 'cpu_percent': 100.0 * cpu / wall, 'cpu_ms_per_frame': 1000.0 * cpu / count}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark and check damage-driven window capture")
+    parser.add_argument('--xvfb', action='store_true', help="run on a private Xvfb instead of $DISPLAY")
+    parser.add_argument('--seconds', type=float, default=6.0)
+    parser.add_argument('--paint-rate', type=float, default=10.0, help="window repaints per second")
+    parser.add_argument('--framerate', type=float, default=30.0)
+    args = parser.parse_args()
+
+    # The painter and the capture use their own connections from different threads
+    _load_library('X11').XInitThreads()
+    server = None
+    display = os.environ.get('DISPLAY', '')
+    if args.xvfb:
+        server, display = start_xvfb()
+    elif not display:
+        sys.exit("No DISPLAY; use --xvfb")
+    try:
+        window = run_window(display, args.seconds, args.paint_rate, args.framerate)
+        root = run_root_crop(display, args.seconds, args.framerate)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(f"window capture: {window['frames']} frames for {window['repaints']} repaints, "
+          f"{window['damage_events']} damage events, {window['resizes']} resize(s), "
+          f"{window['cpu_percent']:.1f}% CPU, {window['cpu_ms_per_frame']:.2f} ms CPU per frame")
+    print(f"full screen grab and crop: {root['frames']} frames, {root['cpu_percent']:.1f}% CPU, "
+          f"{root['cpu_ms_per_frame']:.2f} ms CPU per frame")
+
+    failures = []
+    if window['wrong_colour']:
+        failures.append(f"{window['wrong_colour']} frames showed a colour that was never painted")
+    if not window['last_colour_ok']:
+        failures.append("the last frame does not show the last repaint")
+    if window['resizes'] != 1 or not window['frames_after_resize']:
+        failures.append("the capture did not follow the resize")
+    if window['frames'] > window['repaints'] + args.seconds + 3:
+        failures.append("more frames than repaints: damage is not limiting capture")
+    if failures:
+        print("Failed:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
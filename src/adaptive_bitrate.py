@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Adaptive Quality Controller
+
+import logging
+import math
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.color_convert import RESOLUTION_PRESETS, resolution_size
+
+logger = logging.getLogger("UbuntuCast.AdaptiveBitrate")
+
+
+class QualityTier:
+    """One step of the quality ladder"""
+
+    def __init__(self, resolution: str, framerate: int, bitrate: int):
+        self.resolution = resolution
+        self.framerate = framerate
+        self.bitrate = bitrate  # kbit/s
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return resolution_size(self.resolution)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, QualityTier) and self.__dict__ == other.__dict__
+
+    def __repr__(self) -> str:
+        return f"QualityTier({self.resolution!r}, {self.framerate}, {self.bitrate})"
+
+    def __str__(self) -> str:
+        return f"{self.resolution} {self.framerate} fps, {self.bitrate / 1000:.1f} Mbit/s"
+
+
+def build_tiers(max_resolution: str, max_framerate: int, max_bitrate: int,
+                min_resolution: str = '480p', min_framerate: int = 15,
+                min_bitrate: int = 1000) -> List[QualityTier]:
+    """Build a quality ladder between the configured bounds, lowest tier first
+
+    Each resolution preset between the bounds gets a tier whose bitrate
+    scales with pixel count to the power 0.75, the usual rule of thumb for
+    H.264. Below the smallest resolution the frame rate is lowered as a last
+    resort.
+    """
+    max_width, max_height = resolution_size(max_resolution)
+    min_pixels = min(_pixels(min_resolution), max_width * max_height)
+    resolutions = [max_resolution] + [
+        name for name, (width, height) in RESOLUTION_PRESETS.items()
+        if min_pixels <= width * height < max_width * max_height
+    ]
+
+    tiers = []
+    for resolution in resolutions:
+        scale = (_pixels(resolution) / (max_width * max_height)) ** 0.75
+        tiers.append(QualityTier(resolution, max_framerate, max(min_bitrate, int(max_bitrate * scale))))
+    tiers.sort(key=lambda tier: _pixels(tier.resolution))
+
+    if min_framerate < max_framerate:
+        lowest = tiers[0]
+        bitrate = int(lowest.bitrate * math.sqrt(min_framerate / max_framerate))
+        tiers.insert(0, QualityTier(lowest.resolution, min_framerate, max(min_bitrate, bitrate)))
+    return tiers
+
+
+def _pixels(resolution: str) -> int:
+    width, height = resolution_size(resolution)
+    return width * height
+
+
+class _Ewma:
+    """Exponentially weighted moving average weighted by sample duration"""
+
+    def __init__(self, half_life: float):
+        self._alpha = math.exp(math.log(0.5) / half_life)
+        self._estimate = 0.0
+        self._total_weight = 0.0
+
+    def sample(self, weight: float, value: float):
+        adjusted = self._alpha ** weight
+        self._estimate = adjusted * self._estimate + (1 - adjusted) * value
+        self._total_weight += weight
+
+    @property
+    def estimate(self) -> float:
+        # Correct the bias towards the initial zero estimate
+        return self._estimate / (1 - self._alpha ** self._total_weight)
+
+
+class _ReceiverBandwidth:
+    """Bandwidth estimate for one receiver"""
+
+    def __init__(self):
+        self.fast = _Ewma(1.0)
+        self.slow = _Ewma(4.0)
+        self.last_sample = 0.0
+
+    @property
+    def estimate(self) -> float:
+        # Take the lower average: react to drops quickly, to recoveries slowly
+        return min(self.fast.estimate, self.slow.estimate)
+
+
+class AdaptiveBitrateController:
+    """Picks the stream's quality tier from network and encoder feedback
+
+    Inputs are reported as they happen: ``report_delivery`` for each segment
+    sent to a receiver, ``report_stall`` when a receiver starts buffering
+    during playback, and ``report_encoder`` with the encoder queue state.
+    ``update`` is called periodically, decides and hands a changed tier to
+    ``apply_callback``.
+
+    All receivers share one stream, so the slowest one sets the pace. The
+    controller steps down as soon as the link is close to saturated, a
+    receiver stalls or the encoder cannot keep up, and only steps up one
+    tier after conditions have stayed good for ``upswitch_delay`` seconds
+    with clear headroom. The gap between ``down_threshold`` and
+    ``up_threshold`` keeps it from oscillating between neighbouring tiers.
+    """
+
+    def __init__(self, tiers: List[QualityTier], apply_callback: Callable[[QualityTier], None],
+                 initial_tier: Optional[int] = None, down_threshold: float = 0.9,
+                 up_threshold: float = 0.7, upswitch_delay: float = 8.0,
+                 switch_interval: float = 2.0, receiver_timeout: float = 5.0,
+                 clock: Callable[[], float] = time.monotonic):
+        if not tiers:
+            raise ValueError("At least one quality tier is required")
+        self.tiers = tiers
+        self.apply_callback = apply_callback
+        self.down_threshold = down_threshold
+        self.up_threshold = up_threshold
+        self.upswitch_delay = upswitch_delay
+        self.switch_interval = switch_interval
+        self.receiver_timeout = receiver_timeout
+        self.clock = clock
+
+        self.tier_index = len(tiers) - 1 if initial_tier is None else initial_tier
+        self.switches = 0
+        self.sustained_tier_index: Optional[int] = None  # Last tier held for upswitch_delay without trouble
+        self._receivers: Dict[str, _ReceiverBandwidth] = {}
+        self._stalled = False
+        self._encoder_overloads = 0
+        self._encoder_dropped = 0
+        self._last_switch = clock()
+        self._stable_since = self._last_switch
+
+    @property
+    def tier(self) -> QualityTier:
+        return self.tiers[self.tier_index]
+
+    @property
+    def sustained_tier(self) -> Optional[QualityTier]:
+        """The last tier that held steady, suitable to start the next session at"""
+        if self.sustained_tier_index is None:
+            return None
+        return self.tiers[self.sustained_tier_index]
+
+    @property
+    def bandwidth_estimate(self) -> Optional[float]:
+        """Estimated throughput to the slowest recently active receiver, in kbit/s"""
+        now = self.clock()
+        estimates = [receiver.estimate for receiver in self._receivers.values()
+                     if now - receiver.last_sample < self.receiver_timeout]
+        return min(estimates) if estimates else None
+
+    def report_delivery(self, receiver: str, num_bytes: int, seconds: float):
+        """Record a segment delivery that kept the socket busy for ``seconds``"""
+        if num_bytes <= 0:
+            return
+        # Writes that finish instantly only show the link is faster than the stream
+        seconds = max(seconds, 0.001)
+        kbps = num_bytes * 8 / 1000 / seconds
+        bandwidth = self._receivers.get(receiver)
+        if bandwidth is None:
+            bandwidth = self._receivers[receiver] = _ReceiverBandwidth()
+        bandwidth.fast.sample(seconds, kbps)
+        bandwidth.slow.sample(seconds, kbps)
+        bandwidth.last_sample = self.clock()
+
+    def report_stall(self, receiver: str):
+        """Record that a receiver ran out of buffered media during playback"""
+        logger.info(f"Receiver {receiver} is rebuffering")
+        self._stalled = True
+
+    def report_encoder(self, queue_depth: int, queue_size: int, frames_dropped: int):
+        """Record the encoder's queue state, sampled once per update"""
+        dropped = frames_dropped - self._encoder_dropped
+        self._encoder_dropped = frames_dropped
+        if queue_depth >= queue_size - 1 or dropped > 0:
+            self._encoder_overloads += 1
+        else:
+            self._encoder_overloads = 0
+
+    def update(self) -> Optional[QualityTier]:
+        """Decide on the tier, returning the new tier if it changed"""
+        now = self.clock()
+        bandwidth = self.bandwidth_estimate
+        target = self.tier_index
+        reason = ""
+
+        if bandwidth is not None and self.tier.bitrate > bandwidth * self.down_threshold:
+            target = self._fitting_tier(bandwidth * self.down_threshold)
+            reason = f"bandwidth {bandwidth:.0f} kbit/s"
+        if self._stalled:
+            target = min(target, self.tier_index - 1)
+            reason = reason or "receiver rebuffering"
+        if self._encoder_overloads >= 3:
+            target = min(target, self.tier_index - 1)
+            reason = reason or "encoder overloaded"
+        target = max(0, target)
+
+        if reason:
+            self._stable_since = now
+        elif now - self._stable_since >= self.upswitch_delay:
+            self.sustained_tier_index = self.tier_index
+        if now - self._last_switch < self.switch_interval:
+            return None
+        self._stalled = False
+
+        if target < self.tier_index:
+            return self._switch(target, now, reason)
+
+        if (self.tier_index + 1 < len(self.tiers) and bandwidth is not None
+                and now - self._stable_since >= self.upswitch_delay
+                and self.tiers[self.tier_index + 1].bitrate <= bandwidth * self.up_threshold):
+            return self._switch(self.tier_index + 1, now, f"bandwidth {bandwidth:.0f} kbit/s")
+        return None
+
+    def _fitting_tier(self, kbps: float) -> int:
+        """Index of the highest tier whose bitrate fits in ``kbps``"""
+        for index in range(len(self.tiers) - 1, -1, -1):
+            if self.tiers[index].bitrate <= kbps:
+                return index
+        return 0
+
+    def _switch(self, index: int, now: float, reason: str) -> QualityTier:
+        self.tier_index = index
+        self.switches += 1
+        self._last_switch = now
+        self._stable_since = now
+        self._encoder_overloads = 0
+        logger.info(f"Switching to {self.tier} ({reason})")
+        try:
+            self.apply_callback(self.tier)
+        except Exception as e:
+            logger.error(f"Error applying quality tier: {e}")
+        return self.tier
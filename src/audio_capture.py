@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Audio Capture
+
+import logging
+import math
+import subprocess
+import threading
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+from src.metrics import metrics
+from src.pipeline_clock import PipelineClock
+
+# Try to import pulsectl, used to find the monitor of the default output
+try:
+    import pulsectl
+    PULSECTL_AVAILABLE = True
+except ImportError:
+    PULSECTL_AVAILABLE = False
+
+logger = logging.getLogger("UbuntuCast.AudioCapture")
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+BYTES_PER_SAMPLE = 2  # Signed 16-bit little endian
+
+
+def default_monitor_source() -> Optional[str]:
+    """Name of the monitor source of the default PulseAudio sink, i.e. what is being played"""
+    if not PULSECTL_AVAILABLE:
+        logger.warning("pulsectl is not available, cannot find the audio monitor source")
+        return None
+    try:
+        with pulsectl.Pulse('ubuntucast') as pulse:
+            sink = pulse.get_sink_by_name(pulse.server_info().default_sink_name)
+            return sink.monitor_source_name
+    except Exception as e:
+        logger.error(f"Cannot find the default sink's monitor source: {e}")
+        return None
+
+
+class ParecSource:
+    """Reads raw PCM from a PulseAudio source through a parec subprocess"""
+
+    def __init__(self, device: str, rate: int = SAMPLE_RATE, channels: int = CHANNELS,
+                 latency: float = 0.02):
+        self.device = device
+        self.rate = rate
+        self.channels = channels
+        self.latency = latency  # Seconds of audio PulseAudio buffers before handing it over
+        self._process: Optional[subprocess.Popen] = None
+
+    def open(self):
+        self._process = subprocess.Popen(
+            ['parec', '--raw', f'--device={self.device}', '--format=s16le',
+             f'--rate={self.rate}', f'--channels={self.channels}',
+             f'--latency-msec={int(self.latency * 1000)}'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0
+        )
+        logger.info(f"Capturing audio from {self.device}")
+
+    def readinto(self, buffer) -> int:
+        """Read PCM into a writable buffer, returning the number of bytes read (0 at the end)"""
+        return self._process.stdout.readinto(buffer) or 0
+
+    def close(self):
+        if self._process is not None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+            self._process = None
+
+
+class SyntheticPcmSource:
+    """Generates a sine tone in real time, standing in for PulseAudio in benchmarks and tests
+
+    ``drift_ppm`` makes the simulated sound card clock run fast (positive)
+    or slow (negative) against ``clock``, and ``stall`` simulates the source
+    delivering nothing for a while, as when PulseAudio is suspended.
+    """
+
+    def __init__(self, rate: int = SAMPLE_RATE, channels: int = CHANNELS, frequency: float = 440.0,
+                 period: float = 0.01, drift_ppm: float = 0.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.channels = channels
+        self.frequency = frequency
+        self.period = period
+        self.latency = period
+        self.drift_ppm = drift_ppm
+        self.clock = clock
+        self.frames_generated = 0
+        self._start = 0.0
+        self._stall_until = 0.0
+        self._closed = threading.Event()
+
+    def open(self):
+        self._closed.clear()
+        self._start = self.clock()
+        self.frames_generated = 0
+
+    def stall(self, seconds: float):
+        """Deliver nothing for ``seconds``; the audio of that time is lost"""
+        self._stall_until = self.clock() + seconds
+
+    def readinto(self, buffer) -> int:
+        frame_bytes = self.channels * BYTES_PER_SAMPLE
+        frames = min(len(buffer) // frame_bytes, max(1, int(self.rate * self.period)))
+        device_rate = self.rate * (1 + self.drift_ppm / 1e6)
+        while not self._closed.is_set():
+            now = self.clock()
+            if now < self._stall_until:
+                self._closed.wait(self._stall_until - now)
+                # Samples are produced by the device clock whether or not anyone reads them
+                self.frames_generated = int((self.clock() - self._start) * device_rate)
+                continue
+            due = self._start + (self.frames_generated + frames) / device_rate
+            if now >= due:
+                break
+            self._closed.wait(due - now)
+        if self._closed.is_set():
+            return 0
+
+        phase = np.arange(self.frames_generated, self.frames_generated + frames) \
+            * (2 * math.pi * self.frequency / self.rate)
+        samples = np.frombuffer(buffer, dtype=np.int16, count=frames * self.channels)
+        samples.shape = (frames, self.channels)
+        samples[:] = (np.sin(phase) * 8000).astype(np.int16)[:, None]
+        self.frames_generated += frames
+        return frames * frame_bytes
+
+    def close(self):
+        self._closed.set()
+
+
+class PcmRingBuffer:
+    """Single-producer single-consumer ring of interleaved 16-bit PCM frames
+
+    Storage is allocated once. The producer only advances ``write_index``
+    and the consumer only ``read_index``; both are ever-increasing frame
+    counts and each is assigned by a single thread, so neither side takes a
+    lock. The producer fills contiguous spans in place and never overwrites
+    unread frames: if the consumer falls that far behind, new audio is
+    discarded and counted in ``overruns``.
+    """
+
+    def __init__(self, capacity: int, channels: int = CHANNELS, rate: int = SAMPLE_RATE):
+        self.capacity = capacity
+        self.channels = channels
+        self.rate = rate
+        self.data = np.zeros((capacity, channels), dtype=np.int16)
+        self.write_index = 0
+        self.read_index = 0
+        self.overruns = 0  # Frames discarded because the ring was full
+        # Capture time of the frame at a write index, replaced as one tuple so readers see a consistent pair
+        self.anchor = (0, 0.0)
+
+    @property
+    def available(self) -> int:
+        """Frames written but not read yet"""
+        return self.write_index - self.read_index
+
+    def write_span(self) -> Optional[np.ndarray]:
+        """The contiguous free region after the write position, or None if the ring is full"""
+        free = self.capacity - self.available
+        if free <= 0:
+            return None
+        start = self.write_index % self.capacity
+        return self.data[start:start + min(free, self.capacity - start)]
+
+    def commit(self, frames: int, timestamp: float):
+        """Publish ``frames`` frames written into the span; ``timestamp`` is when the last one was captured"""
+        index = self.write_index + frames
+        self.anchor = (index, timestamp)
+        self.write_index = index
+
+    def timestamp_of(self, index: int) -> float:
+        """Capture time of the frame at ``index``, extrapolated from the latest anchor"""
+        anchor_index, anchor_time = self.anchor
+        return anchor_time - (anchor_index - index) / self.rate
+
+    def read_into(self, out: np.ndarray, frames: int) -> int:
+        """Copy up to ``frames`` frames into ``out`` and consume them"""
+        frames = min(frames, self.available)
+        start = self.read_index % self.capacity
+        first = min(frames, self.capacity - start)
+        out[:first] = self.data[start:start + first]
+        out[first:frames] = self.data[:frames - first]
+        self.read_index += frames
+        return frames
+
+    def discard(self, frames: int):
+        """Consume frames without reading them"""
+        self.read_index += min(frames, self.available)
+
+
+class AudioCapture:
+    """Captures system audio and feeds it to the encoder in step with video
+
+    A capture thread reads the source straight into a PcmRingBuffer and
+    stamps what it reads against the pipeline clock. A feeder thread emits
+    fixed-size chunks paced by the same clock. It keeps the ring's fill
+    level at the target latency by resampling very slightly (by at most
+    ``max_correction``), so drift between the sound card clock and the
+    pipeline clock is corrected continuously instead of with audible jumps.
+    The target follows the video path's delay so audio and video reach the
+    encoder equally late. When the ring runs dry the feeder writes silence
+    and counts an underrun, so the encoder's audio timeline never stalls.
+    Audio goes to the encoder on its own thread and pipe, so a slow audio
+    path cannot hold up video frames.
+    """
+
+    def __init__(self, source, clock: PipelineClock,
+                 output_callback: Optional[Callable[[memoryview], None]] = None,
+                 video_delay: Optional[Callable[[], float]] = None,
+                 chunk_duration: float = 0.02, buffer_duration: float = 1.0,
+                 min_latency: float = 0.04, max_correction: float = 0.005):
+        self.source = source
+        self.clock = clock
+        self.output_callback = output_callback
+        self.video_delay = video_delay
+        self.rate = source.rate
+        self.channels = source.channels
+        self.chunk_frames = int(self.rate * chunk_duration)
+        self.min_latency = min_latency
+        self.max_correction = max_correction
+        self.ring = PcmRingBuffer(int(self.rate * buffer_duration), self.channels, self.rate)
+
+        self.underruns = 0
+        self.av_offset = 0.0  # Smoothed seconds audio reaches the encoder later than video
+        self.drift_ppm = 0.0  # Estimated sound card clock error the feeder corrects for
+        self.latency = 0.0  # Smoothed seconds from capture to the encoder
+
+        max_input = int(self.chunk_frames * (1 + max_correction)) + 2
+        self._input = np.zeros((max_input, self.channels), dtype=np.int16)
+        self._output = np.zeros((self.chunk_frames, self.channels), dtype=np.int16)
+        self._output_positions = np.arange(self.chunk_frames, dtype=np.float64)
+        self._discard = bytearray(self.chunk_frames * self.channels * BYTES_PER_SAMPLE)
+        self._fill = 0.0
+        self._drift = 0.0
+        self._fraction = 0.0
+        self._running = False
+        self._threads = []
+
+    @property
+    def is_running(self) -> bool:
+        return self._running
+
+    def start(self):
+        """Open the source and start the capture and feeder threads"""
+        if self._running:
+            return
+        self.source.open()
+        self._running = True
+        self._threads = [
+            threading.Thread(target=self._capture, name="UbuntuCastAudioCapture"),
+            threading.Thread(target=self._feed, name="UbuntuCastAudioFeeder"),
+        ]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        """Stop both threads and close the source"""
+        self._running = False
+        self.source.close()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=2)
+        self._threads = []
+
+    def stats(self) -> dict:
+        """Audio sync metrics"""
+        return {
+            'av_offset': self.av_offset,
+            'latency': self.latency,
+            'drift_ppm': self.drift_ppm,
+            'underruns': self.underruns,
+            'overruns': self.ring.overruns,
+            'buffered': self.ring.available / self.rate,
+        }
+
+    def _capture(self):
+        """Capture thread: read the source into the ring"""
+        frame_bytes = self.channels * BYTES_PER_SAMPLE
+        latency = getattr(self.source, 'latency', 0.0)
+        try:
+            while self._running:
+                span = self.ring.write_span()
+                if span is None:
+                    # Ring full: keep draining the source so it does not back up, dropping the audio
+                    count = self.source.readinto(self._discard)
+                    self.ring.overruns += count // frame_bytes
+                    if metrics.enabled:
+                        metrics.inc('ubuntucast_audio_overrun_frames_total', count // frame_bytes)
+                else:
+                    count = self.source.readinto(memoryview(span).cast('B'))
+                    if count:
+                        self.ring.commit(count // frame_bytes, self.clock.now() - latency)
+                if not count:
+                    break
+        except Exception as e:
+            logger.error(f"Error capturing audio: {e}")
+        if self._running:
+            logger.warning("Audio source ended")
+
+    def _target_fill(self) -> float:
+        """Seconds of audio to keep buffered so audio is as late as video"""
+        latency = getattr(self.source, 'latency', 0.0)
+        video_delay = self.video_delay() if self.video_delay is not None else 0.0
+        return max(self.min_latency, video_delay - latency)
+
+    def _feed(self):
+        """Feeder thread: emit one chunk per chunk duration, corrected for drift"""
+        chunk_duration = self.chunk_frames / self.rate
+        next_time = self.clock.now()
+        primed = started = False
+        while self._running:
+            delay = next_time - self.clock.now()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -0.2:
+                logger.info(f"Audio feeder fell {-delay:.2f} s behind, skipping ahead")
+                next_time = self.clock.now()
+            next_time += chunk_duration
+
+            target = self._target_fill()
+            fill = self._fill_level(chunk_duration)
+            if not primed:
+                # Wait for the target latency to fill up, at the start and after an underrun.
+                # Once the timeline has started it is kept going with silence.
+                if fill < target:
+                    if started:
+                        self._output[:] = 0
+                        self._emit(None)
+                    continue
+                primed = started = True
+                self._fill = fill
+            self._fill = 0.9 * self._fill + 0.1 * fill
+            if fill - target > 0.2:
+                # Far off, e.g. after the feeder was held up: jump to the target instead of slewing for seconds
+                self._resync(fill, target)
+                self._fill = target
+
+            # Take slightly more or fewer input frames than we output to move the fill level.
+            # The integral term converges on the clock drift, the proportional one holds the target.
+            error = self._fill - target
+            self._drift = max(-self.max_correction,
+                              min(self.max_correction, self._drift + error * 0.02 * chunk_duration))
+            correction = max(-self.max_correction, min(self.max_correction, self._drift + error * 0.2))
+            self.drift_ppm = self._drift * 1e6
+            wanted = self.chunk_frames * (1 + correction) + self._fraction
+            frames = int(wanted)
+            self._fraction = wanted - frames
+
+            index = self.ring.read_index
+            if self.ring.available < frames:
+                self.underruns += 1
+                if metrics.enabled:
+                    metrics.inc('ubuntucast_audio_underruns_total')
+                got = self.ring.read_into(self._output, min(self.chunk_frames, self.ring.available))
+                self._output[got:] = 0
+                primed = False
+            else:
+                self.ring.read_into(self._input, frames)
+                self._resample(frames)
+            self._emit(index)
+
+    def _fill_level(self, limit: float) -> float:
+        """Seconds of audio buffered, smoothed over the source's bursty delivery
+
+        The source hands over audio a period at a time, so the raw ring level
+        is a sawtooth. Counting the time since the last delivery as buffered
+        (up to ``limit``) turns it into a steady level that drift shows up in.
+        """
+        anchor_index, anchor_time = self.ring.anchor
+        since = self.clock.now() - anchor_time - getattr(self.source, 'latency', 0.0)
+        return (anchor_index - self.ring.read_index) / self.rate + max(0.0, min(since, limit))
+
+    def _resync(self, fill: float, target: float):
+        """Discard surplus audio at once"""
+        self.ring.discard(int((fill - target) * self.rate))
+        logger.info(f"Audio resynchronised, dropped {fill - target:.3f} s")
+
+    def _resample(self, frames: int):
+        """Stretch ``frames`` input frames onto one output chunk by linear interpolation"""
+        if frames == self.chunk_frames:
+            self._output[:] = self._input[:frames]
+            return
+        positions = self._output_positions * (frames / self.chunk_frames)
+        source_positions = np.arange(frames, dtype=np.float64)
+        for channel in range(self.channels):
+            self._output[:, channel] = np.interp(positions, source_positions, self._input[:frames, channel])
+
+    def _emit(self, index: Optional[int]):
+        """Hand the output chunk to the encoder and update the sync metrics
+
+        ``index`` is the ring position the chunk starts at, None for silence.
+        """
+        now = self.clock.now()
+        if index is not None:
+            delay = now - self.ring.timestamp_of(index)
+            self.latency = 0.9 * self.latency + 0.1 * delay
+            video_delay = self.video_delay() if self.video_delay is not None else 0.0
+            self.av_offset = 0.9 * self.av_offset + 0.1 * (delay - video_delay)
+        if self.output_callback is not None:
+            try:
+                self.output_callback(memoryview(self._output).cast('B'))
+            except Exception as e:
+                logger.error(f"Error in audio output callback: {e}")
@@ -0,0 +1,839 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Cast Session Manager
+
+import functools
+import logging
+import os
+import random
+import shutil
+import threading
+import time
+from concurrent.futures import wait
+from typing import Dict, List, Callable, Optional, Any, Tuple
+
+from src.adaptive_bitrate import AdaptiveBitrateController, QualityTier, build_tiers
+from src.audio_capture import AudioCapture, ParecSource, default_monitor_source
+from src.connection_pool import ConnectionPool
+from src.device_profiles import ENCODER_CODECS, DeviceProfiles, cap_stream, starting_tier
+from src.frame_trace import RecordingSource, TraceReplay
+from src.metrics import metrics
+from src.pipeline import CastPipeline
+from src.pipeline_clock import PipelineClock
+from src.pipeline_runner import ProcessPipeline
+from src.resource_governor import LEVELS, GovernorLevel, ResourceGovernor
+from src.screen_capture import CaptureError, ScreenCapture
+from src.stream_server import StreamServer, local_address_for
+from src.window_capture import WindowCapture, active_window
+
+logger = logging.getLogger("UbuntuCast.CastManager")
+
+# Receiver states, also reported to per-device status callbacks
+TARGET_CONNECTING = "connecting"
+TARGET_CONNECTED = "connected"
+TARGET_LAUNCHING = "launching"
+TARGET_PLAYING = "playing"
+TARGET_RECONNECTING = "reconnecting"
+TARGET_FAILED = "failed"
+
+# Reconnection backoff for a receiver that dropped out of the session, in seconds
+RESUME_BACKOFF_BASE = 0.5
+RESUME_BACKOFF_MAX = 8.0
+
+
+class CastTarget:
+    """One receiver taking part in the cast session"""
+
+    def __init__(self, uuid: str):
+        self.uuid = uuid
+        self.cast: Optional[Any] = None  # Connected Chromecast object
+        self.state = TARGET_CONNECTING
+        self.error = ""
+
+    @property
+    def name(self) -> str:
+        return self.cast.name if self.cast is not None else self.uuid
+
+    @property
+    def is_active(self) -> bool:
+        """Whether the receiver is connected and has not failed"""
+        return self.cast is not None and self.state != TARGET_FAILED
+
+
+class _MediaStatusListener:
+    """Reports a receiver that starts rebuffering during playback"""
+
+    def __init__(self, cast_manager: 'CastManager', uuid: str):
+        self.cast_manager = cast_manager
+        self.uuid = uuid
+        self._player_state: Optional[str] = None
+
+    def new_media_status(self, status):
+        state = status.player_state
+        if state == 'BUFFERING' and self._player_state == 'PLAYING':
+            self.cast_manager._on_receiver_stall(self.uuid)
+        self._player_state = state
+
+
+class _ConnectionStatusListener:
+    """Reports a receiver whose connection drops during playback"""
+
+    def __init__(self, cast_manager: 'CastManager', uuid: str, cast: Any):
+        self.cast_manager = cast_manager
+        self.uuid = uuid
+        self.cast = cast
+
+    def new_connection_status(self, status):
+        if status.status in ('LOST', 'FAILED', 'DISCONNECTED'):
+            self.cast_manager._on_receiver_lost(self.uuid, self.cast)
+
+
+class CastManager:
+    """Manages the selected cast devices and the casting session
+
+    Any number of receivers can be selected. They all share one capture and
+    encode pipeline and one segment server, so each extra receiver only
+    costs the HTTP requests it makes. Receivers are tracked individually: a
+    receiver that fails to connect or to start playback is marked failed
+    without affecting the others, and the session only ends in an error once
+    no receiver is left.
+
+    A receiver whose connection drops is not failed straight away: the
+    pipeline and segment ring keep running while it is reconnected with
+    backoff, and once back it is relaunched at the live edge. It only
+    fails if that takes longer than the resume grace period.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.targets: Dict[str, CastTarget] = {}  # In selection order
+        self.is_casting = False
+        self.cast_mode = "screen"
+        self.cast_window: Optional[int] = None  # Window cast in window mode; None for the active one
+        self.audio_enabled = config.getboolean('CASTING', 'audio_enabled', fallback=True)
+        self.resolution = config.get('CASTING', 'resolution', fallback='1080p')
+        self.framerate = config.getint('CASTING', 'framerate', fallback=30)
+        self.status_callbacks: List[Callable[[str], None]] = []
+        self.device_status_callbacks: Dict[str, List[Callable[[str], None]]] = {}
+        self.connection_pool: Optional[ConnectionPool] = None
+        self.pipeline: Optional[CastPipeline] = None
+        self.stream_server: Optional[StreamServer] = None
+        self.quality_controller: Optional[AdaptiveBitrateController] = None
+        self.quality_tier: Optional[QualityTier] = None
+        self.resource_governor: Optional[ResourceGovernor] = None
+        self.resource_limit: Optional[str] = None  # How and why the governor is holding the session back
+        self._session_tier: Optional[QualityTier] = None  # Quality the session would run at unlimited
+        self.pipeline_stats: Optional[dict] = None
+        self.device_profiles = DeviceProfiles()
+        # Called with framerate and clock keywords to create the frame source
+        self.source_factory: Callable[..., Any] = ScreenCapture
+        self.resume_grace_period = config.getfloat('ADVANCED', 'resume_grace_period', fallback=30.0)
+        self._media_listeners: Dict[str, Tuple[Any, _MediaStatusListener]] = {}
+        self._connection_listeners: Dict[str, Tuple[Any, _ConnectionStatusListener]] = {}
+        self._select_lock = threading.RLock()
+        self._session_started = False
+
+        metrics.register_gauge('ubuntucast_receivers_active', "Receivers taking part in the session",
+                               lambda: len(self.active_targets) if self.is_casting else None)
+        metrics.register_gauge('ubuntucast_video_bitrate_kbps', "Video bitrate of the current quality tier",
+                               lambda: self.quality_tier.bitrate if self.quality_tier else None)
+        metrics.register_gauge('ubuntucast_bandwidth_estimate_kbps', "Estimated bandwidth to the slowest receiver",
+                               lambda: self.quality_controller.bandwidth_estimate
+                               if self.quality_controller else None)
+        metrics.register_gauge('ubuntucast_encoder_queue_depth', "Frames waiting for the encoder",
+                               lambda: self.pipeline.encoder.queue_depth
+                               if self.pipeline and self.pipeline.encoder else None)
+        metrics.register_gauge('ubuntucast_av_offset_seconds', "Seconds audio reaches the encoder later than video",
+                               lambda: self._audio_stat('av_offset'))
+        metrics.register_gauge('ubuntucast_audio_latency_seconds', "Seconds from capturing audio to the encoder",
+                               lambda: self._audio_stat('latency'))
+        metrics.register_gauge('ubuntucast_audio_drift_ppm', "Sound card clock error corrected for",
+                               lambda: self._audio_stat('drift_ppm'))
+        metrics.register_gauge('ubuntucast_audio_buffered_seconds', "Audio waiting in the capture ring",
+                               lambda: self._audio_stat('buffered'))
+        metrics.register_gauge('ubuntucast_governor_level', "Resource governor steps below full quality",
+                               lambda: self.resource_governor.level_index if self.resource_governor else None)
+        metrics.register_gauge('ubuntucast_process_cpu_percent', "CPU used by casting, percent of all cores",
+                               lambda: self._resource_reading('process_cpu'))
+        metrics.register_gauge('ubuntucast_system_cpu_percent', "CPU busy system-wide, percent of all cores",
+                               lambda: self._resource_reading('system_cpu'))
+        metrics.register_gauge('ubuntucast_load_per_core', "One-minute load average per core",
+                               lambda: self._resource_reading('load'))
+        metrics.register_gauge('ubuntucast_cpu_temperature_celsius', "Hottest CPU sensor",
+                               lambda: self._resource_reading('temperature'))
+
+    def set_device_discovery(self, device_discovery):
+        """Attach the device discovery service and start pooling connections"""
+        self._device_discovery = device_discovery
+        self.connection_pool = ConnectionPool(
+            device_discovery,
+            connect_timeout=self.config.getfloat('ADVANCED', 'connect_timeout', fallback=10.0),
+            idle_timeout=self.config.getfloat('ADVANCED', 'connection_idle_timeout', fallback=300.0)
+        )
+        self.connection_pool.set_preferred_device(
+            self.config.get('CASTING', 'preferred_device', fallback='')
+        )
+
+    @property
+    def active_targets(self) -> List[CastTarget]:
+        """Connected receivers that have not failed, in selection order"""
+        with self._select_lock:
+            return [target for target in self.targets.values() if target.is_active]
+
+    @property
+    def current_device(self) -> Optional[Any]:
+        """The first active receiver's Chromecast object"""
+        targets = self.active_targets
+        return targets[0].cast if targets else None
+
+    @property
+    def current_device_uuid(self) -> Optional[str]:
+        targets = self.active_targets
+        return targets[0].uuid if targets else None
+
+    @property
+    def current_device_name(self) -> str:
+        """Friendly names of the active receivers"""
+        return ", ".join(target.name for target in self.active_targets)
+
+    def get_target_states(self) -> Dict[str, str]:
+        """Return the state of every selected receiver by UUID"""
+        with self._select_lock:
+            return {uuid: target.state for uuid, target in self.targets.items()}
+
+    def register_status_callback(self, callback: Callable[[str], None],
+                                 device_uuid: Optional[str] = None):
+        """Register a callback to be called when the cast status changes
+
+        Without ``device_uuid`` the callback receives session statuses
+        ("started", "stopped", "error", "quality_changed", "reconnecting",
+        "resumed"). With it, the callback receives that receiver's state
+        changes ("connecting", "connected", "launching", "playing",
+        "reconnecting", "failed").
+        """
+        if device_uuid is None:
+            callbacks = self.status_callbacks
+        else:
+            callbacks = self.device_status_callbacks.setdefault(device_uuid, [])
+        if callback not in callbacks:
+            callbacks.append(callback)
+
+    def unregister_status_callback(self, callback: Callable, device_uuid: Optional[str] = None):
+        """Remove a previously registered status callback"""
+        if device_uuid is None:
+            callbacks = self.status_callbacks
+        else:
+            callbacks = self.device_status_callbacks.get(device_uuid, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def _notify_status(self, status: str, device_uuid: Optional[str] = None):
+        """Notify session or per-device status callbacks about a status change"""
+        if device_uuid is None:
+            callbacks = self.status_callbacks
+        else:
+            callbacks = self.device_status_callbacks.get(device_uuid, [])
+        for callback in list(callbacks):
+            try:
+                callback(status)
+            except Exception as e:
+                logger.error(f"Error in cast status callback: {e}")
+
+    def select_device(self, device_uuid: str, callback: Optional[Callable[[bool], None]] = None) -> bool:
+        """Select a single device to cast to, replacing any other selection"""
+        return self.select_devices([device_uuid], callback)
+
+    def select_devices(self, device_uuids: List[str],
+                       callback: Optional[Callable[[bool], None]] = None) -> bool:
+        """Select the devices to cast to
+
+        Receivers already selected stay connected, those left out are
+        released (and stopped if the session is running) and new ones are
+        connected. If casting, new receivers join the running session as soon
+        as they connect.
+
+        Without a callback this blocks until every connection attempt has
+        finished and returns whether at least one receiver is connected.
+        With a callback the connections are made on worker threads; the
+        return value only says whether the request was accepted and the
+        callback later receives the outcome.
+        """
+        if self.connection_pool is None:
+            logger.error("Cannot select device: device discovery is not available")
+            return False
+
+        with self._select_lock:
+            previous = self.targets
+            self.targets = {}
+            for uuid in dict.fromkeys(device_uuids):
+                target = previous.pop(uuid, None)
+                if target is None or target.state == TARGET_FAILED:
+                    target = CastTarget(uuid)
+                self.targets[uuid] = target
+            pending = [target for target in self.targets.values() if target.cast is None]
+        for target in previous.values():
+            self._drop_target(target)
+
+        if callback is None:
+            futures = [self.connection_pool.connect(target.uuid) for target in pending]
+            wait(futures)
+            for target, future in zip(pending, futures):
+                self._attach_target(target, future.result())
+            return bool(self.active_targets)
+
+        if not pending:
+            callback(bool(self.active_targets))
+            return True
+
+        remaining = [len(pending)]
+        remaining_lock = threading.Lock()
+
+        def on_connected(target, cast):
+            self._attach_target(target, cast)
+            with remaining_lock:
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+            if finished:
+                callback(bool(self.active_targets))
+
+        for target in pending:
+            self.connection_pool.connect(
+                target.uuid, callback=lambda cast, target=target: on_connected(target, cast)
+            )
+        return True
+
+    def _attach_target(self, target: CastTarget, cast: Optional[Any]):
+        """Record the outcome of connecting a receiver, unless it was deselected meanwhile"""
+        profile = self._probe_profile(target.uuid, cast) if cast is not None else None
+        if profile is not None and not profile.get('video', True):
+            cast = None
+            error = "receiver cannot show video"
+        else:
+            error = "connection failed"
+        with self._select_lock:
+            if self.targets.get(target.uuid) is not target:
+                return
+            if cast is None:
+                target.state = TARGET_FAILED
+                target.error = error
+                logger.error(f"Cannot cast to device {target.uuid}: {error}")
+            else:
+                target.cast = cast
+                target.state = TARGET_CONNECTED
+                self.connection_pool.acquire(target.uuid)
+                self._listen_for_media_status(target)
+                self._watch_connection(target)
+                logger.info(f"Selected device: {cast.name}")
+            stream_server = self.stream_server if self.is_casting else None
+        self._notify_status(target.state, target.uuid)
+
+        if cast is None:
+            self._check_session()
+        elif stream_server is not None:
+            self._start_launcher(target, stream_server)
+
+    def _probe_profile(self, device_uuid: str, cast: Any) -> Optional[dict]:
+        """A receiver's capabilities, probed the first time it connects"""
+        try:
+            cast_info = cast.cast_info
+            return self.device_profiles.ensure(device_uuid, cast_info.model_name, cast_info.cast_type,
+                                               cast_info.host)
+        except Exception as e:
+            logger.error(f"Cannot probe capabilities of {device_uuid}: {e}")
+            return None
+
+    def _listen_for_media_status(self, target: CastTarget):
+        """Watch a receiver's media status for rebuffering, once per Chromecast object"""
+        registered = self._media_listeners.get(target.uuid)
+        if registered is not None and registered[0] is target.cast:
+            return
+        listener = _MediaStatusListener(self, target.uuid)
+        try:
+            target.cast.media_controller.register_status_listener(listener)
+        except Exception as e:
+            logger.error(f"Cannot watch media status of {target.name}: {e}")
+            return
+        self._media_listeners[target.uuid] = (target.cast, listener)
+
+    def _watch_connection(self, target: CastTarget):
+        """Watch a receiver's connection for drops, once per Chromecast object"""
+        registered = self._connection_listeners.get(target.uuid)
+        if registered is not None and registered[0] is target.cast:
+            return
+        listener = _ConnectionStatusListener(self, target.uuid, target.cast)
+        try:
+            target.cast.register_connection_listener(listener)
+        except Exception as e:
+            logger.error(f"Cannot watch connection of {target.name}: {e}")
+            return
+        self._connection_listeners[target.uuid] = (target.cast, listener)
+
+    def _on_receiver_lost(self, device_uuid: str, cast: Any):
+        """Keep the session going while a receiver that dropped out reconnects"""
+        with self._select_lock:
+            target = self.targets.get(device_uuid)
+            if (not self.is_casting or target is None or target.cast is not cast
+                    or target.state not in (TARGET_LAUNCHING, TARGET_PLAYING)):
+                return
+            target.state = TARGET_RECONNECTING
+            stream_server = self.stream_server
+            none_playing = not any(other.state == TARGET_PLAYING for other in self.targets.values())
+        logger.warning(f"Lost connection to {target.name}, reconnecting")
+        self._notify_status(TARGET_RECONNECTING, device_uuid)
+        if none_playing:
+            self._notify_status("reconnecting")
+        # The listener runs on the receiver's socket thread, which disconnecting would join
+        resumer = threading.Thread(target=self._resume_target, args=(target, stream_server, time.monotonic()))
+        resumer.daemon = True
+        resumer.start()
+
+    def _is_resuming(self, target: CastTarget, stream_server: StreamServer) -> bool:
+        return (stream_server is self.stream_server and self.targets.get(target.uuid) is target
+                and target.state == TARGET_RECONNECTING)
+
+    def _resume_target(self, target: CastTarget, stream_server: StreamServer, lost_at: float):
+        """Reconnect a lost receiver with backoff and relaunch it at the live edge"""
+        deadline = lost_at + self.resume_grace_period
+        self.connection_pool.discard(target.uuid)
+        cast = None
+        attempt = 0
+        while cast is None and self._is_resuming(target, stream_server):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                cast = self.connection_pool.connect(target.uuid).result(timeout=remaining)
+            except Exception:
+                cast = None
+            if cast is None:
+                # Full jitter, so receivers that dropped together do not retry in lockstep
+                delay = random.uniform(0, min(RESUME_BACKOFF_MAX, RESUME_BACKOFF_BASE * 2 ** attempt))
+                attempt += 1
+                time.sleep(max(0.0, min(delay, deadline - time.monotonic())))
+
+        with self._select_lock:
+            if not self._is_resuming(target, stream_server):
+                return
+            if cast is not None:
+                target.cast = cast
+                target.state = TARGET_LAUNCHING
+        if cast is None:
+            logger.error(f"Could not reconnect to {target.name} within {self.resume_grace_period:.0f} s")
+            if metrics.enabled:
+                metrics.inc('ubuntucast_resumes_total', result='expired')
+            self._fail_target(target, "connection lost", session_status="stopped")
+            return
+
+        self.connection_pool.acquire(target.uuid)
+        self._listen_for_media_status(target)
+        self._watch_connection(target)
+        self._notify_status(TARGET_LAUNCHING, target.uuid)
+        if not self._launch_media(target, stream_server, live_edge=True):
+            return
+        seconds = time.monotonic() - lost_at
+        logger.info(f"{target.name} resumed after {seconds:.2f} s, {attempt + 1} attempts")
+        if metrics.enabled:
+            metrics.observe('ubuntucast_resume_seconds', seconds)
+            metrics.inc('ubuntucast_resumes_total', result='resumed')
+        self._notify_status("resumed")
+
+    def _on_receiver_stall(self, device_uuid: str):
+        """Tell the quality controller that a receiver in the session ran dry"""
+        controller = self.quality_controller
+        target = self.targets.get(device_uuid)
+        if controller is not None and target is not None and target.state == TARGET_PLAYING:
+            controller.report_stall(device_uuid)
+
+    def _drop_target(self, target: CastTarget):
+        """Stop and release a receiver that is no longer selected"""
+        if target.cast is None:
+            return
+        if target.state in (TARGET_LAUNCHING, TARGET_PLAYING):
+            try:
+                target.cast.media_controller.stop()
+            except Exception as e:
+                logger.error(f"Error stopping playback on {target.name}: {e}")
+        self.connection_pool.release(target.uuid)
+        logger.info(f"Deselected device: {target.name}")
+
+    def set_cast_mode(self, mode: str, window_id: Optional[int] = None):
+        """Set whether to cast the whole screen or a single window
+
+        In window mode ``window_id`` picks the window; without it the window
+        that is active when casting starts is cast.
+        """
+        if mode not in ("screen", "window"):
+            raise ValueError(f"Unknown cast mode: {mode}")
+        self.cast_mode = mode
+        self.cast_window = window_id if mode == "window" else None
+
+    def set_audio_enabled(self, enabled: bool):
+        """Enable or disable audio streaming"""
+        self.audio_enabled = enabled
+
+    def start_casting(self) -> bool:
+        """Start casting to the selected devices"""
+        if self.is_casting:
+            return True
+        targets = self.active_targets
+        if not targets:
+            logger.error("Cannot start casting: no device selected")
+            return False
+
+        try:
+            self.stream_server = StreamServer(
+                port=self.config.getint('ADVANCED', 'stream_port', fallback=0),
+                ring_slots=self.config.getint('ADVANCED', 'segment_ring_size', fallback=8)
+            )
+            self.stream_server.start()
+            profiles = [profile for profile in (self.device_profiles.get(target.uuid) for target in targets)
+                        if profile is not None]
+            tiers, initial = self._session_tiers(profiles)
+            self._session_tier = tiers[initial]
+            self.pipeline = self._create_pipeline(tiers[initial], profiles)
+            self.quality_controller = self._create_quality_controller(tiers, initial)
+            self.resource_governor = self._create_resource_governor()
+            self.pipeline.start()
+        except Exception as e:
+            logger.error(f"Failed to start casting: {e}")
+            self._stop_pipeline()
+            self._notify_status("error")
+            return False
+
+        with self._select_lock:
+            self.is_casting = True
+            self._session_started = False
+            targets = self.active_targets
+        logger.info(f"Casting {self.cast_mode} to {self.current_device_name}")
+
+        for target in targets:
+            self._start_launcher(target, self.stream_server)
+
+        if self.quality_controller is not None:
+            self.quality_tier = self.quality_controller.tier
+            self.stream_server.delivery_callback = self.quality_controller.report_delivery
+        if self.quality_controller is not None or self.resource_governor is not None:
+            monitor = threading.Thread(target=self._monitor_session,
+                                       args=(self.stream_server, self.quality_controller, self.resource_governor))
+            monitor.daemon = True
+            monitor.start()
+        return True
+
+    def _start_launcher(self, target: CastTarget, stream_server: StreamServer):
+        """Tell a receiver to play once the first segment exists, off the caller's thread"""
+        with self._select_lock:
+            if target.state != TARGET_CONNECTED:
+                return
+            target.state = TARGET_LAUNCHING
+        self._notify_status(TARGET_LAUNCHING, target.uuid)
+        launcher = threading.Thread(target=self._launch_media, args=(target, stream_server))
+        launcher.daemon = True
+        launcher.start()
+
+    def _launch_media(self, target: CastTarget, stream_server: StreamServer, live_edge: bool = False) -> bool:
+        """Point one receiver's default media player at the live stream, returning whether it plays"""
+        try:
+            ready = stream_server.ring.wait_for_segments(1, timeout=10)
+            if stream_server is not self.stream_server or self.targets.get(target.uuid) is not target:
+                return False  # The session was stopped or the receiver deselected meanwhile
+            if not ready:
+                raise TimeoutError("no stream segments were produced")
+            host = local_address_for(target.cast.cast_info.host)
+            url = stream_server.stream_url(host, live_edge=live_edge)
+            media_controller = target.cast.media_controller
+            media_controller.play_media(url, 'application/x-mpegURL', title="UbuntuCast",
+                                        stream_type='LIVE')
+            logger.info(f"{target.name} loading {url}")
+        except Exception as e:
+            logger.error(f"Failed to start playback on {target.name}: {e}")
+            self._fail_target(target, str(e))
+            return False
+
+        with self._select_lock:
+            if target.state != TARGET_LAUNCHING:
+                return False
+            target.state = TARGET_PLAYING
+            first = not self._session_started
+            self._session_started = True
+        self._notify_status(TARGET_PLAYING, target.uuid)
+        if first:
+            self._notify_status("started")
+        return True
+
+    def _fail_target(self, target: CastTarget, error: str, session_status: str = "error"):
+        """Take a single receiver out of the session without affecting the others"""
+        with self._select_lock:
+            if self.targets.get(target.uuid) is not target or target.state == TARGET_FAILED:
+                return
+            target.state = TARGET_FAILED
+            target.error = error
+        self._notify_status(TARGET_FAILED, target.uuid)
+        self._check_session(session_status)
+
+    def _check_session(self, status: str = "error"):
+        """End the session once every receiver has failed"""
+        if self.is_casting and not self.active_targets:
+            logger.error("No receivers left in the casting session")
+            self.stop_casting(status=status)
+
+    def _session_tiers(self, profiles: List[dict]) -> Tuple[List[QualityTier], int]:
+        """Quality ladder every receiver can decode, and the index of the tier to start at
+
+        Receivers that have played before start at the tier they last held
+        steady, so the session does not have to find it again.
+        """
+        config = self.config
+        resolution, framerate = cap_stream(profiles, self.resolution, self.framerate)
+        if (resolution, framerate) != (self.resolution, self.framerate):
+            logger.info(f"Capping the stream at {resolution} {framerate} fps for the selected receivers")
+        bitrate = config.getint('ADVANCED', 'video_bitrate', fallback=6000)
+        if not config.getboolean('ADVANCED', 'adaptive_quality', fallback=True):
+            return [QualityTier(resolution, framerate, bitrate)], 0
+        tiers = build_tiers(
+            resolution,
+            framerate,
+            bitrate,
+            min_resolution=config.get('ADVANCED', 'min_resolution', fallback='480p'),
+            min_framerate=config.getint('ADVANCED', 'min_framerate', fallback=15),
+            min_bitrate=config.getint('ADVANCED', 'min_video_bitrate', fallback=1000)
+        )
+        initial = starting_tier(tiers, profiles)
+        if initial != len(tiers) - 1:
+            logger.info(f"Starting at {tiers[initial]}, as negotiated in an earlier session")
+        return tiers, initial
+
+    def _session_codec(self, profiles: List[dict]) -> str:
+        """The configured encoder, unless a receiver cannot decode what it produces"""
+        codec = self.config.get('ADVANCED', 'video_codec', fallback='libx264')
+        produced = ENCODER_CODECS.get(codec, 'h264')
+        if any(produced not in profile.get('codecs', ('h264',)) for profile in profiles):
+            logger.warning(f"Not every selected receiver decodes {produced}, encoding with libx264")
+            return 'libx264'
+        return codec
+
+    def _create_pipeline(self, tier: QualityTier, profiles: List[dict]) -> CastPipeline:
+        """Build the capture and encode pipeline, starting at the given quality tier"""
+        config = self.config
+        clock = PipelineClock()
+        options = dict(
+            bitrate=tier.bitrate,
+            codec=self._session_codec(profiles),
+            keepalive_interval=config.getfloat('ADVANCED', 'keepalive_interval', fallback=1.0),
+            queue_size=config.getint('ADVANCED', 'encoder_queue_size', fallback=3),
+            restart_callback=self.stream_server.restart_stream,
+            error_callback=self._on_pipeline_error,
+            audio=self._create_audio_capture(clock) if self.audio_enabled else None,
+            audio_bitrate=config.getint('ADVANCED', 'audio_bitrate', fallback=128),
+            clock=clock
+        )
+        source_factory = self._capture_factory()
+        if config.get('ADVANCED', 'pipeline_mode', fallback='thread') == 'process':
+            # Capture runs in its own process there, so it gets a factory rather than a source;
+            # its monotonic timestamps still share the pipeline clock's time base
+            return ProcessPipeline(
+                functools.partial(source_factory, framerate=tier.framerate),
+                tier.size,
+                tier.framerate,
+                self.stream_server.publish,
+                workers=config.getint('ADVANCED', 'pipeline_workers', fallback=0),
+                health_callback=self._on_pipeline_health,
+                **options
+            )
+        source = source_factory(framerate=tier.framerate, clock=clock.now)
+        return CastPipeline(source, tier.size, tier.framerate, self.stream_server.publish, **options)
+
+    def _capture_factory(self) -> Callable[..., Any]:
+        """The frame source factory for the cast mode, or for the configured frame trace"""
+        config = self.config
+        replay = config.get('ADVANCED', 'frame_trace_replay', fallback='')
+        if replay:
+            logger.info(f"Casting frames replayed from {replay} instead of the screen")
+            factory = functools.partial(TraceReplay, os.path.expanduser(replay), loop=True,
+                                        speed=config.getfloat('ADVANCED', 'frame_trace_speed', fallback=1.0))
+        elif self.cast_mode != "window":
+            factory = self.source_factory
+        else:
+            window_id = self.cast_window or active_window()
+            if not window_id:
+                raise CaptureError("No window to cast")
+            # Unchanged windows are captured once per keep-alive period
+            factory = functools.partial(WindowCapture, window_id,
+                                        idle_interval=config.getfloat('ADVANCED', 'keepalive_interval',
+                                                                      fallback=1.0))
+        record = config.get('ADVANCED', 'frame_trace_record', fallback='')
+        if record:
+            factory = functools.partial(RecordingSource, factory, os.path.expanduser(record),
+                                        delta=config.getboolean('ADVANCED', 'frame_trace_delta', fallback=True))
+        return factory
+
+    def _on_pipeline_health(self, stats: dict):
+        """Keep the latest stage health report from the process pipeline"""
+        self.pipeline_stats = stats
+
+    def get_pipeline_stats(self) -> Optional[dict]:
+        """Stage health and queue depths of the running pipeline"""
+        pipeline = self.pipeline
+        if pipeline is None:
+            return None
+        return self.pipeline_stats or pipeline.stats()
+
+    def _create_audio_capture(self, clock: PipelineClock) -> Optional[AudioCapture]:
+        """Capture what the default output device plays, if PulseAudio is reachable"""
+        if shutil.which('parec') is None:
+            logger.warning("parec not found, casting without audio")
+            return None
+        device = default_monitor_source()
+        if device is None:
+            logger.warning("No audio monitor source, casting without audio")
+            return None
+        return AudioCapture(ParecSource(device), clock)
+
+    def _create_quality_controller(self, tiers: List[QualityTier],
+                                   initial: int) -> Optional[AdaptiveBitrateController]:
+        """Build the adaptive quality controller over the session's quality ladder"""
+        if not self.config.getboolean('ADVANCED', 'adaptive_quality', fallback=True):
+            return None
+        return AdaptiveBitrateController(tiers, self._apply_quality, initial_tier=initial)
+
+    def _create_resource_governor(self) -> Optional[ResourceGovernor]:
+        """Build the governor that holds the session back when CPU or temperature run over budget"""
+        config = self.config
+        if not config.getboolean('ADVANCED', 'governor_enabled', fallback=True):
+            return None
+        return ResourceGovernor(
+            self._apply_resource_level,
+            cpu_budget=config.getfloat('ADVANCED', 'governor_cpu_budget', fallback=50.0),
+            system_cpu_budget=config.getfloat('ADVANCED', 'governor_system_cpu_budget', fallback=90.0),
+            load_budget=config.getfloat('ADVANCED', 'governor_load_budget', fallback=1.5),
+            temperature_limit=config.getfloat('ADVANCED', 'governor_temperature_limit', fallback=85.0)
+        )
+
+    def _monitor_session(self, stream_server: StreamServer, controller: Optional[AdaptiveBitrateController],
+                         governor: Optional[ResourceGovernor]):
+        """Let the quality controller and the resource governor decide, once a second"""
+        while True:
+            time.sleep(1.0)
+            if stream_server is not self.stream_server:
+                return
+            if controller is not None:
+                pipeline = self.pipeline
+                encoder = pipeline.encoder if pipeline is not None else None
+                if encoder is not None:
+                    controller.report_encoder(encoder.queue_depth, encoder.queue_size, encoder.frames_dropped)
+                controller.update()
+            if governor is not None:
+                governor.update()
+
+    def _apply_quality(self, tier: QualityTier):
+        """Switch the running pipeline to a new quality tier"""
+        self._session_tier = tier
+        self._update_pipeline_quality()
+        self.quality_tier = tier
+        self._notify_status("quality_changed")
+
+    def _apply_resource_level(self, level: GovernorLevel):
+        """Cut the running pipeline back, or restore it, as the resource governor decided"""
+        governor = self.resource_governor
+        if governor is not None and governor.level_index > 0:
+            self.resource_limit = f"{level.describe()} ({governor.reason})"
+        else:
+            self.resource_limit = None
+        self._update_pipeline_quality()
+        self._notify_status("resources_changed")
+
+    def _update_pipeline_quality(self):
+        """Hand the session's quality tier, cut back by the resource governor's level, to the pipeline"""
+        pipeline, tier = self.pipeline, self._session_tier
+        if pipeline is None or tier is None:
+            return
+        governor = self.resource_governor
+        level = governor.level if governor is not None else LEVELS[0]
+        width, height = tier.size
+        size = (int(width * level.size_scale) & ~1, int(height * level.size_scale) & ~1)
+        min_framerate = min(self.config.getint('ADVANCED', 'min_framerate', fallback=15), tier.framerate)
+        framerate = max(min_framerate, round(tier.framerate * level.framerate_scale))
+        workers = 0
+        if level.worker_scale < 1:
+            # Converter processes in the process pipeline, encoder threads in both
+            available = getattr(pipeline, 'workers', os.cpu_count() or 1)
+            workers = max(1, int(available * level.worker_scale))
+        pipeline.set_quality(size, framerate, tier.bitrate, workers)
+
+    def _audio_stat(self, field: str) -> Optional[float]:
+        """A sync metric of the session's audio capture, if it has audio"""
+        pipeline = self.pipeline
+        audio = pipeline.audio if pipeline is not None else None
+        return audio.stats()[field] if audio is not None else None
+
+    def _resource_reading(self, field: str) -> Optional[float]:
+        """A field of the resource governor's latest reading, if there is one"""
+        governor = self.resource_governor
+        reading = governor.reading if governor is not None else None
+        return getattr(reading, field) if reading is not None else None
+
+    def _on_pipeline_error(self, message: str):
+        """Stop the session when the pipeline fails for good"""
+        logger.error(f"Casting pipeline failed: {message}")
+        self.stop_casting(status="error")
+
+    def stop_casting(self, status: str = "stopped"):
+        """Stop the current casting session"""
+        with self._select_lock:
+            if not self.is_casting:
+                return
+            self.is_casting = False
+            stopped = []
+            played = [target for target in self.targets.values() if target.state == TARGET_PLAYING]
+            lost = []
+            for target in self.targets.values():
+                if target.state in (TARGET_LAUNCHING, TARGET_PLAYING):
+                    target.state = TARGET_CONNECTED
+                    stopped.append(target)
+                elif target.state == TARGET_RECONNECTING:
+                    # Its connection is gone, selecting it again makes a new one
+                    target.state = TARGET_FAILED
+                    target.error = "connection lost"
+                    lost.append(target)
+        for target in stopped:
+            try:
+                target.cast.media_controller.stop()
+            except Exception as e:
+                logger.error(f"Error stopping playback on {target.name}: {e}")
+            self._notify_status(TARGET_CONNECTED, target.uuid)
+        for target in lost:
+            self._notify_status(TARGET_FAILED, target.uuid)
+        self._record_streams(played)
+        self._stop_pipeline()
+        self.quality_controller = None
+        self.quality_tier = None
+        self.resource_governor = None
+        self.resource_limit = None
+        self._session_tier = None
+        logger.info("Casting stopped")
+        self._notify_status(status)
+
+    def _record_streams(self, targets: List[CastTarget]):
+        """Remember the tier the session held steady for the receivers that played it"""
+        controller = self.quality_controller
+        tier = controller.sustained_tier if controller is not None else None
+        if tier is None:
+            return
+        for target in targets:
+            self.device_profiles.record_stream(target.uuid, tier)
+        self.device_profiles.save()
+
+    def _stop_pipeline(self):
+        """Stop the pipeline and the stream server"""
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+        self.pipeline_stats = None
+        if self.stream_server is not None:
+            self.stream_server.stop()
+            self.stream_server = None
+
+    def shutdown(self):
+        """Stop casting and close all device connections"""
+        self.stop_casting()
+        if self.connection_pool is not None:
+            self.connection_pool.close()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Colour Conversion and Scaling
+
+import functools
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("UbuntuCast.ColorConvert")
+
+# Output sizes for the resolution names accepted in config.ini
+RESOLUTION_PRESETS: Dict[str, Tuple[int, int]] = {
+    '480p': (854, 480),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '1440p': (2560, 1440),
+    '2160p': (3840, 2160),
+}
+
+# Luma coefficients (Kr, Kb) of the supported colour matrices
+COLOR_MATRICES = {
+    'bt601': (0.299, 0.114),
+    'bt709': (0.2126, 0.0722),
+}
+
+PIXEL_FORMATS = ('i420', 'nv12')
+
+
+def resolution_size(resolution: str) -> Tuple[int, int]:
+    """Translate a resolution preset like "1080p", or "WIDTHxHEIGHT", into an even size"""
+    if resolution in RESOLUTION_PRESETS:
+        return RESOLUTION_PRESETS[resolution]
+    try:
+        width, height = (int(value) for value in resolution.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"Unknown resolution: {resolution}")
+    return width & ~1, height & ~1
+
+
+def fit_size(source: Tuple[int, int], target: Tuple[int, int]) -> Tuple[int, int]:
+    """Fit a source size inside a target size, keeping the aspect ratio and never upscaling
+
+    Both sides are even and at least 2, the smallest frame 4:2:0 chroma can describe.
+    """
+    source_width, source_height = source
+    scale = min(1.0, target[0] / max(source_width, 2), target[1] / max(source_height, 2))
+    return max(2, int(source_width * scale) & ~1), max(2, int(source_height * scale) & ~1)
+
+
+def _yuv_matrix(matrix: str) -> np.ndarray:
+    """Build the 4x3 matrix taking BGRA pixels to limited-range Y, Cb, Cr without offsets"""
+    kr, kb = COLOR_MATRICES[matrix]
+    kg = 1.0 - kr - kb
+    luma = np.array([kb, kg, kr, 0.0])
+    y = luma * 219.0 / 255.0
+    cb = (np.array([1.0, 0.0, 0.0, 0.0]) - luma) * 224.0 / 255.0 / (2.0 * (1.0 - kb))
+    cr = (np.array([0.0, 0.0, 1.0, 0.0]) - luma) * 224.0 / 255.0 / (2.0 * (1.0 - kr))
+    return np.stack([y, cb, cr], axis=1).astype(np.float32)
+
+
+def _blocks(source_length: int, target_length: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Start and length of the source block averaged into each output pixel"""
+    starts = (np.arange(target_length) * source_length) // target_length
+    return starts, np.diff(np.append(starts, source_length))
+
+
+def _taps(source_length: int, target_length: int) -> List[Tuple[np.ndarray, Optional[np.ndarray]]]:
+    """Build the source index and weight of every tap of a 1D area-average downscale
+
+    Tap t reads starts[i] + t for output pixel i, with a weight of 0 where
+    the block is shorter than t + 1 pixels; the weight is None when every
+    block has that pixel.
+    """
+    starts, counts = _blocks(source_length, target_length)
+    taps = []
+    for tap in range(int(counts.max())):
+        indices = np.minimum(starts + tap, source_length - 1)
+        present = counts > tap
+        weights = None if present.all() else present.astype(np.float32)
+        taps.append((indices, weights))
+    return taps
+
+
+class ScalePlan:
+    """Precomputed area-average downscale from one frame size to another
+
+    Every output pixel averages the block of source pixels between integer
+    boundaries, which is exact for integer ratios (1440p to 720p) and a close
+    approximation otherwise (1080p to 720p). Blocks are summed as a few
+    gathered taps per axis, which keeps memory access sequential.
+    """
+
+    def __init__(self, source: Tuple[int, int], target: Tuple[int, int]):
+        source_width, source_height = source
+        target_width, target_height = target
+        self.source = source
+        self.target = target
+        self.row_taps = [(indices, None if weights is None else weights[:, np.newaxis, np.newaxis])
+                         for indices, weights in _taps(source_height, target_height)]
+        self.col_taps = [(indices, None if weights is None else weights[np.newaxis, :, np.newaxis])
+                         for indices, weights in _taps(source_width, target_width)]
+        area = np.outer(_blocks(source_height, target_height)[1], _blocks(source_width, target_width)[1])
+        self.inverse_area = (1.0 / area).astype(np.float32)[:, :, np.newaxis]
+
+
+@functools.lru_cache(maxsize=16)
+def get_scale_plan(source: Tuple[int, int], target: Tuple[int, int]) -> ScalePlan:
+    """Return the cached scale plan between two sizes"""
+    return ScalePlan(source, target)
+
+
+class ColorConverter:
+    """Converts BGRA frames to planar I420 or NV12, scaling them down if needed
+
+    All intermediate and output buffers are preallocated per source size.
+    ``convert()`` returns the same contiguous output buffer every time, laid
+    out exactly as ffmpeg expects for the pixel format, so it can be written
+    to the encoder without copying. The buffer is overwritten by the next
+    call.
+    """
+
+    def __init__(self, output_size: Tuple[int, int], pixel_format: str = 'i420',
+                 matrix: str = 'bt709', fit: bool = True):
+        if pixel_format not in PIXEL_FORMATS:
+            raise ValueError(f"Unsupported pixel format: {pixel_format}")
+        self.max_size = (output_size[0] & ~1, output_size[1] & ~1)
+        self.pixel_format = pixel_format
+        self.fit = fit
+        self._matrix = _yuv_matrix(matrix)
+        self._source_size: Tuple[int, int] = (0, 0)
+        self.output_size: Tuple[int, int] = self.max_size
+        self._allocate(self.max_size, self.max_size)
+
+    @property
+    def frame_size(self) -> int:
+        """Size of one converted frame in bytes"""
+        return self.output.nbytes
+
+    def set_output_size(self, output_size: Tuple[int, int]):
+        """Change the maximum output size, e.g. when the stream resolution adapts"""
+        self.max_size = (output_size[0] & ~1, output_size[1] & ~1)
+        self._source_size = (0, 0)
+
+    def _allocate(self, source: Tuple[int, int], target: Tuple[int, int]):
+        """Allocate the buffers for converting one source size to one output size"""
+        width, height = target
+        self._source_size = source
+        self.output_size = target
+        self._plan = None if source == target else get_scale_plan(source, target)
+        if self._plan is not None:
+            self._row_gather = np.empty((height, source[0], 4), dtype=np.uint8)
+            self._row_sums = np.empty((height, source[0], 4), dtype=np.float32)
+            self._row_tap = np.empty((height, source[0], 4), dtype=np.float32)
+            self._col_tap = np.empty((height, width, 4), dtype=np.float32)
+        self._rgb = np.empty((height, width, 4), dtype=np.float32)
+        self._yuv = np.empty((height, width, 3), dtype=np.float32)
+        self._chroma = np.empty((height // 2, width // 2, 2), dtype=np.float32)
+
+        luma_size = width * height
+        self.output = np.empty(luma_size * 3 // 2, dtype=np.uint8)
+        self.y_plane = self.output[:luma_size].reshape(height, width)
+        if self.pixel_format == 'nv12':
+            self.uv_plane = self.output[luma_size:].reshape(height // 2, width // 2, 2)
+        else:
+            chroma_size = luma_size // 4
+            self.u_plane = self.output[luma_size:luma_size + chroma_size].reshape(height // 2, width // 2)
+            self.v_plane = self.output[luma_size + chroma_size:].reshape(height // 2, width // 2)
+        logger.info(f"Converting {source[0]}x{source[1]} BGRA to "
+                    f"{width}x{height} {self.pixel_format.upper()}")
+
+    def _scale(self, bgra: np.ndarray):
+        """Area-average downscale a BGRA frame into the RGB working buffer"""
+        plan = self._plan
+        for tap, (indices, weights) in enumerate(plan.row_taps):
+            np.take(bgra, indices, axis=0, out=self._row_gather)
+            if tap == 0:
+                np.copyto(self._row_sums, self._row_gather, casting='unsafe')
+                continue
+            if weights is None:
+                np.copyto(self._row_tap, self._row_gather, casting='unsafe')
+            else:
+                np.multiply(self._row_gather, weights, out=self._row_tap)
+            np.add(self._row_sums, self._row_tap, out=self._row_sums)
+
+        for tap, (indices, weights) in enumerate(plan.col_taps):
+            target = self._rgb if tap == 0 else self._col_tap
+            np.take(self._row_sums, indices, axis=1, out=target)
+            if tap == 0:
+                continue
+            if weights is not None:
+                np.multiply(target, weights, out=target)
+            np.add(self._rgb, target, out=self._rgb)
+
+        np.multiply(self._rgb, plan.inverse_area, out=self._rgb)
+
+    def convert(self, bgra: np.ndarray) -> np.ndarray:
+        """Convert one height x width x 4 BGRA frame and return the output buffer"""
+        if bgra.shape[0] < 2 or bgra.shape[1] < 2:
+            # Repeat pixels of a sliver of a window up to the 2x2 minimum
+            bgra = np.repeat(np.repeat(bgra, 2 if bgra.shape[0] < 2 else 1, axis=0),
+                             2 if bgra.shape[1] < 2 else 1, axis=1)
+        source = (bgra.shape[1] & ~1, bgra.shape[0] & ~1)
+        if source != self._source_size:
+            target = fit_size(source, self.max_size) if self.fit else self.max_size
+            self._allocate(source, target)
+        bgra = bgra[:source[1], :source[0]]
+
+        # Scale (area average) or widen to float into the RGB working buffer
+        if self._plan is not None:
+            self._scale(bgra)
+        else:
+            np.copyto(self._rgb, bgra, casting='unsafe')
+
+        # One matrix product gives Y, Cb and Cr for every pixel
+        np.matmul(self._rgb.reshape(-1, 4), self._matrix, out=self._yuv.reshape(-1, 3))
+        np.add(self._yuv[:, :, 0], 16.5, out=self.y_plane, casting='unsafe')
+
+        # Average chroma over 2x2 blocks
+        chroma = self._chroma
+        np.add(self._yuv[0::2, 0::2, 1:], self._yuv[1::2, 0::2, 1:], out=chroma)
+        np.add(chroma, self._yuv[0::2, 1::2, 1:], out=chroma)
+        np.add(chroma, self._yuv[1::2, 1::2, 1:], out=chroma)
+        np.multiply(chroma, 0.25, out=chroma)
+        np.add(chroma, 128.5, out=chroma)
+        if self.pixel_format == 'nv12':
+            np.copyto(self.uv_plane, chroma, casting='unsafe')
+        else:
+            np.copyto(self.u_plane, chroma[:, :, 0], casting='unsafe')
+            np.copyto(self.v_plane, chroma[:, :, 1], casting='unsafe')
+        return self.output
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Cast Device Connection Pool
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional
+
+from src.device_discovery import DeviceDelta, DEVICE_ADDED, DEVICE_UPDATED
+
+logger = logging.getLogger("UbuntuCast.ConnectionPool")
+
+
+class PooledConnection:
+    """A connected cast device held by the pool"""
+
+    def __init__(self, uuid: str, cast: Any):
+        self.uuid = uuid
+        self.cast = cast
+        self.last_used = time.monotonic()
+        self.in_use = False
+
+
+class ConnectionPool:
+    """Connects to cast devices on worker threads and keeps idle connections warm
+
+    Connections are established asynchronously with a timeout and delivered
+    through a Future or a callback. Idle connections are kept alive with
+    heartbeats and closed once they have been unused for ``idle_timeout``
+    seconds. The preferred device is connected as soon as it is discovered,
+    so selecting it does not have to wait for the socket and TLS handshake.
+    """
+
+    def __init__(self, device_discovery, connect_timeout: float = 10.0,
+                 idle_timeout: float = 300.0, heartbeat_interval: float = 10.0,
+                 max_workers: int = 2):
+        self.device_discovery = device_discovery
+        self.connect_timeout = connect_timeout
+        self.idle_timeout = idle_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.preferred_device = ""
+        self._connections: Dict[str, PooledConnection] = {}
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="UbuntuCastConnect")
+        self._stop_event = threading.Event()
+        self._janitor_thread = threading.Thread(target=self._maintain_connections)
+        self._janitor_thread.daemon = True
+        self._janitor_thread.start()
+
+    def set_preferred_device(self, preferred_device: str):
+        """Pre-connect to the given device (uuid or friendly name) whenever it is discovered"""
+        self.preferred_device = preferred_device.strip()
+        if not self.preferred_device:
+            return
+        self.device_discovery.register_delta_callback(self._on_device_deltas)
+
+        # The device may already be known, e.g. restored from the device cache
+        for uuid, device in self.device_discovery.get_devices().items():
+            if self._is_preferred(device):
+                self.prewarm(uuid)
+
+    def get(self, uuid: str) -> Optional[Any]:
+        """Return an already connected cast object for a device, if there is one"""
+        with self._lock:
+            connection = self._connections.get(uuid)
+            if connection is None:
+                return None
+            connection.last_used = time.monotonic()
+            return connection.cast
+
+    def connect(self, uuid: str, callback: Optional[Callable[[Optional[Any]], None]] = None) -> Future:
+        """Connect to a device on a worker thread
+
+        Returns a Future resolving to the connected cast object, or None if
+        the connection failed. If a callback is given it is called with the
+        same value from the worker thread.
+        """
+        with self._lock:
+            connection = self._connections.get(uuid)
+            if connection is not None:
+                connection.last_used = time.monotonic()
+                future = Future()
+                future.set_result(connection.cast)
+            elif uuid in self._pending:
+                future = self._pending[uuid]
+            else:
+                future = self._executor.submit(self._connect, uuid)
+                self._pending[uuid] = future
+
+        if callback is not None:
+            future.add_done_callback(lambda f: self._run_callback(callback, f))
+        return future
+
+    def prewarm(self, uuid: str):
+        """Start connecting to a device in the background without waiting for it"""
+        logger.info(f"Pre-connecting to device {uuid}")
+        self.connect(uuid)
+
+    def acquire(self, uuid: str):
+        """Mark a connection as in use so it is not evicted while idle"""
+        with self._lock:
+            connection = self._connections.get(uuid)
+            if connection is not None:
+                connection.in_use = True
+                connection.last_used = time.monotonic()
+
+    def release(self, uuid: str):
+        """Mark a connection as no longer in use"""
+        with self._lock:
+            connection = self._connections.get(uuid)
+            if connection is not None:
+                connection.in_use = False
+                connection.last_used = time.monotonic()
+
+    def discard(self, uuid: str):
+        """Close and forget the connection to a device"""
+        with self._lock:
+            connection = self._connections.pop(uuid, None)
+        if connection is not None:
+            self._disconnect(connection)
+        # A disconnected cast object cannot be reused, the next connect needs a new one
+        self.device_discovery.forget_cast(uuid)
+
+    def close(self):
+        """Close all connections and stop the worker threads"""
+        self._stop_event.set()
+        self.device_discovery.unregister_delta_callback(self._on_device_deltas)
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for connection in connections:
+            self._disconnect(connection)
+
+    def _connect(self, uuid: str) -> Optional[Any]:
+        """Worker thread body that establishes a connection"""
+        try:
+            cast = self.device_discovery.get_cast(uuid)
+            if cast is None:
+                return None
+
+            started = time.monotonic()
+            cast.wait(timeout=self.connect_timeout)
+            if not cast.socket_client.is_connected:
+                logger.error(f"Timed out connecting to device {uuid}")
+                # Stop its socket thread retrying in the background; the next attempt needs a new object
+                self._disconnect(PooledConnection(uuid, cast))
+                self.device_discovery.forget_cast(uuid)
+                return None
+
+            logger.info(f"Connected to {cast.name} in {time.monotonic() - started:.2f}s")
+            with self._lock:
+                self._connections[uuid] = PooledConnection(uuid, cast)
+            self.device_discovery.cache.touch(uuid)
+            return cast
+        except Exception as e:
+            logger.error(f"Error connecting to device {uuid}: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._pending.pop(uuid, None)
+
+    def _run_callback(self, callback: Callable[[Optional[Any]], None], future: Future):
+        """Deliver a connection result to a callback"""
+        try:
+            callback(future.result())
+        except Exception as e:
+            logger.error(f"Error in connection callback: {e}")
+
+    def _is_preferred(self, device: Dict[str, Any]) -> bool:
+        """Check whether a device matches the configured preferred device"""
+        return self.preferred_device in (device.get('uuid'), device.get('name'))
+
+    def _on_device_deltas(self, deltas: List[DeviceDelta]):
+        """Pre-connect to the preferred device as soon as it is discovered"""
+        for delta in deltas:
+            if delta.kind not in (DEVICE_ADDED, DEVICE_UPDATED) or not self._is_preferred(delta.device):
+                continue
+            if delta.kind == DEVICE_UPDATED and not {'address', 'port'} & set(delta.changed):
+                continue
+            if delta.kind == DEVICE_UPDATED:
+                self.discard(delta.uuid)
+            self.prewarm(delta.uuid)
+
+    def _maintain_connections(self):
+        """Background thread that sends heartbeats and evicts idle connections"""
+        while not self._stop_event.wait(timeout=self.heartbeat_interval):
+            now = time.monotonic()
+            with self._lock:
+                connections = list(self._connections.values())
+
+            for connection in connections:
+                if not connection.in_use and now - connection.last_used > self.idle_timeout:
+                    logger.info(f"Closing idle connection to device {connection.uuid}")
+                    self.discard(connection.uuid)
+                    continue
+                try:
+                    if not connection.cast.socket_client.is_connected:
+                        raise ConnectionError("socket closed")
+                    connection.cast.socket_client.heartbeat_controller.ping()
+                except Exception as e:
+                    logger.warning(f"Dropping dead connection to device {connection.uuid}: {e}")
+                    # Disconnecting stops its socket thread retrying in the background
+                    self.discard(connection.uuid)
+
+    def _disconnect(self, connection: PooledConnection):
+        """Disconnect a cast object, ignoring errors"""
+        try:
+            connection.cast.disconnect(timeout=self.connect_timeout)
+        except Exception as e:
+            logger.error(f"Error disconnecting from device {connection.uuid}: {e}")
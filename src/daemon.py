@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Headless Casting Daemon and Client
+
+import itertools
+import json
+import logging
+import os
+import queue
+import signal
+import socket
+import socketserver
+import subprocess
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger("UbuntuCast.Daemon")
+
+PROTOCOL_VERSION = 1
+MAX_MESSAGE = 1024 * 1024  # Longest request or event line accepted
+CLIENT_QUEUE_SIZE = 256  # Messages buffered for a slow client before it is dropped
+
+
+def default_socket_path() -> str:
+    """The control socket in the user's runtime directory"""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or os.path.expanduser("~/.local/share/ubuntucast")
+    return os.path.join(runtime_dir, "ubuntucast.sock")
+
+
+def socket_path_from_config(config) -> str:
+    return config.get('ADVANCED', 'daemon_socket', fallback='') or default_socket_path()
+
+
+class RemoteDeviceDelta(NamedTuple):
+    """A device table change received from the daemon, shaped like DeviceDelta"""
+    kind: str
+    uuid: str
+    device: Dict[str, Any]
+    changed: Tuple[str, ...] = ()
+
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return json.dumps(message, separators=(',', ':')).encode() + b'\n'
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    """One client connection: newline-delimited JSON requests in, responses and events out
+
+    Everything sent to the client goes through a bounded queue drained by
+    a writer thread, so a client that stops reading cannot block the cast
+    manager's callbacks; it is disconnected once its queue fills up.
+    """
+    server: 'CastDaemon'
+
+    def setup(self):
+        super().setup()
+        self.outbox: 'queue.Queue[Optional[bytes]]' = queue.Queue(CLIENT_QUEUE_SIZE)
+        self.subscribed = False
+        self.closed = False
+        self._writer = threading.Thread(target=self._write_messages, name="UbuntuCastDaemonWriter")
+        self._writer.daemon = True
+        self._writer.start()
+
+    def handle(self):
+        self.server.add_client(self)
+        try:
+            while not self.closed:
+                line = self.rfile.readline(MAX_MESSAGE)
+                if not line:
+                    return
+                try:
+                    request = json.loads(line)
+                    method = request['method']
+                except (ValueError, KeyError, TypeError):
+                    self.send({'error': "malformed request"})
+                    continue
+                response = {'id': request.get('id')}
+                try:
+                    response['result'] = self.server.dispatch(self, method, request.get('params') or {})
+                except Exception as e:
+                    response['error'] = str(e)
+                self.send(response)
+        except OSError:
+            pass
+        finally:
+            self.server.remove_client(self)
+
+    def finish(self):
+        self.closed = True
+        try:
+            self.outbox.put_nowait(None)
+        except queue.Full:
+            pass
+        self._writer.join(timeout=1)
+        super().finish()
+
+    def send(self, message: Dict[str, Any]):
+        """Queue a message for the client, dropping the client if it has fallen behind"""
+        if self.closed:
+            return
+        try:
+            self.outbox.put_nowait(_encode(message))
+        except queue.Full:
+            logger.warning("Dropping a control client that stopped reading")
+            self.closed = True
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _write_messages(self):
+        while True:
+            data = self.outbox.get()
+            if data is None:
+                return
+            try:
+                self.wfile.write(data)
+                self.wfile.flush()
+            except OSError:
+                self.closed = True
+                return
+
+
+class CastDaemon(socketserver.ThreadingUnixStreamServer):
+    """Runs discovery and casting without a GUI, controlled over a Unix socket
+
+    Requests are JSON objects on one line, ``{"id": 1, "method": "start",
+    "params": {...}}``, answered with ``{"id": 1, "result": ...}`` or
+    ``{"id": 1, "error": "..."}``. After ``subscribe`` the client also
+    receives events: ``{"event": "status", "status": ..., "state": ...}``
+    for session statuses, ``{"event": "device_status", ...}`` for receiver
+    states and ``{"event": "devices", "deltas": [...]}`` for device table
+    changes.
+    """
+    daemon_threads = True
+
+    def __init__(self, config, socket_path: Optional[str] = None):
+        self.config = config
+        self.socket_path = socket_path or socket_path_from_config(config)
+        self._claim_socket_path()
+        super().__init__(self.socket_path, _ControlHandler)
+        os.chmod(self.socket_path, 0o600)
+
+        # Imported here so that clients of the daemon do not load the casting stack
+        from src.cast_manager import CastManager
+        from src.device_discovery import DeviceDiscovery
+        self.cast_manager = CastManager(config)
+        self.device_discovery = DeviceDiscovery(self.cast_manager)
+        self.cast_manager.set_device_discovery(self.device_discovery)
+        self.cast_manager.register_status_callback(self._on_status)
+        self.device_discovery.register_delta_callback(self._on_deltas)
+
+        self._clients: List[_ControlHandler] = []
+        self._clients_lock = threading.Lock()
+        self._device_callbacks: Dict[str, Callable[[str], None]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._methods: Dict[str, Callable[..., Any]] = {
+            'hello': lambda client: {'version': PROTOCOL_VERSION, 'pid': os.getpid()},
+            'status': lambda client: self._state(),
+            'list_devices': lambda client: self.device_discovery.get_devices(),
+            'subscribe': self._subscribe,
+            'select_device': self._select_device,
+            'select_devices': self._select_devices,
+            'start': self._start,
+            'stop': lambda client: self.cast_manager.stop_casting(),
+            'pipeline_stats': lambda client: self.cast_manager.get_pipeline_stats(),
+            'refresh_devices': self._refresh_devices,
+            'shutdown': lambda client: self._stopped.set(),
+        }
+
+    def _claim_socket_path(self):
+        """Remove a socket left behind by a daemon that died, refusing if one is still running"""
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        if not os.path.exists(self.socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except OSError:
+            os.unlink(self.socket_path)
+            return
+        finally:
+            probe.close()
+        raise RuntimeError(f"A daemon is already listening on {self.socket_path}")
+
+    def start(self):
+        """Serve the control socket and start discovering devices"""
+        self._thread = threading.Thread(target=self.serve_forever, name="UbuntuCastDaemon")
+        self._thread.daemon = True
+        self._thread.start()
+        self.device_discovery.start_discovery()
+        logger.info(f"Daemon listening on {self.socket_path}")
+
+    def run(self) -> int:
+        """Run until a client asks for shutdown or the process gets SIGTERM or SIGINT"""
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: self._stopped.set())
+        self.start()
+        self._stopped.wait()
+        self.stop()
+        return 0
+
+    def stop(self):
+        """Stop casting and discovery and close the control socket"""
+        self.cast_manager.shutdown()
+        self.device_discovery.stop_discovery()
+        self.shutdown()
+        self.server_close()
+        with self._clients_lock:
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+        from src.metrics import metrics
+        metrics.shutdown()
+        logger.info("Daemon stopped")
+
+    def add_client(self, client: _ControlHandler):
+        with self._clients_lock:
+            self._clients.append(client)
+
+    def remove_client(self, client: _ControlHandler):
+        with self._clients_lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    def dispatch(self, client: _ControlHandler, method: str, params: Dict[str, Any]) -> Any:
+        handler = self._methods.get(method)
+        if handler is None:
+            raise ValueError(f"Unknown method: {method}")
+        return handler(client, **params)
+
+    def _broadcast(self, message: Dict[str, Any]):
+        with self._clients_lock:
+            clients = [client for client in self._clients if client.subscribed]
+        for client in clients:
+            client.send(message)
+
+    def _state(self) -> Dict[str, Any]:
+        """What clients need to draw the casting state"""
+        manager = self.cast_manager
+        tier = manager.quality_tier
+        return {
+            'is_casting': manager.is_casting,
+            'current_device_uuid': manager.current_device_uuid,
+            'current_device_name': manager.current_device_name,
+            'quality_tier': str(tier) if tier is not None else None,
+            'resource_limit': manager.resource_limit,
+            'targets': manager.get_target_states(),
+        }
+
+    def _subscribe(self, client: _ControlHandler) -> Dict[str, Any]:
+        client.subscribed = True
+        return {'state': self._state(), 'devices': self.device_discovery.get_devices()}
+
+    def _select_device(self, client: _ControlHandler, uuid: str) -> bool:
+        return self._select_devices(client, [uuid])
+
+    def _select_devices(self, client: _ControlHandler, uuids: List[str]) -> bool:
+        """Select receivers and wait for the connections, like CastManager.select_devices"""
+        for uuid in uuids:
+            if uuid not in self._device_callbacks:
+                callback = self._device_callbacks[uuid] = (
+                    lambda status, uuid=uuid: self._broadcast({'event': 'device_status', 'uuid': uuid,
+                                                              'status': status}))
+                self.cast_manager.register_status_callback(callback, uuid)
+        return self.cast_manager.select_devices(uuids)
+
+    def _start(self, client: _ControlHandler, mode: str = "screen", audio: Optional[bool] = None,
+               window: Optional[int] = None) -> bool:
+        self.cast_manager.set_cast_mode(mode, window)
+        if audio is not None:
+            self.cast_manager.set_audio_enabled(audio)
+        return self.cast_manager.start_casting()
+
+    def _refresh_devices(self, client: _ControlHandler):
+        self.device_discovery.stop_discovery()
+        self.device_discovery.start_discovery()
+
+    def _on_status(self, status: str):
+        self._broadcast({'event': 'status', 'status': status, 'state': self._state()})
+
+    def _on_deltas(self, deltas):
+        self._broadcast({'event': 'devices', 'deltas': [
+            {'kind': delta.kind, 'uuid': delta.uuid, 'device': delta.device, 'changed': list(delta.changed)}
+            for delta in deltas
+        ]})
+
+
+class DaemonClient:
+    """Talks to a CastDaemon, offering the part of the CastManager and
+    DeviceDiscovery interfaces that the tray and main window use
+
+    The client subscribes to the daemon's events and keeps a local copy of
+    the casting state and device table, so reading them never waits on
+    the socket. Status callbacks are called from the client's reader
+    thread, as CastManager calls them from its worker threads. If the
+    connection is lost the callbacks receive "disconnected".
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.cast_mode = "screen"
+        self.cast_window: Optional[int] = None
+        self.audio_enabled: Optional[bool] = None
+        self.status_callbacks: List[Callable[[str], None]] = []
+        self.delta_callbacks: List[Callable[[List[RemoteDeviceDelta]], None]] = []
+        self._state: Dict[str, Any] = {}
+        self._devices: Dict[str, Dict[str, Any]] = {}
+        self._pending: Dict[int, 'queue.Queue'] = {}
+        self._callbacks: Dict[int, Callable[[Any], None]] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._daemon_process: Optional[subprocess.Popen] = None
+        self.connected = False
+
+    def connect(self):
+        """Connect and subscribe to the daemon's events"""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        self._sock = sock
+        self.connected = True
+        reader = threading.Thread(target=self._read_messages, args=(sock.makefile('rb'),),
+                                  name="UbuntuCastDaemonClient")
+        reader.daemon = True
+        reader.start()
+
+        # Applied on the reader thread, so that events sent after the snapshot are applied after it too
+        applied: 'queue.Queue[bool]' = queue.Queue(1)
+
+        def on_subscribed(snapshot):
+            if snapshot is not None:
+                with self._lock:
+                    self._state = snapshot['state']
+                    self._devices = snapshot['devices']
+            applied.put(snapshot is not None)
+
+        request_id = self.call_async('subscribe', on_subscribed)
+        try:
+            subscribed = applied.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._callbacks.pop(request_id, None)
+            raise TimeoutError("The daemon did not answer subscribe")
+        if not subscribed:
+            raise RuntimeError("The daemon refused the subscription")
+
+    def connect_or_spawn(self, command: List[str], startup_timeout: float = 30.0):
+        """Connect to a running daemon, or start one with ``command`` and connect to it"""
+        try:
+            self.connect()
+            return
+        except OSError:
+            pass
+        logger.info("Starting the casting daemon")
+        self._daemon_process = subprocess.Popen(command, start_new_session=True)
+        deadline = time.monotonic() + startup_timeout
+        while True:
+            try:
+                self.connect()
+                return
+            except OSError:
+                if self._daemon_process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("The casting daemon did not start")
+                time.sleep(0.05)
+
+    def close(self):
+        self.connected = False
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+            self._sock = None
+
+    def call(self, method: str, **params) -> Any:
+        """Send a request and wait for its result"""
+        request_id = next(self._ids)
+        reply: 'queue.Queue' = queue.Queue(1)
+        with self._lock:
+            self._pending[request_id] = reply
+        self._send({'id': request_id, 'method': method, 'params': params})
+        try:
+            response = reply.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"The daemon did not answer {method}")
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response.get('result')
+
+    def call_async(self, method: str, callback: Callable[[Any], None], **params) -> int:
+        """Send a request and hand its result, or None on error, to a callback on the reader thread"""
+        request_id = next(self._ids)
+        with self._lock:
+            self._callbacks[request_id] = callback
+        self._send({'id': request_id, 'method': method, 'params': params})
+        return request_id
+
+    def _send(self, message: Dict[str, Any]):
+        sock = self._sock
+        if sock is None:
+            raise ConnectionError("Not connected to the casting daemon")
+        with self._send_lock:
+            sock.sendall(_encode(message))
+
+    def _read_messages(self, stream):
+        try:
+            for line in stream:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    logger.warning("Ignoring a malformed message from the daemon")
+                    continue
+                if 'event' in message:
+                    self._handle_event(message)
+                    continue
+                with self._lock:
+                    reply = self._pending.get(message.get('id'))
+                    callback = self._callbacks.pop(message.get('id'), None)
+                if reply is not None:
+                    reply.put(message)
+                elif callback is not None:
+                    self._run_callback(callback, message.get('result') if 'error' not in message else None)
+        except OSError:
+            pass
+        if self.connected:
+            logger.error("Lost the connection to the casting daemon")
+            self.connected = False
+            with self._lock:
+                self._state = dict(self._state, is_casting=False)
+            self._notify_status("disconnected")
+
+    def _handle_event(self, message: Dict[str, Any]):
+        event = message['event']
+        if event == 'status':
+            with self._lock:
+                self._state = message['state']
+            self._notify_status(message['status'])
+        elif event == 'devices':
+            deltas = [RemoteDeviceDelta(delta['kind'], delta['uuid'], delta['device'], tuple(delta['changed']))
+                      for delta in message['deltas']]
+            with self._lock:
+                for delta in deltas:
+                    if delta.kind == 'removed':
+                        self._devices.pop(delta.uuid, None)
+                    else:
+                        self._devices[delta.uuid] = delta.device
+            for callback in list(self.delta_callbacks):
+                self._run_callback(callback, deltas)
+
+    def _run_callback(self, callback: Callable, value: Any):
+        try:
+            callback(value)
+        except Exception as e:
+            logger.error(f"Error in daemon client callback: {e}")
+
+    def _notify_status(self, status: str):
+        for callback in list(self.status_callbacks):
+            self._run_callback(callback, status)
+
+    # CastManager interface
+
+    @property
+    def is_casting(self) -> bool:
+        return bool(self._state.get('is_casting'))
+
+    @property
+    def current_device_uuid(self) -> Optional[str]:
+        return self._state.get('current_device_uuid')
+
+    @property
+    def current_device(self) -> Optional[str]:
+        """The first active receiver; only its truth value is meaningful here"""
+        return self.current_device_uuid
+
+    @property
+    def current_device_name(self) -> str:
+        return self._state.get('current_device_name') or ""
+
+    @property
+    def quality_tier(self) -> Optional[str]:
+        return self._state.get('quality_tier')
+
+    @property
+    def resource_limit(self) -> Optional[str]:
+        return self._state.get('resource_limit')
+
+    def get_target_states(self) -> Dict[str, str]:
+        return dict(self._state.get('targets') or {})
+
+    def register_status_callback(self, callback: Callable[[str], None]):
+        if callback not in self.status_callbacks:
+            self.status_callbacks.append(callback)
+
+    def unregister_status_callback(self, callback: Callable):
+        if callback in self.status_callbacks:
+            self.status_callbacks.remove(callback)
+
+    def select_device(self, device_uuid: str, callback: Optional[Callable[[bool], None]] = None) -> bool:
+        return self.select_devices([device_uuid], callback)
+
+    def select_devices(self, device_uuids: List[str],
+                       callback: Optional[Callable[[bool], None]] = None) -> bool:
+        """Select receivers; with a callback the result arrives there, as with CastManager"""
+        try:
+            if callback is None:
+                selected = bool(self.call('select_devices', uuids=device_uuids))
+                self._state = self.call('status')
+                return selected
+
+            def on_selected(result):
+                try:
+                    self._state = self.call('status')
+                except (OSError, RuntimeError, TimeoutError):
+                    pass
+                callback(bool(result))
+
+            # Answered on the reader thread, so the state refresh must not block it
+            self.call_async('select_devices',
+                            lambda result: threading.Thread(target=on_selected, args=(result,), daemon=True).start(),
+                            uuids=device_uuids)
+            return True
+        except (OSError, RuntimeError, TimeoutError) as e:
+            logger.error(f"Cannot select device: {e}")
+            return False
+
+    def set_cast_mode(self, mode: str, window_id: Optional[int] = None):
+        if mode not in ("screen", "window"):
+            raise ValueError(f"Unknown cast mode: {mode}")
+        self.cast_mode = mode
+        self.cast_window = window_id if mode == "window" else None
+
+    def set_audio_enabled(self, enabled: bool):
+        self.audio_enabled = enabled
+
+    def start_casting(self) -> bool:
+        try:
+            return bool(self.call('start', mode=self.cast_mode, audio=self.audio_enabled, window=self.cast_window))
+        except (OSError, RuntimeError, TimeoutError) as e:
+            logger.error(f"Failed to start casting: {e}")
+            return False
+
+    def stop_casting(self):
+        try:
+            self.call('stop')
+        except (OSError, RuntimeError, TimeoutError) as e:
+            logger.error(f"Failed to stop casting: {e}")
+
+    def get_pipeline_stats(self) -> Optional[dict]:
+        """Stage health, queue depths and audio sync of the daemon's pipeline"""
+        try:
+            return self.call('pipeline_stats')
+        except (OSError, RuntimeError, TimeoutError) as e:
+            logger.error(f"Failed to get pipeline stats: {e}")
+            return None
+
+    def shutdown(self):
+        """Stop casting, and stop the daemon too if this client started it"""
+        if self._daemon_process is not None:
+            try:
+                self.call('shutdown')
+            except (OSError, RuntimeError, TimeoutError) as e:
+                logger.error(f"Failed to stop the casting daemon: {e}")
+        else:
+            self.stop_casting()
+        self.close()
+
+    # DeviceDiscovery interface
+
+    def get_devices(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return dict(self._devices)
+
+    def register_delta_callback(self, callback: Callable[[List[RemoteDeviceDelta]], None]):
+        """Register a callback for device table changes, called on the reader thread"""
+        if callback not in self.delta_callbacks:
+            self.delta_callbacks.append(callback)
+
+    def unregister_delta_callback(self, callback: Callable):
+        if callback in self.delta_callbacks:
+            self.delta_callbacks.remove(callback)
+
+    def refresh_devices(self):
+        try:
+            self.call('refresh_devices')
+        except (OSError, RuntimeError, TimeoutError) as e:
+            logger.error(f"Failed to refresh devices: {e}")
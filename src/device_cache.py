@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Persistent Device Cache
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Any, List
+
+logger = logging.getLogger("UbuntuCast.DeviceCache")
+
+DEFAULT_CACHE_PATH = os.path.expanduser("~/.local/share/ubuntucast/devices.json")
+DEFAULT_TTL = 7 * 24 * 60 * 60  # One week
+DEFAULT_MAX_ENTRIES = 64
+
+# Fields persisted for every device
+CACHED_FIELDS = ('uuid', 'name', 'model_name', 'cast_type', 'address', 'port')
+
+
+class DeviceCache:
+    """On-disk cache of previously discovered cast devices
+
+    Entries are keyed by uuid and carry two timestamps: ``last_seen`` (the
+    last time the device was confirmed on the network) drives TTL expiry and
+    ``last_used`` drives LRU eviction once the cache is over its size cap.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl: float = DEFAULT_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Load the cache from disk and return the entries that are still fresh"""
+        try:
+            with open(self.path, 'r') as cache_file:
+                data = json.load(cache_file)
+        except FileNotFoundError:
+            data = {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable device cache {self.path}: {e}")
+            data = {}
+
+        with self._lock:
+            self._entries = {}
+            for uuid, entry in data.get('devices', {}).items():
+                if isinstance(entry, dict) and all(field in entry for field in CACHED_FIELDS):
+                    self._entries[uuid] = entry
+        self.evict()
+        return self.entries()
+
+    def save(self):
+        """Write the cache to disk if it has changed since the last save"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {'version': 1, 'devices': dict(self._entries)}
+            self._dirty = False
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(data, cache_file, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Error saving device cache: {e}")
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        """Return a copy of all cached entries"""
+        with self._lock:
+            return {uuid: dict(entry) for uuid, entry in self._entries.items()}
+
+    def update(self, device: Dict[str, Any]):
+        """Record a device that has just been seen on the network"""
+        now = time.time()
+        entry = {field: device.get(field) for field in CACHED_FIELDS}
+        with self._lock:
+            previous = self._entries.get(entry['uuid'], {})
+            entry['last_seen'] = now
+            entry['last_used'] = previous.get('last_used', now)
+            self._entries[entry['uuid']] = entry
+            self._dirty = True
+
+    def touch(self, uuid: str):
+        """Mark a device as recently used, protecting it from LRU eviction"""
+        with self._lock:
+            if uuid in self._entries:
+                self._entries[uuid]['last_used'] = time.time()
+                self._dirty = True
+
+    def remove(self, uuid: str):
+        """Drop a device from the cache"""
+        with self._lock:
+            if self._entries.pop(uuid, None) is not None:
+                self._dirty = True
+
+    def evict(self) -> List[str]:
+        """Evict expired entries, then least recently used ones over the size cap"""
+        now = time.time()
+        evicted = []
+        with self._lock:
+            for uuid, entry in list(self._entries.items()):
+                if now - entry.get('last_seen', 0) > self.ttl:
+                    del self._entries[uuid]
+                    evicted.append(uuid)
+
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                by_use = sorted(self._entries, key=lambda u: self._entries[u].get('last_used', 0))
+                for uuid in by_use[:overflow]:
+                    del self._entries[uuid]
+                    evicted.append(uuid)
+
+            if evicted:
+                self._dirty = True
+
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} stale devices from cache")
+        return evicted
@@ -3,9 +3,12 @@
 # Device Discovery Module
 
 import logging
+import socket
 import threading
 import time
-from typing import List, Dict, Callable, Optional, Any, Set, Tuple, Union
+from concurrent.futures import Future
+from typing import List, Dict, Callable, Optional, Any, NamedTuple, Set, Tuple
+from uuid import UUID
 
 # Handle imports with better error handling for IDE resolution
 try:
@@ -49,53 +52,164 @@ except ImportError:
         def close(self):
             pass
 
+from src.device_cache import DeviceCache, DEFAULT_TTL, DEFAULT_MAX_ENTRIES
+from src.unicast_probe import UnicastProber, expand_hosts
+
 logger = logging.getLogger("UbuntuCast.DeviceDiscovery")
 
+# Kinds of device table changes
+DEVICE_ADDED = 'added'
+DEVICE_REMOVED = 'removed'
+DEVICE_UPDATED = 'updated'
+
+# Fields compared when deciding whether a device has changed
+DEVICE_FIELDS = ('name', 'model_name', 'uuid', 'cast_type', 'address', 'port', 'status')
+
+
+class DeviceDelta(NamedTuple):
+    """A single change to the device table"""
+    kind: str  # DEVICE_ADDED, DEVICE_REMOVED or DEVICE_UPDATED
+    uuid: str
+    device: Dict[str, Any]  # New device state, or the last known state for removals
+    changed: Tuple[str, ...] = ()  # Fields that changed, for updates
+
+
 class DeviceDiscovery:
     """Handles discovery of Google Cast compatible devices on the network"""
     
-    def __init__(self, cast_manager):
+    def __init__(self, cast_manager, cache: Optional[DeviceCache] = None):
         self.cast_manager = cast_manager
-        self.devices: Dict[str, Dict[str, Any]] = {}  # Dictionary to store discovered devices
+        self.devices: Dict[str, Dict[str, Any]] = {}  # Device table indexed by uuid
         self.browser: Optional[CastBrowser] = None
         self.listener: Optional[SimpleCastListener] = None
         self.zeroconf: Optional[Zeroconf] = None
-        self._discovery_thread: Optional[threading.Thread] = None
+        self._revalidate_thread: Optional[threading.Thread] = None
+        self._probe_thread: Optional[threading.Thread] = None
+        self._probed_devices: Set[str] = set()  # Devices found by unicast probing rather than mDNS
         self._stop_discovery = threading.Event()
+        self._lock = threading.RLock()
         self.discovery_callbacks: List[Callable[[Dict[str, Dict[str, Any]]], None]] = []  # Callbacks to be called when devices are discovered
-        self._known_devices: Dict[str, pychromecast.Chromecast] = {}
+        self.delta_callbacks: List[Callable[[List[DeviceDelta]], None]] = []  # Callbacks to be called with device table changes
+        self._known_devices: Dict[str, Any] = {}  # Chromecast objects created on connect
+        
+        config = getattr(cast_manager, 'config', None)
+        self.discovery_timeout = 5.0
+        self.interfaces: List[str] = []  # Addresses of the interfaces to browse on, empty for all
+        self.unicast_hosts: List[str] = []  # Hosts probed directly, for networks that filter multicast
+        self.unicast_probe_interval = 300.0
+        probe_workers = 16
+        if config is not None:
+            self.discovery_timeout = config.getfloat('ADVANCED', 'discovery_timeout', fallback=5.0)
+            self.interfaces = [address.strip() for address in
+                               config.get('ADVANCED', 'discovery_interfaces', fallback='').split(',')
+                               if address.strip()]
+            self.unicast_hosts = expand_hosts(config.get('ADVANCED', 'unicast_hosts', fallback=''))
+            self.unicast_probe_interval = config.getfloat('ADVANCED', 'unicast_probe_interval', fallback=300.0)
+            probe_workers = config.getint('ADVANCED', 'unicast_probe_workers', fallback=16)
+        self.prober = UnicastProber(timeout=self.discovery_timeout, max_workers=probe_workers)
+        
+        # Startup timing, used to measure how long it takes to list the first device
+        self._started_at = time.monotonic()
+        self.time_to_first_device: Optional[float] = None
+        
+        # Seed the device list from the persistent cache so the menu is populated immediately
+        if cache is None:
+            ttl = DEFAULT_TTL
+            max_entries = DEFAULT_MAX_ENTRIES
+            if config is not None:
+                ttl = config.getfloat('ADVANCED', 'device_cache_ttl', fallback=DEFAULT_TTL)
+                max_entries = config.getint('ADVANCED', 'device_cache_size', fallback=DEFAULT_MAX_ENTRIES)
+            cache = DeviceCache(ttl=ttl, max_entries=max_entries)
+        self.cache = cache
+        self._load_cached_devices()
+        
+    def _load_cached_devices(self):
+        """Populate the device list with unverified entries from the cache"""
+        for uuid, entry in self.cache.load().items():
+            self.devices[uuid] = {
+                'name': entry['name'],
+                'model_name': entry['model_name'],
+                'uuid': uuid,
+                'cast_type': entry['cast_type'],
+                'address': entry['address'],
+                'port': entry['port'],
+                'status': 'unverified'
+            }
+        if self.devices:
+            logger.info(f"Loaded {len(self.devices)} cast devices from cache")
+            self._mark_first_device()
+    
+    def _mark_first_device(self):
+        """Record the time from startup until the first device could be listed"""
+        if self.time_to_first_device is None:
+            self.time_to_first_device = time.monotonic() - self._started_at
+            logger.info(f"First device listed {self.time_to_first_device * 1000:.1f} ms after startup")
         
     def start_discovery(self):
         """Start the device discovery process"""
-        if self._discovery_thread and self._discovery_thread.is_alive():
+        if self.browser is not None:
             logger.info("Discovery is already running")
             return
-            
+        
         self._stop_discovery.clear()
-        self._discovery_thread = threading.Thread(target=self._discover_devices)
-        self._discovery_thread.daemon = True
-        self._discovery_thread.start()
+        
+        # Probe configured and cached addresses directly, in case multicast is filtered
+        if not (self._probe_thread and self._probe_thread.is_alive()):
+            self._probe_thread = threading.Thread(target=self._probe_unicast_hosts)
+            self._probe_thread.daemon = True
+            self._probe_thread.start()
+        
+        if not PYCHROMECAST_AVAILABLE or not ZEROCONF_AVAILABLE:
+            logger.error("Cannot discover devices: pychromecast or zeroconf package is missing")
+            return
+            
+        try:
+            # Initialize zeroconf for discovery
+            self.zeroconf = Zeroconf(interfaces=self.interfaces) if self.interfaces else Zeroconf()
+            
+            # The browser reports add/remove/update events from the zeroconf thread
+            self.listener = SimpleCastListener(
+                add_callback=self._cast_added_callback,
+                remove_callback=self._cast_removed_callback,
+                update_callback=self._cast_updated_callback
+            )
+            self.browser = CastBrowser(self.listener, self.zeroconf)
+            self.browser.start_discovery()
+        except Exception as e:
+            logger.error(f"Fatal error in device discovery: {e}")
+            self.stop_discovery()
+            return
+        
+        # Revalidate cached entries in the background while mDNS discovery runs
+        if not (self._revalidate_thread and self._revalidate_thread.is_alive()):
+            self._revalidate_thread = threading.Thread(target=self._revalidate_cached_devices)
+            self._revalidate_thread.daemon = True
+            self._revalidate_thread.start()
         logger.info("Device discovery started")
         
     def stop_discovery(self):
         """Stop the device discovery process"""
-        if self._discovery_thread and self._discovery_thread.is_alive():
-            self._stop_discovery.set()
-            self._discovery_thread.join(timeout=5)
-            logger.info("Device discovery stopped")
+        self._stop_discovery.set()
+        if self._revalidate_thread and self._revalidate_thread.is_alive():
+            self._revalidate_thread.join(timeout=5)
+        if self._probe_thread and self._probe_thread.is_alive():
+            self._probe_thread.join(timeout=self.discovery_timeout + 1)
         
         # Clean up browser resources
         if self.browser:
             self.browser.stop_discovery()
             self.browser = None
+            logger.info("Device discovery stopped")
         
         # Clean up zeroconf resources
         if self.zeroconf:
             self.zeroconf.close()
             self.zeroconf = None
+        
+        self.cache.save()
             
     def register_callback(self, callback: Callable[[Dict[str, Dict[str, Any]]], None]):
-        """Register a callback to be called when devices change"""
+        """Register a callback to be called with the full device list when devices change"""
         if callback not in self.discovery_callbacks:
             self.discovery_callbacks.append(callback)
             
@@ -103,105 +217,244 @@ class DeviceDiscovery:
         """Remove a previously registered callback"""
         if callback in self.discovery_callbacks:
             self.discovery_callbacks.remove(callback)
+    
+    def register_delta_callback(self, callback: Callable[[List[DeviceDelta]], None]):
+        """Register a callback to be called with the list of changes to the device table"""
+        if callback not in self.delta_callbacks:
+            self.delta_callbacks.append(callback)
+    
+    def unregister_delta_callback(self, callback: Callable):
+        """Remove a previously registered delta callback"""
+        if callback in self.delta_callbacks:
+            self.delta_callbacks.remove(callback)
             
     def get_devices(self) -> Dict[str, Dict[str, Any]]:
-        """Get the list of currently discovered devices"""
-        return self.devices
+        """Get a snapshot of the currently discovered devices
+
+        Devices restored from the cache that have not been seen on the network
+        yet are included with their status set to 'unverified'.
+        """
+        with self._lock:
+            return dict(self.devices)
     
-    def _discover_devices(self):
-        """Background thread that discovers Cast devices"""
-        if not PYCHROMECAST_AVAILABLE or not ZEROCONF_AVAILABLE:
-            logger.error("Cannot discover devices: pychromecast or zeroconf package is missing")
-            return
-            
+    def _cast_added_callback(self, uuid, service):
+        """Callback for when a cast device is discovered"""
+        self._cast_info_changed(uuid)
+    
+    def _cast_updated_callback(self, uuid, service):
+        """Callback for when a cast device's advertisement changes"""
+        self._cast_info_changed(uuid)
+    
+    def _cast_removed_callback(self, uuid, service, cast_info):
+        """Callback for when a cast device disappears from the network"""
         try:
-            # Initialize zeroconf for discovery
-            self.zeroconf = Zeroconf()
-            
-            # Create a listener for the browser
-            self.listener = SimpleCastListener()
-            self.listener.add_callback(self._cast_discovered_callback)
-            
-            # Create and start the cast browser
-            self.browser = CastBrowser(self.listener, zeroconf=self.zeroconf)
-            self.browser.start_discovery()
-            
-            # Run the discovery loop
-            while not self._stop_discovery.is_set():
-                # Wait for a period before refreshing
-                self._stop_discovery.wait(timeout=5)
-                
-                # Check for new devices periodically
-                if not self._stop_discovery.is_set():
-                    self._update_devices()
-        
+            self._remove_device(str(uuid))
         except Exception as e:
-            logger.error(f"Fatal error in device discovery: {e}")
-        finally:
-            # Clean up resources
-            self.stop_discovery()
+            logger.error(f"Error in cast removal callback: {e}")
     
-    def _cast_discovered_callback(self, cast):
-        """Callback for when a cast device is discovered"""
+    def _cast_info_changed(self, uuid):
+        """Apply the browser's current information for a device to the table"""
         try:
-            uuid = str(cast.uuid)
-            self._known_devices[uuid] = cast
-            self._update_devices()
+            cast_info = self.browser.devices[uuid]
+            self._apply_device({
+                'name': cast_info.friendly_name,
+                'model_name': cast_info.model_name,
+                'uuid': str(cast_info.uuid),
+                'cast_type': cast_info.cast_type,
+                'address': cast_info.host,
+                'port': cast_info.port,
+                'status': 'available'
+            })
         except Exception as e:
             logger.error(f"Error in cast discovery callback: {e}")
-            
-    def _update_devices(self):
-        """Update the list of devices and notify callbacks"""
-        try:
-            # Build the new device list from known devices
-            new_devices: Dict[str, Dict[str, Any]] = {}
-            
-            for uuid, cast in self._known_devices.items():
+    
+    def _apply_device(self, device: Dict[str, Any]):
+        """Insert or update a device, emitting a delta only if a field changed"""
+        uuid = device['uuid']
+        with self._lock:
+            previous = self.devices.get(uuid)
+            if previous is None:
+                delta = DeviceDelta(DEVICE_ADDED, uuid, device)
+            else:
+                changed = tuple(field for field in DEVICE_FIELDS
+                                if previous.get(field) != device.get(field))
+                if not changed:
+                    return
+                delta = DeviceDelta(DEVICE_UPDATED, uuid, device, changed)
+                if 'address' in changed or 'port' in changed:
+                    # The connection object points at the old address
+                    self._known_devices.pop(uuid, None)
+            self.devices[uuid] = device
+        
+        if device['status'] != 'unverified':
+            self.cache.update(device)
+        if previous is None or previous['status'] == 'unverified':
+            logger.info(f"Discovered cast device {device['name']}")
+        self._mark_first_device()
+        self._emit([delta])
+    
+    def _remove_device(self, uuid: str):
+        """Remove a device from the table, emitting a removal delta"""
+        with self._lock:
+            previous = self.devices.pop(uuid, None)
+            self._known_devices.pop(uuid, None)
+        if previous is not None:
+            logger.info(f"Cast device {previous['name']} removed")
+            self._emit([DeviceDelta(DEVICE_REMOVED, uuid, previous)])
+    
+    def _emit(self, deltas: List[DeviceDelta]):
+        """Notify delta callbacks, then full-list callbacks, about table changes"""
+        for callback in list(self.delta_callbacks):
+            try:
+                callback(deltas)
+            except Exception as e:
+                logger.error(f"Error in device delta callback: {e}")
+        
+        if self.discovery_callbacks:
+            devices = self.get_devices()
+            for callback in list(self.discovery_callbacks):
                 try:
-                    # Get device info
-                    device_info = {
-                        'name': cast.device.friendly_name,
-                        'model_name': cast.device.model_name,
-                        'uuid': str(cast.uuid),
-                        'cast_type': cast.device.cast_type,
-                        'address': cast.device.host,
-                        'port': cast.device.port,
-                        'cast_object': cast,
-                        'status': 'available'
-                    }
-                    new_devices[uuid] = device_info
+                    callback(devices)
                 except Exception as e:
-                    logger.error(f"Error getting device info for {uuid}: {e}")
-            
-            # Check if the device list has changed
-            if new_devices != self.devices:
-                self.devices = new_devices
-                logger.info(f"Discovered {len(self.devices)} cast devices")
-                
-                # Notify callbacks about the updated device list
-                for callback in self.discovery_callbacks:
-                    try:
-                        callback(self.devices)
-                    except Exception as e:
-                        logger.error(f"Error in device discovery callback: {e}")
-                        
-        except Exception as e:
-            logger.error(f"Error updating devices: {e}")
+                    logger.error(f"Error in device discovery callback: {e}")
+    
+    def _revalidate_cached_devices(self):
+        """Background task that confirms or drops devices restored from the cache"""
+        # Give mDNS discovery a chance to confirm cached devices first
+        if self._stop_discovery.wait(timeout=self.discovery_timeout):
+            return
+        
+        with self._lock:
+            unverified = [dict(device) for device in self.devices.values()
+                          if device['status'] == 'unverified']
+        
+        for device in unverified:
+            if self._stop_discovery.is_set():
+                return
+            try:
+                with socket.create_connection((device['address'], device['port']),
+                                              timeout=self.discovery_timeout):
+                    pass
+                self._set_cached_status(device['uuid'], 'available')
+            except OSError:
+                logger.info(f"Cached device {device['name']} is not reachable")
+                self._set_cached_status(device['uuid'], None)
+        
+        # Expire entries past their TTL and trim the cache to its size cap
+        for uuid in self.cache.evict():
+            self._set_cached_status(uuid, None)
+        self.cache.save()
+    
+    def _probe_unicast_hosts(self):
+        """Background task that probes known hosts until discovery stops"""
+        while True:
+            try:
+                self.probe_hosts()
+            except Exception as e:
+                logger.error(f"Error probing cast hosts: {e}")
+            if self.unicast_probe_interval <= 0 or self._stop_discovery.wait(self.unicast_probe_interval):
+                return
+    
+    def probe_hosts(self, hosts: Optional[List[str]] = None):
+        """Probe hosts over unicast and merge the receivers found into the table
+
+        By default the configured hosts and the addresses of every known
+        device are probed. Devices seen by mDNS are left to the browser.
+        """
+        if hosts is None:
+            with self._lock:
+                hosts = self.unicast_hosts + [device['address'] for device in self.devices.values()
+                                              if device.get('address')]
+        if not hosts:
+            return
+        found = self.prober.probe(hosts, self._stop_discovery)
+        if self._stop_discovery.is_set():
+            return
+        
+        browser = self.browser
+        browsed = {str(uuid) for uuid in browser.devices} if browser is not None else set()
+        for device in found:
+            if device['uuid'] not in browsed:
+                self._apply_device(device)
+                self._probed_devices.add(device['uuid'])
+        
+        # Drop probed devices that no longer answer at an address that was probed
+        answered = {device['uuid'] for device in found}
+        probed = set(hosts)
+        for uuid in list(self._probed_devices - answered):
+            with self._lock:
+                device = self.devices.get(uuid)
+            if device is None or device['address'] in probed:
+                self._probed_devices.discard(uuid)
+                if uuid not in browsed:
+                    self._remove_device(uuid)
+    
+    def _set_cached_status(self, uuid: str, status: Optional[str]):
+        """Confirm or remove a cache-restored device that mDNS has not reported"""
+        with self._lock:
+            device = self.devices.get(uuid)
+            if device is None or device['status'] != 'unverified':
+                return
+        if status is None:
+            # Otherwise it would come back as unverified at every startup until its TTL ran out
+            self.cache.remove(uuid)
+            self._remove_device(uuid)
+        else:
+            self._apply_device(dict(device, status=status))
     
-    def connect_to_device(self, device_uuid: str) -> Optional[Any]:
-        """Connect to a specific device"""
+    def get_cast(self, device_uuid: str) -> Optional[Any]:
+        """Get the Chromecast object for a device, creating it if needed, without connecting"""
         if not PYCHROMECAST_AVAILABLE:
             logger.error("Cannot connect to device: pychromecast package is missing")
             return None
-            
-        if device_uuid in self.devices:
-            device = self.devices[device_uuid]
+        
+        with self._lock:
+            cast = self._known_devices.get(device_uuid)
+            device = self.devices.get(device_uuid)
+        if cast is not None:
+            return cast
+        if device is None:
+            logger.error(f"Device with UUID {device_uuid} not found")
+            return None
+        
+        browser = self.browser
+        cast_info = None
+        if browser is not None:
+            # The browser keys devices by UUID object, not string
             try:
-                cast = device['cast_object']
-                cast.wait()  # Wait for the device to be ready
-                return cast
-            except Exception as e:
-                logger.error(f"Error connecting to device {device['name']}: {e}")
+                cast_info = browser.devices.get(UUID(device_uuid))
+            except ValueError:
+                pass
+        if cast_info is not None:
+            cast = pychromecast.get_chromecast_from_cast_info(cast_info, self.zeroconf)
         else:
-            logger.error(f"Device with UUID {device_uuid} not found")
-        return None 
\ No newline at end of file
+            # Device restored from the cache, connect to its last known address
+            cast = pychromecast.get_chromecast_from_host(
+                (device['address'], device['port'], device['uuid'],
+                 device['model_name'], device['name'])
+            )
+        with self._lock:
+            cast = self._known_devices.setdefault(device_uuid, cast)
+        return cast
+    
+    def forget_cast(self, device_uuid: str):
+        """Drop the Chromecast object of a device once it has been disconnected"""
+        with self._lock:
+            self._known_devices.pop(device_uuid, None)
+    
+    def connect_to_device(self, device_uuid: str,
+                          callback: Optional[Callable[[Optional[Any]], None]] = None) -> Future:
+        """Connect to a specific device through the cast manager's connection pool
+
+        Returns at once with a Future resolving to the connected cast object,
+        or None if the connection failed or timed out; see ConnectionPool.connect.
+        """
+        pool = getattr(self.cast_manager, 'connection_pool', None)
+        if pool is not None:
+            return pool.connect(device_uuid, callback)
+        logger.error(f"Cannot connect to device {device_uuid}: no connection pool")
+        future = Future()
+        future.set_result(None)
+        if callback is not None:
+            callback(None)
+        return future
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Per-Device Stream Profiles
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.adaptive_bitrate import QualityTier
+from src.color_convert import resolution_size
+from src.unicast_probe import fetch_eureka_info
+
+logger = logging.getLogger("UbuntuCast.DeviceProfiles")
+
+DEFAULT_PROFILE_PATH = os.path.expanduser("~/.local/share/ubuntucast/profiles.json")
+PROFILE_VERSION = 1
+
+# Decoding limits of known receiver models: (max resolution, max frame rate, codecs).
+# The Cast protocol has no way to ask a receiver what it decodes, so the model
+# is the best guide; unknown models get the baseline every receiver supports.
+MODEL_LIMITS: Dict[str, Tuple[str, int, Tuple[str, ...]]] = {
+    'Chromecast': ('1080p', 30, ('h264',)),
+    'Chromecast Ultra': ('2160p', 60, ('h264', 'vp9', 'hevc')),
+    'Chromecast with Google TV': ('2160p', 60, ('h264', 'vp9', 'hevc', 'av1')),
+    'Chromecast HD': ('1080p', 60, ('h264', 'vp9', 'hevc', 'av1')),
+    'Google TV Streamer': ('2160p', 60, ('h264', 'vp9', 'hevc', 'av1')),
+    'Google Nest Hub': ('720p', 30, ('h264', 'vp9')),
+    'Google Nest Hub Max': ('720p', 30, ('h264', 'vp9')),
+}
+DEFAULT_LIMITS = ('1080p', 30, ('h264',))
+
+# ffmpeg encoders and the codec each one produces
+ENCODER_CODECS = {
+    'libx264': 'h264', 'h264_vaapi': 'h264', 'h264_nvenc': 'h264',
+    'libx265': 'hevc', 'hevc_vaapi': 'hevc', 'hevc_nvenc': 'hevc',
+    'libvpx-vp9': 'vp9', 'vp9_vaapi': 'vp9',
+}
+
+
+def probe_capabilities(uuid: str, model_name: str, cast_type: str, address: Optional[str],
+                       timeout: float = 2.0) -> Dict[str, Any]:
+    """Work out what a receiver can play from its model and device-info document"""
+    max_resolution, max_framerate, codecs = MODEL_LIMITS.get(model_name, DEFAULT_LIMITS)
+    video = cast_type != 'audio'
+
+    # Only needed to tell whether a video receiver has a display
+    info = fetch_eureka_info(address, timeout) if address and video else None
+    if info is not None:
+        capabilities = info.get('device_info', {}).get('capabilities', {})
+        if capabilities.get('display_supported') is False:
+            video = False
+    logger.info(f"Probed {model_name or uuid}: {max_resolution} {max_framerate} fps, "
+                f"codecs {', '.join(codecs)}{'' if video else ', no video'}")
+    return {
+        'model_name': model_name,
+        'video': video,
+        'max_resolution': max_resolution,
+        'max_framerate': max_framerate,
+        'codecs': list(codecs),
+        'device_info': info is not None,
+        'probed_at': time.time(),
+    }
+
+
+def cap_stream(profiles: List[Dict[str, Any]], resolution: str, framerate: int) -> Tuple[str, int]:
+    """Lower a resolution and frame rate to what every profiled receiver can decode"""
+    width, height = resolution_size(resolution)
+    for profile in profiles:
+        max_resolution = profile.get('max_resolution')
+        if max_resolution:
+            max_width, max_height = resolution_size(max_resolution)
+            if max_width * max_height < width * height:
+                resolution, width, height = max_resolution, max_width, max_height
+        framerate = min(framerate, profile.get('max_framerate') or framerate)
+    return resolution, framerate
+
+
+def starting_tier(tiers: List[QualityTier], profiles: List[Dict[str, Any]]) -> int:
+    """Index of the highest tier no better than every receiver's negotiated stream"""
+    streams = [profile['stream'] for profile in profiles if profile.get('stream')]
+    for index in range(len(tiers) - 1, -1, -1):
+        tier = tiers[index]
+        width, height = tier.size
+        if all(width * height <= _pixels(stream['resolution']) and tier.framerate <= stream['framerate']
+               and tier.bitrate <= stream['bitrate'] for stream in streams):
+            return index
+    return 0
+
+
+def _pixels(resolution: str) -> int:
+    width, height = resolution_size(resolution)
+    return width * height
+
+
+class DeviceProfiles:
+    """On-disk cache of receiver capabilities and negotiated stream profiles
+
+    Entries are keyed by uuid. Capabilities are probed the first time a
+    receiver connects; ``stream`` records the highest quality tier a
+    session held without trouble, so the next session can start there
+    instead of working its way up.
+    """
+
+    def __init__(self, path: str = DEFAULT_PROFILE_PATH):
+        self.path = path
+        self._profiles: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as profile_file:
+                data = json.load(profile_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable device profiles {self.path}: {e}")
+            return
+        if data.get('version') != PROFILE_VERSION:
+            return
+        with self._lock:
+            self._profiles = {uuid: profile for uuid, profile in data.get('devices', {}).items()
+                              if isinstance(profile, dict)}
+
+    def save(self):
+        """Write the profiles to disk if they have changed since the last save"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {'version': PROFILE_VERSION, 'devices': dict(self._profiles)}
+            self._dirty = False
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as profile_file:
+                json.dump(data, profile_file, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Error saving device profiles: {e}")
+
+    def get(self, uuid: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of a receiver's profile, if it has been probed"""
+        with self._lock:
+            profile = self._profiles.get(uuid)
+            return dict(profile) if profile is not None else None
+
+    def ensure(self, uuid: str, model_name: str, cast_type: str, address: Optional[str]) -> Dict[str, Any]:
+        """Return a receiver's profile, probing it first if it is new or its model changed"""
+        profile = self.get(uuid)
+        if profile is not None and profile.get('model_name') == model_name:
+            return profile
+        capabilities = probe_capabilities(uuid, model_name, cast_type, address)
+        with self._lock:
+            # A negotiated stream from a different model does not carry over
+            self._profiles[uuid] = capabilities
+            self._dirty = True
+        self.save()
+        return dict(capabilities)
+
+    def record_stream(self, uuid: str, tier: QualityTier):
+        """Remember the quality tier a receiver played without trouble"""
+        with self._lock:
+            profile = self._profiles.get(uuid)
+            if profile is None:
+                return
+            profile['stream'] = {'resolution': tier.resolution, 'framerate': tier.framerate,
+                                 'bitrate': tier.bitrate, 'updated_at': time.time()}
+            self._dirty = True
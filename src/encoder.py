@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# FFmpeg Encoder Supervisor
+
+import collections
+import functools
+import logging
+import os
+import re
+import select
+import subprocess
+import threading
+import time
+from typing import Callable, Deque, List, Optional, Tuple
+
+import numpy as np
+
+from src.metrics import metrics
+
+logger = logging.getLogger("UbuntuCast.Encoder")
+
+# ffmpeg pixel format names for the converter's output formats
+FFMPEG_PIXEL_FORMATS = {'i420': 'yuv420p', 'nv12': 'nv12'}
+
+# Low-latency options of each encoder; others get only the generic rate control below
+CODEC_OPTIONS = {
+    'libx264': ['-preset', 'ultrafast', '-tune', 'zerolatency', '-profile:v', 'high', '-pix_fmt', 'yuv420p'],
+    'libx265': ['-preset', 'ultrafast', '-tune', 'zerolatency', '-profile:v', 'main', '-pix_fmt', 'yuv420p',
+                '-x265-params', 'log-level=error'],
+    'h264_nvenc': ['-preset', 'fast', '-zerolatency', '1', '-profile:v', 'high', '-pix_fmt', 'yuv420p'],
+    'hevc_nvenc': ['-preset', 'fast', '-zerolatency', '1', '-profile:v', 'main', '-pix_fmt', 'yuv420p'],
+    'libvpx-vp9': ['-deadline', 'realtime', '-cpu-used', '8', '-row-mt', '1', '-lag-in-frames', '0',
+                   '-pix_fmt', 'yuv420p'],
+    # VAAPI encoders take frames in GPU memory
+    'h264_vaapi': ['-vf', 'format=nv12,hwupload', '-profile:v', 'high'],
+    'hevc_vaapi': ['-vf', 'format=nv12,hwupload', '-profile:v', 'main'],
+    'vp9_vaapi': ['-vf', 'format=nv12,hwupload'],
+}
+VAAPI_DEVICE = '/dev/dri/renderD128'
+
+# Keys ffmpeg emits in -progress output, anything else on stderr is an error message
+PROGRESS_KEYS = {
+    'frame', 'fps', 'bitrate', 'total_size', 'out_time_us', 'out_time_ms', 'out_time',
+    'dup_frames', 'drop_frames', 'speed', 'progress'
+}
+
+
+class EncoderSettings:
+    """Parameters of one encoder process"""
+
+    def __init__(self, width: int, height: int, framerate: float = 30,
+                 pixel_format: str = 'i420', bitrate: int = 6000,
+                 codec: str = 'libx264', keyframe_interval: float = 1.0,
+                 fragment_duration: float = 0.2, audio_rate: int = 0, audio_channels: int = 2,
+                 audio_bitrate: int = 128, threads: int = 0):
+        self.width = width
+        self.height = height
+        self.framerate = framerate
+        self.pixel_format = pixel_format
+        self.bitrate = bitrate  # kbit/s
+        self.codec = codec
+        self.keyframe_interval = keyframe_interval  # seconds
+        self.fragment_duration = fragment_duration  # seconds per fMP4 fragment within a segment
+        self.audio_rate = audio_rate  # Hz of the s16le PCM audio input, 0 for video only
+        self.audio_channels = audio_channels
+        self.audio_bitrate = audio_bitrate  # kbit/s
+        self.threads = threads  # Encoder threads, 0 for ffmpeg's choice
+
+    @property
+    def frame_size(self) -> int:
+        return self.width * self.height * 3 // 2
+
+    def replace(self, **changes) -> 'EncoderSettings':
+        """Return a copy with some parameters changed"""
+        values = dict(self.__dict__)
+        values.update(changes)
+        return EncoderSettings(**values)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, EncoderSettings) and self.__dict__ == other.__dict__
+
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_version() -> Tuple[int, ...]:
+    """(major, minor) of the installed ffmpeg, or () for a git build or no ffmpeg"""
+    try:
+        result = subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return ()
+    match = re.match(r'ffmpeg version n?(\d+)\.(\d+)', result.stdout.decode(errors='replace'))
+    return (int(match.group(1)), int(match.group(2))) if match else ()
+
+
+def build_ffmpeg_command(settings: EncoderSettings, audio_fd: Optional[int] = None) -> List[str]:
+    """Build the ffmpeg command line reading raw frames on stdin and writing fragmented MP4 to stdout
+
+    Fragments are cut at every keyframe and every ``fragment_duration``, so
+    a segment can be served in chunks before its next keyframe arrives. With
+    ``audio_fd``, PCM audio is read from that pipe as a second input. Both
+    inputs are timestamped on arrival, so audio and video written equally
+    late after capture line up.
+    """
+    gop = max(1, int(round(settings.framerate * settings.keyframe_interval)))
+    audio_input = []
+    audio_output = []
+    if audio_fd is not None and settings.audio_rate:
+        audio_input = [
+            '-use_wallclock_as_timestamps', '1',
+            '-f', 's16le', '-ar', str(settings.audio_rate), '-ac', str(settings.audio_channels),
+            '-i', f'pipe:{audio_fd}',
+        ]
+        audio_output = [
+            '-map', '0:v', '-map', '1:a',
+            # Arrival jitter must not become gaps in the audio timeline
+            '-af', 'aresample=async=1',
+            '-c:a', 'aac', '-b:a', f"{settings.audio_bitrate}k",
+        ]
+    threads = ['-threads', str(settings.threads)] if settings.threads else []
+    hardware = ['-vaapi_device', VAAPI_DEVICE] if settings.codec.endswith('_vaapi') else []
+    codec_options = CODEC_OPTIONS.get(settings.codec, ['-pix_fmt', 'yuv420p'])
+    # -fps_mode replaced -vsync in ffmpeg 5.1; Ubuntu 20.04 and 22.04 ship 4.2 and 4.4
+    version = ffmpeg_version()
+    sync = ['-fps_mode', 'vfr'] if version and version >= (5, 1) else ['-vsync', 'vfr']
+    return [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostats', '-progress', 'pipe:2',
+    ] + hardware + [
+        # Frames arrive at a variable rate, so timestamp them on arrival
+        '-use_wallclock_as_timestamps', '1',
+        '-f', 'rawvideo', '-pix_fmt', FFMPEG_PIXEL_FORMATS[settings.pixel_format],
+        '-s', f"{settings.width}x{settings.height}", '-r', str(settings.framerate),
+        '-i', 'pipe:0',
+    ] + audio_input + audio_output + threads + [
+        '-c:v', settings.codec,
+    ] + codec_options + [
+        '-b:v', f"{settings.bitrate}k", '-maxrate', f"{settings.bitrate}k",
+        '-bufsize', f"{settings.bitrate // 2}k",
+        '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+    ] + sync + [
+        '-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+        '-frag_duration', str(int(settings.fragment_duration * 1000000)),
+        'pipe:1',
+    ]
+
+
+class EncoderSupervisor:
+    """Runs ffmpeg as a long-lived subprocess fed with raw frames
+
+    Frames are copied into a small ring of preallocated slots and written to
+    ffmpeg's stdin by a writer thread. When the encoder falls behind and all
+    slots are queued, the oldest queued frame is dropped and its slot reused,
+    so memory stays bounded and the newest frame always gets through. Encoded
+    output is delivered to ``output_callback`` from a reader thread. If
+    ffmpeg exits unexpectedly it is restarted, and ``restart_callback`` is
+    called so consumers can expect a new stream header.
+
+    When the settings include audio, ffmpeg reads PCM from a second pipe
+    written with ``write_audio``, independently of the video frames.
+    """
+
+    def __init__(self, settings: EncoderSettings, output_callback: Callable[[bytes], None],
+                 queue_size: int = 3, command: Optional[List[str]] = None,
+                 restart_callback: Optional[Callable[[], None]] = None,
+                 error_callback: Optional[Callable[[str], None]] = None,
+                 max_restarts: int = 5, restart_window: float = 60.0):
+        self.settings = settings
+        self.output_callback = output_callback
+        self.restart_callback = restart_callback
+        self.error_callback = error_callback
+        self.queue_size = max(2, queue_size)
+        self.command = command
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+
+        self.frames_submitted = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.restarts = 0
+        self.encode_latency = 0.0  # Smoothed seconds from submit to ffmpeg reporting the frame encoded
+        self.write_delay = 0.0  # Smoothed seconds from a frame's timestamp to it reaching ffmpeg
+
+        self._process: Optional[subprocess.Popen] = None
+        self._audio_pipe: Optional[int] = None
+        self._audio_lock = threading.Lock()
+        self._running = False
+        self._condition = threading.Condition()
+        self._restart_lock = threading.Lock()
+        self._slots: List[np.ndarray] = []
+        self._free: Deque[int] = collections.deque()
+        self._ready: Deque[Tuple[int, float]] = collections.deque()
+        self._submit_times: Deque[Tuple[int, float]] = collections.deque(maxlen=256)
+        self._restart_times: Deque[float] = collections.deque()
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of frames waiting to be written to the encoder"""
+        return len(self._ready)
+
+    @property
+    def is_running(self) -> bool:
+        return self._running
+
+    def start(self):
+        """Start the encoder process and its worker threads"""
+        if self._running:
+            return
+        self._allocate_slots()
+        self._running = True
+        self._spawn()
+        supervisor = threading.Thread(target=self._supervise, name="UbuntuCastEncoderSupervisor")
+        supervisor.daemon = True
+        supervisor.start()
+
+    def stop(self):
+        """Stop the encoder, letting it flush what it has already received"""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        process = self._process
+        self._close_audio_pipe()
+        if process is not None:
+            try:
+                process.stdin.close()
+                process.wait(timeout=3)
+            except (OSError, subprocess.TimeoutExpired):
+                process.kill()
+        for thread in self._threads:
+            thread.join(timeout=3)
+        self._threads = []
+        self._process = None
+
+    def reconfigure(self, settings: EncoderSettings):
+        """Restart the encoder with new settings without tearing down the session"""
+        if settings == self.settings:
+            return
+        logger.info(f"Reconfiguring encoder to {settings.width}x{settings.height} "
+                    f"@ {settings.framerate} fps, {settings.bitrate} kbit/s")
+        self.settings = settings
+        if self._running:
+            self._restart(reallocate=True)
+
+    def submit(self, frame: np.ndarray, timestamp: Optional[float] = None) -> bool:
+        """Queue a converted frame for encoding, returning False if it was not accepted"""
+        if not self._running or frame.nbytes != self.settings.frame_size:
+            return False
+        with self._condition:
+            if self._free:
+                slot = self._free.popleft()
+            elif self._ready:
+                # Encoder is behind: drop the oldest queued frame and reuse its slot
+                slot, _ = self._ready.popleft()
+                self.frames_dropped += 1
+                if metrics.enabled:
+                    metrics.inc('ubuntucast_frames_dropped_total', stage='encoder')
+            else:
+                self.frames_dropped += 1
+                if metrics.enabled:
+                    metrics.inc('ubuntucast_frames_dropped_total', stage='encoder')
+                return False
+            # Copy under the lock so the slots cannot be reallocated mid-copy
+            np.copyto(self._slots[slot], frame.reshape(-1))
+            self._ready.append((slot, timestamp if timestamp is not None else time.monotonic()))
+            self.frames_submitted += 1
+            self._condition.notify()
+        return True
+
+    def write_audio(self, data) -> bool:
+        """Write PCM audio to the encoder, returning False if it has no audio input right now"""
+        with self._audio_lock:
+            if self._audio_pipe is None:
+                return False
+            view = memoryview(data)
+            try:
+                while view and self._running:
+                    try:
+                        view = view[os.write(self._audio_pipe, view):]
+                    except BlockingIOError:
+                        # Wait for ffmpeg to read, but never past the encoder stopping
+                        select.select([], [self._audio_pipe], [], 0.1)
+            except OSError:
+                return False
+        return not view
+
+    def _close_audio_pipe(self):
+        with self._audio_lock:
+            if self._audio_pipe is not None:
+                os.close(self._audio_pipe)
+                self._audio_pipe = None
+
+    def _allocate_slots(self):
+        with self._condition:
+            self._slots = [np.empty(self.settings.frame_size, dtype=np.uint8)
+                           for _ in range(self.queue_size)]
+            self._free = collections.deque(range(self.queue_size))
+            self._ready.clear()
+
+    def _spawn(self):
+        """Start an ffmpeg process and the threads that feed and drain it"""
+        audio_read = None
+        if self.command is None and self.settings.audio_rate:
+            audio_read, audio_write = os.pipe()
+        command = self.command or build_ffmpeg_command(self.settings, audio_read)
+        try:
+            self._process = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                bufsize=0, pass_fds=(audio_read,) if audio_read is not None else ()
+            )
+        except OSError:
+            if audio_read is not None:
+                os.close(audio_write)
+            raise
+        finally:
+            if audio_read is not None:
+                os.close(audio_read)
+        if audio_read is not None:
+            os.set_blocking(audio_write, False)
+            with self._audio_lock:
+                self._audio_pipe = audio_write
+        self._submit_times.clear()
+        process = self._process
+        self._threads = [
+            threading.Thread(target=self._write_frames, args=(process,), name="UbuntuCastEncoderWriter"),
+            threading.Thread(target=self._read_output, args=(process,), name="UbuntuCastEncoderReader"),
+            threading.Thread(target=self._read_progress, args=(process,), name="UbuntuCastEncoderProgress"),
+        ]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        logger.info(f"Encoder started (pid {process.pid})")
+
+    def _restart(self, reallocate: bool = False, expected: Optional[subprocess.Popen] = None):
+        """Replace the running ffmpeg process with a fresh one
+
+        If ``expected`` is given, nothing happens unless it is still the
+        current process, so a crash and a reconfigure cannot both restart.
+        """
+        with self._restart_lock:
+            old = self._process
+            if expected is not None and old is not expected:
+                return
+            with self._condition:
+                # Detach the old process so its writer thread stops waiting for frames
+                self._process = None
+                self._condition.notify_all()
+            if old is not None:
+                try:
+                    old.kill()
+                    old.wait(timeout=3)
+                except (OSError, subprocess.TimeoutExpired):
+                    pass
+            # Only after the kill, so a blocked audio write fails and releases the lock
+            self._close_audio_pipe()
+            for thread in self._threads:
+                if thread is not threading.current_thread():
+                    thread.join(timeout=3)
+            if not self._running:
+                return
+            if metrics.enabled:
+                # Frames written to the old process never come out
+                metrics.discard_encoding()
+            if reallocate:
+                self._allocate_slots()
+            else:
+                self.restarts += 1
+            self._spawn()
+        if self.restart_callback is not None:
+            try:
+                self.restart_callback()
+            except Exception as e:
+                logger.error(f"Error in encoder restart callback: {e}")
+
+    def _supervise(self):
+        """Restart the encoder if it exits while the session is running"""
+        while self._running:
+            process = self._process
+            if process is None or process.poll() is None or not self._running:
+                time.sleep(0.2)
+                continue
+
+            now = time.monotonic()
+            while self._restart_times and now - self._restart_times[0] > self.restart_window:
+                self._restart_times.popleft()
+            if len(self._restart_times) >= self.max_restarts:
+                logger.error("Encoder keeps crashing, giving up")
+                self._running = False
+                if self.error_callback is not None:
+                    self.error_callback(f"encoder exited with code {process.returncode}")
+                return
+
+            logger.warning(f"Encoder exited with code {process.returncode}, restarting")
+            self._restart_times.append(now)
+            time.sleep(min(2.0, 0.1 * 2 ** len(self._restart_times)))
+            self._restart(expected=process)
+
+    def _write_frames(self, process: subprocess.Popen):
+        """Writer thread: copy queued frames into ffmpeg's stdin"""
+        frame_number = 0
+        while True:
+            with self._condition:
+                while self._running and not self._ready and self._process is process:
+                    self._condition.wait(timeout=0.5)
+                if not self._running or self._process is not process:
+                    return
+                slot, timestamp = self._ready.popleft()
+            try:
+                process.stdin.write(memoryview(self._slots[slot]))
+                frame_number += 1
+                self.frames_written += 1
+                self.write_delay = 0.9 * self.write_delay + 0.1 * (time.monotonic() - timestamp)
+                self._submit_times.append((frame_number, timestamp))
+                if metrics.enabled:
+                    metrics.mark(timestamp, 'queue')
+            except (BrokenPipeError, ValueError, OSError):
+                return
+            finally:
+                with self._condition:
+                    self._free.append(slot)
+
+    def _read_output(self, process: subprocess.Popen):
+        """Reader thread: forward encoded output as it arrives"""
+        stdout = process.stdout.fileno()
+        while True:
+            try:
+                data = os.read(stdout, 65536)
+            except OSError:
+                return
+            if not data:
+                return
+            try:
+                self.output_callback(data)
+            except Exception as e:
+                logger.error(f"Error in encoder output callback: {e}")
+
+    def _read_progress(self, process: subprocess.Popen):
+        """Progress thread: track encode latency from ffmpeg's progress reports"""
+        for raw_line in process.stderr:
+            line = raw_line.decode(errors='replace').strip()
+            key, separator, value = line.partition('=')
+            if key == 'frame' and value.isdigit():
+                self._update_latency(int(value))
+            elif line and not (separator and (key in PROGRESS_KEYS or key.startswith('stream_'))):
+                logger.warning(f"ffmpeg: {line}")
+
+    def _update_latency(self, encoded_frames: int):
+        """Smooth the time between submitting a frame and ffmpeg reporting it encoded"""
+        now = time.monotonic()
+        submitted = None
+        while self._submit_times and self._submit_times[0][0] <= encoded_frames:
+            submitted = self._submit_times.popleft()[1]
+        if submitted is not None:
+            self.encode_latency = 0.8 * self.encode_latency + 0.2 * (now - submitted)
+
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Frame Damage Tracking
+
+import logging
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("UbuntuCast.FrameDiff")
+
+Rect = Tuple[int, int, int, int]  # x, y, width, height
+
+
+class DiffResult:
+    """A frame that should be passed on to the encoder"""
+    __slots__ = ('frame', 'dirty_rects', 'keepalive')
+
+    def __init__(self, frame, dirty_rects: List[Rect], keepalive: bool = False):
+        self.frame = frame
+        self.dirty_rects = dirty_rects  # Changed regions, empty for keep-alive frames
+        self.keepalive = keepalive  # True if the frame is unchanged and only sent to keep the stream alive
+
+
+class FrameDiffer:
+    """Drops unchanged frames and reports the dirty regions of changed ones
+
+    Each frame is compared with the previous one as 32-bit pixels and the
+    differences are reduced to a grid of fixed-size tiles with vectorized
+    NumPy operations. Unchanged frames are dropped, except for a keep-alive
+    frame every ``keepalive_interval`` seconds, which gives the encoder a
+    variable frame rate driven by screen changes.
+    """
+
+    def __init__(self, tile_size: int = 32, keepalive_interval: float = 1.0):
+        self.tile_size = tile_size
+        self.keepalive_interval = keepalive_interval
+        self.frames_in = 0
+        self.frames_dropped = 0
+        self._previous: Optional[np.ndarray] = None
+        self._last_emit = float('-inf')
+
+    def reset(self):
+        """Forget the previous frame so the next one is treated as fully dirty"""
+        self._previous = None
+
+    def process(self, frame) -> Optional[DiffResult]:
+        """Compare a frame with the previous one
+
+        Returns None if the frame is unchanged and no keep-alive is due.
+        """
+        self.frames_in += 1
+        pixels = frame.data.view(np.uint32)[..., 0]
+
+        if self._previous is None or self._previous.shape != pixels.shape:
+            self._allocate(pixels.shape)
+            np.copyto(self._previous, pixels)
+            return self._emit(frame, [(0, 0, frame.width, frame.height)])
+
+        # Per-pixel difference, reduced to a per-tile mask without temporary arrays
+        np.not_equal(pixels, self._previous, out=self._changed)
+        np.logical_or.reduceat(self._changed, self._row_starts, axis=0, out=self._row_tiles)
+        np.logical_or.reduceat(self._row_tiles, self._col_starts, axis=1, out=self._tiles)
+
+        if not self._tiles.any():
+            if frame.timestamp - self._last_emit >= self.keepalive_interval:
+                return self._emit(frame, [], keepalive=True)
+            self.frames_dropped += 1
+            return None
+
+        np.copyto(self._previous, pixels)
+        return self._emit(frame, self._dirty_rects(frame.width, frame.height))
+
+    def _allocate(self, shape: Tuple[int, int]):
+        """Allocate the comparison buffers for a frame size"""
+        height, width = shape
+        tile = self.tile_size
+        self._previous = np.empty(shape, dtype=np.uint32)
+        self._changed = np.empty(shape, dtype=bool)
+        self._row_starts = np.arange(0, height, tile)
+        self._col_starts = np.arange(0, width, tile)
+        self._row_tiles = np.empty((len(self._row_starts), width), dtype=bool)
+        self._tiles = np.empty((len(self._row_starts), len(self._col_starts)), dtype=bool)
+
+    def _emit(self, frame, dirty_rects: List[Rect], keepalive: bool = False) -> DiffResult:
+        self._last_emit = frame.timestamp
+        return DiffResult(frame, dirty_rects, keepalive)
+
+    def _dirty_rects(self, width: int, height: int) -> List[Rect]:
+        """Merge dirty tiles into rectangles
+
+        Runs of dirty tiles in each tile row are merged horizontally, then
+        identical runs in consecutive rows are merged vertically.
+        """
+        tile = self.tile_size
+        open_runs = {}  # (first column, last column) -> first tile row
+        rects = []
+
+        def close(run, first_row, end_row):
+            x = run[0] * tile
+            y = first_row * tile
+            rects.append((x, y, min(run[1] * tile, width) - x, min(end_row * tile, height) - y))
+
+        for row_index, row in enumerate(self._tiles):
+            # Start and end column of every run of dirty tiles in this row
+            edges = np.flatnonzero(np.diff(np.concatenate(([False], row, [False]))))
+            runs = set(zip(edges[::2].tolist(), edges[1::2].tolist()))
+            for run in list(open_runs):
+                if run not in runs:
+                    close(run, open_runs.pop(run), row_index)
+            for run in runs:
+                open_runs.setdefault(run, row_index)
+
+        for run, first_row in open_runs.items():
+            close(run, first_row, len(self._tiles))
+        return rects
@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Frame Trace Recording and Replay
+
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import Callable, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+
+from src.frame_diff import FrameDiffer
+from src.metrics import metrics
+from src.screen_capture import Frame
+
+logger = logging.getLogger("UbuntuCast.FrameTrace")
+
+# File layout: a header, then one record per frame, then an index of record offsets.
+# Pixel payloads start on ALIGNMENT byte boundaries so they can be used in place.
+MAGIC = b'UCTRACE\0'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQd')  # magic, version, tile size, frame count, index offset, first timestamp
+HEADER_SIZE = 64
+RECORD = struct.Struct('<HHIIId')  # kind, rect count, width, height, sequence, timestamp
+RECT = np.dtype('<u4')  # x, y, width, height
+ALIGNMENT = 64
+CHUNK_SIZE = 64 * 1024 * 1024  # The recording file grows by this much at a time
+
+# Record kinds. A keyframe holds the whole frame; a delta holds only the
+# pixels of its dirty rectangles and needs the frame before it.
+KEYFRAME = 1
+DELTA = 2
+
+
+class TraceError(Exception):
+    """Raised when a frame trace cannot be read"""
+
+
+class TraceRecord(NamedTuple):
+    """One frame of a trace; ``rects`` and the pixels are views of the mapped file"""
+    kind: int
+    sequence: int
+    timestamp: float
+    width: int
+    height: int
+    rects: np.ndarray  # n x 4 array of dirty rectangles, x, y, width, height
+    payload: int  # Offset of the pixel data in the file
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class TraceRecorder:
+    """Writes frames, timestamps and dirty regions to a memory-mapped trace file
+
+    Dirty rectangles come from a FrameDiffer run over the recorded frames.
+    With ``delta`` on, a frame is stored as the pixels of its dirty
+    rectangles only, with a full keyframe at the start, on every size
+    change, every ``keyframe_interval`` frames and whenever most of the
+    frame changed; with it off every frame is a keyframe. Unchanged frames
+    are kept as empty deltas so replay keeps the original timing.
+    """
+
+    def __init__(self, path: str, delta: bool = True, tile_size: int = 32, keyframe_interval: int = 300):
+        self.path = path
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval
+        self.differ = FrameDiffer(tile_size=tile_size, keepalive_interval=float('inf'))
+        self.frames = 0
+        self.keyframes = 0
+        self._file = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._offset = HEADER_SIZE
+        self._offsets: List[int] = []
+        self._first_timestamp = 0.0
+        self._last_size = (0, 0)
+        self._since_keyframe = 0
+
+    @property
+    def size(self) -> int:
+        """Bytes of frame records written so far"""
+        return self._offset
+
+    def open(self):
+        """Create the trace file and map its first chunk"""
+        if self._mmap is not None:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'w+b')
+        self._file.truncate(CHUNK_SIZE)
+        self._mmap = mmap.mmap(self._file.fileno(), CHUNK_SIZE)
+        # No index yet: a trace left unclosed is recovered by scanning its records
+        HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, self.differ.tile_size, 0, 0, 0.0)
+        self._offset = HEADER_SIZE
+        self._offsets = []
+        self.frames = 0
+        self.keyframes = 0
+        self.differ.reset()
+
+    def write(self, frame):
+        """Append a frame to the trace"""
+        if self._mmap is None:
+            self.open()
+        result = self.differ.process(frame)
+        rects = result.dirty_rects if result is not None else []
+        size_changed = not self._offsets or self._last_size != (frame.width, frame.height)
+        dirty_area = sum(width * height for _, _, width, height in rects)
+        kind = DELTA
+        if (not self.delta or size_changed or self._since_keyframe >= self.keyframe_interval
+                or dirty_area * 2 > frame.width * frame.height):
+            kind = KEYFRAME
+
+        rect_bytes = len(rects) * 4 * RECT.itemsize
+        payload = _align(self._offset + RECORD.size + rect_bytes)
+        pixel_bytes = (frame.width * frame.height if kind == KEYFRAME else dirty_area) * 4
+        self._reserve(payload + pixel_bytes)
+
+        if not self._offsets:
+            self._first_timestamp = frame.timestamp
+        RECORD.pack_into(self._mmap, self._offset, kind, len(rects), frame.width, frame.height,
+                         frame.sequence & 0xFFFFFFFF, frame.timestamp)
+        if rects:
+            self._mmap[self._offset + RECORD.size:self._offset + RECORD.size + rect_bytes] = \
+                np.array(rects, dtype=RECT).tobytes()
+        if kind == KEYFRAME:
+            target = np.frombuffer(self._mmap, np.uint8, pixel_bytes, payload)
+            np.copyto(target.reshape(frame.height, frame.width, 4), frame.data)
+            self._since_keyframe = 0
+            self.keyframes += 1
+        else:
+            offset = payload
+            for x, y, width, height in rects:
+                count = width * height * 4
+                target = np.frombuffer(self._mmap, np.uint8, count, offset)
+                np.copyto(target.reshape(height, width, 4), frame.data[y:y + height, x:x + width])
+                offset += count
+            self._since_keyframe += 1
+        # Views of the map must be gone before it can grow
+        target = None
+
+        self._offsets.append(self._offset)
+        self._offset = _align(payload + pixel_bytes)
+        self._last_size = (frame.width, frame.height)
+        self.frames += 1
+
+    def _reserve(self, end: int):
+        """Grow the file and its map to hold ``end`` bytes, and the index after them"""
+        needed = _align(end) + (len(self._offsets) + 1) * 8
+        if needed <= len(self._mmap):
+            return
+        self._mmap.resize(max(needed, len(self._mmap) + CHUNK_SIZE))
+
+    def close(self):
+        """Write the index and header and trim the file to its contents"""
+        if self._mmap is None:
+            return
+        index_offset = self._offset
+        end = index_offset + len(self._offsets) * 8
+        self._reserve(end)
+        self._mmap[index_offset:end] = np.array(self._offsets, dtype='<u8').tobytes()
+        HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, self.differ.tile_size, len(self._offsets),
+                         index_offset, self._first_timestamp)
+        self._mmap.flush()
+        self._mmap.close()
+        self._mmap = None
+        self._file.truncate(end)
+        self._file.close()
+        self._file = None
+        logger.info(f"Recorded {self.frames} frames ({self.keyframes} keyframes) to {self.path}, "
+                    f"{end / 1e6:.1f} MB")
+
+    def __enter__(self) -> 'TraceRecorder':
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RecordingSource:
+    """A frame source that records everything another source produces
+
+    ``source_factory`` is called with the remaining keywords to create the
+    wrapped source, so this can stand in for it as a capture factory,
+    including in the capture process of the multi-process pipeline.
+    """
+
+    def __init__(self, source_factory: Callable, path: str, delta: bool = True, **source_options):
+        self.source = source_factory(**source_options)
+        self.recorder = TraceRecorder(path, delta=delta)
+
+    @property
+    def framerate(self) -> float:
+        return self.source.framerate
+
+    @framerate.setter
+    def framerate(self, framerate: float):
+        self.source.framerate = framerate
+
+    @property
+    def width(self) -> int:
+        return self.source.width
+
+    @property
+    def height(self) -> int:
+        return self.source.height
+
+    def open(self):
+        self.source.open()
+        self.recorder.open()
+
+    def close(self):
+        try:
+            self.recorder.close()
+        finally:
+            self.source.close()
+
+    def frames(self, max_frames: Optional[int] = None) -> Iterator[Frame]:
+        for frame in self.source.frames(max_frames):
+            self.recorder.write(frame)
+            yield frame
+
+    def __iter__(self) -> Iterator[Frame]:
+        return self.frames()
+
+
+class FrameTrace:
+    """Read access to a trace file through a read-only memory map"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as trace_file:
+            try:
+                self._mmap = mmap.mmap(trace_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise TraceError(f"{path} is empty")
+        if len(self._mmap) < HEADER_SIZE:
+            raise TraceError(f"{path} is not a frame trace")
+        magic, version, self.tile_size, count, index_offset, self.first_timestamp = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise TraceError(f"{path} is not a frame trace")
+        if version != VERSION:
+            raise TraceError(f"{path} is trace version {version}, expected {VERSION}")
+        if index_offset:
+            self._offsets = np.frombuffer(self._mmap, '<u8', count, index_offset)
+        else:
+            logger.warning(f"{path} was not closed, recovering its frames")
+            self._offsets = self._scan()
+        if not len(self._offsets):
+            raise TraceError(f"{path} has no frames")
+
+    def _scan(self) -> np.ndarray:
+        """Find the records of a trace whose recorder never wrote the index"""
+        offsets = []
+        offset = HEADER_SIZE
+        while offset + RECORD.size <= len(self._mmap):
+            kind, count, width, height, _, timestamp = RECORD.unpack_from(self._mmap, offset)
+            if kind not in (KEYFRAME, DELTA) or not width or not height or \
+                    offset + RECORD.size + count * 4 * RECT.itemsize > len(self._mmap):
+                break
+            rects = np.frombuffer(self._mmap, RECT, count * 4, offset + RECORD.size).reshape(count, 4)
+            pixels = width * height if kind == KEYFRAME else int((rects[:, 2] * rects[:, 3]).sum())
+            end = _align(offset + RECORD.size + rects.nbytes) + pixels * 4
+            if end > len(self._mmap):
+                break
+            if not offsets:
+                self.first_timestamp = timestamp
+            offsets.append(offset)
+            offset = _align(end)
+        return np.array(offsets, dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    @property
+    def duration(self) -> float:
+        return self.record(len(self) - 1).timestamp - self.first_timestamp
+
+    def record(self, index: int) -> TraceRecord:
+        offset = int(self._offsets[index])
+        kind, count, width, height, sequence, timestamp = RECORD.unpack_from(self._mmap, offset)
+        rects = np.frombuffer(self._mmap, RECT, count * 4, offset + RECORD.size).reshape(count, 4)
+        return TraceRecord(kind, sequence, timestamp, width, height, rects,
+                           _align(offset + RECORD.size + rects.nbytes))
+
+    def keyframe_pixels(self, record: TraceRecord) -> np.ndarray:
+        """A keyframe's pixels as a read-only height x width x 4 view of the file"""
+        count = record.width * record.height * 4
+        return np.frombuffer(self._mmap, np.uint8, count, record.payload).reshape(record.height, record.width, 4)
+
+    def apply(self, record: TraceRecord, data: np.ndarray):
+        """Copy a delta's dirty rectangles into the frame before it"""
+        offset = record.payload
+        for x, y, width, height in record.rects.tolist():
+            count = width * height * 4
+            data[y:y + height, x:x + width] = \
+                np.frombuffer(self._mmap, np.uint8, count, offset).reshape(height, width, 4)
+            offset += count
+
+    def close(self):
+        self._offsets = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # Frames still refer to the map; it is unmapped once they are gone
+
+
+class TraceReplay:
+    """A frame source that plays a recorded trace back, with the interface of ScreenCapture
+
+    ``speed`` 1 replays at the recorded pace, 2 twice as fast, and 0 as
+    fast as the consumer takes frames. Keyframes are handed out as
+    read-only views of the mapped file without a copy; deltas are applied
+    to a small ring of frames, each brought up to date by copying only the
+    rectangles that changed since it was last used. Frame timestamps keep
+    the recorded spacing divided by ``speed``, from the clock time the
+    replay started; at speed 0 they keep the recorded spacing, so frame
+    drops and keep-alives downstream are the same on every run.
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, loop: bool = False, ring_size: int = 3,
+                 framerate: float = 30, clock: Callable[[], float] = time.monotonic):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.ring_size = max(2, ring_size)
+        self.framerate = framerate  # Set by the pipeline; the trace's own pacing is used
+        self.clock = clock
+        self.trace: Optional[FrameTrace] = None
+        self.dirty_rects: np.ndarray = np.empty((0, 4), dtype=RECT)  # Of the last frame returned
+        self._slots: List[Optional[Frame]] = []
+        self._slot_positions: List[int] = []
+        self._previous: Optional[Frame] = None
+        self._position = 0
+        self._epoch = 0.0
+        self._loop_offset = 0.0
+
+    @property
+    def width(self) -> int:
+        return self.trace.record(0).width if self.trace is not None else 0
+
+    @property
+    def height(self) -> int:
+        return self.trace.record(0).height if self.trace is not None else 0
+
+    def open(self):
+        """Map the trace file"""
+        if self.trace is not None:
+            return
+        self.trace = FrameTrace(self.path)
+        self._slots = [None] * self.ring_size
+        self._slot_positions = [-1] * self.ring_size
+        self._previous = None
+        self._position = 0
+        self._loop_offset = 0.0
+        self._epoch = self.clock()
+        logger.info(f"Replaying {len(self.trace)} frames ({self.trace.duration:.1f} s) from {self.path}")
+
+    def close(self):
+        self._slots = []
+        self._previous = None
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+    def _record(self, position: int) -> TraceRecord:
+        return self.trace.record(position % len(self.trace))
+
+    def grab(self) -> Optional[Frame]:
+        """Build the next frame of the trace, or None at its end"""
+        if self.trace is None:
+            self.open()
+        count = len(self.trace)
+        position = self._position
+        if position >= count and not self.loop:
+            return None
+        if position and position % count == 0:
+            # Carry on one frame interval after the end of the last pass
+            self._loop_offset += self.trace.duration + 1.0 / max(self.framerate, 1)
+        started = self.clock() if metrics.enabled else 0.0
+        record = self._record(position)
+
+        if record.kind == KEYFRAME:
+            frame = Frame(self.trace.keyframe_pixels(record))
+        else:
+            frame = self._apply_delta(position, record)
+
+        offset = self._loop_offset + record.timestamp - self.trace.first_timestamp
+        frame.timestamp = self._epoch + (offset / self.speed if self.speed > 0 else offset)
+        frame.sequence = position
+        self.dirty_rects = record.rects
+        self._previous = frame
+        self._position += 1
+        if metrics.enabled and self.speed > 0:
+            metrics.mark(frame.timestamp, 'capture', frame.timestamp, start=started)
+        return frame
+
+    def _apply_delta(self, position: int, record: TraceRecord) -> Frame:
+        """Bring the next ring slot up to ``position`` and return it"""
+        index = position % self.ring_size
+        slot, since = self._slots[index], self._slot_positions[index]
+        shape = (record.height, record.width, 4)
+        # The slot can catch up on its own if every frame since it was used is a delta
+        catch_up = slot is not None and slot.data.shape == shape and position - self.ring_size <= since and \
+            all(self._record(later).kind == DELTA for later in range(since + 1, position))
+        if slot is None or slot.data.shape != shape:
+            slot = self._slots[index] = Frame(np.empty(shape, dtype=np.uint8))
+        if catch_up:
+            for later in range(since + 1, position):
+                self.trace.apply(self._record(later), slot.data)
+        else:
+            np.copyto(slot.data, self._previous.data)
+        self.trace.apply(record, slot.data)
+        self._slot_positions[index] = position
+        return slot
+
+    def frames(self, max_frames: Optional[int] = None) -> Iterator[Frame]:
+        """Yield the trace's frames at the replay speed"""
+        count = 0
+        while max_frames is None or count < max_frames:
+            frame = self.grab()
+            if frame is None:
+                return
+            if self.speed > 0:
+                delay = frame.timestamp - self.clock()
+                if delay > 0:
+                    time.sleep(delay)
+            yield frame
+            count += 1
+
+    def __iter__(self) -> Iterator[Frame]:
+        return self.frames()
+
+    def __enter__(self) -> 'TraceReplay':
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Logging Pipeline
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger("UbuntuCast.Logging")
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DEFAULT_LOG_DIR = os.path.expanduser("~/.local/share/ubuntucast/logs")
+
+# Structured per-frame events; disabled unless an events file is configured
+EVENT_LOGGER = "UbuntuCast.Events"
+events = logging.getLogger(EVENT_LOGGER)
+events.propagate = False
+
+QUEUE_SIZE = 10000  # Records buffered for the writer before new ones are dropped
+MAX_RATE_KEYS = 1024  # Message keys tracked by the rate limiter
+
+
+class RateLimitFilter(logging.Filter):
+    """Passes at most ``burst`` records per message key in each ``interval``, dropping repeats
+
+    The key is the ``log_key`` given through ``extra``, or else the call
+    site, so a loop logging the same failure for every device is limited
+    as one source. Within a window a message identical to one already
+    passed is dropped outright. The first record of the next window says
+    how many were suppressed.
+    """
+
+    def __init__(self, interval: float = 10.0, burst: int = 5):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.suppressed_total = 0
+        self._windows: Dict[Any, list] = {}  # key -> [window start, passed messages, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.interval <= 0:
+            return True
+        key = getattr(record, 'log_key', None) or (record.name, record.pathname, record.lineno)
+        message = record.getMessage()
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                if window is None and len(self._windows) >= MAX_RATE_KEYS:
+                    self._expire(now)
+                self._windows[key] = [now, {message}, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+                return True
+            if message in window[1] or len(window[1]) >= self.burst:
+                window[2] += 1
+                self.suppressed_total += 1
+                return False
+            window[1].add(message)
+            return True
+
+    def _expire(self, now: float):
+        """Forget keys whose window has closed, or all of them if none has"""
+        expired = [key for key, window in self._windows.items() if now - window[0] >= self.interval]
+        for key in expired or list(self._windows):
+            del self._windows[key]
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the fields of an ``event`` dict passed through ``extra``"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        event = getattr(record, 'event', None)
+        if event:
+            entry.update(event)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(',', ':'), default=str)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread, dropping them rather than blocking when it falls behind"""
+
+    def __init__(self, log_queue: 'queue.Queue'):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _LoggerFilter(logging.Filter):
+    """Passes records from one logger, or with ``exclude``, every record except those"""
+
+    def __init__(self, name: str, exclude: bool = False):
+        super().__init__()
+        self.logger_name = name
+        self.exclude = exclude
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return (record.name == self.logger_name) != self.exclude
+
+
+class LogPipeline:
+    """Logging through a queue, so threads that log never wait on disk or terminal I/O
+
+    Records are rate limited on the logging thread, then queued and
+    written by a background listener to a rotating log file and stderr,
+    and to a JSON lines file for per-frame events when one is configured.
+    """
+
+    def __init__(self):
+        self.rate_limit = RateLimitFilter()
+        self.file_handler: Optional[logging.handlers.RotatingFileHandler] = None
+        self.events_handler: Optional[logging.handlers.RotatingFileHandler] = None
+        self._queue_handler: Optional[_DroppingQueueHandler] = None
+        self._events_queue_handler: Optional[_DroppingQueueHandler] = None
+        self._listener: Optional[logging.handlers.QueueListener] = None
+
+    @property
+    def dropped(self) -> int:
+        """Records dropped because the writer fell behind"""
+        return sum(handler.dropped for handler in (self._queue_handler, self._events_queue_handler)
+                   if handler is not None)
+
+    def start(self, log_dir: str = DEFAULT_LOG_DIR, level: int = logging.INFO, name: str = "ubuntucast"):
+        """Install the queue handler on the root logger and start the writer thread
+
+        ``name`` names the log file. Each process needs its own, as
+        rotating a file renames it under any other process writing to it.
+        """
+        if self._listener is not None:
+            return
+        os.makedirs(log_dir, exist_ok=True)
+        formatter = logging.Formatter(LOG_FORMAT)
+        self.file_handler = logging.handlers.RotatingFileHandler(
+            os.path.join(log_dir, f"{name}.log"), maxBytes=5 * 1024 * 1024, backupCount=3)
+        self.file_handler.setFormatter(formatter)
+        self.file_handler.addFilter(_LoggerFilter(EVENT_LOGGER, exclude=True))
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+        stream_handler.addFilter(_LoggerFilter(EVENT_LOGGER, exclude=True))
+
+        log_queue: 'queue.Queue' = queue.Queue(QUEUE_SIZE)
+        self._queue_handler = _DroppingQueueHandler(log_queue)
+        self._queue_handler.addFilter(self.rate_limit)
+        self._events_queue_handler = _DroppingQueueHandler(log_queue)
+        self._listener = logging.handlers.QueueListener(log_queue, self.file_handler, stream_handler,
+                                                        respect_handler_level=True)
+        self._listener.start()
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self._queue_handler)
+        root.setLevel(level)
+        events.addHandler(self._events_queue_handler)
+        events.setLevel(logging.WARNING)
+        atexit.register(self.shutdown)
+
+    def configure(self, config, frame_events: bool = True):
+        """Apply the log level, file rotation, rate limiting and events file from the ADVANCED section
+
+        Only the process running the pipeline should pass ``frame_events``,
+        so one process writes the events file.
+        """
+        level_name = config.get('ADVANCED', 'log_level', fallback='INFO').upper()
+        level = logging.getLevelName(level_name)
+        if not isinstance(level, int):
+            logger.warning(f"Unknown log level {level_name}, using INFO")
+            level = logging.INFO
+        logging.getLogger().setLevel(level)
+
+        self.rate_limit.interval = config.getfloat('ADVANCED', 'log_rate_limit_interval', fallback=10.0)
+        self.rate_limit.burst = config.getint('ADVANCED', 'log_rate_limit_burst', fallback=5)
+        max_bytes, backup_count = self._rotation(config)
+        if self.file_handler is not None:
+            # Read by the handler on every write, so they can change while it is open
+            self.file_handler.maxBytes = max_bytes
+            self.file_handler.backupCount = backup_count
+
+        events_file = config.get('ADVANCED', 'log_events_file', fallback='')
+        if frame_events and events_file and self._listener is not None and self.events_handler is None:
+            events_file = os.path.expanduser(events_file)
+            os.makedirs(os.path.dirname(os.path.abspath(events_file)), exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(events_file, maxBytes=max_bytes,
+                                                           backupCount=backup_count)
+            handler.setFormatter(JsonFormatter())
+            handler.addFilter(_LoggerFilter(EVENT_LOGGER))
+            self._restart_listener(handler)
+            self.events_handler = handler
+            events.setLevel(logging.DEBUG)
+            logger.info(f"Writing frame events to {events_file}")
+
+    @staticmethod
+    def _rotation(config) -> Tuple[int, int]:
+        max_bytes = config.getint('ADVANCED', 'log_max_bytes', fallback=5 * 1024 * 1024)
+        backup_count = config.getint('ADVANCED', 'log_backup_count', fallback=3)
+        return max_bytes, backup_count
+
+    def _restart_listener(self, handler: logging.Handler):
+        """Add a handler to the writer thread, which only takes handlers when it is created"""
+        listener = self._listener
+        listener.stop()
+        self._listener = logging.handlers.QueueListener(listener.queue, *listener.handlers, handler,
+                                                        respect_handler_level=True)
+        self._listener.start()
+
+    def shutdown(self):
+        """Write out the queued records and stop the writer thread"""
+        if self._listener is None:
+            return
+        # Later records fall through to logging's last resort handler on stderr
+        logging.getLogger().removeHandler(self._queue_handler)
+        events.removeHandler(self._events_queue_handler)
+        events.setLevel(logging.WARNING)
+        self._listener.stop()
+        self._listener = None
+        for handler in (self.file_handler, self.events_handler):
+            if handler is not None:
+                handler.close()
+        self.events_handler = None
+        if self.dropped:
+            logger.warning(f"{self.dropped} log records were dropped because the writer fell behind")
+
+
+log_pipeline = LogPipeline()
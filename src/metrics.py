@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Pipeline Metrics and Tracing
+
+import bisect
+import collections
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("UbuntuCast.Metrics")
+
+# Frame stages in pipeline order, also the trace dump's thread ids
+STAGES = ('capture', 'diff', 'convert', 'queue', 'encode', 'send')
+
+# Histogram bucket bounds in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+RECOVERY_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative bucket counts plus a rolling window of recent samples for quantiles"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS, window: int = 512):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent: Deque[float] = collections.deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Quantile of the recent window"""
+        recent = sorted(self.recent)
+        if not recent:
+            return None
+        return recent[min(len(recent) - 1, int(q * len(recent)))]
+
+
+class _FrameTrace:
+    """A frame on its way through the pipeline, identified by its capture timestamp"""
+    __slots__ = ('number', 'start', 'last', 'stage', 'segment', 'offset')
+
+    def __init__(self, number: int, start: float):
+        self.number = number
+        self.start = start
+        self.last = start
+        self.stage = None
+        self.segment = -1
+        self.offset = 0
+
+
+class Metrics:
+    """Counters, latency histograms and per-frame trace spans for the casting pipeline
+
+    Disabled by default. Instrumented code checks ``metrics.enabled`` before
+    doing any work, so a disabled instance costs one attribute lookup per
+    call site.
+
+    A frame is followed by its capture timestamp. Each ``mark`` closes the
+    span from the frame's previous mark, recording the stage's latency.
+    Encoded frames lose their identity in ffmpeg, so the encoder marks
+    them ``queue`` when written and ``fragment_published`` matches them,
+    in order, to the video samples of each fragment the segmenter sees.
+    The first read of a fragment by any receiver ends the frame's ``send``
+    span and its end-to-end latency.
+    """
+
+    def __init__(self, max_frames: int = 512):
+        self.enabled = False
+        self.max_frames = max_frames
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._gauges: Dict[str, Callable[[], Optional[float]]] = {}
+        self._frames: 'collections.OrderedDict[float, _FrameTrace]' = collections.OrderedDict()
+        self._frame_number = 0
+        self._trace_file = None
+        self._server: Optional[MetricsServer] = None
+
+        self.describe('ubuntucast_stage_seconds', 'histogram', "Time frames spend in each pipeline stage")
+        self.describe('ubuntucast_frame_latency_seconds', 'histogram',
+                      "Time from capturing a frame to the first receiver reading it")
+        self.describe('ubuntucast_frames_total', 'counter', "Captured frames by outcome")
+        self.describe('ubuntucast_frames_dropped_total', 'counter', "Frames dropped by stage")
+        self.describe('ubuntucast_resume_seconds', 'histogram',
+                      "Time from losing a receiver to it playing the live stream again", RECOVERY_BUCKETS)
+        self.describe('ubuntucast_resumes_total', 'counter', "Receiver reconnection attempts by outcome")
+        self.describe('ubuntucast_audio_underruns_total', 'counter', "Audio chunks padded with silence")
+        self.describe('ubuntucast_audio_overrun_frames_total', 'counter',
+                      "Audio frames discarded because the capture ring was full")
+
+    def configure(self, config):
+        """Enable metrics from the ADVANCED config section and start the endpoint and trace dump"""
+        if not config.getboolean('ADVANCED', 'metrics_enabled', fallback=False):
+            return
+        self.enabled = True
+        port = config.getint('ADVANCED', 'metrics_port', fallback=9477)
+        if port:
+            try:
+                self._server = MetricsServer(self, port=port)
+                self._server.start()
+            except OSError as e:
+                logger.error(f"Failed to start metrics endpoint on port {port}: {e}")
+        trace_file = config.get('ADVANCED', 'trace_file', fallback='')
+        if trace_file:
+            self.open_trace(trace_file)
+
+    def shutdown(self):
+        """Stop the endpoint and finish the trace dump"""
+        self.enabled = False
+        if self._server is not None:
+            self._server.stop()
+            self._server = None
+        self.close_trace()
+
+    def reset(self):
+        """Clear all recorded values, e.g. between benchmark runs"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._frames.clear()
+
+    def describe(self, name: str, kind: str, help_text: str,
+                 buckets: Optional[Tuple[float, ...]] = None):
+        """Set the Prometheus type and help text of a metric, and a histogram's bucket bounds"""
+        self._help[name] = (kind, help_text)
+        if buckets is not None:
+            self._buckets[name] = buckets
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Add to a counter"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        """Record a histogram sample"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self._buckets.get(name, LATENCY_BUCKETS))
+            histogram.observe(value)
+
+    def register_gauge(self, name: str, help_text: str, read: Callable[[], Optional[float]]):
+        """Export the value returned by ``read`` at scrape time, skipped while it returns None"""
+        self.describe(name, 'gauge', help_text)
+        self._gauges[name] = read
+
+    def unregister_gauge(self, name: str):
+        self._gauges.pop(name, None)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        return self._histograms.get(name, {}).get(tuple(sorted(labels.items())))
+
+    def counter(self, name: str, **labels) -> float:
+        return self._counters.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def mark(self, frame: float, stage: str, now: Optional[float] = None, start: Optional[float] = None):
+        """Close a frame's span for ``stage``; ``start`` begins tracing a new frame"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            trace = self._frames.get(frame)
+            if trace is None:
+                if start is None:
+                    return  # Not traced, or evicted after being dropped along the way
+                trace = self._begin(frame, start)
+            begin, trace.last, trace.stage = trace.last, now, stage
+        self._span(trace, stage, begin, now)
+
+    def forget(self, frame: float):
+        """Stop tracing a frame that goes no further, like an unchanged one"""
+        with self._lock:
+            self._frames.pop(frame, None)
+
+    def fragment_published(self, segment: int, offset: int, samples: int, now: Optional[float] = None):
+        """Match the next ``samples`` frames written to the encoder to a published fragment"""
+        now = time.monotonic() if now is None else now
+        published = []
+        with self._lock:
+            for trace in self._frames.values():
+                if len(published) == samples:
+                    break
+                if trace.stage == 'queue':
+                    published.append((trace, trace.last))
+                    trace.last, trace.stage = now, 'encode'
+                    trace.segment, trace.offset = segment, offset
+        for trace, begin in published:
+            self._span(trace, 'encode', begin, now)
+
+    def segment_read(self, segment: int, end: int, now: Optional[float] = None):
+        """Record that a receiver was handed a segment's bytes up to ``end``"""
+        now = time.monotonic() if now is None else now
+        sent = []
+        with self._lock:
+            for frame, trace in list(self._frames.items()):
+                if trace.stage == 'encode' and trace.segment == segment and trace.offset < end:
+                    sent.append((trace, trace.last))
+                    del self._frames[frame]
+        for trace, begin in sent:
+            self._span(trace, 'send', begin, now)
+            self.observe('ubuntucast_frame_latency_seconds', now - trace.start)
+
+    def discard_encoding(self):
+        """Forget frames inside the encoder, e.g. when it restarts and loses them"""
+        with self._lock:
+            for frame in [frame for frame, trace in self._frames.items() if trace.stage == 'queue']:
+                del self._frames[frame]
+
+    def _begin(self, frame: float, start: float) -> _FrameTrace:
+        self._frame_number += 1
+        trace = self._frames[frame] = _FrameTrace(self._frame_number, start)
+        while len(self._frames) > self.max_frames:
+            self._frames.popitem(last=False)
+        return trace
+
+    def _span(self, trace: _FrameTrace, stage: str, begin: float, end: float):
+        self.observe('ubuntucast_stage_seconds', end - begin, stage=stage)
+        trace_file = self._trace_file
+        if trace_file is not None:
+            event = {
+                'name': stage, 'cat': 'frame', 'ph': 'X', 'pid': 1,
+                'tid': STAGES.index(stage) if stage in STAGES else len(STAGES),
+                'ts': round(begin * 1e6, 1), 'dur': round((end - begin) * 1e6, 1),
+                'args': {'frame': trace.number},
+            }
+            with self._lock:
+                if self._trace_file is not None:
+                    self._trace_file.write(json.dumps(event) + ',\n')
+
+    def open_trace(self, path: str):
+        """Start dumping spans to ``path`` in Chrome trace event format (chrome://tracing, Perfetto)"""
+        try:
+            trace_file = open(path, 'w')
+        except OSError as e:
+            logger.error(f"Failed to open trace file {path}: {e}")
+            return
+        # Viewers accept an unterminated array, so a crash still leaves a usable trace
+        trace_file.write('[\n')
+        for tid, stage in enumerate(STAGES):
+            trace_file.write(json.dumps({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid,
+                                         'args': {'name': stage}}) + ',\n')
+        with self._lock:
+            self._trace_file = trace_file
+        logger.info(f"Writing pipeline trace to {path}")
+
+    def close_trace(self):
+        with self._lock:
+            trace_file, self._trace_file = self._trace_file, None
+        if trace_file is not None:
+            trace_file.write('{}]\n')
+            trace_file.close()
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines: List[str] = []
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: dict(series) for name, series in self._histograms.items()}
+
+        for name, series in sorted(counters.items()):
+            self._header(lines, name, 'counter')
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_labels(labels)} {value:g}")
+
+        for name, series in sorted(histograms.items()):
+            self._header(lines, name, 'histogram')
+            for labels, histogram in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+            # Quantiles over the recent window show what is happening now, not since start
+            recent = f"{name}_recent"
+            lines.append(f"# TYPE {recent} gauge")
+            for labels, histogram in sorted(series.items()):
+                for q in QUANTILES:
+                    value = histogram.quantile(q)
+                    if value is not None:
+                        lines.append(f"{recent}{_labels(labels + (('quantile', f'{q:g}'),))} {value:.6f}")
+
+        for name, read in sorted(self._gauges.items()):
+            try:
+                value = read()
+            except Exception as e:
+                logger.error(f"Error reading gauge {name}: {e}")
+                continue
+            if value is not None:
+                self._header(lines, name, 'gauge')
+                lines.append(f"{name} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, lines: List[str], name: str, kind: str):
+        kind, help_text = self._help.get(name, (kind, ''))
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    server: 'MetricsServer'
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """Serves /metrics for Prometheus on the loopback interface only"""
+    daemon_threads = True
+
+    def __init__(self, metrics: Metrics, host: str = '127.0.0.1', port: int = 9477):
+        super().__init__((host, port), _MetricsRequestHandler)
+        self.metrics = metrics
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="UbuntuCastMetrics")
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info(f"Metrics endpoint at http://127.0.0.1:{self.server_address[1]}/metrics")
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+# Shared by the whole process, configured once at startup
+metrics = Metrics()
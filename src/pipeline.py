@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Casting Pipeline
+
+import logging
+import threading
+from typing import Callable, Optional, Tuple
+
+from src.color_convert import ColorConverter
+from src.encoder import EncoderSettings, EncoderSupervisor
+from src.frame_diff import FrameDiffer
+from src.logging_setup import events
+from src.metrics import metrics
+from src.pipeline_clock import PipelineClock
+
+logger = logging.getLogger("UbuntuCast.Pipeline")
+
+
+class CastPipeline:
+    """Runs capture, damage tracking, colour conversion and encoding on a worker thread
+
+    ``source`` is anything with ``open()``, ``close()`` and a ``frames()``
+    iterator of BGRA frames, normally a ScreenCapture. Encoded output goes to
+    ``output_callback``. The encoder is started once the first frame tells
+    the pipeline the real output size. An optional AudioCapture is fed to
+    the encoder alongside; it and the source should stamp their frames
+    against the pipeline's ``clock``.
+    """
+
+    def __init__(self, source, output_size: Tuple[int, int], framerate: float,
+                 output_callback: Callable[[bytes], None], bitrate: int = 6000,
+                 codec: str = 'libx264', keyframe_interval: float = 1.0,
+                 keepalive_interval: float = 1.0, queue_size: int = 3,
+                 restart_callback: Optional[Callable[[], None]] = None,
+                 error_callback: Optional[Callable[[str], None]] = None,
+                 audio=None, audio_bitrate: int = 128, clock: Optional[PipelineClock] = None):
+        self.source = source
+        self.audio = audio
+        self.clock = clock or PipelineClock()
+        self.framerate = framerate
+        self.output_callback = output_callback
+        self.restart_callback = restart_callback
+        self.error_callback = error_callback
+        self.differ = FrameDiffer(keepalive_interval=keepalive_interval)
+        self.converter = ColorConverter(output_size)
+        self.encoder_settings = EncoderSettings(0, 0, framerate, self.converter.pixel_format,
+                                                bitrate, codec, keyframe_interval)
+        if audio is not None:
+            self.encoder_settings = self.encoder_settings.replace(audio_rate=audio.rate,
+                                                                  audio_channels=audio.channels,
+                                                                  audio_bitrate=audio_bitrate)
+        self.queue_size = queue_size
+        self.encoder: Optional[EncoderSupervisor] = None
+        self._pending_quality: Optional[Tuple[Tuple[int, int], float, int, int]] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the pipeline thread"""
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self.clock.start()
+        if self.audio is not None:
+            self.audio.output_callback = self._write_audio
+            self.audio.video_delay = self._video_delay
+            try:
+                self.audio.start()
+            except Exception as e:
+                logger.error(f"Failed to start audio capture, casting without audio: {e}")
+                self.audio = None
+                self.encoder_settings = self.encoder_settings.replace(audio_rate=0)
+        self._thread = threading.Thread(target=self._run, name="UbuntuCastPipeline")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the pipeline and the encoder"""
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._thread = None
+        if self.audio is not None:
+            self.audio.stop()
+        if self.encoder is not None:
+            self.encoder.stop()
+            self.encoder = None
+
+    def _write_audio(self, data):
+        """Audio feeder output: pass it on to the encoder once it runs"""
+        encoder = self.encoder
+        if encoder is not None:
+            encoder.write_audio(data)
+
+    def _video_delay(self) -> float:
+        """Seconds video frames currently take from capture to the encoder"""
+        encoder = self.encoder
+        return encoder.write_delay if encoder is not None else 0.0
+
+    def set_quality(self, output_size: Tuple[int, int], framerate: float, bitrate: int, workers: int = 0):
+        """Change the output size, frame rate, bitrate and worker limit from any thread
+
+        The change is picked up by the pipeline thread before the next frame;
+        the encoder is reconfigured when that frame reaches it. ``workers``
+        caps the encoder's threads, 0 for no limit.
+        """
+        self._pending_quality = (output_size, framerate, bitrate, workers)
+
+    def _apply_quality(self):
+        """Apply a quality change requested with set_quality"""
+        quality, self._pending_quality = self._pending_quality, None
+        if quality is None:
+            return
+        output_size, framerate, bitrate, workers = quality
+        if output_size != self.converter.max_size:
+            self.converter.set_output_size(output_size)
+        self.framerate = framerate
+        if hasattr(self.source, 'framerate'):
+            self.source.framerate = framerate
+        self.encoder_settings = self.encoder_settings.replace(framerate=framerate, bitrate=bitrate,
+                                                              threads=workers)
+
+    def _run(self):
+        """Pipeline thread body"""
+        try:
+            self.source.open()
+            for frame in self.source.frames():
+                if self._stop_event.is_set():
+                    break
+                if self._pending_quality is not None:
+                    self._apply_quality()
+                if self.differ.process(frame) is None:
+                    if metrics.enabled:
+                        metrics.forget(frame.timestamp)
+                        metrics.inc('ubuntucast_frames_total', result='unchanged')
+                    if events.isEnabledFor(logging.DEBUG):
+                        events.debug("frame", extra={'event': {'pts': frame.timestamp, 'result': 'unchanged'}})
+                    continue
+                if metrics.enabled:
+                    metrics.mark(frame.timestamp, 'diff', start=frame.timestamp)
+                planes = self.converter.convert(frame.data)
+                if metrics.enabled:
+                    metrics.mark(frame.timestamp, 'convert')
+                    metrics.inc('ubuntucast_frames_total', result='changed')
+                self._ensure_encoder(self.converter.output_size)
+                self.encoder.submit(planes, frame.timestamp)
+                if events.isEnabledFor(logging.DEBUG):
+                    width, height = self.converter.output_size
+                    events.debug("frame", extra={'event': {
+                        'pts': frame.timestamp, 'result': 'changed', 'width': width, 'height': height,
+                        'encoder_queue': self.encoder.queue_depth}})
+        except Exception as e:
+            logger.error(f"Error in casting pipeline: {e}")
+            if self.error_callback is not None and not self._stop_event.is_set():
+                self.error_callback(str(e))
+        finally:
+            self.source.close()
+
+    def stats(self) -> dict:
+        """Stage health and queue depths"""
+        encoder = self.encoder
+        return {
+            'mode': 'thread',
+            'stages': {
+                'pipeline': {'alive': self.is_running, 'frames': self.differ.frames_in,
+                             'unchanged': self.differ.frames_dropped},
+            },
+            'encoder_queue': encoder.queue_depth if encoder is not None else 0,
+            'audio': self.audio.stats() if self.audio is not None else None,
+        }
+
+    def _ensure_encoder(self, output_size: Tuple[int, int]):
+        """Start the encoder, or restart it if the converted frame size changed"""
+        width, height = output_size
+        settings = self.encoder_settings.replace(width=width, height=height)
+        if self.encoder is None:
+            self.encoder_settings = settings
+            self.encoder = EncoderSupervisor(settings, self.output_callback,
+                                             queue_size=self.queue_size,
+                                             restart_callback=self.restart_callback,
+                                             error_callback=self.error_callback)
+            self.encoder.start()
+        elif settings != self.encoder.settings:
+            self.encoder_settings = settings
+            self.encoder.reconfigure(settings)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Pipeline Clock
+
+import time
+from typing import Callable, Optional
+
+
+class PipelineClock:
+    """The single time base that audio and video frames are stamped against
+
+    Timestamps are in seconds of the underlying monotonic clock, so they can
+    be compared with timestamps taken anywhere else in the process. ``start``
+    marks the origin of the stream's presentation timeline. A different
+    ``now`` function can be injected to run the pipeline on simulated time.
+    """
+
+    def __init__(self, now: Callable[[], float] = time.monotonic):
+        self.now = now
+        self.start_time: Optional[float] = None
+
+    def start(self) -> float:
+        """Mark the start of the presentation timeline"""
+        self.start_time = self.now()
+        return self.start_time
+
+    def elapsed(self, timestamp: Optional[float] = None) -> float:
+        """Seconds from the start of the timeline to ``timestamp``, or to now"""
+        if self.start_time is None:
+            return 0.0
+        return (self.now() if timestamp is None else timestamp) - self.start_time
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Multi-process Pipeline Runner
+
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.color_convert import ColorConverter
+from src.frame_diff import FrameDiffer
+from src.logging_setup import events
+from src.metrics import metrics
+from src.pipeline import CastPipeline
+
+logger = logging.getLogger("UbuntuCast.PipelineRunner")
+
+# Per-stage counters in the shared health array
+HEALTH_FIELDS = ('heartbeat', 'frames', 'unchanged', 'dropped')
+
+# Layout of the shared control block written by the parent
+CONTROL_FRAMERATE, CONTROL_WIDTH, CONTROL_HEIGHT, CONTROL_GENERATION, CONTROL_WORKERS = range(5)
+
+
+def default_worker_count() -> int:
+    """Converter processes to use: the cores left after capture, encoding and the UI"""
+    return max(1, min(4, (os.cpu_count() or 1) - 2))
+
+
+class _StageHealth:
+    """A stage's view of its row in the shared health array"""
+
+    def __init__(self, health, stage: int):
+        self._health = health
+        self._offset = stage * len(HEALTH_FIELDS)
+
+    def beat(self):
+        self._health[self._offset] = time.monotonic()
+
+    def count(self, field: str, amount: int = 1):
+        self._health[self._offset + HEALTH_FIELDS.index(field)] += amount
+
+
+def _capture_stage(source_factory, keepalive_interval, control, health, stop_event,
+                   bgra_free, bgra_ready):
+    """Capture process: grab and diff frames, copying changed ones into shared slots"""
+    stage = _StageHealth(health, 0)
+    source = source_factory()
+    differ = FrameDiffer(keepalive_interval=keepalive_interval)
+    segments: Dict[int, shared_memory.SharedMemory] = {}
+    sequence = 0
+    try:
+        source.open()
+        for frame in source.frames():
+            stage.beat()
+            if stop_event.is_set():
+                break
+            if hasattr(source, 'framerate'):
+                source.framerate = control[CONTROL_FRAMERATE]
+            stage.count('frames')
+            if differ.process(frame) is None:
+                stage.count('unchanged')
+                continue
+            try:
+                index = bgra_free.get_nowait()
+            except queue.Empty:
+                # Converters are behind, drop this frame rather than stall capture
+                stage.count('dropped')
+                continue
+
+            data = frame.data
+            segment = segments.get(index)
+            if segment is None or segment.size < data.nbytes:
+                # First use, or the source grew: give this slot a bigger segment
+                if segment is not None:
+                    segment.close()
+                    segment.unlink()
+                segment = segments[index] = shared_memory.SharedMemory(create=True, size=data.nbytes)
+            np.copyto(np.ndarray(data.shape, np.uint8, segment.buf), data)
+            bgra_ready.put((index, segment.name, sequence, frame.timestamp, frame.width, frame.height))
+            sequence += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
+        for segment in segments.values():
+            segment.close()
+            segment.unlink()
+
+
+def _convert_stage(worker, max_size, pixel_format, yuv_names, control, health, stop_event,
+                   bgra_free, bgra_ready, yuv_free, yuv_ready):
+    """Converter process: colour convert and scale frames from shared slot to shared slot"""
+    stage = _StageHealth(health, worker + 1)
+    converter = ColorConverter(max_size, pixel_format)
+    outputs = [shared_memory.SharedMemory(name=name) for name in yuv_names]
+    inputs: Dict[int, shared_memory.SharedMemory] = {}
+    generation = 0
+    try:
+        while not stop_event.is_set():
+            stage.beat()
+            if worker >= control[CONTROL_WORKERS]:
+                # Parked to limit CPU use; the other converters take the frames
+                stop_event.wait(0.2)
+                continue
+            try:
+                index, name, sequence, timestamp, width, height = bgra_ready.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if control[CONTROL_GENERATION] != generation:
+                generation = control[CONTROL_GENERATION]
+                converter.set_output_size((int(control[CONTROL_WIDTH]), int(control[CONTROL_HEIGHT])))
+
+            segment = inputs.get(index)
+            if segment is None or segment.name != name:
+                # Capture replaced this slot's segment with a bigger one; let go of the old mapping
+                if segment is not None:
+                    segment.close()
+                segment = inputs[index] = shared_memory.SharedMemory(name=name)
+            planes = converter.convert(np.ndarray((height, width, 4), np.uint8, segment.buf))
+            bgra_free.put(index)
+
+            while True:
+                try:
+                    output = yuv_free.get(timeout=0.2)
+                    break
+                except queue.Empty:
+                    if stop_event.is_set():
+                        return
+            np.copyto(np.ndarray(planes.nbytes, np.uint8, outputs[output].buf), planes.reshape(-1))
+            out_width, out_height = converter.output_size
+            yuv_ready.put((output, sequence, timestamp, out_width, out_height, planes.nbytes, generation))
+            stage.count('frames')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for segment in list(inputs.values()) + outputs:
+            segment.close()
+
+
+class ProcessPipeline(CastPipeline):
+    """Runs capture and colour conversion in separate processes to escape the GIL
+
+    A capture process grabs and diffs frames and copies changed ones into
+    shared-memory BGRA slots. A pool of converter processes turns them into
+    YUV in shared-memory output slots, so conversion of consecutive frames
+    runs on several cores at once. This process reorders the converted
+    frames and feeds the encoder, exactly as the threaded pipeline does.
+    Only slot indices and a few numbers travel through the queues; frame
+    data is never pickled.
+
+    ``source_factory`` is called in the capture process to create the frame
+    source, since X connections cannot cross processes. ``health_callback``
+    receives ``stats()`` once a second, and a stage process that dies ends
+    the session through ``error_callback``.
+    """
+
+    def __init__(self, source_factory: Callable, output_size: Tuple[int, int], framerate: float,
+                 output_callback: Callable[[bytes], None], workers: int = 0,
+                 input_slots: int = 0, output_slots: int = 0,
+                 health_callback: Optional[Callable[[dict], None]] = None,
+                 keepalive_interval: float = 1.0, **kwargs):
+        super().__init__(None, output_size, framerate, output_callback,
+                         keepalive_interval=keepalive_interval, **kwargs)
+        self.source_factory = source_factory
+        self.keepalive_interval = keepalive_interval
+        self.workers = workers or default_worker_count()
+        # Every worker needs an input and an output slot in flight, plus headroom to absorb jitter
+        self.input_slots = input_slots or self.workers + 2
+        self.output_slots = output_slots or self.workers + 3
+        self.health_callback = health_callback
+
+        self._context = multiprocessing.get_context('spawn')
+        self._processes: List[multiprocessing.Process] = []
+        self._output_segments: List[shared_memory.SharedMemory] = []
+        self._control = self._context.Array('d', [framerate, output_size[0], output_size[1], 0, self.workers])
+        self._health = self._context.Array('d', (1 + self.workers) * len(HEALTH_FIELDS), lock=False)
+        self._process_stop = self._context.Event()
+        self._queues: Dict[str, multiprocessing.Queue] = {}
+        self._monitor: Optional[threading.Thread] = None
+        self._generation = 0  # Newest quality generation delivered to the encoder
+        self.frames_skipped = 0  # Frames given up on because a converter never delivered them
+
+    def start(self):
+        """Start the stage processes, the encoder feeding thread and the health monitor"""
+        if self.is_running:
+            return
+        max_size = self.converter.max_size
+        frame_bytes = max_size[0] * max_size[1] * 3 // 2
+        self._output_segments = [shared_memory.SharedMemory(create=True, size=frame_bytes)
+                                 for _ in range(self.output_slots)]
+        self._queues = {name: self._context.Queue()
+                        for name in ('bgra_free', 'bgra_ready', 'yuv_free', 'yuv_ready')}
+        for index in range(self.input_slots):
+            self._queues['bgra_free'].put(index)
+        for index in range(self.output_slots):
+            self._queues['yuv_free'].put(index)
+        self._process_stop.clear()
+
+        common = (self._control, self._health, self._process_stop)
+        self._processes = [self._context.Process(
+            target=_capture_stage, name="UbuntuCastCapture",
+            args=(self.source_factory, self.keepalive_interval) + common
+            + (self._queues['bgra_free'], self._queues['bgra_ready'])
+        )]
+        names = [segment.name for segment in self._output_segments]
+        for worker in range(self.workers):
+            self._processes.append(self._context.Process(
+                target=_convert_stage, name=f"UbuntuCastConvert{worker}",
+                args=(worker, max_size, self.converter.pixel_format, names) + common
+                + tuple(self._queues[name] for name in ('bgra_free', 'bgra_ready', 'yuv_free', 'yuv_ready'))
+            ))
+        for process in self._processes:
+            process.daemon = True
+            process.start()
+        logger.info(f"Started capture process and {self.workers} converter processes")
+
+        super().start()
+        self._monitor = threading.Thread(target=self._monitor_stages, name="UbuntuCastStageMonitor")
+        self._monitor.daemon = True
+        self._monitor.start()
+
+    def stop(self):
+        """Stop the stage processes and the encoder"""
+        self._process_stop.set()
+        super().stop()
+        for process in self._processes:
+            process.join(timeout=3)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        for stage_queue in self._queues.values():
+            stage_queue.close()
+            stage_queue.cancel_join_thread()
+        self._queues = {}
+        for segment in self._output_segments:
+            segment.close()
+            segment.unlink()
+        self._output_segments = []
+
+    def _apply_quality(self):
+        """Hand a quality change to the stage processes through the control block"""
+        quality, self._pending_quality = self._pending_quality, None
+        if quality is None:
+            return
+        output_size, framerate, bitrate, workers = quality
+        max_size = self.converter.max_size
+        if output_size[0] * output_size[1] > max_size[0] * max_size[1]:
+            logger.warning(f"Output size {output_size} exceeds the shared slots, keeping {max_size}")
+            output_size = max_size
+        with self._control.get_lock():
+            self._control[CONTROL_FRAMERATE] = framerate
+            self._control[CONTROL_WIDTH] = output_size[0]
+            self._control[CONTROL_HEIGHT] = output_size[1]
+            self._control[CONTROL_GENERATION] += 1
+            self._control[CONTROL_WORKERS] = min(workers, self.workers) if workers else self.workers
+        self.framerate = framerate
+        self.encoder_settings = self.encoder_settings.replace(framerate=framerate, bitrate=bitrate,
+                                                              threads=workers)
+
+    def _run(self):
+        """Encoder feeding thread: put converted frames back in order and submit them"""
+        yuv_ready = self._queues['yuv_ready']
+        pending: Dict[int, tuple] = {}
+        next_sequence = 0
+        waiting_since = time.monotonic()
+        try:
+            while not self._stop_event.is_set():
+                if self._pending_quality is not None:
+                    self._apply_quality()
+                try:
+                    item = yuv_ready.get(timeout=0.1)
+                    if item[1] < next_sequence:
+                        # Already skipped; newer frames went to the encoder in its place
+                        self._queues['yuv_free'].put(item[0])
+                    else:
+                        if not pending:
+                            waiting_since = time.monotonic()
+                        pending[item[1]] = item
+                except queue.Empty:
+                    pass
+
+                while next_sequence in pending:
+                    self._deliver(pending.pop(next_sequence))
+                    next_sequence += 1
+                    waiting_since = time.monotonic()
+                if not pending:
+                    continue
+                # A frame this late is not coming, and once every output slot waits here it cannot
+                if time.monotonic() - waiting_since > 0.1 or len(pending) >= self.output_slots:
+                    self.frames_skipped += min(pending) - next_sequence
+                    next_sequence = min(pending)
+        except Exception as e:
+            logger.error(f"Error in casting pipeline: {e}")
+            if self.error_callback is not None and not self._stop_event.is_set():
+                self.error_callback(str(e))
+
+    def _deliver(self, item: tuple):
+        """Submit one converted frame to the encoder and recycle its slot"""
+        index, sequence, timestamp, width, height, size, generation = item
+        try:
+            # Around a quality change workers finish old-size frames after new-size ones
+            if generation < self._generation:
+                return
+            self._generation = generation
+            if metrics.enabled:
+                # Capture and conversion happen in other processes, so trace them as one span
+                metrics.mark(timestamp, 'convert', start=timestamp)
+            self._ensure_encoder((width, height))
+            planes = np.ndarray(size, np.uint8, self._output_segments[index].buf)
+            self.encoder.submit(planes, timestamp)
+            if events.isEnabledFor(logging.DEBUG):
+                events.debug("frame", extra={'event': {
+                    'pts': timestamp, 'result': 'changed', 'sequence': sequence, 'width': width, 'height': height,
+                    'encoder_queue': self.encoder.queue_depth, 'skipped': self.frames_skipped}})
+        finally:
+            self._queues['yuv_free'].put(index)
+
+    def stats(self) -> dict:
+        """Stage health and queue depths"""
+        now = time.monotonic()
+        stages = {}
+        for stage, process in enumerate(self._processes):
+            row = self._health[stage * len(HEALTH_FIELDS):(stage + 1) * len(HEALTH_FIELDS)]
+            values = dict(zip(HEALTH_FIELDS, row))
+            name = 'capture' if stage == 0 else f'convert{stage - 1}'
+            stages[name] = {
+                'alive': process.is_alive(),
+                'heartbeat_age': now - values['heartbeat'] if values['heartbeat'] else None,
+                'frames': int(values['frames']),
+            }
+            if stage == 0:
+                stages[name]['unchanged'] = int(values['unchanged'])
+                stages[name]['dropped'] = int(values['dropped'])
+        encoder = self.encoder
+        return {
+            'mode': 'process',
+            'stages': stages,
+            'convert_queue': self._queue_depth('bgra_ready'),
+            'encode_queue': self._queue_depth('yuv_ready'),
+            'encoder_queue': encoder.queue_depth if encoder is not None else 0,
+            'skipped': self.frames_skipped,
+            'audio': self.audio.stats() if self.audio is not None else None,
+        }
+
+    def _queue_depth(self, name: str) -> int:
+        try:
+            return self._queues[name].qsize()
+        except (KeyError, NotImplementedError):
+            return 0
+
+    def _monitor_stages(self):
+        """Report stage health once a second and fail the session if a stage process dies"""
+        reported = {'changed': 0, 'unchanged': 0, 'dropped': 0, 'skipped': 0}
+        while not self._stop_event.wait(1.0):
+            stats = self.stats()
+            if metrics.enabled and 'capture' in stats['stages']:
+                # Stage processes count on their own, pass the increments on
+                capture = stats['stages']['capture']
+                counts = dict(capture, changed=capture['frames'] - capture['unchanged'],
+                              skipped=stats['skipped'])
+                for result in ('changed', 'unchanged'):
+                    metrics.inc('ubuntucast_frames_total', counts[result] - reported[result], result=result)
+                metrics.inc('ubuntucast_frames_dropped_total', counts['dropped'] - reported['dropped'],
+                            stage='capture')
+                metrics.inc('ubuntucast_frames_dropped_total', counts['skipped'] - reported['skipped'],
+                            stage='convert')
+                reported = {key: counts[key] for key in reported}
+            dead = [name for name, stage in stats['stages'].items() if not stage['alive']]
+            if dead:
+                message = f"pipeline stage {', '.join(dead)} exited"
+                logger.error(message)
+                if self.error_callback is not None and not self._stop_event.is_set():
+                    self.error_callback(message)
+                return
+            if self.health_callback is not None:
+                try:
+                    self.health_callback(stats)
+                except Exception as e:
+                    logger.error(f"Error in pipeline health callback: {e}")
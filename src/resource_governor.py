@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# CPU and Thermal Resource Governor
+
+import glob
+import logging
+import os
+import time
+from typing import Callable, Dict, NamedTuple, Optional, Sequence
+
+from src.metrics import metrics
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+logger = logging.getLogger("UbuntuCast.ResourceGovernor")
+
+# psutil sensor groups that report the CPU package or cores
+CPU_SENSORS = ('coretemp', 'k10temp', 'zenpower', 'cpu_thermal', 'cpu-thermal', 'soc_thermal', 'acpitz')
+
+
+class ResourceReading(NamedTuple):
+    """One sample of the machine's state; None where it cannot be read"""
+    process_cpu: float  # Percent of all cores used by UbuntuCast and its child processes
+    system_cpu: Optional[float] = None  # Percent of all cores busy
+    load: Optional[float] = None  # One-minute load average per core
+    temperature: Optional[float] = None  # Hottest CPU sensor, degrees Celsius
+
+
+class GovernorLevel(NamedTuple):
+    """One step down from the session's quality, as fractions of what it would otherwise use"""
+    framerate_scale: float
+    size_scale: float
+    worker_scale: float  # Encoder threads and converter processes; 0 leaves one
+
+    def describe(self) -> str:
+        parts = []
+        if self.framerate_scale < 1:
+            parts.append(f"{self.framerate_scale:.0%} frame rate")
+        if self.size_scale < 1:
+            parts.append(f"{self.size_scale:.0%} size")
+        if self.worker_scale < 1:
+            parts.append("one worker" if self.worker_scale == 0 else f"{self.worker_scale:.0%} workers")
+        return ", ".join(parts) or "full quality"
+
+
+# Cheapest sacrifice first: parallelism, then frame rate, then resolution
+LEVELS = (
+    GovernorLevel(1.0, 1.0, 1.0),
+    GovernorLevel(1.0, 1.0, 0.5),
+    GovernorLevel(0.75, 1.0, 0.5),
+    GovernorLevel(0.5, 1.0, 0.5),
+    GovernorLevel(0.5, 0.75, 0.0),
+    GovernorLevel(0.5, 0.5, 0.0),
+)
+
+
+class ResourceSampler:
+    """Reads CPU use, load and temperature, through psutil when it is installed
+
+    Each call reports CPU use since the previous one. Without psutil only
+    this process's own CPU time is counted, not ffmpeg's or the stage
+    processes', and temperatures come from the kernel's thermal zones.
+    """
+
+    def __init__(self):
+        self.cpu_count = os.cpu_count() or 1
+        self._process = psutil.Process() if PSUTIL_AVAILABLE else None
+        self._children: Dict[int, 'psutil.Process'] = {}
+        self._last_cpu = (time.monotonic(), time.process_time())
+        if PSUTIL_AVAILABLE:
+            psutil.cpu_percent(None)
+            self._process.cpu_percent(None)
+        else:
+            logger.warning("psutil not found, counting only this process's CPU time")
+
+    def __call__(self) -> ResourceReading:
+        if PSUTIL_AVAILABLE:
+            process_cpu = self._process_tree_cpu()
+            system_cpu = psutil.cpu_percent(None)
+        else:
+            now, cpu = time.monotonic(), time.process_time()
+            last_now, last_cpu = self._last_cpu
+            self._last_cpu = (now, cpu)
+            process_cpu = 100.0 * (cpu - last_cpu) / max(now - last_now, 1e-6) / self.cpu_count
+            system_cpu = None
+        try:
+            load = os.getloadavg()[0] / self.cpu_count
+        except OSError:
+            load = None
+        return ResourceReading(process_cpu, system_cpu, load, self._temperature())
+
+    def _process_tree_cpu(self) -> float:
+        """CPU use of this process and its children, as a percentage of all cores"""
+        total = self._process.cpu_percent(None)
+        try:
+            children = self._process.children(recursive=True)
+        except psutil.Error:
+            children = []
+        current = {}
+        for child in children:
+            # Keep the same objects, whose previous sample the next reading is measured from
+            process = current[child.pid] = self._children.get(child.pid, child)
+            try:
+                total += process.cpu_percent(None)
+            except psutil.Error:
+                current.pop(child.pid)
+        self._children = current
+        return total / self.cpu_count
+
+    @staticmethod
+    def _temperature() -> Optional[float]:
+        if PSUTIL_AVAILABLE and hasattr(psutil, 'sensors_temperatures'):
+            try:
+                sensors = psutil.sensors_temperatures()
+            except (OSError, RuntimeError):
+                sensors = {}
+            readings = [entry.current for name in CPU_SENSORS for entry in sensors.get(name, ())]
+            return max(readings) if readings else None
+        readings = []
+        for path in glob.glob('/sys/class/thermal/thermal_zone*/temp'):
+            try:
+                with open(path) as zone:
+                    readings.append(int(zone.read()) / 1000)
+            except (OSError, ValueError):
+                continue
+        return max(readings) if readings else None
+
+
+class ResourceGovernor:
+    """Steps capture and encoding down when the machine runs short of CPU or hot, and back up
+
+    ``update`` is called periodically, takes a reading from ``sampler``,
+    or the one passed in, and hands a changed level to ``apply_callback``.
+    It steps one level down once any budget has been exceeded for
+    ``down_samples`` readings in a row, and one level up once every reading
+    has stayed below ``headroom`` times its budget, and the temperature
+    ``temperature_margin`` below its limit, for ``upswitch_delay`` seconds.
+    Readings between the two thresholds hold the level, which keeps it
+    from oscillating as the cut in load it made brings usage down.
+
+    The load average trails a change by a minute, too slowly to step down
+    on, so it only holds back stepping up while the machine is busy. The
+    temperature trails too, which ``switch_interval`` allows for.
+    """
+
+    def __init__(self, apply_callback: Callable[[GovernorLevel], None],
+                 sampler: Optional[Callable[[], ResourceReading]] = None,
+                 cpu_budget: float = 50.0, system_cpu_budget: float = 90.0, load_budget: float = 1.5,
+                 temperature_limit: float = 85.0, headroom: float = 0.8, temperature_margin: float = 5.0,
+                 down_samples: int = 3, upswitch_delay: float = 20.0, switch_interval: float = 10.0,
+                 levels: Sequence[GovernorLevel] = LEVELS, clock: Callable[[], float] = time.monotonic):
+        self.apply_callback = apply_callback
+        self.sampler = sampler or ResourceSampler()
+        self.cpu_budget = cpu_budget
+        self.system_cpu_budget = system_cpu_budget
+        self.load_budget = load_budget
+        self.temperature_limit = temperature_limit
+        self.headroom = headroom
+        self.temperature_margin = temperature_margin
+        self.down_samples = down_samples
+        self.upswitch_delay = upswitch_delay
+        self.switch_interval = switch_interval
+        self.levels = levels
+        self.clock = clock
+
+        self.level_index = 0
+        self.switches = 0
+        self.reading: Optional[ResourceReading] = None
+        self.reason = ""  # Budget that caused the last step down
+        self._over_samples = 0
+        self._last_switch = clock()
+        self._clear_since = self._last_switch
+
+    @property
+    def level(self) -> GovernorLevel:
+        return self.levels[self.level_index]
+
+    def _exceeded(self, reading: ResourceReading) -> str:
+        """The first budget the reading exceeds, or an empty string"""
+        if reading.temperature is not None and reading.temperature > self.temperature_limit:
+            return f"CPU at {reading.temperature:.0f} °C"
+        if reading.process_cpu > self.cpu_budget:
+            return f"casting using {reading.process_cpu:.0f}% CPU"
+        if reading.system_cpu is not None and reading.system_cpu > self.system_cpu_budget:
+            return f"system CPU at {reading.system_cpu:.0f}%"
+        return ""
+
+    def _has_headroom(self, reading: ResourceReading) -> bool:
+        return ((reading.temperature is None
+                 or reading.temperature < self.temperature_limit - self.temperature_margin)
+                and reading.process_cpu < self.cpu_budget * self.headroom
+                and (reading.system_cpu is None or reading.system_cpu < self.system_cpu_budget * self.headroom)
+                and (reading.load is None or reading.load < self.load_budget * self.headroom))
+
+    def update(self, reading: Optional[ResourceReading] = None) -> Optional[GovernorLevel]:
+        """Take a reading and decide on the level, returning the new level if it changed"""
+        now = self.clock()
+        if reading is None:
+            try:
+                reading = self.sampler()
+            except Exception as e:
+                logger.error(f"Error reading resource usage: {e}")
+                return None
+        self.reading = reading
+
+        reason = self._exceeded(reading)
+        if reason:
+            self._over_samples += 1
+            self._clear_since = now
+        else:
+            self._over_samples = 0
+            if not self._has_headroom(reading):
+                self._clear_since = now
+        if now - self._last_switch < self.switch_interval:
+            return None
+
+        if self._over_samples >= self.down_samples and self.level_index + 1 < len(self.levels):
+            self.reason = reason
+            return self._switch(self.level_index + 1, now, 'down', reason)
+        if self.level_index > 0 and now - self._clear_since >= self.upswitch_delay:
+            if self.level_index == 1:
+                self.reason = ""
+            return self._switch(self.level_index - 1, now, 'up', "headroom returned")
+        return None
+
+    def _switch(self, index: int, now: float, direction: str, reason: str) -> GovernorLevel:
+        self.level_index = index
+        self.switches += 1
+        self._last_switch = now
+        self._clear_since = now
+        self._over_samples = 0
+        logger.info(f"Resource governor stepping {direction} to {self.level.describe()} ({reason})")
+        if metrics.enabled:
+            metrics.inc('ubuntucast_governor_switches_total', direction=direction)
+        try:
+            self.apply_callback(self.level)
+        except Exception as e:
+            logger.error(f"Error applying resource level: {e}")
+        return self.level
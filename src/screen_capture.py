@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# X11 Screen Capture Engine
+
+import contextlib
+import ctypes
+import ctypes.util
+import logging
+import os
+import time
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from src.metrics import metrics
+
+# python-xlib is only needed for the fallback path when MIT-SHM is unavailable
+try:
+    from Xlib import X, display as xdisplay
+    XLIB_AVAILABLE = True
+except ImportError:
+    XLIB_AVAILABLE = False
+
+logger = logging.getLogger("UbuntuCast.ScreenCapture")
+
+# X11 constants
+ZPIXMAP = 2
+ALL_PLANES = 0xFFFFFFFF
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+
+
+class XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ('shmseg', ctypes.c_ulong),
+        ('shmid', ctypes.c_int),
+        ('shmaddr', ctypes.c_void_p),
+        ('readOnly', ctypes.c_int),
+    ]
+
+
+class XImage(ctypes.Structure):
+    # Only the leading fields are declared; images are always allocated by Xlib
+    _fields_ = [
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('xoffset', ctypes.c_int),
+        ('format', ctypes.c_int),
+        ('data', ctypes.c_void_p),
+        ('byte_order', ctypes.c_int),
+        ('bitmap_unit', ctypes.c_int),
+        ('bitmap_bit_order', ctypes.c_int),
+        ('bitmap_pad', ctypes.c_int),
+        ('depth', ctypes.c_int),
+        ('bytes_per_line', ctypes.c_int),
+        ('bits_per_pixel', ctypes.c_int),
+    ]
+
+
+class XWindowAttributes(ctypes.Structure):
+    _fields_ = [
+        ('x', ctypes.c_int),
+        ('y', ctypes.c_int),
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('border_width', ctypes.c_int),
+        ('depth', ctypes.c_int),
+        ('visual', ctypes.c_void_p),
+        ('root', ctypes.c_ulong),
+        ('class', ctypes.c_int),
+        ('bit_gravity', ctypes.c_int),
+        ('win_gravity', ctypes.c_int),
+        ('backing_store', ctypes.c_int),
+        ('backing_planes', ctypes.c_ulong),
+        ('backing_pixel', ctypes.c_ulong),
+        ('save_under', ctypes.c_int),
+        ('colormap', ctypes.c_ulong),
+        ('map_installed', ctypes.c_int),
+        ('map_state', ctypes.c_int),
+        ('all_event_masks', ctypes.c_long),
+        ('your_event_mask', ctypes.c_long),
+        ('do_not_propagate_mask', ctypes.c_long),
+        ('override_redirect', ctypes.c_int),
+        ('screen', ctypes.c_void_p),
+    ]
+
+
+class XErrorEvent(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_int),
+        ('display', ctypes.c_void_p),
+        ('resourceid', ctypes.c_ulong),
+        ('serial', ctypes.c_ulong),
+        ('error_code', ctypes.c_ubyte),
+        ('request_code', ctypes.c_ubyte),
+        ('minor_code', ctypes.c_ubyte),
+    ]
+
+
+X_ERROR_HANDLER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(XErrorEvent))
+
+
+def _load_library(name: str) -> Optional[ctypes.CDLL]:
+    """Load a shared library by its short name, returning None if it is missing"""
+    path = ctypes.util.find_library(name)
+    if not path:
+        return None
+    try:
+        return ctypes.CDLL(path)
+    except OSError:
+        return None
+
+
+def _bind_x11(libx11, libxext, libc):
+    """Declare the argument and return types of the X11, XShm and SysV functions used"""
+    libx11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+    libx11.XOpenDisplay.restype = ctypes.c_void_p
+    libx11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+    libx11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+    libx11.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    libx11.XRootWindow.restype = ctypes.c_ulong
+    libx11.XGetWindowAttributes.argtypes = [ctypes.c_void_p, ctypes.c_ulong,
+                                            ctypes.POINTER(XWindowAttributes)]
+    libx11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    libx11.XFree.argtypes = [ctypes.c_void_p]
+    # Plain pointers, so the previous handler can be put back as it was
+    libx11.XSetErrorHandler.argtypes = [ctypes.c_void_p]
+    libx11.XSetErrorHandler.restype = ctypes.c_void_p
+
+    libxext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+    libxext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint,
+                                        ctypes.c_int, ctypes.c_void_p,
+                                        ctypes.POINTER(XShmSegmentInfo),
+                                        ctypes.c_uint, ctypes.c_uint]
+    libxext.XShmCreateImage.restype = ctypes.POINTER(XImage)
+    libxext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+    libxext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+    libxext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(XImage),
+                                     ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+
+    libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+    libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+    libc.shmat.restype = ctypes.c_void_p
+    libc.shmdt.argtypes = [ctypes.c_void_p]
+    libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+
+# (error code, request code) of X errors reported while trap_x_errors() is active
+_x_errors: List[Tuple[int, int]] = []
+
+
+@X_ERROR_HANDLER
+def _x_error_handler(display, event):
+    # Xlib's default handler terminates the process; record the error for trap_x_errors() instead
+    _x_errors.append((event.contents.error_code, event.contents.request_code))
+    return 0
+
+
+class CaptureError(Exception):
+    """Raised when the screen cannot be captured"""
+
+
+@contextlib.contextmanager
+def trap_x_errors(libx11, display, what: str, sync: bool = False):
+    """Turn X errors caused by the requests in the block into a CaptureError
+
+    The handler is installed only for the block and the previous one is
+    restored after it. Requests without a reply fail asynchronously, so
+    ``sync`` waits for the server to process them before leaving the block.
+    """
+    start = len(_x_errors)
+    previous = libx11.XSetErrorHandler(ctypes.cast(_x_error_handler, ctypes.c_void_p))
+    try:
+        yield
+        if sync:
+            libx11.XSync(display, 0)
+    finally:
+        libx11.XSetErrorHandler(previous)
+        errors = _x_errors[start:]
+        del _x_errors[start:]
+    if errors:
+        error_code, request_code = errors[0]
+        raise CaptureError(f"{what} failed with X error {error_code} (request {request_code})")
+
+
+class Frame:
+    """A captured frame backed by a reusable ring slot
+
+    ``data`` is a height x width x 4 BGRA array. It stays valid until the
+    capture ring wraps around to the same slot again.
+    """
+    __slots__ = ('data', 'timestamp', 'sequence', 'width', 'height')
+
+    def __init__(self, data: np.ndarray):
+        self.data = data
+        self.timestamp = 0.0  # Capture clock time when the grab completed
+        self.sequence = -1
+        self.height, self.width = data.shape[:2]
+
+
+class _ShmSlot:
+    """One MIT-SHM segment and the XImage and NumPy view that share it"""
+
+    def __init__(self, capture: 'ScreenCapture', width: int, height: int):
+        self._capture = capture
+        self.shminfo = XShmSegmentInfo()
+        self.image = capture._libxext.XShmCreateImage(
+            capture._display, capture._visual, capture._depth, ZPIXMAP,
+            None, ctypes.byref(self.shminfo), width, height
+        )
+        if not self.image:
+            raise CaptureError("XShmCreateImage failed")
+
+        image = self.image.contents
+        size = image.bytes_per_line * image.height
+        libc = capture._libc
+        self.shminfo.shmid = libc.shmget(IPC_PRIVATE, size, IPC_CREAT | 0o600)
+        if self.shminfo.shmid < 0:
+            capture._libx11.XFree(self.image)
+            raise CaptureError("shmget failed")
+        address = libc.shmat(self.shminfo.shmid, None, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            libc.shmctl(self.shminfo.shmid, IPC_RMID, None)
+            capture._libx11.XFree(self.image)
+            raise CaptureError("shmat failed")
+        self.shminfo.shmaddr = address
+        self.shminfo.readOnly = 0
+        image.data = address
+
+        try:
+            with trap_x_errors(capture._libx11, capture._display, "XShmAttach", sync=True):
+                capture._libxext.XShmAttach(capture._display, ctypes.byref(self.shminfo))
+        except CaptureError:
+            # E.g. a remote X server, which cannot see this machine's shared memory
+            libc.shmdt(ctypes.c_void_p(address))
+            libc.shmctl(self.shminfo.shmid, IPC_RMID, None)
+            capture._libx11.XFree(self.image)
+            raise
+        # Mark for removal now; the segment lives until both sides detach
+        libc.shmctl(self.shminfo.shmid, IPC_RMID, None)
+
+        buffer = (ctypes.c_uint8 * size).from_address(address)
+        pixels = np.frombuffer(buffer, dtype=np.uint8)
+        # Slice off any row padding as a view, never a copy
+        self.frame = Frame(pixels.reshape(image.height, image.bytes_per_line // 4, 4)[:, :width])
+
+    def grab(self, drawable: int, x: int, y: int) -> bool:
+        capture = self._capture
+        # XShmGetImage waits for its reply, so any error has arrived by the end of the block
+        with trap_x_errors(capture._libx11, capture._display, "XShmGetImage"):
+            return bool(capture._libxext.XShmGetImage(capture._display, drawable, self.image, x, y, ALL_PLANES))
+
+    def release(self):
+        capture = self._capture
+        self.frame.data = None
+        try:
+            with trap_x_errors(capture._libx11, capture._display, "XShmDetach", sync=True):
+                capture._libxext.XShmDetach(capture._display, ctypes.byref(self.shminfo))
+        finally:
+            capture._libc.shmdt(ctypes.c_void_p(self.shminfo.shmaddr))
+            capture._libx11.XFree(self.image)
+
+
+class ScreenCapture:
+    """Captures the root window, or a chosen window, into a ring of reusable frames
+
+    Frames are grabbed with the X shared-memory extension directly into
+    preallocated shared-memory segments, so steady-state capture allocates
+    nothing. ``grab()`` returns the next frame; iterating over the capture
+    yields frames paced at ``framerate``. Without MIT-SHM the capture falls
+    back to python-xlib ``GetImage`` and copies into the same ring.
+    """
+
+    def __init__(self, display_name: Optional[str] = None, window_id: Optional[int] = None,
+                 region: Optional[Tuple[int, int, int, int]] = None,
+                 ring_size: int = 3, framerate: float = 30,
+                 clock: Callable[[], float] = time.monotonic):
+        self.display_name = display_name or os.environ.get('DISPLAY', ':0')
+        self.window_id = window_id
+        self.region = region  # (x, y, width, height) within the drawable
+        self.ring_size = max(2, ring_size)
+        self.framerate = framerate
+        self.clock = clock  # Frame timestamps, normally the pipeline clock shared with audio
+        self.use_shm = False
+        self._display = None
+        self._visual = None
+        self._depth = 0
+        self._drawable = 0
+        self._origin = (0, 0)
+        self._size = (0, 0)
+        self._slots: List[_ShmSlot] = []
+        self._frames: List[Frame] = []
+        self._sequence = 0
+        self._xlib_display = None
+        self._libx11 = None
+        self._libxext = None
+        self._libc = None
+
+    @property
+    def width(self) -> int:
+        return self._size[0]
+
+    @property
+    def height(self) -> int:
+        return self._size[1]
+
+    def open(self):
+        """Connect to the X server and allocate the frame ring"""
+        if self._frames:
+            return
+        self._libx11 = _load_library('X11')
+        self._libxext = _load_library('Xext')
+        self._libc = _load_library('c')
+        if self._libx11 and self._libxext and self._libc:
+            _bind_x11(self._libx11, self._libxext, self._libc)
+            try:
+                self._open_shm()
+                self.use_shm = True
+            except CaptureError as e:
+                logger.warning(f"MIT-SHM capture unavailable, falling back to GetImage: {e}")
+                self._close_shm()
+
+        if not self.use_shm:
+            self._open_xlib()
+        logger.info(f"Capturing {self.width}x{self.height} from {self.display_name} "
+                    f"({'MIT-SHM' if self.use_shm else 'GetImage'}, ring of {self.ring_size})")
+
+    def _open_shm(self):
+        """Set up MIT-SHM capture through libX11 and libXext"""
+        libx11 = self._libx11
+        self._display = libx11.XOpenDisplay(self.display_name.encode())
+        if not self._display:
+            raise CaptureError(f"Cannot open display {self.display_name}")
+        if not self._libxext.XShmQueryExtension(self._display):
+            raise CaptureError("X server does not support MIT-SHM")
+
+        screen = libx11.XDefaultScreen(self._display)
+        root = libx11.XRootWindow(self._display, screen)
+        self._drawable = self.window_id or root
+        attributes = XWindowAttributes()
+        with trap_x_errors(libx11, self._display, f"Querying window {self._drawable:#x}"):
+            found = libx11.XGetWindowAttributes(self._display, self._drawable, ctypes.byref(attributes))
+        if not found:
+            raise CaptureError(f"Cannot query window {self._drawable:#x}")
+        self._visual = attributes.visual
+        self._depth = attributes.depth
+        self._set_geometry(attributes.width, attributes.height)
+
+        for _ in range(self.ring_size):
+            slot = _ShmSlot(self, *self._size)
+            self._slots.append(slot)
+            self._frames.append(slot.frame)
+
+    def _open_xlib(self):
+        """Set up GetImage capture through python-xlib"""
+        if not XLIB_AVAILABLE:
+            raise CaptureError("python-xlib is not installed")
+        try:
+            self._xlib_display = xdisplay.Display(self.display_name)
+        except Exception as e:
+            raise CaptureError(f"Cannot open display {self.display_name}: {e}")
+        if self.window_id:
+            self._xlib_drawable = self._xlib_display.create_resource_object('window', self.window_id)
+        else:
+            self._xlib_drawable = self._xlib_display.screen().root
+        geometry = self._xlib_drawable.get_geometry()
+        self._set_geometry(geometry.width, geometry.height)
+        width, height = self._size
+        self._frames = [Frame(np.zeros((height, width, 4), dtype=np.uint8))
+                        for _ in range(self.ring_size)]
+
+    def _set_geometry(self, drawable_width: int, drawable_height: int):
+        """Work out the captured rectangle from the drawable size and the region"""
+        if self.region:
+            x, y, width, height = self.region
+            width = min(width, drawable_width - x)
+            height = min(height, drawable_height - y)
+            if width <= 0 or height <= 0:
+                raise CaptureError(f"Capture region {self.region} is outside the drawable")
+            self._origin = (x, y)
+            self._size = (width, height)
+        else:
+            self._origin = (0, 0)
+            self._size = (drawable_width, drawable_height)
+
+    def close(self):
+        """Release the frame ring and the X connection"""
+        self._close_shm()
+        if self._xlib_display is not None:
+            self._xlib_display.close()
+            self._xlib_display = None
+        self._frames = []
+
+    def _close_shm(self):
+        for slot in self._slots:
+            try:
+                slot.release()
+            except Exception as e:
+                logger.error(f"Error releasing capture buffer: {e}")
+        self._slots = []
+        if self._display:
+            self._libx11.XCloseDisplay(self._display)
+            self._display = None
+        self.use_shm = False
+
+    def grab(self) -> Frame:
+        """Capture the next frame into the ring and return it"""
+        if not self._frames:
+            self.open()
+        index = self._sequence % self.ring_size
+        frame = self._frames[index]
+        x, y = self._origin
+        started = self.clock() if metrics.enabled else 0.0
+
+        if self.use_shm:
+            if not self._slots[index].grab(self._drawable, x, y):
+                raise CaptureError("XShmGetImage failed")
+        else:
+            width, height = self._size
+            reply = self._xlib_drawable.get_image(x, y, width, height, X.ZPixmap, ALL_PLANES)
+            pixels = np.frombuffer(reply.data, dtype=np.uint8)
+            np.copyto(frame.data, pixels.reshape(height, -1, 4)[:, :width])
+
+        frame.timestamp = self.clock()
+        frame.sequence = self._sequence
+        self._sequence += 1
+        if metrics.enabled:
+            metrics.mark(frame.timestamp, 'capture', frame.timestamp, start=started)
+        return frame
+
+    def frames(self, max_frames: Optional[int] = None) -> Iterator[Frame]:
+        """Yield frames paced at the configured frame rate"""
+        deadline = time.monotonic()
+        count = 0
+        while max_frames is None or count < max_frames:
+            yield self.grab()
+            count += 1
+            # Read the rate every frame so it can be changed while capturing
+            deadline += 1.0 / self.framerate if self.framerate > 0 else 0.0
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Running late, don't try to catch up with a burst of frames
+                deadline = time.monotonic()
+
+    def __iter__(self) -> Iterator[Frame]:
+        return self.frames()
+
+    def __enter__(self) -> 'ScreenCapture':
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Startup Profiler
+
+import contextlib
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class StartupProfiler:
+    """Records how long each startup phase takes and how many modules it imported
+
+    Times are in seconds since ``origin``, a ``time.perf_counter()`` value
+    taken as early as possible. Phases can run on several threads at once;
+    their module counts then include imports made by the other threads.
+    """
+
+    def __init__(self, enabled: bool = True, origin: Optional[float] = None):
+        self.enabled = enabled
+        self.origin = time.perf_counter() if origin is None else origin
+        self.phases: List[Dict[str, Any]] = []
+        self.marks: Dict[str, float] = {}
+        self.imported: Dict[str, List[str]] = {}  # Modules loaded at marks recorded with modules=True
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time the body of a with statement as one startup phase"""
+        if not self.enabled:
+            yield
+            return
+        modules = len(sys.modules)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.phases.append({
+                    'name': name,
+                    'thread': threading.current_thread().name,
+                    'start': start - self.origin,
+                    'seconds': end - start,
+                    'modules': len(sys.modules) - modules,
+                })
+
+    def mark(self, name: str, modules: bool = False):
+        """Record the time at which a startup milestone was reached, and optionally the modules loaded by then"""
+        if self.enabled:
+            self.marks[name] = time.perf_counter() - self.origin
+            if modules:
+                self.imported[name] = sorted(sys.modules)
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'phases': list(self.phases), 'marks': dict(self.marks)}
+
+    def format(self) -> str:
+        """The report as a table, phases in the order they started"""
+        report = self.report()
+        lines = [f"{'phase':32} {'thread':18} {'start':>8} {'time':>8} {'modules':>7}"]
+        for phase in sorted(report['phases'], key=lambda phase: phase['start']):
+            lines.append(f"{phase['name']:32} {phase['thread'][:18]:18} {phase['start'] * 1000:6.1f}ms "
+                         f"{phase['seconds'] * 1000:6.1f}ms {phase['modules']:7d}")
+        for name, at in sorted(report['marks'].items(), key=lambda mark: mark[1]):
+            lines.append(f"{name}: {at * 1000:.1f} ms")
+        return '\n'.join(lines)
@@ -0,0 +1,703 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Streaming Segment Server
+
+import collections
+import contextlib
+import logging
+import re
+import secrets
+import socket
+import struct
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from src.metrics import metrics
+
+logger = logging.getLogger("UbuntuCast.StreamServer")
+
+# Bit in ISO BMFF sample flags marking a sample that is not a sync (key) frame
+SAMPLE_IS_NON_SYNC = 0x10000
+
+
+class Segment:
+    """One slot of the segment ring
+
+    The buffer is allocated once and reused when the ring wraps around, so
+    publishing does not allocate in steady state. If a reader still holds
+    the slot then, it gets a new buffer, so the old one stays intact under
+    the reader's views until it has finished sending. A segment starts with a
+    keyframe fragment and grows by one fragment (chunk) at a time until the
+    next keyframe closes it.
+    """
+
+    def __init__(self, capacity: int):
+        self.buffer = bytearray(capacity)
+        self.sequence = -1
+        self.generation = 0  # Encoder stream the segment belongs to
+        self.discontinuity = 0  # Discontinuity sequence number of the segment in the playlist
+        self.length = 0
+        self.complete = False
+        self.publish_time = 0.0  # time.monotonic() when the first chunk was published
+        self.duration = 0.0
+        self.first_byte_time: Optional[float] = None
+        self.sent_length = 0  # Bytes handed to any reader so far, for frame tracing
+        self.readers = 0  # Requests holding views of this slot's buffer
+        self.fragment_end = 0  # Length up to the end of the last whole fragment
+        self.fragment_time = 0.0  # time.monotonic() when that fragment ended
+        self.parts: List[Tuple[int, int, float]] = []  # Start, end and duration of each whole fragment
+
+    def reset(self, sequence: int, generation: int, discontinuity: int):
+        if self.readers:
+            self.buffer = bytearray(len(self.buffer))
+        self.sequence = sequence
+        self.generation = generation
+        self.discontinuity = discontinuity
+        self.length = 0
+        self.complete = False
+        self.publish_time = time.monotonic()
+        self.duration = 0.0
+        self.first_byte_time = None
+        self.sent_length = 0
+        self.fragment_end = 0
+        self.fragment_time = self.publish_time
+        self.parts = []
+
+
+class SegmentInfo(NamedTuple):
+    """A segment as the playlist lists it"""
+    sequence: int
+    duration: float  # Of the parts so far while it is open
+    generation: int
+    discontinuity: int
+    complete: bool
+    parts: Tuple[float, ...]  # Durations of its whole fragments
+
+
+class SegmentRing:
+    """Fixed-size in-memory ring of stream segments shared by all HTTP clients
+
+    Segments of a previous encoder stream stay in the ring after a restart,
+    along with their init segment, until newer segments replace them, so
+    players can see where the stream changed.
+    """
+
+    def __init__(self, slots: int = 8, capacity: int = 2 * 1024 * 1024):
+        self._segments = [Segment(capacity) for _ in range(slots)]
+        self._condition = threading.Condition()
+        self.init_segments: Dict[int, bytes] = {}  # By generation
+        self.next_sequence = 0
+        self.generation = 0  # Incremented when the encoder restarts with a new init segment
+        self._discontinuity = -1  # Of the newest segment
+        self._last_generation = 0  # Of the newest segment
+        self._fragment_time = 0.0  # time.monotonic() when the last whole fragment ended
+        self.first_byte_latencies: Deque[float] = collections.deque(maxlen=100)
+
+    def _slot(self, sequence: int) -> Segment:
+        return self._segments[sequence % len(self._segments)]
+
+    @property
+    def init_segment(self) -> bytes:
+        """The initialization segment of the current stream"""
+        return self.init_segments.get(self.generation, b'')
+
+    def set_init_segment(self, data: bytes):
+        """Publish a new initialization segment, starting a new stream
+
+        The previous stream's open segment may end in a partial fragment, so
+        it is cut back to its last whole fragment and closed, or if it has
+        none, dropped and its sequence number given to the new stream.
+        """
+        with self._condition:
+            if self.next_sequence > 0:
+                previous = self._slot(self.next_sequence - 1)
+                if previous.sequence == self.next_sequence - 1 and not previous.complete:
+                    previous.length = previous.fragment_end
+                    if previous.length:
+                        previous.complete = True
+                        previous.duration = previous.fragment_time - previous.publish_time
+                    else:
+                        previous.sequence = -1
+                        self.next_sequence -= 1
+            self.generation += 1
+            self.init_segments[self.generation] = bytes(data)
+            self._prune_init_segments()
+            self._condition.notify_all()
+
+    def _prune_init_segments(self):
+        """Forget init segments of streams with no segments left in the ring"""
+        live = {segment.generation for segment in self._segments if segment.sequence >= 0}
+        live.add(self.generation)
+        for generation in [generation for generation in self.init_segments if generation not in live]:
+            del self.init_segments[generation]
+
+    def begin_segment(self) -> int:
+        """Close the open segment and start a new one"""
+        with self._condition:
+            now = time.monotonic()
+            if self.next_sequence > 0:
+                previous = self._slot(self.next_sequence - 1)
+                if previous.sequence == self.next_sequence - 1 and not previous.complete:
+                    previous.complete = True
+                    previous.duration = now - previous.publish_time
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            if self.generation != self._last_generation:
+                self._last_generation = self.generation
+                self._discontinuity += 1
+            self._slot(sequence).reset(sequence, self.generation, self._discontinuity)
+            self._prune_init_segments()
+            self._condition.notify_all()
+            return sequence
+
+    def append(self, data: bytes) -> int:
+        """Append a chunk to the open segment, returning its offset in the segment"""
+        with self._condition:
+            if self.next_sequence == 0:
+                return -1
+            segment = self._slot(self.next_sequence - 1)
+            end = segment.length + len(data)
+            if end > len(segment.buffer):
+                # Readers may hold views of the old buffer, so replace it rather than resize
+                logger.warning(f"Segment {segment.sequence} outgrew its slot, enlarging to {end * 2} bytes")
+                buffer = bytearray(end * 2)
+                buffer[:segment.length] = segment.buffer[:segment.length]
+                segment.buffer = buffer
+            segment.buffer[segment.length:end] = data
+            offset, segment.length = segment.length, end
+            self._condition.notify_all()
+            return offset
+
+    def end_fragment(self):
+        """Mark the end of a whole fragment in the open segment"""
+        with self._condition:
+            if self.next_sequence == 0:
+                return
+            segment = self._slot(self.next_sequence - 1)
+            now = time.monotonic()
+            if segment.length > segment.fragment_end:
+                # Fragments end one fragment duration apart, across segments too
+                started = self._fragment_time or segment.publish_time
+                segment.parts.append((segment.fragment_end, segment.length, now - started))
+                self._fragment_time = now
+            segment.fragment_end = segment.length
+            segment.fragment_time = now
+            self._condition.notify_all()
+
+    def wait_for_segments(self, count: int, timeout: float) -> bool:
+        """Wait until ``count`` segments of the current stream have been completed"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while len([segment for segment in self._segments if segment.sequence >= 0 and segment.complete
+                       and segment.generation == self.generation]) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(timeout=remaining)
+        return True
+
+    def segments(self) -> List[SegmentInfo]:
+        """The complete segments in the ring and the open one, oldest first"""
+        with self._condition:
+            segments = [SegmentInfo(segment.sequence,
+                                    segment.duration if segment.complete
+                                    else sum(duration for _, _, duration in segment.parts),
+                                    segment.generation, segment.discontinuity, segment.complete,
+                                    tuple(duration for _, _, duration in segment.parts))
+                        for segment in self._segments if segment.sequence >= 0]
+        return sorted(segments)
+
+    def wait_for_playlist(self, sequence: int, part: Optional[int], timeout: float) -> bool:
+        """Wait until a segment is complete, or with ``part`` until it has that part (a blocking reload)"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                if self.next_sequence - 1 > sequence:
+                    return True
+                segment = self._slot(sequence)
+                if part is not None and segment.sequence == sequence and len(segment.parts) > part:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(timeout=remaining)
+
+    def _mark_read(self, segment: Segment, end: int):
+        """Note the first byte of a segment, and for frame tracing the furthest byte, handed to a reader"""
+        if segment.first_byte_time is None and end > 0:
+            segment.first_byte_time = time.monotonic()
+            self.first_byte_latencies.append(segment.first_byte_time - segment.publish_time)
+        if metrics.enabled and end > segment.sent_length:
+            segment.sent_length = end
+            metrics.segment_read(segment.sequence, end)
+
+    @contextlib.contextmanager
+    def holding(self, sequence: int):
+        """Keep the slot of a segment from being overwritten while views from ``read`` are in use"""
+        segment = self._slot(sequence)
+        with self._condition:
+            segment.readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                segment.readers -= 1
+
+    def read(self, sequence: int, offset: int, timeout: float) -> Tuple[Optional[memoryview], bool]:
+        """Wait for data of a segment past ``offset``
+
+        Returns a view of the available bytes (None if the segment is not in
+        the ring) and whether the segment is complete. The view is only
+        valid while the caller is ``holding`` the segment.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                segment = self._slot(sequence)
+                if segment.sequence == sequence:
+                    if offset > segment.length:
+                        return None, True  # Cut back after an encoder restart, past what was sent
+                    if segment.length > offset or segment.complete:
+                        self._mark_read(segment, segment.length)
+                        return memoryview(segment.buffer)[offset:segment.length], segment.complete
+                elif sequence != self.next_sequence:
+                    # Evicted from the ring, lost in an encoder restart, or too far ahead
+                    return None, True
+
+                # Wait for the open segment to grow, or for the next one to start
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None, False
+                self._condition.wait(timeout=remaining)
+
+    def read_part(self, sequence: int, index: int, timeout: float) -> Tuple[Optional[memoryview], bool]:
+        """Wait for a whole fragment of a segment, served as an LL-HLS part
+
+        Returns a view of the part, or None and whether that is final: the
+        segment closed without it or left the ring, rather than the wait
+        timing out. The view is only valid while the caller is ``holding``
+        the segment.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                segment = self._slot(sequence)
+                if segment.sequence == sequence:
+                    if index < len(segment.parts):
+                        start, end, _ = segment.parts[index]
+                        self._mark_read(segment, end)
+                        return memoryview(segment.buffer)[start:end], True
+                    if segment.complete:
+                        return None, True
+                elif sequence != self.next_sequence:
+                    return None, True
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None, False
+                self._condition.wait(timeout=remaining)
+
+
+class Fmp4Segmenter:
+    """Splits a fragmented MP4 byte stream into an init segment and keyframe-aligned segments
+
+    The encoder output is parsed one top-level box at a time. ``ftyp`` and
+    ``moov`` form the init segment; each ``moof``+``mdat`` fragment is
+    appended to the open segment as a chunk, and a fragment whose first
+    sample is a keyframe starts a new segment.
+    """
+
+    def __init__(self, ring: SegmentRing):
+        self.ring = ring
+        self._pending = bytearray()
+        self._init = bytearray()
+        self._fragment: Optional[Tuple[int, int]] = None  # Offset and video sample count of the open fragment
+
+    def reset(self):
+        """Prepare for a new stream, e.g. after the encoder restarted"""
+        self._pending = bytearray()
+        self._init = bytearray()
+        self._fragment = None
+
+    def feed(self, data: bytes):
+        """Consume a chunk of encoder output"""
+        self._pending += data
+        offset = 0
+        while len(self._pending) - offset >= 8:
+            size, box_type = struct.unpack_from('>I4s', self._pending, offset)
+            header = 8
+            if size == 1:
+                if len(self._pending) - offset < 16:
+                    break
+                size = struct.unpack_from('>Q', self._pending, offset + 8)[0]
+                header = 16
+            if size < header:
+                logger.error(f"Corrupt MP4 box {box_type!r} in encoder output")
+                self._pending = bytearray()
+                return
+            if len(self._pending) - offset < size:
+                break
+            self._box(box_type, memoryview(self._pending)[offset:offset + size], header)
+            offset += size
+        del self._pending[:offset]
+
+    def _box(self, box_type: bytes, box: memoryview, header: int):
+        if box_type in (b'ftyp', b'moov'):
+            self._init += box
+            if box_type == b'moov':
+                self.ring.set_init_segment(self._init)
+                self._init = bytearray()
+        elif box_type == b'moof':
+            if _first_sample_is_sync(box[header:]):
+                self.ring.begin_segment()
+            offset = self.ring.append(box)
+            if metrics.enabled:
+                self._fragment = (offset, _video_sample_count(box[header:]))
+        elif box_type == b'mdat':
+            self.ring.append(box)
+            self.ring.end_fragment()
+            if metrics.enabled and self._fragment is not None:
+                offset, samples = self._fragment
+                self._fragment = None
+                if offset >= 0 and samples:
+                    metrics.fragment_published(self.ring.next_sequence - 1, offset, samples)
+
+
+def _child_boxes(data: memoryview):
+    """Yield (type, payload) of the boxes directly inside a container payload"""
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        if size < 8 or offset + size > len(data):
+            return
+        yield box_type, data[offset + 8:offset + size]
+        offset += size
+
+
+def _video_sample_count(moof: memoryview, track_id: int = 1) -> int:
+    """Count the samples of the video track in a movie fragment"""
+    count = 0
+    for box_type, traf in _child_boxes(moof):
+        if box_type != b'traf':
+            continue
+        for child_type, payload in _child_boxes(traf):
+            if child_type == b'tfhd' and struct.unpack_from('>I', payload, 4)[0] != track_id:
+                break
+            if child_type == b'trun':
+                count += struct.unpack_from('>I', payload, 4)[0]
+    return count
+
+
+def _first_sample_is_sync(moof: memoryview, track_id: int = 1) -> bool:
+    """Check whether the first sample of the video track in a movie fragment is a keyframe
+
+    The encoder maps video first, so it is track 1; audio samples are all
+    sync samples and must not start segments.
+    """
+    for box_type, traf in _child_boxes(moof):
+        if box_type != b'traf':
+            continue
+        default_flags = None
+        for child_type, payload in _child_boxes(traf):
+            flags = struct.unpack_from('>I', payload, 0)[0] & 0xFFFFFF
+            if child_type == b'tfhd':
+                if struct.unpack_from('>I', payload, 4)[0] != track_id:
+                    break
+                offset = 8  # version/flags and track_ID
+                for bit, size in ((0x01, 8), (0x02, 4), (0x08, 4), (0x10, 4)):
+                    if flags & bit:
+                        offset += size
+                if flags & 0x20:
+                    default_flags = struct.unpack_from('>I', payload, offset)[0]
+            elif child_type == b'trun':
+                offset = 8  # version/flags and sample_count
+                if flags & 0x01:
+                    offset += 4
+                if flags & 0x04:
+                    sample_flags = struct.unpack_from('>I', payload, offset)[0]
+                elif flags & 0x400:
+                    offset += 4 * (bool(flags & 0x100) + bool(flags & 0x200))
+                    sample_flags = struct.unpack_from('>I', payload, offset)[0]
+                elif default_flags is not None:
+                    sample_flags = default_flags
+                else:
+                    return True
+                return not sample_flags & SAMPLE_IS_NON_SYNC
+    return False  # An audio-only fragment
+
+
+class _StreamRequestHandler(BaseHTTPRequestHandler):
+    """Serves the playlist, init segment and media segments from the ring"""
+    protocol_version = 'HTTP/1.1'
+    server: 'StreamServer'
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        prefix = self.server.base_path + '/'
+        if not path.startswith(prefix):
+            self.send_error(404)
+            return
+        path = path[len(prefix) - 1:]
+        match = re.fullmatch(r'/segment_(\d+)\.m4s', path)
+        part_match = re.fullmatch(r'/part_(\d+)_(\d+)\.m4s', path)
+        init_match = re.fullmatch(r'/init(?:_(\d+))?\.mp4', path)
+        if path == '/live.m3u8':
+            self._send_playlist(urllib.parse.parse_qs(query))
+        elif init_match:
+            ring = self.server.ring
+            generation = int(init_match.group(1)) if init_match.group(1) else ring.generation
+            data = ring.init_segments.get(generation)
+            if data is None:
+                self.send_error(503 if generation >= ring.generation else 404, "No such stream")
+            else:
+                self._send_bytes(data, 'video/mp4')
+        elif match:
+            self._send_segment(int(match.group(1)))
+        elif part_match:
+            self._send_part(int(part_match.group(1)), int(part_match.group(2)))
+        else:
+            self.send_error(404)
+
+    def _send_playlist(self, query: Dict[str, List[str]]):
+        """Send the playlist, first waiting for the segment or part a blocking reload asks for"""
+        try:
+            msn = int(query['_HLS_msn'][0]) if '_HLS_msn' in query else None
+            part = int(query['_HLS_part'][0]) if '_HLS_part' in query else None
+        except ValueError:
+            self.send_error(400)
+            return
+        if msn is not None:
+            if msn > self.server.ring.next_sequence + 1:
+                self.send_error(400, "Segment too far ahead")
+                return
+            if not self.server.ring.wait_for_playlist(msn, part, self.server.segment_timeout):
+                self.send_error(503)
+                return
+        elif part is not None:
+            self.send_error(400)
+            return
+        live_edge = query.get('start') == ['live']
+        self._send_bytes(self.server.playlist(live_edge).encode(), 'application/vnd.apple.mpegurl')
+
+    def _send_bytes(self, data: bytes, content_type: str):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_part(self, sequence: int, index: int):
+        """Send one whole fragment of a segment, once it exists"""
+        ring = self.server.ring
+        with ring.holding(sequence):
+            view, final = ring.read_part(sequence, index, self.server.segment_timeout)
+            if view is None:
+                self.send_error(404 if final else 503)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/iso.segment')
+            self.send_header('Content-Length', str(len(view)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            started = time.monotonic()
+            self.wfile.write(view)
+        self.server.record_delivery(self.client_address[0], len(view), time.monotonic() - started)
+
+    def _send_segment(self, sequence: int):
+        """Send a segment, streaming it with chunked encoding while it is still growing"""
+        with self.server.ring.holding(sequence):
+            self._stream_segment(sequence)
+
+    def _stream_segment(self, sequence: int):
+        ring = self.server.ring
+        view, complete = ring.read(sequence, 0, self.server.segment_timeout)
+        if view is None:
+            self.send_error(404 if complete else 503)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/iso.segment')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if complete:
+            self.send_header('Content-Length', str(len(view)))
+            self.end_headers()
+            started = time.monotonic()
+            self.wfile.write(view)
+            self.server.record_delivery(self.client_address[0], len(view), time.monotonic() - started)
+            return
+
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        offset = 0
+        # Only time spent writing counts towards throughput, not waiting for the encoder
+        write_time = 0.0
+        try:
+            while True:
+                if len(view):
+                    started = time.monotonic()
+                    self.wfile.write(f"{len(view):x}\r\n".encode())
+                    self.wfile.write(view)
+                    self.wfile.write(b"\r\n")
+                    write_time += time.monotonic() - started
+                    offset += len(view)
+                if complete:
+                    break
+                view, complete = ring.read(sequence, offset, self.server.segment_timeout)
+                if view is None:
+                    # Lost mid-stream; end without the last chunk so the player sees a failed request
+                    self.close_connection = True
+                    return
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        self.server.record_delivery(self.client_address[0], offset, write_time)
+
+
+class StreamServer(ThreadingHTTPServer):
+    """Embedded HTTP server publishing the live stream as fMP4 HLS segments from memory
+
+    Media bytes are written to sockets straight from the ring buffers through
+    memoryviews, so nothing is copied or written to disk on the hot path.
+    Everything is served under a random path created with the server, so
+    only receivers handed ``stream_url`` can watch the screen.
+
+    The playlist is Low-Latency HLS: each fragment the encoder cuts is also
+    listed as a part, including those of the open segment, with a preload
+    hint for the next one, and playlist requests can block until a given
+    segment or part exists. A whole segment requested while still open is
+    streamed with chunked encoding as its fragments arrive.
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 0, ring_slots: int = 8,
+                 segment_capacity: int = 2 * 1024 * 1024, target_duration: float = 1.0,
+                 part_target: float = 0.2):
+        super().__init__((host, port), _StreamRequestHandler)
+        self.ring = SegmentRing(ring_slots, segment_capacity)
+        self.segmenter = Fmp4Segmenter(self.ring)
+        self.target_duration = target_duration
+        self.part_target = part_target  # The encoder's fragment duration
+        self.base_path = f"/{secrets.token_urlsafe(16)}"
+        self.segment_timeout = max(2.0, target_duration * 3)
+        # Called with (client address, bytes, seconds spent writing) for each segment sent
+        self.delivery_callback: Optional[Callable[[str, int, float], None]] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self):
+        """Serve requests on a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, name="UbuntuCastStreamServer")
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info(f"Stream server listening on port {self.port}")
+
+    def stop(self):
+        """Stop serving and close the listening socket"""
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def publish(self, data: bytes):
+        """Feed encoder output into the segment ring"""
+        self.segmenter.feed(data)
+
+    def restart_stream(self):
+        """Reset segmenting after the encoder restarted"""
+        self.segmenter.reset()
+
+    def record_delivery(self, client: str, num_bytes: int, seconds: float):
+        """Report a finished segment delivery to the delivery callback"""
+        if self.delivery_callback is not None:
+            try:
+                self.delivery_callback(client, num_bytes, seconds)
+            except Exception as e:
+                logger.error(f"Error in delivery callback: {e}")
+
+    def stream_url(self, host: str, live_edge: bool = False) -> str:
+        """URL of the playlist; with ``live_edge`` players start at the newest segment"""
+        url = f"http://{host}:{self.port}{self.base_path}/live.m3u8"
+        return f"{url}?start=live" if live_edge else url
+
+    def playlist(self, live_edge: bool = False) -> str:
+        """Build the live LL-HLS media playlist for the segments in the ring
+
+        Each encoder stream (a new one starts after a restart or a quality
+        change) has its own init segment. Where the segments of one stream
+        follow another's, an EXT-X-DISCONTINUITY tag and the new stream's
+        EXT-X-MAP tell receivers to reinitialise their decoder instead of
+        misparsing the new segments. Parts are listed for the segments of
+        the last three target durations, as only players near the live edge
+        use them. With ``live_edge`` the playlist asks players to start at
+        the newest segment rather than the usual three target durations back.
+        """
+        segments = self.ring.segments()
+        complete = [segment for segment in segments if segment.complete]
+        target = max([self.target_duration] + [segment.duration for segment in complete])
+        part_target = max([self.part_target] + [duration for segment in segments for duration in segment.parts])
+        generation = segments[0].generation if segments else self.ring.generation
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:7',
+            f'#EXT-X-TARGETDURATION:{int(target + 0.999)}',
+            f'#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={3 * part_target:.3f}',
+            f'#EXT-X-PART-INF:PART-TARGET={part_target:.3f}',
+            f'#EXT-X-MEDIA-SEQUENCE:{segments[0].sequence if segments else self.ring.next_sequence}',
+            f'#EXT-X-DISCONTINUITY-SEQUENCE:{segments[0].discontinuity if segments else 0}',
+            f'#EXT-X-MAP:URI="init_{generation}.mp4"',
+        ]
+        if live_edge:
+            lines.insert(2, f'#EXT-X-START:TIME-OFFSET=-{target:.3f}')
+
+        parts_from = len(segments)
+        recent = 0.0
+        while parts_from > 0 and recent < 3 * target:
+            parts_from -= 1
+            recent += segments[parts_from].duration
+        for position, segment in enumerate(segments):
+            if segment.generation != generation:
+                generation = segment.generation
+                lines.append('#EXT-X-DISCONTINUITY')
+                lines.append(f'#EXT-X-MAP:URI="init_{generation}.mp4"')
+            if position >= parts_from:
+                for index, duration in enumerate(segment.parts):
+                    independent = ',INDEPENDENT=YES' if index == 0 else ''
+                    lines.append(f'#EXT-X-PART:DURATION={duration:.3f},'
+                                 f'URI="part_{segment.sequence}_{index}.m4s"{independent}')
+            if segment.complete:
+                lines.append(f'#EXTINF:{segment.duration:.3f},')
+                lines.append(f'segment_{segment.sequence}.m4s')
+            else:
+                lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,'
+                             f'URI="part_{segment.sequence}_{len(segment.parts)}.m4s"')
+        return '\n'.join(lines) + '\n'
+
+    def latency_stats(self) -> dict:
+        """Publish-to-first-byte latency over recent segments, in seconds"""
+        latencies = sorted(self.ring.first_byte_latencies)
+        if not latencies:
+            return {}
+        return {
+            'count': len(latencies),
+            'median': latencies[len(latencies) // 2],
+            'max': latencies[-1],
+        }
+
+
+def local_address_for(remote_host: str) -> str:
+    """Find the local address used to reach a host, to build URLs it can fetch"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.connect((remote_host, 9))
+        return probe.getsockname()[0]
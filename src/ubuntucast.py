@@ -2,127 +2,265 @@
 # UbuntuCast - Screen Casting Tool for Ubuntu Linux
 # Main application entry point
 
-import sys
-import os
-import logging
+import time
+_STARTED = time.perf_counter()  # Origin of the startup profile
+
+import argparse
 import configparser
-from PyQt5.QtWidgets import QApplication
-from PyQt5.QtGui import QIcon
+import logging
+import os
+import sys
+import threading
+from typing import Optional
 
-# Import local modules
+# Import local modules; everything heavy is imported where it is first needed
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from ui.main_window import MainWindow
-from ui.system_tray import SystemTrayIcon
-from src.device_discovery import DeviceDiscovery
-from src.cast_manager import CastManager
-
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.expanduser("~/.local/share/ubuntucast/logs/ubuntucast.log")),
-        logging.StreamHandler()
-    ]
-)
+from src.logging_setup import log_pipeline
+from src.startup_profiler import StartupProfiler
+
 logger = logging.getLogger("UbuntuCast")
 
-class UbuntuCast:
-    def __init__(self):
-        self.app = QApplication(sys.argv)
-        self.app.setApplicationName("UbuntuCast")
-        self.app.setQuitOnLastWindowClosed(False)
-        
-        # Load configuration
-        self.config = self._load_config()
-        
-        # Initialize components
-        self.cast_manager = CastManager(self.config)
-        self.device_discovery = DeviceDiscovery(self.cast_manager)
-        
-        # Setup UI
-        self.main_window = MainWindow(self.cast_manager, self.device_discovery)
-        self.tray_icon = SystemTrayIcon(self.main_window, self.cast_manager)
-        self.tray_icon.show()
-        
-        logger.info("UbuntuCast initialized successfully")
+
+def _setup_logging(name: str):
+    """Log to the process's rotating log file and to stderr from a background writer"""
+    log_pipeline.start(name=name)
+
+
+def load_config() -> configparser.ConfigParser:
+    """Load configuration from the config file"""
+    config = configparser.ConfigParser()
     
-    def _load_config(self):
-        """Load configuration from the config file"""
-        config = configparser.ConfigParser()
-        
-        # Default config path
-        config_dir = os.path.expanduser("~/.config/ubuntucast")
-        config_path = os.path.join(config_dir, "config.ini")
-        
-        # Create config directory if it doesn't exist
-        if not os.path.exists(config_dir):
-            os.makedirs(config_dir)
-            
-        # If config doesn't exist, copy from installation directory
-        if not os.path.exists(config_path):
-            default_config = os.path.join(
-                os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
-                "config.ini"
-            )
-            if os.path.exists(default_config):
-                import shutil
-                shutil.copy2(default_config, config_path)
+    # Default config path
+    config_dir = os.path.expanduser("~/.config/ubuntucast")
+    config_path = os.path.join(config_dir, "config.ini")
+    
+    # Create config directory if it doesn't exist
+    if not os.path.exists(config_dir):
+        os.makedirs(config_dir)
         
-        # Read config file
-        if os.path.exists(config_path):
-            config.read(config_path)
-        else:
-            # Create default config
-            config["GENERAL"] = {
-                "first_run": "true",
-                "minimize_to_tray": "true",
-                "start_with_system": "false"
-            }
-            config["CASTING"] = {
-                "resolution": "1080p",
-                "framerate": "30",
-                "audio_enabled": "true",
-                "preferred_device": ""
-            }
-            config["ADVANCED"] = {
-                "discovery_timeout": "5",
-                "buffer_size": "8192",
-                "log_level": "INFO"
-            }
-            
-            # Save default config
-            with open(config_path, 'w') as config_file:
-                config.write(config_file)
+    # If config doesn't exist, copy from installation directory
+    if not os.path.exists(config_path):
+        default_config = os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
+            "config.ini"
+        )
+        if os.path.exists(default_config):
+            import shutil
+            shutil.copy2(default_config, config_path)
+    
+    # Read config file
+    if os.path.exists(config_path):
+        config.read(config_path)
+    else:
+        # Create default config
+        config["GENERAL"] = {
+            "first_run": "true",
+            "minimize_to_tray": "true",
+            "start_with_system": "false"
+        }
+        config["CASTING"] = {
+            "resolution": "1080p",
+            "framerate": "30",
+            "audio_enabled": "true",
+            "preferred_device": ""
+        }
+        config["ADVANCED"] = {
+            "discovery_timeout": "5",
+            "discovery_interfaces": "",
+            "unicast_hosts": "",
+            "unicast_probe_interval": "300",
+            "unicast_probe_workers": "16",
+            "connect_timeout": "10",
+            "connection_idle_timeout": "300",
+            "resume_grace_period": "30",
+            "daemon_socket": "",
+            "buffer_size": "8192",
+            "video_codec": "libx264",
+            "video_bitrate": "6000",
+            "adaptive_quality": "true",
+            "min_resolution": "480p",
+            "min_framerate": "15",
+            "min_video_bitrate": "1000",
+            "audio_bitrate": "128",
+            "encoder_queue_size": "3",
+            "keepalive_interval": "1.0",
+            "pipeline_mode": "thread",
+            "pipeline_workers": "0",
+            "governor_enabled": "true",
+            "governor_cpu_budget": "50",
+            "governor_system_cpu_budget": "90",
+            "governor_load_budget": "1.5",
+            "governor_temperature_limit": "85",
+            "metrics_enabled": "false",
+            "metrics_port": "9477",
+            "trace_file": "",
+            "frame_trace_record": "",
+            "frame_trace_replay": "",
+            "frame_trace_speed": "1.0",
+            "frame_trace_delta": "true",
+            "stream_port": "0",
+            "segment_ring_size": "8",
+            "device_cache_ttl": "604800",
+            "device_cache_size": "64",
+            "log_level": "INFO",
+            "log_max_bytes": "5242880",
+            "log_backup_count": "3",
+            "log_rate_limit_interval": "10",
+            "log_rate_limit_burst": "5",
+            "log_events_file": ""
+        }
         
-        return config
+        # Save default config
+        with open(config_path, 'w') as config_file:
+            config.write(config_file)
     
+    return config
+
+
+class UbuntuCast:
+    """The application: shows the tray icon first and builds everything else behind it
+
+    Only Qt, the config and the tray icon are set up before the icon
+    appears. Discovery and casting run in the headless daemon, so UI
+    repaints never compete with the casting hot path; the tray and main
+    window are its clients. The connection to the daemon, started here if
+    none is running, is made on a background thread right after, or on
+    first use if that comes sooner. The main window is created the first
+    time it is shown.
+    """
+
+    def __init__(self, profiler: Optional[StartupProfiler] = None):
+        self.profiler = profiler or StartupProfiler(enabled=False)
+        profile = self.profiler.phase
+
+        with profile("import PyQt5"):
+            from PyQt5.QtWidgets import QApplication
+        with profile("QApplication"):
+            self.app = QApplication(sys.argv)
+            self.app.setApplicationName("UbuntuCast")
+            self.app.setQuitOnLastWindowClosed(False)
+
+        # Load configuration
+        with profile("config"):
+            self.config = load_config()
+            # Frame events come from the pipeline, which runs in the daemon
+            log_pipeline.configure(self.config, frame_events=False)
+
+        self._cast_manager = None
+        self._device_discovery = None
+        self._main_window = None
+        self._stack_lock = threading.Lock()
+        self.stack_ready = threading.Event()
+
+        # Setup UI
+        with profile("tray icon"):
+            from ui.device_model import DeviceModel
+            from ui.system_tray import SystemTrayIcon
+            # Device table shared by the tray menu and the main window
+            self.device_model = DeviceModel()
+            self.tray_icon = SystemTrayIcon(self)
+            self.tray_icon.show()
+        self.profiler.mark("tray_visible", modules=True)
+        logger.info("UbuntuCast tray icon ready")
+
+        loader = threading.Thread(target=self._load_in_background, name="UbuntuCastStartup")
+        loader.daemon = True
+        loader.start()
+
+    @property
+    def cast_manager(self):
+        """The daemon client standing in for the cast manager, connected on first use"""
+        self._load_cast_stack()
+        return self._cast_manager
+
+    @property
+    def device_discovery(self):
+        """The daemon client standing in for device discovery, connected on first use"""
+        self._load_cast_stack()
+        return self._device_discovery
+
+    @property
+    def main_window(self):
+        """The main window, created the first time it is needed; None if it is not available"""
+        if self._main_window is None:
+            with self.profiler.phase("main window"):
+                try:
+                    from ui.main_window import MainWindow
+                except ImportError as e:
+                    logger.error(f"Main window is not available: {e}")
+                    return None
+                self._main_window = MainWindow(self.cast_manager, self.device_discovery, self.device_model)
+        return self._main_window
+
+    def _load_cast_stack(self):
+        """Connect to the casting daemon, starting it if needed, once"""
+        with self._stack_lock:
+            if self._cast_manager is not None:
+                return
+            with self.profiler.phase("connect to daemon"):
+                from src.daemon import DaemonClient, socket_path_from_config
+                client = DaemonClient(socket_path_from_config(self.config))
+                client.connect_or_spawn([sys.executable, os.path.abspath(__file__), '--daemon'])
+                self.device_model.attach(client)
+            self._device_discovery = client
+            self._cast_manager = client
+        self.stack_ready.set()
+
+    def _load_in_background(self):
+        """Connect to the casting daemon off the GUI thread"""
+        try:
+            self._load_cast_stack()
+        except Exception as e:
+            logger.error(f"Failed to start the casting stack: {e}")
+            return
+        self.profiler.mark("daemon_connected")
+        # Status callbacks are hooked up on the GUI thread
+        self.tray_icon.cast_stack_loaded.emit()
+        if self.profiler.enabled:
+            logger.info(f"Startup profile:\n{self.profiler.format()}")
+
     def run(self):
         """Run the application"""
         # Show main window if this is the first run
         if self.config.get('GENERAL', 'first_run', fallback='true') == 'true':
-            self.main_window.show()
+            main_window = self.main_window
+            if main_window is not None:
+                main_window.show()
             # Update first_run setting
             self.config['GENERAL']['first_run'] = 'false'
             config_path = os.path.expanduser("~/.config/ubuntucast/config.ini")
             with open(config_path, 'w') as config_file:
                 self.config.write(config_file)
         
-        # Start device discovery
-        self.device_discovery.start_discovery()
-        
         # Run event loop
         return self.app.exec_()
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Screen casting tool for Ubuntu Linux")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="log how long each startup phase and its imports take")
+    parser.add_argument('--daemon', action='store_true',
+                        help="run discovery and casting headless, controlled over the daemon socket")
+    # Anything else is left to Qt, e.g. -platform
+    args, _ = parser.parse_known_args()
+
     # Create necessary directories
     os.makedirs(os.path.expanduser("~/.local/share/ubuntucast/logs"), exist_ok=True)
+    _setup_logging("ubuntucast-daemon" if args.daemon else "ubuntucast")
+    
+    if args.daemon:
+        from src.daemon import CastDaemon
+        from src.metrics import metrics
+        config = load_config()
+        log_pipeline.configure(config)
+        metrics.configure(config)
+        sys.exit(CastDaemon(config).run())
     
     # Start application
-    ubuntucast = UbuntuCast()
+    ubuntucast = UbuntuCast(StartupProfiler(enabled=args.profile_startup, origin=_STARTED))
     sys.exit(ubuntucast.run())
 
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
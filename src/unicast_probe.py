@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Unicast Device Probing
+
+import errno
+import http.client
+import ipaddress
+import json
+import logging
+import selectors
+import socket
+import ssl
+import threading
+import time
+import uuid as uuid_module
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger("UbuntuCast.UnicastProbe")
+
+CAST_PORT = 8009  # Cast control channel, open on every receiver
+EUREKA_HTTP_PORT = 8008
+EUREKA_HTTPS_PORT = 8443  # Newer firmware only answers over TLS
+EUREKA_PATH = "/setup/eureka_info?params=name,device_info"
+
+MAX_RANGE_HOSTS = 4096  # Largest range expanded from a single CIDR entry
+MAX_SOCKETS = 512  # Connection attempts in flight at once during a sweep
+
+
+def expand_hosts(spec: str) -> List[str]:
+    """Expand a comma or space separated list of hosts and CIDR ranges"""
+    hosts = []
+    for entry in spec.replace(',', ' ').split():
+        if '/' not in entry:
+            hosts.append(entry)
+            continue
+        try:
+            network = ipaddress.ip_network(entry, strict=False)
+        except ValueError as e:
+            logger.error(f"Invalid address range {entry}: {e}")
+            continue
+        if network.num_addresses > MAX_RANGE_HOSTS + 2:
+            logger.warning(f"Address range {entry} is too large, probing its first {MAX_RANGE_HOSTS} hosts")
+        for count, address in enumerate(network.hosts()):
+            if count >= MAX_RANGE_HOSTS:
+                break
+            hosts.append(str(address))
+    # Keep the order but drop duplicates
+    return list(dict.fromkeys(hosts))
+
+
+def fetch_eureka_info(address: str, timeout: float = 5.0) -> Optional[Dict[str, Any]]:
+    """Fetch a receiver's device-info document, over HTTP and then over TLS"""
+    # Receivers use self-signed certificates
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    connections = (
+        lambda: http.client.HTTPConnection(address, EUREKA_HTTP_PORT, timeout=timeout),
+        lambda: http.client.HTTPSConnection(address, EUREKA_HTTPS_PORT, timeout=timeout, context=context),
+    )
+    for make_connection in connections:
+        connection = make_connection()
+        try:
+            connection.request('GET', EUREKA_PATH)
+            response = connection.getresponse()
+            if response.status == 200:
+                return json.loads(response.read())
+        except (OSError, http.client.HTTPException, ValueError):
+            pass
+        finally:
+            connection.close()
+    logger.debug(f"No device info from {address}")
+    return None
+
+
+class UnicastProber:
+    """Finds cast receivers at known addresses without multicast
+
+    Probing happens in two phases so that a whole range finishes in about
+    one timeout period: a single non-blocking connect sweep to the cast
+    port of every host at once, then device-info requests to the hosts
+    that accepted, on a bounded thread pool.
+    """
+
+    def __init__(self, timeout: float = 5.0, max_workers: int = 16):
+        self.timeout = timeout
+        self.max_workers = max_workers
+
+    def probe(self, hosts: Iterable[str], stop_event: Optional[threading.Event] = None) -> List[Dict[str, Any]]:
+        """Return device table entries for the cast receivers among hosts"""
+        started = time.monotonic()
+        addresses = self._resolve(hosts)
+        reachable = self._sweep(addresses, stop_event)
+        if not reachable:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(reachable)),
+                                thread_name_prefix="UbuntuCastProbe") as executor:
+            devices = [device for device in executor.map(self._device_info, reachable) if device]
+        logger.info(f"Unicast probe of {len(addresses)} hosts found {len(devices)} cast devices "
+                    f"in {time.monotonic() - started:.2f} s")
+        return devices
+
+    def _resolve(self, hosts: Iterable[str]) -> List[str]:
+        """Turn host names into IPv4 addresses, keeping literal addresses as they are"""
+        addresses = []
+        for host in hosts:
+            try:
+                ipaddress.ip_address(host)
+                addresses.append(host)
+                continue
+            except ValueError:
+                pass
+            try:
+                addresses.append(socket.gethostbyname(host))
+            except OSError as e:
+                logger.warning(f"Cannot resolve cast host {host}: {e}")
+        return list(dict.fromkeys(addresses))
+
+    def _sweep(self, addresses: List[str], stop_event: Optional[threading.Event]) -> List[str]:
+        """Return the addresses accepting connections on the cast port"""
+        reachable = []
+        for start in range(0, len(addresses), MAX_SOCKETS):
+            if stop_event is not None and stop_event.is_set():
+                break
+            selector = selectors.DefaultSelector()
+            for address in addresses[start:start + MAX_SOCKETS]:
+                family = socket.AF_INET6 if ':' in address else socket.AF_INET
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                error = sock.connect_ex((address, CAST_PORT))
+                if error not in (0, errno.EINPROGRESS, errno.EAGAIN):
+                    sock.close()
+                    continue
+                selector.register(sock, selectors.EVENT_WRITE, address)
+
+            deadline = time.monotonic() + self.timeout
+            while selector.get_map():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (stop_event is not None and stop_event.is_set()):
+                    break
+                for key, _ in selector.select(min(remaining, 0.5)):
+                    sock = key.fileobj
+                    if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                        reachable.append(key.data)
+                    selector.unregister(sock)
+                    sock.close()
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
+        return reachable
+
+    def _device_info(self, address: str) -> Optional[Dict[str, Any]]:
+        """Ask a receiver for its name and identity"""
+        info = fetch_eureka_info(address, self.timeout)
+        if info is None:
+            return None
+        device_info = info.get('device_info', {})
+        try:
+            uuid = str(uuid_module.UUID(device_info['ssdp_udn']))
+        except (KeyError, ValueError, TypeError):
+            logger.warning(f"Cast device at {address} did not report its uuid")
+            return None
+        capabilities = device_info.get('capabilities', {})
+        return {
+            'name': info.get('name') or address,
+            'model_name': device_info.get('model_name', ''),
+            'uuid': uuid,
+            'cast_type': 'audio' if capabilities.get('display_supported') is False else 'cast',
+            'address': address,
+            'port': CAST_PORT,
+            'status': 'available'
+        }
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# X11 Window Capture
+
+import ctypes
+import logging
+import os
+import select
+import time
+from typing import Iterator, Optional
+
+from src.screen_capture import (CaptureError, Frame, ScreenCapture, XWindowAttributes, _ShmSlot, _bind_x11,
+                                _load_library, trap_x_errors)
+
+logger = logging.getLogger("UbuntuCast.WindowCapture")
+
+# X11, XComposite and XDamage constants
+COMPOSITE_REDIRECT_AUTOMATIC = 0
+DAMAGE_REPORT_NON_EMPTY = 3
+DAMAGE_NOTIFY = 0
+STRUCTURE_NOTIFY_MASK = 1 << 17
+DESTROY_NOTIFY = 17
+UNMAP_NOTIFY = 18
+MAP_NOTIFY = 19
+CONFIGURE_NOTIFY = 22
+IS_VIEWABLE = 2
+XA_WINDOW = 33
+
+
+class XConfigureEvent(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_int),
+        ('serial', ctypes.c_ulong),
+        ('send_event', ctypes.c_int),
+        ('display', ctypes.c_void_p),
+        ('event', ctypes.c_ulong),
+        ('window', ctypes.c_ulong),
+        ('x', ctypes.c_int),
+        ('y', ctypes.c_int),
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('border_width', ctypes.c_int),
+        ('above', ctypes.c_ulong),
+        ('override_redirect', ctypes.c_int),
+    ]
+
+
+class XEvent(ctypes.Union):
+    _fields_ = [
+        ('type', ctypes.c_int),
+        ('xconfigure', XConfigureEvent),
+        ('pad', ctypes.c_long * 24),
+    ]
+
+
+def _bind_window_capture(libx11, libxcomposite, libxdamage):
+    """Declare the argument and return types of the event, XComposite and XDamage functions used"""
+    libx11.XSelectInput.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_long]
+    libx11.XPending.argtypes = [ctypes.c_void_p]
+    libx11.XNextEvent.argtypes = [ctypes.c_void_p, ctypes.POINTER(XEvent)]
+    libx11.XConnectionNumber.argtypes = [ctypes.c_void_p]
+    libx11.XFreePixmap.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+
+    libxcomposite.XCompositeQueryExtension.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_int),
+                                                       ctypes.POINTER(ctypes.c_int)]
+    libxcomposite.XCompositeRedirectWindow.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int]
+    libxcomposite.XCompositeUnredirectWindow.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int]
+    libxcomposite.XCompositeNameWindowPixmap.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+    libxcomposite.XCompositeNameWindowPixmap.restype = ctypes.c_ulong
+
+    libxdamage.XDamageQueryExtension.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_int),
+                                                 ctypes.POINTER(ctypes.c_int)]
+    libxdamage.XDamageCreate.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int]
+    libxdamage.XDamageCreate.restype = ctypes.c_ulong
+    libxdamage.XDamageDestroy.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+    libxdamage.XDamageSubtract.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong]
+
+
+def active_window(display_name: Optional[str] = None) -> Optional[int]:
+    """The window the window manager reports as active, if any"""
+    libx11 = _load_library('X11')
+    if libx11 is None:
+        return None
+    libx11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+    libx11.XOpenDisplay.restype = ctypes.c_void_p
+    libx11.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+    libx11.XDefaultRootWindow.restype = ctypes.c_ulong
+    libx11.XInternAtom.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+    libx11.XInternAtom.restype = ctypes.c_ulong
+    libx11.XGetWindowProperty.argtypes = [
+        ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_long, ctypes.c_long, ctypes.c_int,
+        ctypes.c_ulong, ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_int),
+        ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_void_p)]
+    libx11.XFree.argtypes = [ctypes.c_void_p]
+    libx11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+
+    name = display_name or os.environ.get('DISPLAY', ':0')
+    display = libx11.XOpenDisplay(name.encode())
+    if not display:
+        return None
+    try:
+        atom = libx11.XInternAtom(display, b"_NET_ACTIVE_WINDOW", 1)
+        if not atom:
+            return None
+        actual_type = ctypes.c_ulong()
+        actual_format = ctypes.c_int()
+        items = ctypes.c_ulong()
+        remaining = ctypes.c_ulong()
+        data = ctypes.c_void_p()
+        status = libx11.XGetWindowProperty(
+            display, libx11.XDefaultRootWindow(display), atom, 0, 1, 0, XA_WINDOW,
+            ctypes.byref(actual_type), ctypes.byref(actual_format), ctypes.byref(items),
+            ctypes.byref(remaining), ctypes.byref(data))
+        if status != 0 or not data.value:
+            return None
+        try:
+            # Format 32 properties are returned as C longs
+            window = ctypes.cast(data, ctypes.POINTER(ctypes.c_ulong))[0] if items.value else 0
+        finally:
+            libx11.XFree(data)
+        return window or None
+    finally:
+        libx11.XCloseDisplay(display)
+
+
+class WindowCapture(ScreenCapture):
+    """Captures a single window from its composite pixmap, only when it repaints
+
+    The window is redirected with XComposite, so its contents can be read
+    even where other windows cover it, and only its own pixels are grabbed
+    into the MIT-SHM ring. XDamage reports when it repaints: ``frames()``
+    yields a frame for each repaint, at most ``framerate`` a second, and
+    otherwise the unchanged window every ``idle_interval`` seconds so the
+    stream stays alive. Moves need nothing; a resize renames the pixmap
+    and reallocates the ring at the new size before the next grab, which
+    also invalidates frames already returned.
+    """
+
+    def __init__(self, window_id: int, display_name: Optional[str] = None, ring_size: int = 3,
+                 framerate: float = 30, clock=time.monotonic, idle_interval: float = 1.0):
+        super().__init__(display_name, window_id=window_id, ring_size=ring_size, framerate=framerate,
+                         clock=clock)
+        self.idle_interval = idle_interval
+        self.damage_events = 0
+        self.resizes = 0
+        self._libxcomposite = None
+        self._libxdamage = None
+        self._damage = 0
+        self._damage_event = 0
+        self._pixmap = 0
+        self._redirected = False
+        self._dirty = True
+        self._stale = True  # The pixmap must be named again, after a map or resize
+        self._viewable = False
+        self._event = XEvent()
+
+    def open(self):
+        """Connect to the X server, start watching the window and allocate the frame ring"""
+        if self._frames:
+            return
+        self._libx11 = _load_library('X11')
+        self._libxext = _load_library('Xext')
+        self._libc = _load_library('c')
+        if not (self._libx11 and self._libxext and self._libc):
+            raise CaptureError("libX11 or libXext is missing")
+        _bind_x11(self._libx11, self._libxext, self._libc)
+        try:
+            self._open_shm()
+        except CaptureError:
+            self._close_shm()
+            raise
+        self.use_shm = True
+        logger.info(f"Capturing window {self.window_id:#x} ({self.width}x{self.height}) from "
+                    f"{self.display_name} (XComposite, ring of {self.ring_size})")
+
+    def _open_shm(self):
+        """Redirect the window, watch it for damage and size changes, and allocate the ring"""
+        self._libxcomposite = _load_library('Xcomposite')
+        self._libxdamage = _load_library('Xdamage')
+        if self._libxcomposite is None or self._libxdamage is None:
+            raise CaptureError("libXcomposite or libXdamage is missing")
+        libx11 = self._libx11
+        _bind_window_capture(libx11, self._libxcomposite, self._libxdamage)
+
+        self._display = libx11.XOpenDisplay(self.display_name.encode())
+        if not self._display:
+            raise CaptureError(f"Cannot open display {self.display_name}")
+        if not self._libxext.XShmQueryExtension(self._display):
+            raise CaptureError("X server does not support MIT-SHM")
+        event_base, error_base = ctypes.c_int(), ctypes.c_int()
+        if not self._libxcomposite.XCompositeQueryExtension(self._display, ctypes.byref(event_base),
+                                                            ctypes.byref(error_base)):
+            raise CaptureError("X server does not support XComposite")
+        if not self._libxdamage.XDamageQueryExtension(self._display, ctypes.byref(event_base),
+                                                      ctypes.byref(error_base)):
+            raise CaptureError("X server does not support XDamage")
+        self._damage_event = event_base.value + DAMAGE_NOTIFY
+
+        if not self.window_id:
+            raise CaptureError("No window to capture")
+        attributes = XWindowAttributes()
+        with trap_x_errors(libx11, self._display, f"Watching window {self.window_id:#x}", sync=True):
+            if not libx11.XGetWindowAttributes(self._display, self.window_id, ctypes.byref(attributes)):
+                raise CaptureError(f"Cannot query window {self.window_id:#x}")
+            self._visual = attributes.visual
+            self._depth = attributes.depth
+            self._libxcomposite.XCompositeRedirectWindow(self._display, self.window_id,
+                                                         COMPOSITE_REDIRECT_AUTOMATIC)
+            self._redirected = True
+            libx11.XSelectInput(self._display, self.window_id, STRUCTURE_NOTIFY_MASK)
+            self._damage = self._libxdamage.XDamageCreate(self._display, self.window_id, DAMAGE_REPORT_NON_EMPTY)
+        if not self._refresh_pixmap():
+            raise CaptureError(f"Window {self.window_id:#x} is not mapped")
+
+    def _refresh_pixmap(self) -> bool:
+        """Name the window's current pixmap and resize the ring to it; False if the window is not shown"""
+        libx11 = self._libx11
+        attributes = XWindowAttributes()
+        with trap_x_errors(libx11, self._display, "Naming the cast window's pixmap", sync=True):
+            if not libx11.XGetWindowAttributes(self._display, self.window_id, ctypes.byref(attributes)):
+                raise CaptureError("The cast window was closed")
+            self._viewable = attributes.map_state == IS_VIEWABLE
+            if not self._viewable:
+                return False
+            if self._pixmap:
+                libx11.XFreePixmap(self._display, self._pixmap)
+            self._pixmap = self._libxcomposite.XCompositeNameWindowPixmap(self._display, self.window_id)
+        self._drawable = self._pixmap
+        # The pixmap includes the border
+        border = attributes.border_width
+        self._origin = (border, border)
+        size = (attributes.width, attributes.height)
+        if size != self._size or not self._slots:
+            if self._slots:
+                self.resizes += 1
+                logger.info(f"Cast window resized to {size[0]}x{size[1]}")
+            for slot in self._slots:
+                slot.release()
+            self._slots = []
+            self._frames = []
+            self._size = size
+            for _ in range(self.ring_size):
+                slot = _ShmSlot(self, *size)
+                self._slots.append(slot)
+                self._frames.append(slot.frame)
+        self._stale = False
+        self._dirty = True
+        return True
+
+    def _close_shm(self):
+        if self._display:
+            libx11 = self._libx11
+            try:
+                # The window may already be gone
+                with trap_x_errors(libx11, self._display, "Releasing the cast window", sync=True):
+                    if self._damage:
+                        self._libxdamage.XDamageDestroy(self._display, self._damage)
+                    if self._pixmap:
+                        libx11.XFreePixmap(self._display, self._pixmap)
+                    if self._redirected:
+                        libx11.XSelectInput(self._display, self.window_id, 0)
+                        self._libxcomposite.XCompositeUnredirectWindow(self._display, self.window_id,
+                                                                       COMPOSITE_REDIRECT_AUTOMATIC)
+            except CaptureError as e:
+                logger.debug(str(e))
+        self._damage = 0
+        self._pixmap = 0
+        self._redirected = False
+        self._stale = True
+        super()._close_shm()
+
+    def _process_events(self):
+        """Handle queued damage, resize, map and destroy events"""
+        libx11 = self._libx11
+        event = self._event
+        # Errors of earlier requests without a reply are read along with the events
+        with trap_x_errors(libx11, self._display, "Watching the cast window"):
+            while libx11.XPending(self._display):
+                libx11.XNextEvent(self._display, ctypes.byref(event))
+                if event.type == self._damage_event:
+                    self.damage_events += 1
+                    self._dirty = True
+                elif event.type == CONFIGURE_NOTIFY:
+                    configure = event.xconfigure
+                    if (configure.width, configure.height) != self._size:
+                        self._stale = True
+                elif event.type == MAP_NOTIFY:
+                    self._stale = True
+                elif event.type == UNMAP_NOTIFY:
+                    self._viewable = False
+                elif event.type == DESTROY_NOTIFY:
+                    raise CaptureError("The cast window was closed")
+
+    def grab(self) -> Frame:
+        """Capture the window as it is now"""
+        if not self._frames:
+            self.open()
+        if self._stale and not self._refresh_pixmap():
+            raise CaptureError("The cast window is not shown")
+        self._dirty = False
+        # Damage from here on, even during the grab, is reported again; an error
+        # arrives with the reply to the XShmGetImage that follows
+        with trap_x_errors(self._libx11, self._display, "Grabbing the cast window"):
+            self._libxdamage.XDamageSubtract(self._display, self._damage, 0, 0)
+            return super().grab()
+
+    def frames(self, max_frames: Optional[int] = None) -> Iterator[Frame]:
+        """Yield a frame whenever the window repaints, at most at the configured frame rate"""
+        if not self._frames:
+            self.open()
+        connection = self._libx11.XConnectionNumber(self._display)
+        last_frame = float('-inf')
+        count = 0
+        while max_frames is None or count < max_frames:
+            self._process_events()
+            if self._stale and not self._viewable:
+                # Mapped again, or resized while hidden
+                self._refresh_pixmap()
+            now = time.monotonic()
+            interval = 1.0 / self.framerate if self.framerate > 0 else 0.0
+            if self._viewable:
+                due = last_frame + (interval if self._dirty or self._stale else self.idle_interval)
+                if now >= due:
+                    yield self.grab()
+                    count += 1
+                    last_frame = time.monotonic()
+                    continue
+                timeout = due - now
+            else:
+                timeout = self.idle_interval
+            # Sleep until the deadline or until the X server sends something
+            select.select([connection], [], [], timeout)
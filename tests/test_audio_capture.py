@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Audio capture tests, on synthetic PCM
+
+import time
+import types
+
+import numpy as np
+import pytest
+
+from src import audio_capture
+from src.audio_capture import BYTES_PER_SAMPLE, AudioCapture, PcmRingBuffer, SyntheticPcmSource
+from src.pipeline_clock import PipelineClock
+
+RATE = 48000
+CHANNELS = 2
+
+
+class Simulation:
+    """Runs the audio feeder on simulated time, with a sound card delivering PCM as time passes
+
+    The feeder thread's sleeps advance the clock. On the way the simulated
+    sound card, whose clock runs ``drift_ppm`` fast or slow, hands over a
+    period of audio at a time straight into the ring, as the capture thread
+    would, except while it is stalled.
+    """
+
+    def __init__(self, monkeypatch, drift_ppm: float = 0.0, video_delay: float = 0.0, period: float = 0.01):
+        self.now = 0.0
+        self.period = period
+        self.device_rate = RATE * (1 + drift_ppm / 1e6)
+        self.produced = 0  # Frames the sound card has produced, delivered or not
+        self.stalls = []
+        self.emitted = 0
+        self.duration = 0.0
+        source = types.SimpleNamespace(rate=RATE, channels=CHANNELS, latency=period)
+        self.capture = AudioCapture(source, PipelineClock(lambda: self.now), self._output,
+                                    video_delay=lambda: video_delay)
+        self._next_delivery = period
+        monkeypatch.setattr(audio_capture, 'time', types.SimpleNamespace(sleep=self._sleep))
+
+    def run(self, duration: float):
+        """Feed the encoder until ``duration`` seconds of simulated time have passed"""
+        self.duration = duration
+        self.capture._running = True
+        self.capture._feed()
+
+    @property
+    def fill(self) -> float:
+        """Seconds buffered as the feeder measured them before taking its last chunk"""
+        chunk_duration = self.capture.chunk_frames / RATE
+        return self.capture._fill_level(chunk_duration) + chunk_duration
+
+    def _output(self, data: memoryview):
+        self.emitted += len(data) // (CHANNELS * BYTES_PER_SAMPLE)
+
+    def _sleep(self, seconds: float):
+        end = self.now + seconds
+        while self._next_delivery <= end:
+            self.now = self._next_delivery
+            self._next_delivery += self.period
+            due = int(self.now * self.device_rate)
+            if not any(start <= self.now < stop for start, stop in self.stalls):
+                self._deliver(due - self.produced)
+            self.produced = due
+        self.now = end
+        if self.now >= self.duration:
+            self.capture._running = False
+
+    def _deliver(self, frames: int):
+        ring = self.capture.ring
+        delivered = 0
+        while delivered < frames:
+            span = ring.write_span()
+            if span is None:
+                ring.overruns += frames - delivered
+                break
+            count = min(len(span), frames - delivered)
+            span[:count] = 1000
+            delivered += count
+            ring.commit(count, self.now - self.period)
+
+
+def test_steady_source_keeps_the_target_latency(monkeypatch):
+    simulation = Simulation(monkeypatch)
+    simulation.run(10.0)
+    stats = simulation.capture.stats()
+
+    assert stats['underruns'] == 0
+    assert stats['overruns'] == 0
+    # The encoder's timeline keeps pace with the clock, less the time to fill the target latency
+    assert simulation.emitted == pytest.approx(RATE * 10.0, abs=RATE * 0.1)
+    assert simulation.fill == pytest.approx(simulation.capture.min_latency, abs=0.005)
+    assert abs(stats['drift_ppm']) < 50
+
+
+@pytest.mark.parametrize('drift_ppm', [-500.0, 500.0, 2000.0])
+def test_sound_card_drift_is_corrected(monkeypatch, drift_ppm):
+    simulation = Simulation(monkeypatch, drift_ppm=drift_ppm)
+    simulation.run(180.0)
+    stats = simulation.capture.stats()
+
+    assert stats['drift_ppm'] == pytest.approx(drift_ppm, abs=100)
+    assert stats['underruns'] == 0
+    assert simulation.fill == pytest.approx(simulation.capture.min_latency, abs=0.005)
+    # Output stays on the pipeline clock rather than the sound card's
+    assert simulation.emitted == pytest.approx(RATE * 180.0, abs=RATE * 0.1)
+
+
+def test_stalled_source_underruns_without_stalling_the_timeline(monkeypatch):
+    simulation = Simulation(monkeypatch)
+    simulation.stalls.append((5.0, 5.5))
+    simulation.run(10.0)
+    stats = simulation.capture.stats()
+
+    assert stats['underruns'] >= 1
+    # Silence fills the stall, so the encoder still gets audio for all of it
+    assert simulation.emitted == pytest.approx(RATE * 10.0, abs=RATE * 0.1)
+    assert simulation.fill == pytest.approx(simulation.capture.min_latency, abs=0.005)
+
+
+def test_audio_waits_as_long_as_video(monkeypatch):
+    simulation = Simulation(monkeypatch, video_delay=0.2)
+    simulation.run(20.0)
+    stats = simulation.capture.stats()
+
+    assert stats['latency'] == pytest.approx(0.2, abs=0.02)
+    assert stats['av_offset'] == pytest.approx(0.0, abs=0.02)
+    assert stats['underruns'] == 0
+
+
+def test_ring_reads_across_the_wrap_around():
+    ring = PcmRingBuffer(8, channels=1, rate=RATE)
+    out = np.zeros((8, 1), dtype=np.int16)
+    ring.write_span()[:6] = 0
+    ring.commit(6, 0.0)
+    assert ring.read_into(out, 6) == 6
+
+    # Free space is offered in contiguous spans, up to the end of the storage and then from its start
+    span = ring.write_span()
+    assert len(span) == 2
+    span[:] = [[10], [11]]
+    ring.commit(2, 0.0)
+    span = ring.write_span()
+    assert len(span) == 6
+    span[:4] = np.arange(12, 16)[:, None]
+    ring.commit(4, 0.0)
+
+    assert ring.read_into(out, 8) == 6
+    assert out[:6, 0].tolist() == [10, 11, 12, 13, 14, 15]
+    assert ring.available == 0
+
+
+def test_full_ring_offers_no_space_and_keeps_unread_audio():
+    ring = PcmRingBuffer(4, channels=1, rate=RATE)
+    ring.write_span()[:] = 7
+    ring.commit(4, 0.0)
+    assert ring.write_span() is None
+    ring.discard(1)
+    assert len(ring.write_span()) == 1
+    out = np.zeros((4, 1), dtype=np.int16)
+    assert ring.read_into(out, 4) == 3 and out[:3, 0].tolist() == [7, 7, 7]
+
+
+def test_ring_timestamps_are_extrapolated_from_the_latest_delivery():
+    ring = PcmRingBuffer(RATE, channels=1, rate=RATE)
+    ring.commit(RATE // 2, 10.0)
+    assert ring.timestamp_of(RATE // 2) == 10.0
+    assert ring.timestamp_of(0) == pytest.approx(9.5)
+
+
+def test_capture_runs_on_a_real_synthetic_source():
+    clock = PipelineClock()
+    source = SyntheticPcmSource(clock=clock.now)
+    chunks = []
+    capture = AudioCapture(source, clock, lambda data: chunks.append(bytes(data)))
+    clock.start()
+    capture.start()
+    time.sleep(0.5)
+    capture.stop()
+
+    assert not any(thread.is_alive() for thread in capture._threads)
+    assert chunks and all(len(chunk) == capture.chunk_frames * CHANNELS * BYTES_PER_SAMPLE for chunk in chunks)
+    samples = np.frombuffer(b''.join(chunks), dtype=np.int16)
+    # The tone got through, not just silence
+    assert np.abs(samples).max() > 4000
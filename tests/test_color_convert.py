@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Colour conversion tests
+
+import numpy as np
+import pytest
+
+from src.color_convert import COLOR_MATRICES, ColorConverter, fit_size, resolution_size
+
+
+def reference_yuv(bgra: np.ndarray, matrix: str):
+    """Limited-range Y, Cb and Cr planes of a BGRA frame, computed per pixel in float64"""
+    kr, kb = COLOR_MATRICES[matrix]
+    b, g, r = (bgra[:, :, channel].astype(np.float64) for channel in range(3))
+    luma = kr * r + (1.0 - kr - kb) * g + kb * b
+    y = 16 + luma * 219 / 255
+    cb = 128 + (b - luma) * 224 / 255 / (2 * (1 - kb))
+    cr = 128 + (r - luma) * 224 / 255 / (2 * (1 - kr))
+
+    def subsample(plane):
+        return (plane[0::2, 0::2] + plane[1::2, 0::2] + plane[0::2, 1::2] + plane[1::2, 1::2]) / 4
+
+    return np.floor(y + 0.5), np.floor(subsample(cb) + 0.5), np.floor(subsample(cr) + 0.5)
+
+
+def planes(output: np.ndarray, width: int, height: int, pixel_format: str):
+    """Split a converter output buffer into Y, U and V planes"""
+    luma_size = width * height
+    y = output[:luma_size].reshape(height, width)
+    if pixel_format == 'nv12':
+        uv = output[luma_size:].reshape(height // 2, width // 2, 2)
+        return y, uv[:, :, 0], uv[:, :, 1]
+    chroma_size = luma_size // 4
+    u = output[luma_size:luma_size + chroma_size].reshape(height // 2, width // 2)
+    v = output[luma_size + chroma_size:].reshape(height // 2, width // 2)
+    return y, u, v
+
+
+def random_frame(width: int, height: int, seed: int = 1) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 4), dtype=np.uint8)
+
+
+@pytest.mark.parametrize('pixel_format', ['i420', 'nv12'])
+@pytest.mark.parametrize('matrix', ['bt601', 'bt709'])
+def test_conversion_matches_reference(pixel_format, matrix):
+    frame = random_frame(64, 48)
+    converter = ColorConverter((1920, 1080), pixel_format, matrix)
+    output = converter.convert(frame)
+
+    assert converter.output_size == (64, 48)
+    assert output.nbytes == 64 * 48 * 3 // 2
+    for plane, expected in zip(planes(output, 64, 48, pixel_format), reference_yuv(frame, matrix)):
+        assert np.abs(plane.astype(np.int32) - expected).max() <= 1
+
+
+@pytest.mark.parametrize('bgr, yuv', [
+    ((255, 255, 255), (235, 128, 128)),
+    ((0, 0, 0), (16, 128, 128)),
+    ((0, 0, 255), (63, 102, 240)),
+    ((255, 0, 0), (32, 240, 118)),
+])
+def test_bt709_reference_colours(bgr, yuv):
+    frame = np.zeros((4, 4, 4), dtype=np.uint8)
+    frame[:, :, :3] = bgr
+    y, u, v = planes(ColorConverter((4, 4)).convert(frame), 4, 4, 'i420')
+    assert (int(y[0, 0]), int(u[0, 0]), int(v[0, 0])) == pytest.approx(yuv, abs=1)
+
+
+def test_nv12_interleaves_the_i420_chroma_planes():
+    frame = random_frame(32, 16)
+    i420 = planes(ColorConverter((32, 16), 'i420').convert(frame).copy(), 32, 16, 'i420')
+    nv12 = planes(ColorConverter((32, 16), 'nv12').convert(frame), 32, 16, 'nv12')
+    for i420_plane, nv12_plane in zip(i420, nv12):
+        np.testing.assert_array_equal(i420_plane, nv12_plane)
+
+
+def test_integer_downscale_averages_blocks():
+    frame = random_frame(64, 32)
+    converter = ColorConverter((32, 16))
+    output = converter.convert(frame)
+
+    assert converter.output_size == (32, 16)
+    averaged = frame.astype(np.float64).reshape(16, 2, 32, 2, 4).mean(axis=(1, 3))
+    # The reference rounds the averaged pixels, the converter keeps them in float
+    for plane, expected in zip(planes(output, 32, 16, 'i420'), reference_yuv(averaged, 'bt709')):
+        assert np.abs(plane.astype(np.int32) - expected).max() <= 1
+
+
+def test_odd_sizes_are_cropped_to_even():
+    converter = ColorConverter((1280, 720))
+    converter.convert(random_frame(33, 21))
+    assert converter.output_size == (32, 20)
+
+
+def test_output_buffer_is_reused_until_the_size_changes():
+    converter = ColorConverter((1280, 720))
+    first = converter.convert(random_frame(64, 48, seed=1))
+    assert converter.convert(random_frame(64, 48, seed=2)) is first
+    assert converter.convert(random_frame(128, 96)) is not first
+
+
+def test_set_output_size_applies_to_the_next_frame():
+    converter = ColorConverter((1280, 720))
+    converter.convert(random_frame(256, 128))
+    converter.set_output_size((128, 128))
+    converter.convert(random_frame(256, 128))
+    assert converter.output_size == (128, 64)
+
+
+def test_fit_size_keeps_aspect_ratio_without_upscaling():
+    assert fit_size((2560, 1440), (1280, 720)) == (1280, 720)
+    assert fit_size((1920, 1200), (1280, 720)) == (1152, 720)
+    assert fit_size((800, 600), (1280, 720)) == (800, 600)
+    assert fit_size((1001, 751), (1280, 720)) == (958, 720)
+
+
+@pytest.mark.parametrize('source, expected', [
+    ((1, 1), (2, 2)),
+    ((0, 0), (2, 2)),
+    ((4000, 2), (1280, 2)),
+    ((2, 4000), (2, 720)),
+])
+def test_fit_size_never_goes_below_two_pixels(source, expected):
+    assert fit_size(source, (1280, 720)) == expected
+
+
+@pytest.mark.parametrize('shape', [(1, 1, 4), (1, 7, 4), (9, 1, 4), (3000, 3, 4)])
+@pytest.mark.parametrize('pixel_format', ['i420', 'nv12'])
+def test_tiny_frames_convert_to_at_least_two_by_two(shape, pixel_format):
+    frame = np.zeros(shape, dtype=np.uint8)
+    frame[:, :, :3] = 255
+    converter = ColorConverter((1280, 720), pixel_format)
+    output = converter.convert(frame)
+
+    width, height = converter.output_size
+    assert width >= 2 and height >= 2 and width % 2 == 0 and height % 2 == 0
+    assert output.nbytes == width * height * 3 // 2
+    assert output[:width * height].min() >= 234
+
+
+def test_resolution_presets_and_custom_sizes():
+    assert resolution_size('1080p') == (1920, 1080)
+    assert resolution_size('1023x769') == (1022, 768)
+    with pytest.raises(ValueError):
+        resolution_size('huge')
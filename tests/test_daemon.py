@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Daemon and client tests, over a temporary control socket
+
+import configparser
+import json
+import socket
+import threading
+
+import pytest
+
+from src import cast_manager, device_discovery
+from src.daemon import CastDaemon, DaemonClient, _ControlHandler
+from src.device_discovery import DeviceDelta
+
+DEVICE = {'name': "Living Room TV", 'host': '192.0.2.10', 'port': 8009}
+
+
+class FakeCastManager:
+    """Records what the daemon asks of it and reports statuses when told to"""
+
+    def __init__(self, config):
+        self.calls = []
+        self.status_callbacks = []
+        self.device_callbacks = {}
+        self.is_casting = False
+        self.current_device_uuid = None
+        self.current_device_name = ""
+        self.quality_tier = None
+        self.resource_limit = None
+        self.cast_mode = None
+        self.audio_enabled = None
+
+    def set_device_discovery(self, discovery):
+        pass
+
+    def register_status_callback(self, callback, device_uuid=None):
+        if device_uuid is None:
+            self.status_callbacks.append(callback)
+        else:
+            self.device_callbacks[device_uuid] = callback
+
+    def get_target_states(self):
+        return {self.current_device_uuid: "connected"} if self.current_device_uuid else {}
+
+    def select_devices(self, uuids, callback=None):
+        self.calls.append(('select', uuids))
+        self.current_device_uuid = uuids[0]
+        self.current_device_name = DEVICE['name']
+        return True
+
+    def set_cast_mode(self, mode, window_id=None):
+        self.cast_mode = (mode, window_id)
+
+    def set_audio_enabled(self, enabled):
+        self.audio_enabled = enabled
+
+    def start_casting(self):
+        self.calls.append(('start',))
+        self.is_casting = True
+        self.report("started")
+        return True
+
+    def stop_casting(self):
+        self.calls.append(('stop',))
+        self.is_casting = False
+        self.report("stopped")
+
+    def get_pipeline_stats(self):
+        return {'mode': 'thread', 'skipped': 0}
+
+    def shutdown(self):
+        self.calls.append(('shutdown',))
+
+    def report(self, status):
+        for callback in list(self.status_callbacks):
+            callback(status)
+
+
+class FakeDiscovery:
+    def __init__(self, manager):
+        self.devices = {'tv': dict(DEVICE)}
+        self.delta_callbacks = []
+        self.restarts = 0
+
+    def register_delta_callback(self, callback):
+        self.delta_callbacks.append(callback)
+
+    def get_devices(self):
+        return {uuid: dict(device) for uuid, device in self.devices.items()}
+
+    def start_discovery(self):
+        self.restarts += 1
+
+    def stop_discovery(self):
+        pass
+
+    def change(self, *deltas):
+        for delta in deltas:
+            if delta.kind == 'removed':
+                self.devices.pop(delta.uuid, None)
+            else:
+                self.devices[delta.uuid] = delta.device
+        for callback in list(self.delta_callbacks):
+            callback(list(deltas))
+
+
+@pytest.fixture
+def daemon(monkeypatch, tmp_path):
+    # The daemon imports these when it starts, so clients never load the casting stack
+    monkeypatch.setattr(cast_manager, 'CastManager', FakeCastManager)
+    monkeypatch.setattr(device_discovery, 'DeviceDiscovery', FakeDiscovery)
+    daemon = CastDaemon(configparser.ConfigParser(), str(tmp_path / "control.sock"))
+    daemon.start()
+    yield daemon
+    daemon.stop()
+
+
+@pytest.fixture
+def connect(daemon):
+    """Connects clients to the daemon, closing them at the end of the test"""
+    clients = []
+
+    def connect():
+        client = DaemonClient(daemon.socket_path, timeout=5)
+        client.connect()
+        clients.append(client)
+        return client
+
+    yield connect
+    for client in clients:
+        client.close()
+
+
+class Recorder:
+    """Collects what a client's callbacks receive, for waiting on"""
+
+    def __init__(self, client: DaemonClient):
+        self.statuses = []
+        self.deltas = []
+        self._changed = threading.Condition()
+        client.register_status_callback(lambda status: self._add(self.statuses, status))
+        client.register_delta_callback(lambda deltas: self._add(self.deltas, deltas))
+
+    def _add(self, items: list, item):
+        with self._changed:
+            items.append(item)
+            self._changed.notify_all()
+
+    def wait_for(self, items: list, count: int) -> bool:
+        with self._changed:
+            return self._changed.wait_for(lambda: len(items) >= count, timeout=5)
+
+
+def test_subscribe_gives_the_client_the_state_and_devices(daemon, connect):
+    daemon.cast_manager.current_device_uuid = 'tv'
+    daemon.cast_manager.current_device_name = DEVICE['name']
+    client = connect()
+
+    assert client.connected
+    assert client.get_devices() == {'tv': DEVICE}
+    assert client.current_device == 'tv'
+    assert client.current_device_name == DEVICE['name']
+    assert client.get_target_states() == {'tv': "connected"}
+    assert not client.is_casting
+    assert client.call('hello')['version'] == 1
+
+
+def test_events_sent_right_after_the_snapshot_are_not_lost(monkeypatch, daemon):
+    send = _ControlHandler.send
+
+    def send_then_remove(handler, message):
+        send(handler, message)
+        # The device goes away right after the subscription was answered
+        if 'devices' in (message.get('result') or {}):
+            daemon.device_discovery.change(DeviceDelta('removed', 'tv', DEVICE))
+
+    monkeypatch.setattr(_ControlHandler, 'send', send_then_remove)
+    client = DaemonClient(daemon.socket_path, timeout=5)
+    recorder = Recorder(client)
+    try:
+        client.connect()
+        assert recorder.wait_for(recorder.deltas, 1)
+        assert client.get_devices() == {}
+    finally:
+        client.close()
+
+
+def test_commands_reach_the_cast_manager(daemon, connect):
+    client = connect()
+    manager = daemon.cast_manager
+
+    assert client.select_device('tv')
+    assert manager.calls[-1] == ('select', ['tv'])
+    # The client's copy of the state is refreshed after selecting
+    assert client.current_device_name == DEVICE['name']
+
+    client.set_cast_mode("window", 42)
+    client.set_audio_enabled(False)
+    assert client.start_casting()
+    assert manager.cast_mode == ("window", 42) and manager.audio_enabled is False
+    assert client.get_pipeline_stats() == {'mode': 'thread', 'skipped': 0}
+    client.stop_casting()
+    assert manager.calls[-1] == ('stop',)
+
+    restarts = daemon.device_discovery.restarts
+    client.refresh_devices()
+    assert daemon.device_discovery.restarts == restarts + 1
+
+    with pytest.raises(RuntimeError, match="Unknown method"):
+        client.call('reboot')
+
+
+def test_selection_result_arrives_on_the_callback(daemon, connect):
+    client = connect()
+    result = threading.Event()
+    assert client.select_device('tv', callback=lambda selected: selected and result.set())
+    assert result.wait(timeout=5)
+    assert client.current_device == 'tv'
+
+
+def test_events_fan_out_to_every_subscribed_client(daemon, connect):
+    clients = [connect(), connect()]
+    recorders = [Recorder(client) for client in clients]
+
+    clients[0].start_casting()
+    added = {'name': "Kitchen Speaker", 'host': '192.0.2.11', 'port': 8009}
+    daemon.device_discovery.change(DeviceDelta('added', 'speaker', added))
+
+    for client, recorder in zip(clients, recorders):
+        assert recorder.wait_for(recorder.statuses, 1)
+        assert recorder.statuses == ["started"]
+        assert client.is_casting
+        assert recorder.wait_for(recorder.deltas, 1)
+        assert recorder.deltas[0][0].uuid == 'speaker'
+        assert client.get_devices()['speaker'] == added
+
+
+def test_receiver_statuses_are_sent_for_selected_devices(daemon, connect):
+    client = connect()
+    client.select_device('tv')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(daemon.socket_path)
+    stream = sock.makefile('rb')
+    try:
+        sock.sendall(b'{"id": 1, "method": "subscribe"}\n')
+        assert json.loads(stream.readline())['id'] == 1
+        daemon.cast_manager.device_callbacks['tv']("reconnecting")
+        assert json.loads(stream.readline()) == {'event': 'device_status', 'uuid': 'tv', 'status': "reconnecting"}
+    finally:
+        stream.close()
+        sock.close()
+
+
+def test_clients_that_did_not_subscribe_get_no_events(daemon):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(daemon.socket_path)
+    stream = sock.makefile('rb')
+    try:
+        sock.sendall(b'{"id": 1, "method": "hello"}\n')
+        assert json.loads(stream.readline())['id'] == 1
+        daemon.cast_manager.report("started")
+        sock.sendall(b'{"id": 2, "method": "status"}\n{"method": "status"\n')
+        assert json.loads(stream.readline())['id'] == 2
+        assert json.loads(stream.readline()) == {'error': "malformed request"}
+    finally:
+        stream.close()
+        sock.close()
+
+
+def test_lost_connection_is_reported_as_disconnected(daemon, connect):
+    client = connect()
+    recorder = Recorder(client)
+    daemon.cast_manager.is_casting = True
+    daemon.cast_manager.report("started")
+    assert recorder.wait_for(recorder.statuses, 1)
+
+    with daemon._clients_lock:
+        for handler in daemon._clients:
+            handler.connection.shutdown(socket.SHUT_RDWR)
+    assert recorder.wait_for(recorder.statuses, 2)
+    assert recorder.statuses[-1] == "disconnected"
+    assert not client.connected and not client.is_casting
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Device cache tests
+
+import json
+import socket
+
+import pytest
+
+from src import device_cache
+from src.device_cache import DeviceCache
+from src.device_discovery import DeviceDiscovery
+
+
+def device(uuid: str, name: str = "Living Room TV", address: str = "192.168.1.20", port: int = 8009) -> dict:
+    return {'uuid': uuid, 'name': name, 'model_name': "Chromecast", 'cast_type': 'cast',
+            'address': address, 'port': port, 'status': 'available'}
+
+
+class FakeCache(DeviceCache):
+    """Keeps its entries in memory and counts saves instead of writing to disk"""
+
+    def __init__(self, entries: dict, **kwargs):
+        super().__init__(path='/nonexistent/devices.json', **kwargs)
+        self.stored = entries
+        self.saves = 0
+
+    def load(self):
+        with self._lock:
+            self._entries = {uuid: dict(entry) for uuid, entry in self.stored.items()}
+        self.evict()
+        return self.entries()
+
+    def save(self):
+        self.saves += 1
+
+
+class FakeCastManager:
+    config = None
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Wall clock of the cache, moved by hand"""
+    now = [1_000_000.0]
+    monkeypatch.setattr(device_cache.time, 'time', lambda: now[0])
+    return now
+
+
+def test_save_and_load_round_trip(tmp_path, clock):
+    path = str(tmp_path / "cache" / "devices.json")
+    cache = DeviceCache(path)
+    cache.update(device("a"))
+    cache.save()
+
+    loaded = DeviceCache(path).load()
+    assert list(loaded) == ["a"]
+    assert loaded["a"]['address'] == "192.168.1.20"
+    assert loaded["a"]['last_seen'] == clock[0]
+    assert 'status' not in loaded["a"]
+
+
+def test_save_skips_unchanged_cache(tmp_path, clock):
+    path = tmp_path / "devices.json"
+    cache = DeviceCache(str(path))
+    cache.save()
+    assert not path.exists()
+
+
+def test_unreadable_cache_is_ignored(tmp_path):
+    path = tmp_path / "devices.json"
+    path.write_text("{not json")
+    assert DeviceCache(str(path)).load() == {}
+
+
+def test_incomplete_entries_are_dropped(tmp_path, clock):
+    path = tmp_path / "devices.json"
+    entry = dict(device("a"), last_seen=clock[0], last_used=clock[0])
+    partial = {'uuid': "b", 'name': "Kitchen"}
+    path.write_text(json.dumps({'version': 1, 'devices': {"a": entry, "b": partial}}))
+    assert list(DeviceCache(str(path)).load()) == ["a"]
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = DeviceCache('/nonexistent/devices.json', ttl=60)
+    cache.update(device("old"))
+    clock[0] += 30
+    cache.update(device("new"))
+    clock[0] += 40
+
+    assert cache.evict() == ["old"]
+    assert list(cache.entries()) == ["new"]
+
+
+def test_least_recently_used_are_evicted_over_the_cap(clock):
+    cache = DeviceCache('/nonexistent/devices.json', max_entries=2)
+    for uuid in ("a", "b", "c"):
+        cache.update(device(uuid))
+        clock[0] += 1
+    cache.touch("a")
+
+    assert cache.evict() == ["b"]
+    assert sorted(cache.entries()) == ["a", "c"]
+
+
+def test_seeing_a_device_again_keeps_its_last_use(clock):
+    cache = DeviceCache('/nonexistent/devices.json')
+    cache.update(device("a"))
+    used = clock[0]
+    clock[0] += 100
+    cache.update(device("a", name="Renamed"))
+
+    entry = cache.entries()["a"]
+    assert entry['last_used'] == used
+    assert entry['last_seen'] == clock[0]
+    assert entry['name'] == "Renamed"
+
+
+def test_discovery_lists_cached_devices_as_unverified_at_once(clock):
+    entry = dict(device("a"), last_seen=clock[0], last_used=clock[0])
+    discovery = DeviceDiscovery(FakeCastManager(), cache=FakeCache({"a": entry}))
+
+    devices = discovery.get_devices()
+    assert devices["a"]['status'] == 'unverified'
+    assert devices["a"]['name'] == "Living Room TV"
+    assert discovery.time_to_first_device is not None
+    assert discovery.time_to_first_device < 0.5
+
+
+def test_discovery_without_cached_devices_has_no_first_device_yet():
+    discovery = DeviceDiscovery(FakeCastManager(), cache=FakeCache({}))
+    assert discovery.get_devices() == {}
+    assert discovery.time_to_first_device is None
+
+
+def test_discovery_skips_expired_cache_entries(clock):
+    entry = dict(device("a"), last_seen=clock[0] - 120, last_used=clock[0] - 120)
+    discovery = DeviceDiscovery(FakeCastManager(), cache=FakeCache({"a": entry}, ttl=60))
+    assert discovery.get_devices() == {}
+
+
+def test_revalidation_confirms_reachable_and_drops_unreachable_devices(clock):
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    closed = socket.socket()
+    closed.bind(('127.0.0.1', 0))
+    closed_port = closed.getsockname()[1]
+    closed.close()
+
+    seen = dict(last_seen=clock[0], last_used=clock[0])
+    cache = FakeCache({
+        "up": dict(device("up", address='127.0.0.1', port=listener.getsockname()[1]), **seen),
+        "down": dict(device("down", address='127.0.0.1', port=closed_port), **seen),
+    })
+    discovery = DeviceDiscovery(FakeCastManager(), cache=cache)
+    discovery.discovery_timeout = 0.01
+    deltas = []
+    discovery.register_delta_callback(deltas.extend)
+    try:
+        discovery._revalidate_cached_devices()
+    finally:
+        listener.close()
+
+    devices = discovery.get_devices()
+    assert list(devices) == ["up"]
+    assert devices["up"]['status'] == 'available'
+    assert sorted((delta.kind, delta.uuid) for delta in deltas) == [('removed', "down"), ('updated', "up")]
+    assert "up" in cache.entries() and cache.saves == 1
+    # The unreachable device is gone from the cache too, so the next start does not list it
+    assert "down" not in cache.entries()
+    assert list(DeviceDiscovery(FakeCastManager(), cache=FakeCache(cache.entries())).get_devices()) == ["up"]
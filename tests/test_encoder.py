@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Encoder supervisor tests, with small Python programs standing in for ffmpeg
+
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from src import encoder
+from src.encoder import EncoderSettings, EncoderSupervisor, build_ffmpeg_command
+
+# Echoes each raw frame to stdout and reports it on stderr the way ffmpeg's -progress does
+ECHO = """
+import sys
+size, frames = int(sys.argv[1]), 0
+while True:
+    frame = sys.stdin.buffer.read(size)
+    if len(frame) < size:
+        break
+    frames += 1
+    sys.stdout.buffer.write(frame)
+    sys.stdout.buffer.flush()
+    sys.stderr.write(f"frame={frames}\\nfps=30.0\\nprogress=continue\\n")
+    sys.stderr.flush()
+"""
+
+# Reads one frame and crashes, then runs normally
+CRASH_ONCE = """
+import os, sys
+marker, size = sys.argv[1], int(sys.argv[2])
+if not os.path.exists(marker):
+    open(marker, 'w').close()
+    sys.stdin.buffer.read(size)
+    sys.exit(1)
+sys.stdin.buffer.read()
+"""
+
+SMALL = EncoderSettings(16, 16)
+
+
+def stub(source: str, *args) -> list:
+    return [sys.executable, '-c', source] + [str(arg) for arg in args]
+
+
+def frame(settings: EncoderSettings, value: int) -> np.ndarray:
+    return np.full(settings.frame_size, value, dtype=np.uint8)
+
+
+def wait_until(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def supervisors():
+    """Supervisors created by a test, stopped at its end"""
+    created = []
+    yield created
+    for supervisor in created:
+        supervisor.stop()
+
+
+def test_frames_reach_the_encoder_in_order(supervisors):
+    output = bytearray()
+    supervisor = EncoderSupervisor(SMALL, output.extend, command=stub(ECHO, SMALL.frame_size))
+    supervisors.append(supervisor)
+    supervisor.start()
+    for value in range(3):
+        assert supervisor.submit(frame(SMALL, value), timestamp=0.0)
+    # stop() lets ffmpeg finish what it was given, but drops frames still queued
+    assert wait_until(lambda: supervisor.frames_written == 3)
+    supervisor.stop()
+
+    assert bytes(output) == b''.join(frame(SMALL, value).tobytes() for value in range(3))
+    assert supervisor.frames_written == 3
+    assert supervisor.frames_dropped == 0
+    assert supervisor.encode_latency > 0
+
+
+def test_frames_of_the_wrong_size_are_refused(supervisors):
+    supervisor = EncoderSupervisor(SMALL, lambda data: None, command=stub(ECHO, SMALL.frame_size))
+    supervisors.append(supervisor)
+    assert not supervisor.submit(frame(SMALL, 0))
+    supervisor.start()
+    assert not supervisor.submit(np.zeros(SMALL.frame_size + 1, dtype=np.uint8))
+
+
+def test_oldest_frames_are_dropped_while_the_encoder_is_stalled(supervisors):
+    settings = EncoderSettings(320, 240)
+    # Reads nothing for a while, so the first frame fills the pipe and the writer blocks
+    stalled = stub("import sys, time; time.sleep(1); sys.stdin.buffer.read()")
+    supervisor = EncoderSupervisor(settings, lambda data: None, queue_size=3, command=stalled)
+    supervisors.append(supervisor)
+    supervisor.start()
+    for value in range(10):
+        assert supervisor.submit(frame(settings, value))
+
+    assert supervisor.frames_submitted == 10
+    assert supervisor.frames_dropped >= 7
+    assert supervisor.queue_depth <= 3
+    # The newest frame is always kept
+    newest_slot, _ = supervisor._ready[-1]
+    assert supervisor._slots[newest_slot][0] == 9
+
+
+def test_crashed_encoder_is_restarted(supervisors, tmp_path):
+    restarted = threading.Event()
+    command = stub(CRASH_ONCE, tmp_path / "crashed", SMALL.frame_size)
+    supervisor = EncoderSupervisor(SMALL, lambda data: None, command=command, restart_callback=restarted.set)
+    supervisors.append(supervisor)
+    supervisor.start()
+    supervisor.submit(frame(SMALL, 1))
+
+    assert restarted.wait(timeout=10)
+    assert supervisor.restarts == 1
+    assert supervisor.is_running
+
+
+def test_supervisor_gives_up_on_an_encoder_that_keeps_crashing(supervisors):
+    errors = []
+    failed = threading.Event()
+
+    def on_error(message):
+        errors.append(message)
+        failed.set()
+
+    supervisor = EncoderSupervisor(SMALL, lambda data: None, command=stub("import sys; sys.exit(3)"),
+                                   error_callback=on_error, max_restarts=2)
+    supervisors.append(supervisor)
+    supervisor.start()
+
+    assert failed.wait(timeout=10)
+    assert errors == ["encoder exited with code 3"]
+    assert supervisor.restarts == 2
+    assert not supervisor.is_running
+
+
+def test_reconfigure_restarts_with_the_new_frame_size(supervisors):
+    output = bytearray()
+    restarted = threading.Event()
+    larger = SMALL.replace(width=32, height=32)
+    supervisor = EncoderSupervisor(SMALL, output.extend, command=stub(ECHO, larger.frame_size),
+                                   restart_callback=restarted.set)
+    supervisors.append(supervisor)
+    supervisor.start()
+    supervisor.reconfigure(larger)
+
+    assert restarted.is_set()
+    assert supervisor.restarts == 0
+    assert not supervisor.submit(frame(SMALL, 1))
+    assert supervisor.submit(frame(larger, 2))
+    assert wait_until(lambda: supervisor.frames_written == 1)
+    supervisor.stop()
+    assert bytes(output) == frame(larger, 2).tobytes()
+
+
+def option(command: list, name: str):
+    """The value following an option in a command line, or None if it is absent"""
+    return command[command.index(name) + 1] if name in command else None
+
+
+@pytest.mark.parametrize('version, sync', [((7, 0), '-fps_mode'), ((5, 1), '-fps_mode'), ((4, 4), '-vsync'),
+                                           ((), '-vsync')])
+def test_frame_sync_option_follows_the_ffmpeg_version(monkeypatch, version, sync):
+    monkeypatch.setattr(encoder, 'ffmpeg_version', lambda: version)
+    command = build_ffmpeg_command(EncoderSettings(1280, 720))
+    assert option(command, sync) == 'vfr'
+    assert {'-fps_mode', '-vsync'} & set(command) == {sync}
+
+
+def test_codec_options_are_only_given_to_their_codec(monkeypatch):
+    monkeypatch.setattr(encoder, 'ffmpeg_version', lambda: (6, 0))
+    x264 = build_ffmpeg_command(EncoderSettings(1280, 720, codec='libx264'))
+    assert option(x264, '-tune') == 'zerolatency'
+    assert option(x264, '-preset') == 'ultrafast'
+
+    vp9 = build_ffmpeg_command(EncoderSettings(1280, 720, codec='libvpx-vp9'))
+    assert option(vp9, '-c:v') == 'libvpx-vp9'
+    assert '-tune' not in vp9 and '-preset' not in vp9
+    assert option(vp9, '-deadline') == 'realtime'
+
+    unknown = build_ffmpeg_command(EncoderSettings(1280, 720, codec='mpeg4'))
+    assert '-tune' not in unknown and option(unknown, '-pix_fmt') == 'yuv420p'
+
+
+def test_vaapi_device_is_opened_before_the_inputs(monkeypatch):
+    monkeypatch.setattr(encoder, 'ffmpeg_version', lambda: (6, 0))
+    command = build_ffmpeg_command(EncoderSettings(1280, 720, codec='h264_vaapi'))
+    assert command.index('-vaapi_device') < command.index('-i')
+    assert option(command, '-vf') == 'format=nv12,hwupload'
+
+
+def test_audio_is_read_from_its_own_pipe(monkeypatch):
+    monkeypatch.setattr(encoder, 'ffmpeg_version', lambda: (6, 0))
+    settings = EncoderSettings(1280, 720, audio_rate=48000)
+    command = build_ffmpeg_command(settings, audio_fd=7)
+    assert 'pipe:7' in command
+    assert option(command, '-c:a') == 'aac'
+    assert 'pipe:7' not in build_ffmpeg_command(settings)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Multi-process pipeline tests: putting converted frames back in order
+
+import queue
+import threading
+import time
+
+from src.pipeline_runner import ProcessPipeline
+
+
+class ReorderOnly(ProcessPipeline):
+    """The encoder feeding thread alone, with converted frames handed in by the test"""
+
+    def __init__(self, output_slots: int = 7, workers: int = 4):
+        super().__init__(None, (64, 48), 30.0, lambda data: None, workers=workers, output_slots=output_slots)
+        self._queues = {'yuv_ready': queue.Queue(), 'yuv_free': queue.Queue()}
+        self.delivered = []
+
+    def _deliver(self, item: tuple):
+        self.delivered.append(item[1])
+        self._queues['yuv_free'].put(item[0])
+
+    def converted(self, *sequences: int):
+        """Frames coming back from the converters, each in an output slot of its own"""
+        for sequence in sequences:
+            self._queues['yuv_ready'].put((sequence, sequence, 0.0, 64, 48, 0, 0))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join(timeout=5)
+
+    def free_slots(self) -> list:
+        slots = []
+        while not self._queues['yuv_free'].empty():
+            slots.append(self._queues['yuv_free'].get())
+        return sorted(slots)
+
+
+def test_frames_converted_out_of_order_are_delivered_in_order():
+    pipeline = ReorderOnly()
+    pipeline.converted(2, 0, 3, 1)
+    pipeline.start()
+    time.sleep(0.05)
+    pipeline.stop()
+
+    assert pipeline.delivered == [0, 1, 2, 3]
+    assert pipeline.frames_skipped == 0
+
+
+def test_frames_still_being_converted_are_waited_for():
+    # With four workers, three frames overtaking a slow one is normal and not a reason to skip it
+    pipeline = ReorderOnly()
+    pipeline.converted(1, 2, 3)
+    pipeline.start()
+    time.sleep(0.05)
+    pipeline.converted(0)
+    time.sleep(0.05)
+    pipeline.stop()
+
+    assert pipeline.delivered == [0, 1, 2, 3]
+    assert pipeline.frames_skipped == 0
+
+
+def test_frame_arriving_after_it_was_skipped_is_dropped():
+    pipeline = ReorderOnly()
+    pipeline.converted(1, 2, 3)
+    pipeline.start()
+    # Long enough for frame 0 to be given up on
+    time.sleep(0.4)
+    pipeline.converted(0, 4, 5, 6)
+    time.sleep(0.1)
+    pipeline.stop()
+
+    assert pipeline.delivered == [1, 2, 3, 4, 5, 6]
+    assert pipeline.frames_skipped == 1
+    # The late frame's slot went back to the converters
+    assert pipeline.free_slots() == list(range(7))
+
+
+def test_missing_frame_is_skipped_once_it_holds_every_output_slot():
+    pipeline = ReorderOnly(output_slots=3)
+    pipeline.converted(1, 2, 3)
+    pipeline.start()
+    time.sleep(0.05)
+    # Well inside the timeout, but no converter could deliver frame 0 now
+    pipeline.stop()
+
+    assert pipeline.delivered == [1, 2, 3]
+    assert pipeline.frames_skipped == 1
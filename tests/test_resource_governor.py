@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Resource governor tests, on injected readings and a simulated clock
+
+import pytest
+
+from src.resource_governor import LEVELS, ResourceGovernor, ResourceReading
+
+QUIET = ResourceReading(10.0, 20.0, 0.2, 50.0)
+BUSY = ResourceReading(70.0, 80.0, 0.5, 60.0)  # Casting over its 50% CPU budget
+HOT = ResourceReading(20.0, 30.0, 0.2, 90.0)  # Over the 85 °C limit
+# Within every budget but without the headroom to step up: the band that holds the level
+WARM = ResourceReading(45.0, 60.0, 0.5, 60.0)
+
+
+class Governed:
+    """A governor on a clock the test advances, one reading a second"""
+
+    def __init__(self, **options):
+        self.now = 0.0
+        self.applied = []
+        self.governor = ResourceGovernor(self.applied.append, sampler=lambda: QUIET,
+                                         clock=lambda: self.now, **options)
+
+    def feed(self, reading: ResourceReading, seconds: int) -> list:
+        """Levels switched to while ``reading`` held for ``seconds``"""
+        switched = []
+        for _ in range(seconds):
+            self.now += 1.0
+            level = self.governor.update(reading)
+            if level is not None:
+                switched.append(level)
+        return switched
+
+    @property
+    def level(self) -> int:
+        return self.governor.level_index
+
+
+def test_quiet_machine_stays_at_full_quality():
+    governed = Governed()
+    assert governed.feed(QUIET, 120) == []
+    assert governed.governor.level == LEVELS[0]
+    assert governed.applied == []
+
+
+def test_cpu_pressure_steps_down_one_level_at_a_time():
+    governed = Governed()
+    # Not before switch_interval has passed since the governor started
+    assert governed.feed(BUSY, 9) == []
+    assert governed.feed(BUSY, 1) == [LEVELS[1]]
+    assert governed.applied == [LEVELS[1]]
+    assert "70% CPU" in governed.governor.reason
+
+    # Still too busy: the next step waits for switch_interval, and down_samples more readings
+    assert governed.feed(BUSY, 9) == []
+    assert governed.feed(BUSY, 1) == [LEVELS[2]]
+
+
+def test_short_spikes_do_not_step_down():
+    governed = Governed()
+    governed.feed(QUIET, 20)
+    for _ in range(10):
+        # Two readings over budget, fewer than down_samples, then a normal one
+        assert governed.feed(BUSY, 2) == []
+        assert governed.feed(WARM, 1) == []
+    assert governed.level == 0
+
+
+def test_heat_steps_down_even_when_cpu_use_is_low():
+    governed = Governed()
+    governed.feed(QUIET, 20)
+    assert governed.feed(HOT, 3) == [LEVELS[1]]
+    assert "90 °C" in governed.governor.reason
+
+
+def test_busy_system_steps_down():
+    governed = Governed()
+    governed.feed(QUIET, 20)
+    assert governed.feed(ResourceReading(20.0, 95.0), 3) == [LEVELS[1]]
+    assert "system CPU" in governed.governor.reason
+
+
+def test_level_holds_between_the_thresholds():
+    governed = Governed()
+    governed.feed(BUSY, 10)
+    assert governed.level == 1
+    # Under budget now that the cut took effect, but not far enough under to step back up
+    assert governed.feed(WARM, 300) == []
+    for held in (ResourceReading(20.0, 30.0, 0.2, 82.0), ResourceReading(20.0, 30.0, 1.4, 60.0)):
+        # Within the temperature margin, or with the load average still high
+        assert governed.feed(held, 60) == []
+    assert governed.level == 1
+
+
+def test_steps_up_once_load_has_stayed_low_for_the_upswitch_delay():
+    governed = Governed()
+    governed.feed(BUSY, 10)
+    governed.feed(BUSY, 10)
+    assert governed.level == 2
+
+    assert governed.feed(QUIET, 19) == []
+    assert governed.feed(QUIET, 1) == [LEVELS[1]]
+    # Each step up needs its own quiet spell
+    assert governed.feed(QUIET, 19) == []
+    assert governed.feed(QUIET, 1) == [LEVELS[0]]
+    assert governed.governor.reason == ""
+    assert governed.governor.switches == 4
+
+
+def test_a_busy_reading_restarts_the_upswitch_delay():
+    governed = Governed()
+    governed.feed(BUSY, 10)
+    governed.feed(QUIET, 15)
+    governed.feed(WARM, 1)
+    assert governed.feed(QUIET, 19) == []
+    assert governed.feed(QUIET, 1) == [LEVELS[0]]
+
+
+def test_lowest_level_is_the_floor():
+    governed = Governed()
+    governed.feed(HOT, 600)
+    assert governed.level == len(LEVELS) - 1
+    assert governed.governor.switches == len(LEVELS) - 1
+
+
+def test_sampler_is_used_without_an_injected_reading():
+    readings = iter([BUSY] * 3 + [None])
+    now = [0.0]
+
+    def sampler():
+        reading = next(readings)
+        if reading is None:
+            raise OSError("sensor gone")
+        return reading
+
+    governor = ResourceGovernor(lambda level: None, sampler=sampler, clock=lambda: now[0])
+    now[0] = 20.0
+    assert [governor.update() for _ in range(3)] == [None, None, LEVELS[1]]
+    assert governor.reading == BUSY
+    # A failed reading is skipped rather than acted on
+    assert governor.update() is None
+    assert governor.level_index == 1
+
+
+def test_failing_apply_callback_does_not_stop_the_governor():
+    def apply(level):
+        raise RuntimeError("encoder gone")
+
+    governed = Governed()
+    governed.governor.apply_callback = apply
+    assert governed.feed(BUSY, 10) == [LEVELS[1]]
+    assert governed.feed(BUSY, 10) == [LEVELS[2]]
+
+
+@pytest.mark.parametrize('reading', [BUSY, HOT])
+def test_custom_levels_and_budgets(reading):
+    levels = (LEVELS[0], LEVELS[-1])
+    governed = Governed(levels=levels, cpu_budget=80.0, temperature_limit=95.0, down_samples=1)
+    assert governed.feed(reading, 60) == []
+    governed.feed(ResourceReading(85.0), 10)
+    assert governed.governor.level == LEVELS[-1]
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Startup time regression test
+#
+# Starts the application in a fresh interpreter on Qt's offscreen platform,
+# as benchmarks/startup_benchmark.py does, and fails when the tray icon
+# takes longer than the budget to appear or when heavy modules are
+# imported before it.
+
+import os
+import sys
+import threading
+
+import pytest
+
+from src.startup_profiler import StartupProfiler
+
+pytest.importorskip('PyQt5')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from startup_benchmark import run_once  # noqa: E402
+
+# Seconds from launching the interpreter to the tray icon; well above the
+# usual ~100 ms so a busy machine does not fail it, but far below the
+# seconds an eager import of the casting stack costs
+TRAY_BUDGET = 1.5
+
+
+def test_tray_icon_appears_within_budget(tmp_path):
+    report = run_once(str(tmp_path))
+
+    assert report['time_to_tray'] < TRAY_BUDGET
+    assert report['heavy_at_tray'] == []
+    marks = report['profile']['marks']
+    assert marks['tray_visible'] < marks['daemon_connected']
+    phases = {phase['name']: phase for phase in report['profile']['phases']}
+    # Connecting to the daemon happens behind the tray icon, off the GUI thread
+    assert phases['connect to daemon']['thread'] == 'UbuntuCastStartup'
+
+
+def test_profiler_records_phases_per_thread():
+    profiler = StartupProfiler()
+
+    def load():
+        with profiler.phase("background"):
+            pass
+
+    with profiler.phase("tray icon"):
+        worker = threading.Thread(target=load, name="Worker")
+        worker.start()
+        worker.join()
+    profiler.mark("tray_visible", modules=True)
+
+    report = profiler.report()
+    threads = {phase['name']: phase['thread'] for phase in report['phases']}
+    assert threads == {"tray icon": threading.current_thread().name, "background": "Worker"}
+    assert all(phase['seconds'] >= 0 and phase['start'] >= 0 for phase in report['phases'])
+    assert report['marks']['tray_visible'] > 0
+    assert 'src.startup_profiler' in profiler.imported['tray_visible']
+    assert "tray_visible" in profiler.format()
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = StartupProfiler(enabled=False)
+    with profiler.phase("config"):
+        pass
+    profiler.mark("tray_visible", modules=True)
+    assert profiler.report() == {'phases': [], 'marks': {}}
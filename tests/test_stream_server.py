@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Stream server tests, over HTTP
+
+import http.client
+import struct
+import threading
+import time
+
+import pytest
+
+from src.stream_server import SAMPLE_IS_NON_SYNC, StreamServer
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def fragment(keyframe: bool, marker: int) -> bytes:
+    """A minimal moof+mdat pair whose first sample is or is not a keyframe, with a recognisable payload"""
+    tfhd = box(b'tfhd', struct.pack('>II', 0x020000, 1))
+    trun = box(b'trun', struct.pack('>III', 0x000004, 1, 0 if keyframe else SAMPLE_IS_NON_SYNC))
+    return box(b'moof', box(b'traf', tfhd + trun)) + box(b'mdat', bytes([marker]) * 64)
+
+
+def init_segment(marker: int) -> bytes:
+    return box(b'ftyp', b'iso6' + bytes(4)) + box(b'moov', bytes([marker]) * 32)
+
+
+def get(server: StreamServer, path: str, prefix: bool = True):
+    """Status, headers and body of a request, by default under the server's private path"""
+    connection = http.client.HTTPConnection('127.0.0.1', server.port, timeout=10)
+    try:
+        connection.request('GET', (server.base_path if prefix else '') + path)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def server():
+    server = StreamServer('127.0.0.1', 0, ring_slots=4, target_duration=1.0, part_target=0.2)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def fragments():
+    """Fragments A, B (one segment) and C (the open segment), published after the init segment"""
+    return [fragment(True, 0xA), fragment(False, 0xB), fragment(True, 0xC)]
+
+
+def publish(server: StreamServer, *chunks: bytes):
+    for chunk in chunks:
+        server.publish(chunk)
+
+
+def test_stream_is_only_served_under_the_private_path(server, fragments):
+    publish(server, init_segment(1), *fragments)
+    assert server.base_path in server.stream_url('127.0.0.1')
+    assert len(server.base_path) > 16
+    assert get(server, '/live.m3u8', prefix=False)[0] == 404
+    assert get(server, '/segment_0.m4s', prefix=False)[0] == 404
+    assert get(server, '/wrong/live.m3u8', prefix=False)[0] == 404
+    assert get(server, '/live.m3u8')[0] == 200
+
+
+def test_playlist_lists_segments_parts_and_preload_hint(server, fragments):
+    publish(server, init_segment(1), *fragments)
+    status, headers, body = get(server, '/live.m3u8')
+    playlist = body.decode().splitlines()
+
+    assert status == 200
+    assert headers['Content-Type'] == 'application/vnd.apple.mpegurl'
+    assert playlist[0] == '#EXTM3U'
+    assert '#EXT-X-VERSION:7' in playlist
+    assert '#EXT-X-MEDIA-SEQUENCE:0' in playlist
+    assert '#EXT-X-MAP:URI="init_1.mp4"' in playlist
+    assert any(line.startswith('#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES') for line in playlist)
+    assert any(line.startswith('#EXT-X-PART-INF:PART-TARGET=') for line in playlist)
+    parts = [line for line in playlist if line.startswith('#EXT-X-PART:')]
+    uris = [line.split('URI="')[1].split('"')[0] for line in parts]
+    assert uris == ['part_0_0.m4s', 'part_0_1.m4s', 'part_1_0.m4s']
+    assert parts[0].endswith('INDEPENDENT=YES') and not parts[1].endswith('INDEPENDENT=YES')
+    segment = playlist.index('segment_0.m4s')
+    assert playlist[segment - 1].startswith('#EXTINF:')
+    assert 'segment_1.m4s' not in playlist
+    assert playlist[-1] == '#EXT-X-PRELOAD-HINT:TYPE=PART,URI="part_1_1.m4s"'
+
+
+def test_init_segments_segments_and_parts_are_served(server, fragments):
+    publish(server, init_segment(1), *fragments)
+
+    assert get(server, '/init.mp4')[2] == init_segment(1)
+    assert get(server, '/init_1.mp4')[2] == init_segment(1)
+    assert get(server, '/init_9.mp4')[0] == 503
+    status, headers, body = get(server, '/segment_0.m4s')
+    assert status == 200
+    assert headers['Content-Length'] == str(len(body))
+    assert body == fragments[0] + fragments[1]
+    assert get(server, '/part_0_1.m4s')[2] == fragments[1]
+    assert get(server, '/part_1_0.m4s')[2] == fragments[2]
+    # Segment 0 closed with two parts
+    assert get(server, '/part_0_2.m4s')[0] == 404
+
+
+def test_open_segment_is_streamed_as_it_grows(server, fragments):
+    publish(server, init_segment(1), *fragments)
+    later = [fragment(False, 0xD), fragment(True, 0xE)]
+    result = {}
+
+    def fetch():
+        result['response'] = get(server, '/segment_1.m4s')
+
+    client = threading.Thread(target=fetch)
+    client.start()
+    time.sleep(0.2)
+    publish(server, *later)
+    client.join(timeout=10)
+
+    status, headers, body = result['response']
+    assert status == 200
+    assert headers.get('Transfer-Encoding') == 'chunked'
+    assert body == fragments[2] + later[0]
+
+
+def test_blocking_reload_waits_for_the_requested_part(server, fragments):
+    publish(server, init_segment(1), *fragments)
+    timer = threading.Timer(0.3, publish, args=(server, fragment(False, 0xD)))
+    started = time.monotonic()
+    timer.start()
+    status, _, body = get(server, '/live.m3u8?_HLS_msn=1&_HLS_part=1')
+    timer.join()
+
+    assert status == 200
+    assert time.monotonic() - started >= 0.25
+    assert 'URI="part_1_1.m4s"' in body.decode()
+    assert body.decode().splitlines()[-1] == '#EXT-X-PRELOAD-HINT:TYPE=PART,URI="part_1_2.m4s"'
+
+
+def test_blocking_reload_requests_are_checked(server, fragments):
+    publish(server, init_segment(1), *fragments)
+    server.segment_timeout = 0.2
+    assert get(server, '/live.m3u8?_HLS_msn=5')[0] == 400
+    assert get(server, '/live.m3u8?_HLS_part=1')[0] == 400
+    assert get(server, '/live.m3u8?_HLS_msn=x')[0] == 400
+    assert get(server, '/live.m3u8?_HLS_msn=2')[0] == 503
+
+
+def test_future_part_times_out(server, fragments):
+    publish(server, init_segment(1), *fragments)
+    server.segment_timeout = 0.2
+    assert get(server, '/part_1_1.m4s')[0] == 503
+
+
+def test_encoder_restart_starts_a_discontinuity(server, fragments):
+    publish(server, init_segment(1), *fragments)
+    server.restart_stream()
+    publish(server, init_segment(2), fragment(True, 0xF), fragment(True, 0xF))
+    playlist = get(server, '/live.m3u8')[2].decode().splitlines()
+
+    assert '#EXT-X-DISCONTINUITY-SEQUENCE:0' in playlist
+    assert '#EXT-X-MAP:URI="init_1.mp4"' in playlist
+    discontinuity = playlist.index('#EXT-X-DISCONTINUITY')
+    assert playlist[discontinuity + 1] == '#EXT-X-MAP:URI="init_2.mp4"'
+    # The open segment was closed at its last whole fragment and kept its place in the sequence
+    assert playlist.index('segment_0.m4s') < playlist.index('segment_1.m4s') < discontinuity
+    assert playlist.index('segment_2.m4s') > discontinuity
+    assert get(server, '/init_1.mp4')[2] == init_segment(1)
+    assert get(server, '/init_2.mp4')[2] == init_segment(2)
+    assert get(server, '/init.mp4')[2] == init_segment(2)
+
+
+def test_restart_with_an_empty_open_segment_reuses_its_sequence_number(server):
+    publish(server, init_segment(1), fragment(True, 0xA))
+    # A keyframe's moof without its 72 byte mdat: the new segment has no whole fragment yet
+    publish(server, fragment(True, 0xB)[:-72])
+    server.restart_stream()
+    publish(server, init_segment(2), fragment(True, 0xC), fragment(True, 0xD))
+
+    segments = server.ring.segments()
+    assert [(segment.sequence, segment.generation) for segment in segments] == [(0, 1), (1, 2), (2, 2)]
+    assert get(server, '/segment_1.m4s')[2] == fragment(True, 0xC)
+
+
+def test_segments_that_left_the_ring_are_gone(server):
+    publish(server, init_segment(1))
+    for marker in range(6):
+        publish(server, fragment(True, marker))
+
+    playlist = get(server, '/live.m3u8')[2].decode()
+    assert '#EXT-X-MEDIA-SEQUENCE:2' in playlist
+    assert get(server, '/segment_0.m4s')[0] == 404
+    assert get(server, '/segment_4.m4s')[2] == fragment(True, 4)
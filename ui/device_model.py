@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# UbuntuCast - Screen Casting Tool for Ubuntu Linux
+# Shared Device Model
+
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot
+
+logger = logging.getLogger("UbuntuCast.UI.DeviceModel")
+
+# Kinds of change reported to views, the same strings DeviceDiscovery uses for deltas
+DEVICE_ADDED = 'added'
+DEVICE_REMOVED = 'removed'
+DEVICE_UPDATED = 'updated'
+
+FRAME_INTERVAL_MS = 16  # At most one view update per frame at 60 Hz
+
+
+class DeviceModel(QObject):
+    """The device table as the GUI sees it, shared by the tray menu and the main window
+
+    Device deltas may arrive on any thread. They are folded into a pending
+    table holding only the latest delta per device, and the GUI thread is
+    woken through a queued signal when that table stops being empty. The
+    pending changes are applied at most once per frame interval, and views
+    get a single ``devices_changed`` signal with the net change per
+    device, so a burst of discovery events costs the GUI thread one update
+    proportional to the devices that changed, not to the network size.
+    """
+
+    # uuid -> DEVICE_ADDED, DEVICE_UPDATED or DEVICE_REMOVED, emitted on the GUI thread
+    devices_changed = pyqtSignal(object)
+    _changes_pending = pyqtSignal()
+
+    def __init__(self, parent: Optional[QObject] = None, frame_interval_ms: int = FRAME_INTERVAL_MS):
+        super().__init__(parent)
+        self.devices: Dict[str, Dict[str, Any]] = {}  # Only read and written on the GUI thread
+        self.source = None
+        self._pending: Dict[str, Any] = {}  # uuid -> latest delta, shared with discovery threads
+        self._lock = threading.Lock()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(frame_interval_ms)
+        self._timer.timeout.connect(self.flush)
+        self._changes_pending.connect(self._schedule_flush)
+
+    def attach(self, source):
+        """Follow the device table of a DeviceDiscovery or DaemonClient; safe from any thread"""
+        self.source = source
+        source.register_delta_callback(self.submit)
+        # The snapshot is at least as new as anything delivered before it
+        snapshot = source.get_devices()
+        with self._lock:
+            was_empty = not self._pending
+            for uuid, device in snapshot.items():
+                self._pending[uuid] = _SnapshotDelta(uuid, device)
+            if was_empty and self._pending:
+                self._changes_pending.emit()
+
+    def detach(self):
+        if self.source is not None:
+            self.source.unregister_delta_callback(self.submit)
+            self.source = None
+
+    def submit(self, deltas):
+        """Queue device deltas for the GUI thread; called on discovery threads"""
+        with self._lock:
+            was_empty = not self._pending
+            for delta in deltas:
+                self._pending[delta.uuid] = delta
+            if was_empty and self._pending:
+                # Cross-thread emission is queued onto the GUI thread
+                self._changes_pending.emit()
+
+    @pyqtSlot()
+    def _schedule_flush(self):
+        if not self._timer.isActive():
+            self._timer.start()
+
+    @pyqtSlot()
+    def flush(self):
+        """Apply the pending deltas and tell the views what changed"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        changes = {}
+        for uuid, delta in pending.items():
+            known = uuid in self.devices
+            if delta.kind == DEVICE_REMOVED:
+                if known:
+                    del self.devices[uuid]
+                    changes[uuid] = DEVICE_REMOVED
+            elif not known:
+                self.devices[uuid] = delta.device
+                changes[uuid] = DEVICE_ADDED
+            elif self.devices[uuid] != delta.device:
+                self.devices[uuid] = delta.device
+                changes[uuid] = DEVICE_UPDATED
+        if changes:
+            self.devices_changed.emit(changes)
+
+
+class _SnapshotDelta:
+    """A device from a table snapshot, applied like an addition"""
+    __slots__ = ('uuid', 'device')
+    kind = DEVICE_ADDED
+
+    def __init__(self, uuid: str, device: Dict[str, Any]):
+        self.uuid = uuid
+        self.device = device
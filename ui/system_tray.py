@@ -4,23 +4,130 @@
 
 import os
 import sys
+import bisect
 import logging
+import threading
+from typing import Any, Dict, List, Tuple
 from PyQt5.QtWidgets import (
     QSystemTrayIcon, QMenu, QAction, QMessageBox, QApplication
 )
 from PyQt5.QtGui import QIcon
-from PyQt5.QtCore import pyqtSlot
+from PyQt5.QtCore import pyqtSignal, pyqtSlot
+
+from ui.device_model import DEVICE_REMOVED
 
 logger = logging.getLogger("UbuntuCast.UI.SystemTray")
 
+
+class DeviceMenu(QMenu):
+    """The "Cast to Device" submenu, kept in step with the device model
+
+    Only the actions of devices that changed are created, renamed or
+    removed, and they stay sorted by name, so opening the menu does no
+    work however many devices there are.
+    """
+    
+    device_selected = pyqtSignal(str)
+    refresh_requested = pyqtSignal()
+    
+    def __init__(self, device_model, parent=None):
+        super().__init__("Cast to Device", parent)
+        self.device_model = device_model
+        self.device_actions: Dict[str, QAction] = {}
+        self._order: List[Tuple[str, str]] = []  # (sort key, uuid) in menu order
+        self._sort_keys: Dict[str, Tuple[str, str]] = {}
+        self._searching = True
+        
+        # Shown instead of devices while the list is empty
+        self.searching_action = QAction("Searching for devices...", self)
+        self.searching_action.setEnabled(False)
+        self.no_devices_action = QAction("No devices found", self)
+        self.no_devices_action.setEnabled(False)
+        self.refresh_action = QAction("Refresh devices", self)
+        self.addActions([self.searching_action, self.no_devices_action, self.refresh_action])
+        self._update_placeholders()
+        
+        self.triggered.connect(self.on_triggered)
+        device_model.devices_changed.connect(self.on_devices_changed)
+    
+    def set_searching(self, searching: bool):
+        """Say whether devices can be expected yet, for the text shown when there are none"""
+        self._searching = searching
+        self._update_placeholders()
+    
+    def _update_placeholders(self):
+        empty = not self.device_actions
+        self.searching_action.setVisible(empty and self._searching)
+        self.no_devices_action.setVisible(empty and not self._searching)
+        self.refresh_action.setVisible(empty and not self._searching)
+    
+    @staticmethod
+    def _label(device: Dict[str, Any]) -> str:
+        return f"{device['name']} ({device['model_name']})"
+    
+    @pyqtSlot(object)
+    def on_devices_changed(self, changes: Dict[str, str]):
+        """Apply the net changes of one model update to the menu"""
+        devices = self.device_model.devices
+        for uuid, kind in changes.items():
+            if kind == DEVICE_REMOVED:
+                action = self.device_actions.pop(uuid, None)
+                if action is not None:
+                    self._unlink(uuid, action)
+                    action.deleteLater()
+                continue
+            
+            label = self._label(devices[uuid])
+            action = self.device_actions.get(uuid)
+            if action is None:
+                action = self.device_actions[uuid] = QAction(label, self)
+                action.setData(uuid)
+            elif self._sort_keys[uuid] == (label.lower(), uuid):
+                action.setText(label)
+                continue
+            else:
+                # Renamed: move it to its new place
+                self._unlink(uuid, action)
+                action.setText(label)
+            self._link(uuid, action, (label.lower(), uuid))
+        self._update_placeholders()
+    
+    def _link(self, uuid: str, action: QAction, key: Tuple[str, str]):
+        index = bisect.bisect(self._order, key)
+        before = self.device_actions[self._order[index][1]] if index < len(self._order) else self.searching_action
+        self.insertAction(before, action)
+        self._order.insert(index, key)
+        self._sort_keys[uuid] = key
+    
+    def _unlink(self, uuid: str, action: QAction):
+        key = self._sort_keys.pop(uuid)
+        del self._order[bisect.bisect_left(self._order, key)]
+        self.removeAction(action)
+    
+    @pyqtSlot(QAction)
+    def on_triggered(self, action):
+        if action is self.refresh_action:
+            self.refresh_requested.emit()
+            return
+        device_uuid = action.data()
+        if device_uuid:
+            self.device_selected.emit(device_uuid)
+
+
 class SystemTrayIcon(QSystemTrayIcon):
     """System tray icon for UbuntuCast"""
     
-    def __init__(self, main_window, cast_manager):
+    # Cast manager results arrive on worker threads; these signals queue them onto the GUI thread
+    cast_status_changed = pyqtSignal(str)
+    device_connected = pyqtSignal(bool)
+    cast_stack_loaded = pyqtSignal()
+    shutdown_finished = pyqtSignal()
+    
+    def __init__(self, application):
         super().__init__()
         
-        self.main_window = main_window
-        self.cast_manager = cast_manager
+        # The casting stack and main window are created after the icon is shown
+        self.application = application
         
         # Set icon
         icon_path = os.path.join(
@@ -40,18 +147,27 @@ class SystemTrayIcon(QSystemTrayIcon):
         
         # Connect signals
         self.activated.connect(self.on_activated)
-        
-        # Register for cast status updates
-        self.cast_manager.register_status_callback(self.update_casting_status)
+        self.cast_status_changed.connect(self.update_casting_status)
+        self.device_connected.connect(self.on_device_connected)
+        self.cast_stack_loaded.connect(self.on_cast_stack_loaded)
+        self.shutdown_finished.connect(QApplication.quit)
         
         # Set tooltip
         self.setToolTip("UbuntuCast")
     
+    @property
+    def cast_manager(self):
+        return self.application.cast_manager
+    
+    @property
+    def main_window(self):
+        return self.application.main_window
+    
     def setup_menu(self):
         """Set up the tray icon menu"""
         # Show/hide main window
         self.show_action = QAction("Show UbuntuCast", self)
-        self.show_action.triggered.connect(self.main_window.show)
+        self.show_action.triggered.connect(self.on_show_main_window)
         self.menu.addAction(self.show_action)
         
         # Casting controls
@@ -70,63 +186,56 @@ class SystemTrayIcon(QSystemTrayIcon):
         self.stop_action.setEnabled(False)
         self.menu.addAction(self.stop_action)
         
-        # Device selection submenu
-        self.device_menu = QMenu("Cast to Device", self.menu)
+        # Device selection submenu, updated as devices come and go
+        self.device_menu = DeviceMenu(self.application.device_model, self.menu)
+        self.device_menu.device_selected.connect(self.on_device_selected)
+        self.device_menu.refresh_requested.connect(self.on_refresh_devices)
         self.menu.addMenu(self.device_menu)
         
-        # Update device list on show
-        self.device_menu.aboutToShow.connect(self.populate_device_menu)
-        
         # Exit
         self.menu.addSeparator()
         
-        exit_action = QAction("Exit", self)
-        exit_action.triggered.connect(self.on_exit)
-        self.menu.addAction(exit_action)
-    
-    def populate_device_menu(self):
-        """Populate the device menu with available cast devices"""
-        # Clear existing items
-        self.device_menu.clear()
-        
-        # Get devices from device discovery
-        if hasattr(self.cast_manager, '_device_discovery'):
-            device_discovery = self.cast_manager._device_discovery
-            devices = device_discovery.get_devices()
-            
-            if devices:
-                for uuid, device in devices.items():
-                    action = QAction(f"{device['name']} ({device['model_name']})", self)
-                    action.setData(uuid)
-                    action.triggered.connect(self.on_device_selected)
-                    self.device_menu.addAction(action)
-            else:
-                no_devices = QAction("No devices found", self)
-                no_devices.setEnabled(False)
-                self.device_menu.addAction(no_devices)
-                
-                refresh_action = QAction("Refresh devices", self)
-                refresh_action.triggered.connect(self.on_refresh_devices)
-                self.device_menu.addAction(refresh_action)
-        else:
-            no_devices = QAction("No devices found", self)
-            no_devices.setEnabled(False)
-            self.device_menu.addAction(no_devices)
+        self.exit_action = QAction("Exit", self)
+        self.exit_action.triggered.connect(self.on_exit)
+        self.menu.addAction(self.exit_action)
     
     def update_casting_status(self, status):
         """Update UI based on cast status changes"""
-        if status == "started":
+        if status in ("quality_changed", "resources_changed"):
+            self.update_tooltip()
+        elif status == "reconnecting":
+            # The session stays up while the receiver reconnects
+            self.casting_label.setText("Reconnecting...")
+        elif status == "resumed":
+            self.casting_label.setText("Casting...")
+        elif status == "no_device":
+            self.showMessage(
+                "UbuntuCast",
+                "No device selected. Please select a device first.",
+                QSystemTrayIcon.Warning,
+                3000
+            )
+        elif status == "start_failed":
+            self.showMessage(
+                "UbuntuCast",
+                "Failed to start casting. Check logs for details.",
+                QSystemTrayIcon.Critical,
+                3000
+            )
+        elif status == "started":
+            self.update_tooltip()
             self.casting_label.setText("Casting...")
             self.start_action.setEnabled(False)
             self.stop_action.setEnabled(True)
             # Show notification
             self.showMessage(
                 "UbuntuCast", 
-                f"Casting to {self.cast_manager.current_device.device.friendly_name}",
+                f"Casting to {self.cast_manager.current_device_name}",
                 QSystemTrayIcon.Information,
                 3000
             )
         elif status in ["stopped", "error", "disconnected"]:
+            self.update_tooltip()
             self.casting_label.setText("Not casting")
             self.start_action.setEnabled(True)
             self.stop_action.setEnabled(False)
@@ -146,79 +255,118 @@ class SystemTrayIcon(QSystemTrayIcon):
                     3000
                 )
     
+    def update_tooltip(self):
+        """Show the current stream quality tier, and any resource limit on it, in the tooltip while casting"""
+        cast_manager = self.cast_manager
+        lines = ["UbuntuCast"]
+        if cast_manager.is_casting:
+            if cast_manager.quality_tier is not None:
+                lines[0] = f"UbuntuCast - {cast_manager.quality_tier}"
+            if cast_manager.resource_limit:
+                lines.append(f"Limited to {cast_manager.resource_limit}")
+        self.setToolTip("\n".join(lines))
+    
     @pyqtSlot(QSystemTrayIcon.ActivationReason)
     def on_activated(self, reason):
         """Handle tray icon activation"""
         if reason == QSystemTrayIcon.Trigger:
             # Toggle main window visibility
-            if self.main_window.isVisible():
-                self.main_window.hide()
+            main_window = self.main_window
+            if main_window is None:
+                return
+            if main_window.isVisible():
+                main_window.hide()
             else:
-                self.main_window.show()
+                main_window.show()
+    
+    @pyqtSlot()
+    def on_show_main_window(self):
+        """Handle show main window menu action"""
+        main_window = self.main_window
+        if main_window is not None:
+            main_window.show()
+    
+    @pyqtSlot()
+    def on_cast_stack_loaded(self):
+        """Register for cast status updates once the casting stack exists"""
+        self.cast_manager.register_status_callback(self.cast_status_changed.emit)
+        self.device_menu.set_searching(False)
+    
+    def _in_background(self, name: str, work, on_error):
+        """Run a daemon request off the GUI thread; it may wait for the daemon to start or answer"""
+        def run():
+            try:
+                work()
+            except Exception as e:
+                logger.error(f"Cannot reach the casting daemon: {e}")
+                on_error()
+        
+        worker = threading.Thread(target=run, name=f"UbuntuCastTray{name}")
+        worker.daemon = True
+        worker.start()
     
     @pyqtSlot()
     def on_start_casting(self):
         """Handle start casting menu action"""
-        # Check if a device is selected
-        if not self.cast_manager.current_device:
+        def start():
+            cast_manager = self.cast_manager
+            # Check if a device is selected
+            if not cast_manager.current_device:
+                self.cast_status_changed.emit("no_device")
+                return
+            
+            # Set default options for casting
+            cast_manager.set_cast_mode("screen")
+            cast_manager.set_audio_enabled(True)
+            
+            # Success arrives as the "started" status
+            if not cast_manager.start_casting():
+                self.cast_status_changed.emit("start_failed")
+        
+        self._in_background("Start", start, lambda: self.cast_status_changed.emit("start_failed"))
+    
+    @pyqtSlot()
+    def on_stop_casting(self):
+        """Handle stop casting menu action"""
+        self._in_background("Stop", lambda: self.cast_manager.stop_casting(), lambda: None)
+    
+    @pyqtSlot(str)
+    def on_device_selected(self, device_uuid):
+        """Handle device selection from menu"""
+        def select():
+            # The result arrives via device_connected
+            accepted = self.cast_manager.select_device(
+                device_uuid, callback=self.device_connected.emit
+            )
+            if not accepted:
+                self.device_connected.emit(False)
+        
+        self._in_background("Select", select, lambda: self.device_connected.emit(False))
+    
+    @pyqtSlot(bool)
+    def on_device_connected(self, success):
+        """Handle the result of connecting to a selected device"""
+        if success:
             self.showMessage(
                 "UbuntuCast",
-                "No device selected. Please select a device first.",
-                QSystemTrayIcon.Warning,
+                f"Selected device: {self.cast_manager.current_device_name}",
+                QSystemTrayIcon.Information,
                 3000
             )
-            return
-        
-        # Set default options for casting
-        self.cast_manager.set_cast_mode("screen")
-        self.cast_manager.set_audio_enabled(True)
-        
-        # Start casting
-        success = self.cast_manager.start_casting()
-        
-        if not success:
+        else:
             self.showMessage(
                 "UbuntuCast",
-                "Failed to start casting. Check logs for details.",
-                QSystemTrayIcon.Critical,
+                "Failed to connect to selected device",
+                QSystemTrayIcon.Warning,
                 3000
             )
     
-    @pyqtSlot()
-    def on_stop_casting(self):
-        """Handle stop casting menu action"""
-        self.cast_manager.stop_casting()
-    
-    @pyqtSlot()
-    def on_device_selected(self):
-        """Handle device selection from menu"""
-        action = self.sender()
-        if action:
-            device_uuid = action.data()
-            if device_uuid:
-                success = self.cast_manager.select_device(device_uuid)
-                if success:
-                    self.showMessage(
-                        "UbuntuCast",
-                        f"Selected device: {self.cast_manager.current_device.device.friendly_name}",
-                        QSystemTrayIcon.Information,
-                        3000
-                    )
-                else:
-                    self.showMessage(
-                        "UbuntuCast",
-                        "Failed to connect to selected device",
-                        QSystemTrayIcon.Warning,
-                        3000
-                    )
-    
     @pyqtSlot()
     def on_refresh_devices(self):
         """Handle refresh devices menu action"""
-        if hasattr(self.cast_manager, '_device_discovery'):
-            device_discovery = self.cast_manager._device_discovery
-            device_discovery.stop_discovery()
-            device_discovery.start_discovery()
+        if self.application.stack_ready.is_set():
+            # The daemon restarts discovery before answering, which takes seconds
+            self._in_background("Refresh", self.application.device_discovery.refresh_devices, lambda: None)
             
             self.showMessage(
                 "UbuntuCast",
@@ -231,7 +379,8 @@ class SystemTrayIcon(QSystemTrayIcon):
     def on_exit(self):
         """Handle exit menu action"""
         # Check if we're casting
-        if self.cast_manager.is_casting:
+        stack_ready = self.application.stack_ready.is_set()
+        if stack_ready and self.cast_manager.is_casting:
             reply = QMessageBox.question(
                 None,
                 "UbuntuCast",
@@ -243,18 +392,21 @@ class SystemTrayIcon(QSystemTrayIcon):
             if reply == QMessageBox.No:
                 return
             
-            # Stop casting if it's active
-            self.cast_manager.stop_casting()
-        
-        # Stop device discovery
-        if hasattr(self.cast_manager, '_device_discovery'):
-            device_discovery = self.cast_manager._device_discovery
-            device_discovery.stop_discovery()
-        
         # Save config
         config_path = os.path.expanduser("~/.config/ubuntucast/config.ini")
         with open(config_path, 'w') as config_file:
-            self.cast_manager.config.write(config_file)
+            self.application.config.write(config_file)
+        
+        if not stack_ready:
+            QApplication.quit()
+            return
+        
+        # Stop casting, and the daemon if this process started it, then quit; the pipeline
+        # takes a while to tear down, so the menu stays responsive meanwhile
+        def shutdown():
+            self.cast_manager.shutdown()
+            self.shutdown_finished.emit()
         
-        # Quit application
-        QApplication.quit() 
\ No newline at end of file
+        self.exit_action.setEnabled(False)
+        self.casting_label.setText("Exiting...")
+        self._in_background("Exit", shutdown, self.shutdown_finished.emit) 
\ No newline at end of file